@@ -0,0 +1,203 @@
+# Time the Blender importers in headless mode and write the results as JSON.
+# The compiled ldr_tools_py module must be copied into ldr_tools_blender first.
+# See DEVELOPMENT.md for details.
+#
+# blender --background --factory-startup --python benchmarks/blender_bench.py -- \
+#     --ldraw-path ~/ldraw --output bench.json [--compare previous.json]
+#
+# Omit --ldraw-path to only benchmark generated models using a generated library.
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import bpy
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from ldr_tools_blender import importldr  # noqa: E402
+from ldr_tools_blender.importldr import ldr_tools_py  # noqa: E402
+
+custom_mesh_path = os.path.join(repo_dir, 'ldr_tools_blender', 'meshes')
+
+environment_settings = {
+    'add_camera': False,
+    'add_env_lighting': False,
+    'remove_lights': False,
+    'add_ground_plane': False,
+    'solid_floor_bg': False,
+    'transparent_bg': False,
+    'bg_color': [1, 1, 1, 1],
+}
+
+
+def parse_args() -> argparse.Namespace:
+    # Blender ignores any arguments after "--".
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+    parser = argparse.ArgumentParser(description='Benchmark ldr_tools_blender imports')
+    parser.add_argument('--ldraw-path',
+                        help='The folder containing LDConfig.ldr. Defaults to a generated library.')
+    parser.add_argument('--output', required=True,
+                        help='The path for the output JSON results')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of times to import each model')
+    parser.add_argument('--tiles', type=int, nargs='*', default=[4, 16],
+                        help='Grid sizes for generated scenes tiled from models/colors.ldr')
+    parser.add_argument('--synthetic-parts', type=int, nargs='*', default=[1000, 10000],
+                        help='Part counts for generated models using a generated library')
+    parser.add_argument('--object-counts', type=int, nargs='*', default=[1000, 10000, 50000],
+                        help='Object counts for timing object creation with repeated and unique names')
+    parser.add_argument('--compare',
+                        help='Previous JSON results to compare against')
+    return parser.parse_args(argv)
+
+
+def write_tiled_model(tiles: int) -> str:
+    # Repeat the parts from colors.ldr in a grid to create a larger scene.
+    with open(os.path.join(repo_dir, 'models', 'colors.ldr')) as file:
+        lines = [line.split() for line in file]
+
+    path = os.path.join(tempfile.gettempdir(),
+                        f'ldr_tools_bench_tiled_{tiles}.ldr')
+    with open(path, 'w') as file:
+        for i in range(tiles):
+            for j in range(tiles):
+                for tokens in lines:
+                    if len(tokens) == 15 and tokens[0] == '1':
+                        tokens = list(tokens)
+                        tokens[2] = str(float(tokens[2]) + i * 1200.0)
+                        tokens[4] = str(float(tokens[4]) + j * 400.0)
+                        file.write(' '.join(tokens) + '\n')
+    return path
+
+
+def default_settings() -> ldr_tools_py.GeometrySettings:
+    # Use the same settings as the import operator with the optional processing disabled.
+    return importldr.create_settings(
+        add_gap_between_parts=True,
+        primitive_resolution='Normal',
+        stud_type='Normal',
+        cull_hidden_studs=False,
+        remove_duplicate_parts=False,
+        mark_sharp_edges=False,
+        merge_coplanar_faces=False,
+        submodel='',
+        max_step=-1,
+        unofficial_parts=True,
+    )
+
+
+def reset_scene():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+
+def time_import(import_fn, path: str, ldraw_path: str, repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        reset_scene()
+        color_by_code = ldr_tools_py.load_color_table(ldraw_path)
+
+        start = time.perf_counter()
+        import_fn(path, ldraw_path, [], custom_mesh_path, color_by_code,
+                  default_settings(), environment_settings, False)
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'objects': len(bpy.data.objects),
+        'meshes': len(bpy.data.meshes),
+    }
+
+
+def time_object_creation(count: int) -> dict:
+    # Repeated names make Blender search for a free ".001" suffix for every object.
+    # The unique names match the object names assigned by ldr_tools.
+    result = {'count': count}
+    for naming, name_fn in [('repeated', lambda i: '3001.dat'), ('unique', lambda i: f'3001.dat#{i:04}')]:
+        reset_scene()
+        start = time.perf_counter()
+        for i in range(count):
+            obj = bpy.data.objects.new(name_fn(i), None)
+            bpy.context.collection.objects.link(obj)
+        seconds = time.perf_counter() - start
+        result[naming] = seconds
+        result[f'{naming}_us_per_object'] = seconds / count * 1e6
+    return result
+
+
+def compare_results(results: list[dict], previous_path: str):
+    with open(previous_path) as file:
+        previous = {(r['model'], r['mode']): r for r in json.load(file)['results']}
+
+    for result in results:
+        old = previous.get((result['model'], result['mode']))
+        if old is not None:
+            ratio = result['median'] / old['median']
+            print(f"{result['model']} {result['mode']}: {old['median']:.3f}s -> {result['median']:.3f}s ({ratio:.2f}x)")
+
+
+def main():
+    args = parse_args()
+
+    # The generated library doesn't contain the parts used in models.
+    models = {}
+    if args.ldraw_path is not None:
+        models['colors'] = os.path.join(repo_dir, 'models', 'colors.ldr')
+        models['slopes'] = os.path.join(repo_dir, 'models', 'slopes.ldr')
+        for tiles in args.tiles:
+            models[f'tiled_{tiles}x{tiles}'] = write_tiled_model(tiles)
+
+    synthetic_path = os.path.join(tempfile.gettempdir(), 'ldr_tools_bench_library')
+    ldr_tools_py.write_synthetic_library(synthetic_path)
+    synthetic_models = {}
+    for part_count in args.synthetic_parts:
+        path = os.path.join(synthetic_path, f'synthetic_{part_count}.mpd')
+        ldr_tools_py.write_synthetic_model(path, part_count, 2, 4)
+        synthetic_models[f'synthetic_{part_count}'] = path
+
+    modes = {
+        'LinkedDuplicates': importldr.import_objects,
+        'GeometryNodes': importldr.import_instanced,
+        'Merged': importldr.import_merged,
+    }
+
+    results = []
+    for model_paths, ldraw_path in [(models, args.ldraw_path), (synthetic_models, synthetic_path)]:
+        for model, path in model_paths.items():
+            for mode, import_fn in modes.items():
+                result = time_import(import_fn, path, ldraw_path, args.repeat)
+                result['model'] = model
+                result['mode'] = mode
+                results.append(result)
+                print(f"{model} {mode}: {result['median']:.3f}s")
+
+    # The time per object should stay constant for unique names as the count grows.
+    object_creation = []
+    for count in args.object_counts:
+        result = time_object_creation(count)
+        object_creation.append(result)
+        print(f"objects {count}: repeated {result['repeated_us_per_object']:.1f}us, unique {result['unique_us_per_object']:.1f}us per object")
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'blender_version': bpy.app.version_string,
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'results': results,
+            'object_creation': object_creation,
+        }, file, indent=2)
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
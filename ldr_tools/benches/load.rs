@@ -0,0 +1,356 @@
+//! Benchmarks for the individual stages of the loading pipeline.
+//!
+//! Set the `LDRAW_PATH` environment variable to benchmark the models in `models`
+//! using an installed LDraw library:
+//! `LDRAW_PATH=~/ldraw cargo bench -p ldr_tools`
+//! Generated models using a generated library are always benchmarked.
+//! Set `LDR_TOOLS_BENCH_MAX_PARTS` to change the largest generated model (default 100000).
+//!
+//! Criterion writes the results for each benchmark as JSON to
+//! `target/criterion/<group>/<benchmark>/new/estimates.json`.
+//! Use `--save-baseline <name>` and `--baseline <name>` to compare runs.
+use std::path::{Path, PathBuf};
+
+use criterion::{black_box, criterion_group, criterion_main, BatchSize, BenchmarkId, Criterion};
+use ldr_tools::{
+    bench,
+    glam::Mat4,
+    synthetic::{self, SyntheticModelSettings},
+    GeometrySettings,
+};
+
+fn models_dir() -> PathBuf {
+    Path::new(env!("CARGO_MANIFEST_DIR")).join("..").join("models")
+}
+
+fn synthetic_library_path() -> PathBuf {
+    let path = std::env::temp_dir().join("ldr_tools_bench_library");
+    synthetic::write_library(&path).unwrap();
+    path
+}
+
+fn write_synthetic_model(part_count: usize) -> PathBuf {
+    let path = synthetic_library_path().join(format!("synthetic_{part_count}.mpd"));
+    synthetic::write_model(
+        &path,
+        &SyntheticModelSettings {
+            part_count,
+            submodel_depth: 2,
+            submodel_reuse: 4,
+        },
+    )
+    .unwrap();
+    path
+}
+
+/// The LDraw library and models to use for the pipeline stage benchmarks.
+fn ldraw_path_and_models() -> (String, Vec<(String, PathBuf)>) {
+    match std::env::var("LDRAW_PATH") {
+        Ok(ldraw_path) => (ldraw_path, model_paths()),
+        Err(_) => (
+            synthetic_library_path().to_string_lossy().to_string(),
+            vec![
+                ("synthetic_1000".to_string(), write_synthetic_model(1000)),
+                ("synthetic_10000".to_string(), write_synthetic_model(10000)),
+            ],
+        ),
+    }
+}
+
+/// Tile the parts in `models/colors.ldr` to create a larger scene.
+fn write_tiled_model(tiles: usize) -> PathBuf {
+    let contents = std::fs::read_to_string(models_dir().join("colors.ldr")).unwrap();
+
+    let mut output = String::new();
+    for i in 0..tiles {
+        for j in 0..tiles {
+            for line in contents.lines() {
+                let mut tokens: Vec<String> =
+                    line.split_whitespace().map(|t| t.to_string()).collect();
+                if tokens.len() == 15 && tokens[0] == "1" {
+                    // Offset the translation in the XZ plane to avoid overlapping parts.
+                    let x: f32 = tokens[2].parse().unwrap();
+                    let z: f32 = tokens[4].parse().unwrap();
+                    tokens[2] = (x + i as f32 * 1200.0).to_string();
+                    tokens[4] = (z + j as f32 * 400.0).to_string();
+                    output.push_str(&tokens.join(" "));
+                    output.push('\n');
+                }
+            }
+        }
+    }
+
+    let path = std::env::temp_dir().join(format!("ldr_tools_bench_tiled_{tiles}.ldr"));
+    std::fs::write(&path, output).unwrap();
+    path
+}
+
+fn model_paths() -> Vec<(String, PathBuf)> {
+    vec![
+        ("colors".to_string(), models_dir().join("colors.ldr")),
+        ("slopes".to_string(), models_dir().join("slopes.ldr")),
+        ("tiled_8x8".to_string(), write_tiled_model(8)),
+    ]
+}
+
+fn settings(weld_vertices: bool) -> GeometrySettings {
+    GeometrySettings {
+        weld_vertices,
+        ..Default::default()
+    }
+}
+
+fn custom_mesh_path() -> String {
+    Path::new(env!("CARGO_MANIFEST_DIR"))
+        .join("..")
+        .join("ldr_tools_blender")
+        .join("meshes")
+        .to_string_lossy()
+        .to_string()
+}
+
+fn parse_file(c: &mut Criterion) {
+    let (ldraw_path, models) = ldraw_path_and_models();
+    let custom_mesh_path = custom_mesh_path();
+
+    let mut group = c.benchmark_group("parse_file");
+    group.sample_size(10);
+    for (name, path) in models {
+        let path = path.to_string_lossy().to_string();
+        group.bench_with_input(BenchmarkId::from_parameter(name), &path, |b, path| {
+            b.iter(|| {
+                bench::parse_file(
+                    black_box(path),
+                    &ldraw_path,
+                    &[],
+                    &custom_mesh_path,
+                    &settings(true),
+                )
+            })
+        });
+    }
+    group.finish();
+}
+
+fn create_geometry_cache(c: &mut Criterion) {
+    let (ldraw_path, models) = ldraw_path_and_models();
+
+    let mut group = c.benchmark_group("create_geometry_cache");
+    group.sample_size(10);
+    for (name, path) in models {
+        let (source_map, main_model_name) = bench::parse_file(
+            &path.to_string_lossy(),
+            &ldraw_path,
+            &[],
+            &custom_mesh_path(),
+            &settings(true),
+        );
+
+        // Compare with and without welding to measure the cost of welding vertices.
+        for weld_vertices in [true, false] {
+            let id = BenchmarkId::new(name.clone(), format!("weld_vertices={weld_vertices}"));
+            group.bench_function(id, |b| {
+                b.iter(|| {
+                    bench::create_geometry_cache(
+                        black_box(&source_map),
+                        &main_model_name,
+                        &settings(weld_vertices),
+                    )
+                })
+            });
+        }
+    }
+    group.finish();
+}
+
+fn geometry_point_instances(c: &mut Criterion) {
+    let mut group = c.benchmark_group("geometry_point_instances");
+    for count in [1000, 100000] {
+        let transforms: Vec<_> = (0..count)
+            .map(|i| Mat4::from_rotation_y(i as f32) * Mat4::from_translation([i as f32; 3].into()))
+            .collect();
+
+        group.bench_with_input(BenchmarkId::from_parameter(count), &transforms, |b, t| {
+            b.iter_batched(
+                || t.clone(),
+                bench::geometry_point_instances,
+                BatchSize::LargeInput,
+            )
+        });
+    }
+    group.finish();
+
+    let (ldraw_path, models) = ldraw_path_and_models();
+    let mut group = c.benchmark_group("geometry_world_transforms");
+    for (name, path) in models {
+        let (source_map, main_model_name) = bench::parse_file(
+            &path.to_string_lossy(),
+            &ldraw_path,
+            &[],
+            &custom_mesh_path(),
+            &settings(true),
+        );
+        group.bench_function(BenchmarkId::from_parameter(name), |b| {
+            b.iter(|| {
+                bench::geometry_world_transforms(
+                    black_box(&source_map),
+                    &main_model_name,
+                    &settings(true),
+                )
+            })
+        });
+    }
+    group.finish();
+}
+
+fn load_file_scaling(c: &mut Criterion) {
+    // Generated models don't require an LDraw installation or network access.
+    let ldraw_path = synthetic_library_path().to_string_lossy().to_string();
+    let max_parts = std::env::var("LDR_TOOLS_BENCH_MAX_PARTS")
+        .ok()
+        .and_then(|s| s.parse().ok())
+        .unwrap_or(100000);
+
+    let part_counts = [1000, 10000, 100000, 1000000]
+        .into_iter()
+        .filter(|count| *count <= max_parts);
+
+    let mut group = c.benchmark_group("load_file_scaling");
+    group.sample_size(10);
+    for part_count in part_counts {
+        let path = write_synthetic_model(part_count)
+            .to_string_lossy()
+            .to_string();
+
+        group.bench_function(BenchmarkId::new("load_file", part_count), |b| {
+            b.iter(|| ldr_tools::load_file(&path, &ldraw_path, &[], &ldraw_path, &settings(true)))
+        });
+        group.bench_function(
+            BenchmarkId::new("load_file_instanced_points", part_count),
+            |b| {
+                b.iter(|| {
+                    ldr_tools::load_file_instanced_points(
+                        &path,
+                        &ldraw_path,
+                        &[],
+                        &ldraw_path,
+                        &settings(true),
+                    )
+                })
+            },
+        );
+    }
+    group.finish();
+}
+
+/// A welded grid of quads with every fourth row of edges marked as sharp.
+fn quad_grid(size: u32) -> (Vec<[f32; 3]>, Vec<u32>, Vec<u32>, Vec<u32>, Vec<[u32; 2]>) {
+    let mut vertices = Vec::new();
+    for y in 0..=size {
+        for x in 0..=size {
+            vertices.push([x as f32, y as f32, 0.0]);
+        }
+    }
+
+    let index = |x: u32, y: u32| y * (size + 1) + x;
+
+    let mut vertex_indices = Vec::new();
+    let mut face_starts = Vec::new();
+    let mut face_sizes = Vec::new();
+    for y in 0..size {
+        for x in 0..size {
+            face_starts.push(vertex_indices.len() as u32);
+            face_sizes.push(4);
+            vertex_indices.extend_from_slice(&[
+                index(x, y),
+                index(x + 1, y),
+                index(x + 1, y + 1),
+                index(x, y + 1),
+            ]);
+        }
+    }
+
+    let mut sharp_edges = Vec::new();
+    for y in (0..=size).step_by(4) {
+        for x in 0..size {
+            sharp_edges.push([index(x, y), index(x + 1, y)]);
+        }
+    }
+
+    (vertices, vertex_indices, face_starts, face_sizes, sharp_edges)
+}
+
+fn split_edges(c: &mut Criterion) {
+    let mut group = c.benchmark_group("split_edges");
+    for size in [16, 128] {
+        let (vertices, vertex_indices, face_starts, face_sizes, sharp_edges) = quad_grid(size);
+        group.bench_function(BenchmarkId::from_parameter(size * size), |b| {
+            b.iter(|| {
+                bench::split_edges(
+                    black_box(&vertices),
+                    &vertex_indices,
+                    &face_starts,
+                    &face_sizes,
+                    &sharp_edges,
+                )
+            })
+        });
+    }
+    group.finish();
+}
+
+fn compact_split_vertices(c: &mut Criterion) {
+    let mut group = c.benchmark_group("compact_split_vertices");
+    for size in [16, 128] {
+        let (vertices, vertex_indices, face_starts, face_sizes, sharp_edges) = quad_grid(size);
+        let (split_vertices, split_indices) = bench::split_edges(
+            &vertices,
+            &vertex_indices,
+            &face_starts,
+            &face_sizes,
+            &sharp_edges,
+        );
+
+        let stats = bench::compact_split_vertices(
+            &split_vertices,
+            &split_indices,
+            &vertex_indices,
+            &face_starts,
+            &face_sizes,
+            &sharp_edges,
+        )
+        .stats;
+        println!(
+            "{} quads: {} vertices, {} split vertices, {} compacted vertices",
+            size * size,
+            vertices.len(),
+            stats.split_vertices,
+            stats.vertices()
+        );
+
+        group.bench_function(BenchmarkId::from_parameter(size * size), |b| {
+            b.iter(|| {
+                bench::compact_split_vertices(
+                    black_box(&split_vertices),
+                    &split_indices,
+                    &vertex_indices,
+                    &face_starts,
+                    &face_sizes,
+                    &sharp_edges,
+                )
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(
+    benches,
+    parse_file,
+    create_geometry_cache,
+    geometry_point_instances,
+    split_edges,
+    compact_split_vertices,
+    load_file_scaling
+);
+criterion_main!(benches);
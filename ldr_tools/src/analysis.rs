@@ -0,0 +1,473 @@
+//! Fast scene statistics and memory estimates without creating any geometry.
+use std::{
+    collections::{HashMap, HashSet},
+    mem::size_of,
+    path::{Path, PathBuf},
+    sync::{Mutex, OnceLock},
+};
+
+use glam::{Mat4, Vec3};
+use weldr::Command;
+
+use crate::{
+    geometry::replace_studs, has_geometry, is_part, is_step, memory_file_key, parse_with_resolver,
+    replace_color, root_models, BuildSteps, ColorCode, DiskResolver, GeometrySettings,
+    ResolvedFile, StudType, CURRENT_COLOR,
+};
+
+// The approximate size of a Blender object and its base in the view layer.
+const BLENDER_OBJECT_BYTES: usize = 2048;
+
+/// Element counts for a geometry before welding vertices.
+#[derive(Debug, Default, Clone, Copy, PartialEq, Eq)]
+pub struct GeometryCounts {
+    pub face_count: usize,
+    pub triangle_count: usize,
+    /// The number of face corners.
+    /// This is an upper bound for the number of vertices after welding.
+    pub vertex_count: usize,
+    pub edge_count: usize,
+}
+
+impl GeometryCounts {
+    fn add(&mut self, other: &Self) {
+        self.face_count += other.face_count;
+        self.triangle_count += other.triangle_count;
+        self.vertex_count += other.vertex_count;
+        self.edge_count += other.edge_count;
+    }
+
+    /// The estimated bytes for the buffers in an [LDrawGeometry](crate::LDrawGeometry).
+    pub fn geometry_bytes(&self) -> usize {
+        self.vertex_count * (size_of::<Vec3>() + size_of::<u32>())
+            + self.face_count * (3 * size_of::<u32>() + size_of::<bool>())
+            + self.edge_count * size_of::<[u32; 2]>()
+    }
+
+    /// The estimated bytes for a Blender mesh with positions, edges, corners, and faces.
+    pub fn blender_mesh_bytes(&self) -> usize {
+        // Closed meshes have roughly one edge for every two corners.
+        self.vertex_count * size_of::<Vec3>()
+            + self.vertex_count * 2 * size_of::<u32>()
+            + self.vertex_count / 2 * size_of::<[u32; 2]>()
+            + self.face_count * (2 * size_of::<u32>() + size_of::<bool>())
+    }
+}
+
+/// Statistics for a single part or geometry in the scene.
+#[derive(Debug, Default, Clone, PartialEq, Eq)]
+pub struct PartStatistics {
+    /// The number of instances across all colors.
+    pub instance_count: usize,
+    pub color_count: usize,
+    pub counts: GeometryCounts,
+}
+
+/// The results of [analyze_file].
+#[derive(Debug, Clone, PartialEq)]
+pub struct SceneAnalysis {
+    pub main_model_name: String,
+    /// The total number of part instances in the scene.
+    pub part_count: usize,
+    /// The number of unique part and color combinations.
+    pub unique_part_colors: usize,
+    pub parts: HashMap<String, PartStatistics>,
+    /// Files that could not be found in the library or model.
+    pub missing_files: Vec<String>,
+    /// The estimated triangles for all instances in the scene.
+    pub triangle_count: usize,
+    /// The estimated vertices for all instances in the scene before welding.
+    pub vertex_count: usize,
+    /// The estimated peak bytes for each Blender instance type
+    /// like `"LinkedDuplicates"` or `"GeometryNodes"`.
+    pub memory_estimates: HashMap<String, usize>,
+}
+
+// Counts for library parts are reused across calls.
+// The resolver folders include every library path and the primitive resolution.
+// Each entry stores the files used by the part to detect edits to the library.
+type CountsKey = (Vec<PathBuf>, StudType, String);
+type CachedCounts = (HashMap<String, ResolvedFile>, GeometryCounts);
+static PART_COUNTS: OnceLock<Mutex<HashMap<CountsKey, CachedCounts>>> = OnceLock::new();
+
+/// Parse and walk the scene like [load_file_instanced](crate::load_file_instanced)
+/// without creating any geometry.
+///
+/// The triangle and vertex counts for each part are cached for later calls with the same library and settings.
+/// Parts are only cached if all of their files were found in the library folders
+/// and are counted again after any of the files change on disk.
+#[tracing::instrument]
+pub fn analyze_file(
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> SceneAnalysis {
+    let resolver = DiskResolver::new_from_library(
+        ldraw_path,
+        additional_paths.iter().cloned(),
+        custom_mesh_path,
+        settings.primitive_resolution,
+        settings.unofficial_parts,
+    );
+    let (source_map, main_model_name) = parse_with_resolver(path, &resolver, settings);
+
+    let mut instance_counts = HashMap::new();
+    let mut missing_files: HashSet<_> =
+        resolver.missing_files.lock().unwrap().drain(..).collect();
+    let mut steps = BuildSteps::default();
+    for (name, source_file) in root_models(&source_map, &main_model_name, settings) {
+        count_instances(
+            source_file,
+            &name,
+            &source_map,
+            CURRENT_COLOR,
+            settings.max_step,
+            &mut steps,
+            &mut instance_counts,
+            &mut missing_files,
+        );
+    }
+
+    let part_counts = PART_COUNTS.get_or_init(Default::default);
+    let resolved_files = resolver.resolved_files.lock().unwrap();
+    let mut file_counts = HashMap::new();
+    let mut parts: HashMap<String, PartStatistics> = HashMap::new();
+    for ((name, _), count) in &instance_counts {
+        let part = parts.entry(name.clone()).or_insert_with(|| {
+            let source_file = source_map.get(name).unwrap();
+            let counts = if is_part(source_file, name) {
+                let mut files = HashMap::new();
+                let is_library_part = add_library_files(
+                    name,
+                    source_file,
+                    &source_map,
+                    &resolved_files,
+                    settings.stud_type,
+                    &mut files,
+                );
+                let key = (resolver.base_paths.clone(), settings.stud_type, name.clone());
+
+                let cached = part_counts
+                    .lock()
+                    .unwrap()
+                    .get(&key)
+                    .filter(|(cached_files, _)| is_library_part && *cached_files == files)
+                    .map(|(_, counts)| *counts);
+                cached.unwrap_or_else(|| {
+                    let counts = recursive_counts(
+                        name,
+                        source_file,
+                        &source_map,
+                        settings,
+                        &mut file_counts,
+                    );
+                    if is_library_part {
+                        part_counts.lock().unwrap().insert(key, (files, counts));
+                    }
+                    counts
+                })
+            } else {
+                // Only the geometry in this file is used for non part files.
+                file_geometry_counts(source_file)
+            };
+
+            PartStatistics {
+                counts,
+                ..Default::default()
+            }
+        });
+        part.instance_count += count;
+        part.color_count += 1;
+    }
+
+    let part_count: usize = instance_counts.values().sum();
+    let triangle_count: usize = parts
+        .values()
+        .map(|p| p.instance_count * p.counts.triangle_count)
+        .sum();
+    let vertex_count: usize = parts
+        .values()
+        .map(|p| p.instance_count * p.counts.vertex_count)
+        .sum();
+
+    let memory_estimates = memory_estimates(&parts, part_count);
+
+    let mut missing_files: Vec<_> = missing_files.into_iter().collect();
+    missing_files.sort();
+
+    SceneAnalysis {
+        main_model_name,
+        part_count,
+        unique_part_colors: instance_counts.len(),
+        parts,
+        missing_files,
+        triangle_count,
+        vertex_count,
+        memory_estimates,
+    }
+}
+
+fn count_instances(
+    source_file: &weldr::SourceFile,
+    filename: &str,
+    source_map: &weldr::SourceMap,
+    current_color: ColorCode,
+    max_step: Option<usize>,
+    steps: &mut BuildSteps,
+    instance_counts: &mut HashMap<(String, ColorCode), usize>,
+    missing_files: &mut HashSet<String>,
+) {
+    // Match the traversal in load_node_instanced.
+    let is_part = is_part(source_file, filename);
+    if is_part || has_geometry(source_file) {
+        *instance_counts
+            .entry((filename.to_string(), current_color))
+            .or_default() += 1;
+        steps.add_instance();
+    }
+
+    if !is_part {
+        for cmd in &source_file.cmds {
+            if steps.is_after(max_step) {
+                break;
+            }
+            if is_step(cmd) {
+                steps.end_step();
+            }
+            if let Command::SubFileRef(sfr_cmd) = cmd {
+                match source_map.get(&sfr_cmd.file) {
+                    Some(subfile) => count_instances(
+                        subfile,
+                        &sfr_cmd.file,
+                        source_map,
+                        replace_color(sfr_cmd.color, current_color),
+                        max_step,
+                        steps,
+                        instance_counts,
+                        missing_files,
+                    ),
+                    None => {
+                        missing_files.insert(sfr_cmd.file.clone());
+                    }
+                }
+            }
+        }
+    }
+}
+
+/// Add the files used by `name` and its subfiles to `files`.
+/// Returns `false` if any of the files are embedded in the model, in memory, or missing.
+fn add_library_files(
+    name: &str,
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+    resolved_files: &HashMap<String, ResolvedFile>,
+    stud_type: StudType,
+    files: &mut HashMap<String, ResolvedFile>,
+) -> bool {
+    let key = memory_file_key(name);
+    if files.contains_key(&key) {
+        return true;
+    }
+
+    // Absolute paths are model files passed directly to the resolver.
+    match resolved_files.get(&key) {
+        Some(resolved) if Path::new(name).is_relative() => {
+            files.insert(key, resolved.clone());
+        }
+        _ => return false,
+    }
+
+    source_file.cmds.iter().all(|cmd| match cmd {
+        Command::SubFileRef(sfr_cmd) => {
+            let subfilename = replace_studs(sfr_cmd, stud_type);
+            match source_map.get(subfilename) {
+                Some(subfile) => add_library_files(
+                    subfilename,
+                    subfile,
+                    source_map,
+                    resolved_files,
+                    stud_type,
+                    files,
+                ),
+                None => false,
+            }
+        }
+        _ => true,
+    })
+}
+
+fn recursive_counts(
+    name: &str,
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+    settings: &GeometrySettings,
+    file_counts: &mut HashMap<String, GeometryCounts>,
+) -> GeometryCounts {
+    if let Some(counts) = file_counts.get(name) {
+        return *counts;
+    }
+
+    // Transforms don't affect the counts, so each file only needs to be visited once.
+    let mut counts = file_geometry_counts(source_file);
+    for cmd in &source_file.cmds {
+        if let Command::SubFileRef(sfr_cmd) = cmd {
+            let subfilename = replace_studs(sfr_cmd, settings.stud_type);
+            if let Some(subfile) = source_map.get(subfilename) {
+                let subfile_counts =
+                    recursive_counts(subfilename, subfile, source_map, settings, file_counts);
+                counts.add(&subfile_counts);
+            }
+        }
+    }
+
+    file_counts.insert(name.to_string(), counts);
+    counts
+}
+
+fn file_geometry_counts(source_file: &weldr::SourceFile) -> GeometryCounts {
+    let mut counts = GeometryCounts::default();
+    for cmd in &source_file.cmds {
+        match cmd {
+            Command::Triangle(_) => {
+                counts.face_count += 1;
+                counts.triangle_count += 1;
+                counts.vertex_count += 3;
+            }
+            Command::Quad(_) => {
+                counts.face_count += 1;
+                counts.triangle_count += 2;
+                counts.vertex_count += 4;
+            }
+            Command::Line(_) => counts.edge_count += 1,
+            _ => (),
+        }
+    }
+    counts
+}
+
+fn memory_estimates(
+    parts: &HashMap<String, PartStatistics>,
+    part_count: usize,
+) -> HashMap<String, usize> {
+    // Each geometry is created once and each part and color combination has its own Blender mesh.
+    let geometry_bytes: usize = parts.values().map(|p| p.counts.geometry_bytes()).sum();
+    let mesh_bytes: usize = parts
+        .values()
+        .map(|p| p.color_count * p.counts.blender_mesh_bytes())
+        .sum();
+    let unique_part_colors: usize = parts.values().map(|p| p.color_count).sum();
+
+    // Linked duplicates create an object with a transform for each instance.
+    let linked_duplicates = geometry_bytes
+        + mesh_bytes
+        + part_count * (size_of::<Mat4>() + BLENDER_OBJECT_BYTES);
+
+    // Geometry nodes store decomposed transforms in NumPy and in the instancer mesh points.
+    // Each part and color combination has an instancer object and an instance object.
+    let point_instance_bytes = 3 * size_of::<Vec3>() + size_of::<f32>();
+    let geometry_nodes = geometry_bytes
+        + mesh_bytes
+        + part_count * (size_of::<Mat4>() + 2 * point_instance_bytes)
+        + unique_part_colors * 2 * BLENDER_OBJECT_BYTES;
+
+    [
+        ("LinkedDuplicates".to_string(), linked_duplicates),
+        ("GeometryNodes".to_string(), geometry_nodes),
+    ]
+    .into()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use crate::synthetic;
+
+    #[test]
+    fn analyze_file_synthetic() {
+        let ldraw_path = std::env::temp_dir().join("ldr_tools_test_analyze_file");
+        synthetic::write_library(&ldraw_path).unwrap();
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 100,
+                submodel_depth: 2,
+                submodel_reuse: 2,
+            },
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let settings = GeometrySettings::default();
+        let analysis = analyze_file(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+        );
+
+        assert_eq!(100, analysis.part_count);
+        assert_eq!(synthetic::SYNTHETIC_PARTS.len(), analysis.parts.len());
+        assert!(analysis.missing_files.is_empty());
+        assert!(analysis.triangle_count > 0);
+        assert!(
+            analysis.memory_estimates["LinkedDuplicates"]
+                > analysis.memory_estimates["GeometryNodes"]
+        );
+
+        // The counts should match the actual geometry before welding.
+        let scene = crate::load_file_instanced(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+        );
+        for (name, part) in &analysis.parts {
+            let geometry = &scene.geometry_cache[name];
+            assert_eq!(geometry.face_sizes.len(), part.counts.face_count);
+            assert_eq!(geometry.vertex_indices.len(), part.counts.vertex_count);
+        }
+    }
+
+    #[test]
+    fn analyze_file_part_counts_cache() {
+        let ldraw_path = std::env::temp_dir().join("ldr_tools_test_analyze_file_cache");
+        synthetic::write_library(&ldraw_path).unwrap();
+        let part_path = ldraw_path.join("parts").join("synth-brick-1x1.dat");
+
+        // The embedded part should not replace the library part in the cache.
+        let embedded_path = ldraw_path.join("embedded.mpd");
+        std::fs::write(
+            &embedded_path,
+            "0 FILE main.ldr\n\
+             1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n\
+             0 FILE synth-brick-1x1.dat\n\
+             3 16 0 0 0 1 0 0 0 0 1\n",
+        )
+        .unwrap();
+        let model_path = ldraw_path.join("model.ldr");
+        std::fs::write(&model_path, "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n").unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let settings = GeometrySettings::default();
+        let analyze = |path: &std::path::Path| {
+            analyze_file(path.to_str().unwrap(), ldraw_path, &[], ldraw_path, &settings)
+        };
+
+        assert_eq!(1, analyze(&embedded_path).triangle_count);
+        let triangle_count = analyze(&model_path).triangle_count;
+        assert!(triangle_count > 1);
+
+        // Editing a library part should invalidate its counts.
+        let mut contents = std::fs::read_to_string(&part_path).unwrap();
+        contents.push_str("3 16 0 0 0 1 0 0 0 0 1\n");
+        std::fs::write(&part_path, contents).unwrap();
+        assert_eq!(triangle_count + 1, analyze(&model_path).triangle_count);
+    }
+}
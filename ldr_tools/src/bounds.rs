@@ -0,0 +1,124 @@
+use glam::{Mat4, Vec3};
+use weldr::Command;
+
+/// An axis-aligned bounding box in LDraw units.
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub struct Bounds {
+    pub min: Vec3,
+    pub max: Vec3,
+}
+
+impl Bounds {
+    pub fn from_points(points: impl IntoIterator<Item = Vec3>) -> Option<Self> {
+        points.into_iter().fold(None, |bounds: Option<Self>, p| {
+            Some(match bounds {
+                Some(b) => Self {
+                    min: b.min.min(p),
+                    max: b.max.max(p),
+                },
+                None => Self { min: p, max: p },
+            })
+        })
+    }
+
+    pub fn union(&self, other: &Self) -> Self {
+        Self {
+            min: self.min.min(other.min),
+            max: self.max.max(other.max),
+        }
+    }
+
+    /// The bounds of the transformed corners of this box.
+    pub fn transform(&self, transform: &Mat4) -> Self {
+        let corners = (0..8).map(|i| {
+            let corner = Vec3::new(
+                if i & 1 == 0 { self.min.x } else { self.max.x },
+                if i & 2 == 0 { self.min.y } else { self.max.y },
+                if i & 4 == 0 { self.min.z } else { self.max.z },
+            );
+            transform.transform_point3(corner)
+        });
+        Self::from_points(corners).unwrap()
+    }
+
+    /// The length of the diagonal of the box.
+    pub fn size(&self) -> f32 {
+        (self.max - self.min).length()
+    }
+}
+
+/// Find the bounds of all faces in `source_file` and its subfiles.
+pub fn file_bounds(
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+) -> Option<Bounds> {
+    let mut bounds = None;
+    append_bounds(&mut bounds, source_file, source_map, Mat4::IDENTITY);
+    bounds
+}
+
+fn append_bounds(
+    bounds: &mut Option<Bounds>,
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+    transform: Mat4,
+) {
+    for cmd in &source_file.cmds {
+        let points = match cmd {
+            Command::Triangle(t) => Bounds::from_points(t.vertices),
+            Command::Quad(q) => Bounds::from_points(q.vertices),
+            Command::SubFileRef(subfile_cmd) => {
+                if let Some(subfile) = source_map.get(&subfile_cmd.file) {
+                    append_bounds(bounds, subfile, source_map, transform * subfile_cmd.matrix());
+                }
+                None
+            }
+            _ => None,
+        };
+
+        if let Some(points) = points {
+            let points = points.transform(&transform);
+            *bounds = Some(match *bounds {
+                Some(b) => b.union(&points),
+                None => points,
+            });
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    #[test]
+    fn bounds_from_points() {
+        assert_eq!(None, Bounds::from_points(Vec::new()));
+        assert_eq!(
+            Some(Bounds {
+                min: vec3(-1.0, 0.0, -3.0),
+                max: vec3(2.0, 4.0, 3.0)
+            }),
+            Bounds::from_points([vec3(-1.0, 4.0, 3.0), vec3(2.0, 0.0, -3.0)])
+        );
+    }
+
+    #[test]
+    fn bounds_transform() {
+        let bounds = Bounds {
+            min: vec3(0.0, 0.0, 0.0),
+            max: vec3(1.0, 2.0, 3.0),
+        };
+        let transform =
+            Mat4::from_translation(vec3(1.0, 1.0, 1.0)) * Mat4::from_scale(vec3(-2.0, 1.0, 1.0));
+        assert_eq!(
+            Bounds {
+                min: vec3(-1.0, 1.0, 1.0),
+                max: vec3(1.0, 3.0, 4.0)
+            },
+            bounds.transform(&transform)
+        );
+        assert_eq!(14.0f32.sqrt(), bounds.size());
+    }
+}
@@ -0,0 +1,319 @@
+//! Merge adjacent coplanar faces into n-gons.
+//!
+//! Parts and primitives build flat areas from many small triangles and quads.
+//! Applications with n-gon support like Blender can use fewer and larger faces instead.
+use std::collections::{HashMap, HashSet};
+
+use glam::Vec3;
+
+use crate::{
+    edge_split::{find, union},
+    ColorCode, LDrawGeometry,
+};
+
+// Tolerances for treating faces as coplanar.
+// Distances use LDUs since geometry is scaled after merging.
+const NORMAL_TOLERANCE: f32 = 1e-4;
+const DISTANCE_TOLERANCE: f32 = 0.01;
+
+/// Merge adjacent coplanar faces with the same color and stud flag into n-gons
+/// and remove any vertices that are no longer used.
+/// Faces are only merged across edges with one face on each side that are not in `edge_line_indices`.
+/// Groups of faces with holes are not merged since a single n-gon can't represent them.
+///
+/// Returns the number of faces removed.
+pub fn merge_coplanar_faces(geometry: &mut LDrawGeometry) -> usize {
+    let face_count = geometry.face_sizes.len();
+    let planes: Vec<_> = (0..face_count).map(|f| face_plane(geometry, f)).collect();
+
+    let line_edges: HashSet<_> = geometry
+        .edge_line_indices
+        .iter()
+        .map(|[v0, v1]| [*v0.min(v1), *v0.max(v1)])
+        .collect();
+
+    let mut edge_faces: HashMap<[u32; 2], Vec<u32>> = HashMap::new();
+    for f in 0..face_count {
+        for edge in face_edges(face_vertices(geometry, f)) {
+            edge_faces.entry(edge).or_default().push(f as u32);
+        }
+    }
+
+    let mut parents: Vec<u32> = (0..face_count as u32).collect();
+    for ([v0, v1], faces) in &edge_faces {
+        // Check each edge once and only merge faces with consistent winding.
+        if v0 >= v1 || faces.len() != 1 || line_edges.contains(&[*v0, *v1]) {
+            continue;
+        }
+        let f1 = match edge_faces.get(&[*v1, *v0]).map(Vec::as_slice) {
+            Some([f1]) => *f1,
+            _ => continue,
+        };
+        let f0 = faces[0];
+
+        if face_color(geometry, f0) == face_color(geometry, f1)
+            && geometry.is_face_stud[f0 as usize] == geometry.is_face_stud[f1 as usize]
+            && is_coplanar(geometry, &planes, f0, f1)
+        {
+            union(&mut parents, f0, f1);
+        }
+    }
+
+    // The root is the first face in each group since union keeps the lowest index.
+    let mut groups = vec![Vec::new(); face_count];
+    for f in 0..face_count {
+        let root = find(&mut parents, f as u32) as usize;
+        groups[root].push(f);
+    }
+    let polygons: Vec<_> = groups
+        .iter()
+        .map(|faces| (faces.len() > 1).then(|| boundary_loop(geometry, faces)).flatten())
+        .collect();
+
+    let mut vertex_indices = Vec::new();
+    let mut face_start_indices = Vec::new();
+    let mut face_sizes = Vec::new();
+    let mut face_colors = Vec::new();
+    let mut is_face_stud = Vec::new();
+    for f in 0..face_count {
+        let root = find(&mut parents, f as u32) as usize;
+        let face = match &polygons[root] {
+            Some(polygon) if root == f => polygon.as_slice(),
+            Some(_) => continue,
+            None => face_vertices(geometry, f),
+        };
+
+        face_start_indices.push(vertex_indices.len() as u32);
+        face_sizes.push(face.len() as u32);
+        vertex_indices.extend_from_slice(face);
+        face_colors.push(face_color(geometry, f as u32));
+        is_face_stud.push(geometry.is_face_stud[f]);
+    }
+
+    let removed = face_count - face_sizes.len();
+    if removed > 0 {
+        // A single color applies to all faces.
+        if geometry.face_colors.len() == face_count {
+            geometry.face_colors = face_colors;
+        }
+        geometry.vertex_indices = vertex_indices;
+        geometry.face_start_indices = face_start_indices;
+        geometry.face_sizes = face_sizes;
+        geometry.is_face_stud = is_face_stud;
+        remove_unused_vertices(geometry);
+    }
+    removed
+}
+
+fn face_vertices(geometry: &LDrawGeometry, face: usize) -> &[u32] {
+    let start = geometry.face_start_indices[face] as usize;
+    let size = geometry.face_sizes[face] as usize;
+    &geometry.vertex_indices[start..start + size]
+}
+
+fn face_edges(face: &[u32]) -> impl Iterator<Item = [u32; 2]> + '_ {
+    (0..face.len()).map(move |i| [face[i], face[(i + 1) % face.len()]])
+}
+
+fn face_color(geometry: &LDrawGeometry, face: u32) -> ColorCode {
+    geometry
+        .face_colors
+        .get(face as usize)
+        .or(geometry.face_colors.first())
+        .copied()
+        .unwrap_or_default()
+}
+
+fn face_plane(geometry: &LDrawGeometry, face: usize) -> Option<(Vec3, f32)> {
+    let vertices = face_vertices(geometry, face);
+    let position = |i: usize| geometry.vertices[vertices[i % vertices.len()] as usize];
+
+    // Summing cross products handles quads that aren't perfectly flat.
+    let normal = (0..vertices.len())
+        .map(|i| position(i).cross(position(i + 1)))
+        .sum::<Vec3>()
+        .normalize_or_zero();
+    (normal != Vec3::ZERO).then(|| (normal, normal.dot(position(0))))
+}
+
+fn is_coplanar(
+    geometry: &LDrawGeometry,
+    planes: &[Option<(Vec3, f32)>],
+    f0: u32,
+    f1: u32,
+) -> bool {
+    match (planes[f0 as usize], planes[f1 as usize]) {
+        (Some((n0, d0)), Some((n1, _))) => {
+            let distance = |v: &u32| (n0.dot(geometry.vertices[*v as usize]) - d0).abs();
+            n0.dot(n1) > 1.0 - NORMAL_TOLERANCE
+                && face_vertices(geometry, f1 as usize)
+                    .iter()
+                    .all(|v| distance(v) < DISTANCE_TOLERANCE)
+        }
+        _ => false,
+    }
+}
+
+fn boundary_loop(geometry: &LDrawGeometry, faces: &[usize]) -> Option<Vec<u32>> {
+    let edges: HashSet<_> = faces
+        .iter()
+        .flat_map(|f| face_edges(face_vertices(geometry, *f)))
+        .collect();
+
+    // Edges without a matching reversed edge are on the boundary of the group.
+    let mut next = HashMap::new();
+    let mut start = None;
+    for f in faces {
+        for [v0, v1] in face_edges(face_vertices(geometry, *f)) {
+            if !edges.contains(&[v1, v0]) {
+                // The boundary touches itself at this vertex.
+                if next.insert(v0, v1).is_some() {
+                    return None;
+                }
+                start.get_or_insert(v0);
+            }
+        }
+    }
+
+    // A single loop must use all the boundary edges.
+    let start = start?;
+    let mut polygon = vec![start];
+    let mut v = next[&start];
+    while v != start && polygon.len() < next.len() {
+        polygon.push(v);
+        v = *next.get(&v)?;
+    }
+    (v == start && polygon.len() == next.len()).then_some(polygon)
+}
+
+fn remove_unused_vertices(geometry: &mut LDrawGeometry) {
+    let mut is_used = vec![false; geometry.vertices.len()];
+    for v in geometry
+        .vertex_indices
+        .iter()
+        .chain(geometry.edge_line_indices.iter().flatten())
+    {
+        is_used[*v as usize] = true;
+    }
+
+    let mut new_indices = vec![u32::MAX; geometry.vertices.len()];
+    let mut vertices = Vec::new();
+    for (i, vertex) in geometry.vertices.iter().enumerate() {
+        if is_used[i] {
+            new_indices[i] = vertices.len() as u32;
+            vertices.push(*vertex);
+        }
+    }
+
+    geometry.vertices = vertices;
+    for v in &mut geometry.vertex_indices {
+        *v = new_indices[*v as usize];
+    }
+    for edge in &mut geometry.edge_line_indices {
+        *edge = edge.map(|v| new_indices[v as usize]);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    fn grid(size: u32, skip: &[u32], colors: &[ColorCode]) -> LDrawGeometry {
+        let index = |x: u32, y: u32| y * (size + 1) + x;
+
+        let mut geometry = LDrawGeometry {
+            vertices: Vec::new(),
+            vertex_indices: Vec::new(),
+            face_start_indices: Vec::new(),
+            face_sizes: Vec::new(),
+            face_colors: Vec::new(),
+            is_face_stud: Vec::new(),
+            edge_line_indices: Vec::new(),
+            has_grainy_slopes: false,
+        };
+        for y in 0..=size {
+            for x in 0..=size {
+                geometry.vertices.push(vec3(x as f32, y as f32, 0.0));
+            }
+        }
+        for y in 0..size {
+            for x in 0..size {
+                let face = y * size + x;
+                if skip.contains(&face) {
+                    continue;
+                }
+                geometry
+                    .face_start_indices
+                    .push(geometry.vertex_indices.len() as u32);
+                geometry.face_sizes.push(4);
+                geometry.vertex_indices.extend_from_slice(&[
+                    index(x, y),
+                    index(x + 1, y),
+                    index(x + 1, y + 1),
+                    index(x, y + 1),
+                ]);
+                geometry.face_colors.push(colors[x as usize % colors.len()]);
+                geometry.is_face_stud.push(false);
+            }
+        }
+        geometry
+    }
+
+    #[test]
+    fn merge_coplanar_faces_grid() {
+        // 6 - 7 - 8
+        // |   |   |
+        // 3 - 4 - 5
+        // |   |   |
+        // 0 - 1 - 2
+        let mut geometry = grid(2, &[], &[16]);
+        assert_eq!(3, merge_coplanar_faces(&mut geometry));
+
+        // The unused center vertex is removed.
+        assert_eq!(vec![0, 1, 2, 4, 7, 6, 5, 3], geometry.vertex_indices);
+        assert_eq!(vec![0], geometry.face_start_indices);
+        assert_eq!(vec![8], geometry.face_sizes);
+        assert_eq!(vec![16], geometry.face_colors);
+        assert_eq!(vec![false], geometry.is_face_stud);
+        assert_eq!(8, geometry.vertices.len());
+        assert_eq!(vec3(2.0, 2.0, 0.0), geometry.vertices[7]);
+    }
+
+    #[test]
+    fn merge_coplanar_faces_edge_lines_and_colors() {
+        let mut geometry = grid(2, &[], &[16]);
+        geometry.edge_line_indices = vec![[1, 4], [7, 4]];
+        assert_eq!(2, merge_coplanar_faces(&mut geometry));
+        assert_eq!(
+            vec![0, 1, 4, 7, 6, 3, 1, 2, 5, 8, 7, 4],
+            geometry.vertex_indices
+        );
+        assert_eq!(vec![6, 6], geometry.face_sizes);
+        assert_eq!(vec![[1, 4], [7, 4]], geometry.edge_line_indices);
+
+        let mut geometry = grid(2, &[], &[1, 4]);
+        assert_eq!(2, merge_coplanar_faces(&mut geometry));
+        assert_eq!(vec![1, 4], geometry.face_colors);
+    }
+
+    #[test]
+    fn merge_coplanar_faces_skip_holes_and_folds() {
+        // The faces around the center face form a loop with a hole.
+        let mut geometry = grid(3, &[4], &[16]);
+        assert_eq!(0, merge_coplanar_faces(&mut geometry));
+        assert_eq!(8, geometry.face_sizes.len());
+        assert_eq!(16, geometry.vertices.len());
+
+        // Fold the right column of faces up along x = 1.
+        let mut geometry = grid(2, &[], &[16]);
+        for vertex in &mut geometry.vertices {
+            if vertex.x > 1.0 {
+                *vertex = vec3(1.0, vertex.y, 1.0);
+            }
+        }
+        assert_eq!(2, merge_coplanar_faces(&mut geometry));
+        assert_eq!(vec![6, 6], geometry.face_sizes);
+    }
+}
@@ -0,0 +1,615 @@
+//! Remove studs and anti-studs covered by neighboring parts in instanced scenes.
+//!
+//! Studs are hidden if the faces of an opaque part above them enclose the top and sides of the stud.
+//! Anti-studs like the tubes under bricks are hidden if the top faces of an opaque part below cover them.
+//! Testing faces instead of bounds keeps connectors visible under parts like arches and corner plates.
+//! Instances with hidden connectors use a variant of the part geometry like `"3001.dat#culled1"`.
+use std::collections::{BTreeMap, HashMap, HashSet};
+
+use glam::{vec2, Mat4, Vec2, Vec3};
+use rayon::prelude::*;
+use rstar::{
+    primitives::{GeomWithData, Rectangle},
+    RTree,
+};
+use weldr::Command;
+
+use crate::{Bounds, ColorCode, GeometryInitDescriptor, InstanceStep, LDrawColor};
+
+const CULLED_SEPARATOR: &str = "#culled";
+
+// Tolerances in LDUs for parts that don't line up exactly.
+const EPSILON: f32 = 0.5;
+// The height of a stud and the space below the top of a part that can hold a stud.
+const STUD_HEIGHT: f32 = 4.0;
+const STUD_SPACE_HEIGHT: f32 = 8.0;
+// Distances from the center for testing the area covered by studs and anti-studs.
+const STUD_SAMPLE_RADIUS: f32 = 4.0;
+const ANTI_STUD_SAMPLE_RADIUS: f32 = 6.0;
+// Tolerance for rays hitting the edges of faces.
+const RAY_EPSILON: f32 = 1e-4;
+
+// Rays from the middle of a stud up and to each side.
+const STUD_RAYS: [Ray; 9] = [
+    up_ray(0.0, 0.0),
+    up_ray(STUD_SAMPLE_RADIUS, 0.0),
+    up_ray(-STUD_SAMPLE_RADIUS, 0.0),
+    up_ray(0.0, STUD_SAMPLE_RADIUS),
+    up_ray(0.0, -STUD_SAMPLE_RADIUS),
+    side_ray(0, 1.0),
+    side_ray(0, -1.0),
+    side_ray(2, 1.0),
+    side_ray(2, -1.0),
+];
+
+// Rays down from above any stud inside the anti-stud to the top of the part below.
+const ANTI_STUD_RAY_Y: f32 = -(STUD_HEIGHT + STUD_HEIGHT / 2.0 + EPSILON);
+const ANTI_STUD_RAY_DISTANCE: f32 = STUD_HEIGHT + 2.0 * EPSILON;
+const ANTI_STUD_RAYS: [Ray; 5] = [
+    down_ray(0.0, 0.0),
+    down_ray(ANTI_STUD_SAMPLE_RADIUS, 0.0),
+    down_ray(-ANTI_STUD_SAMPLE_RADIUS, 0.0),
+    down_ray(0.0, ANTI_STUD_SAMPLE_RADIUS),
+    down_ray(0.0, -ANTI_STUD_SAMPLE_RADIUS),
+];
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub(crate) enum ConnectorKind {
+    Stud,
+    AntiStud,
+}
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+struct Connector {
+    kind: ConnectorKind,
+    /// The point to test for a covering part in part space.
+    probe: Vec3,
+}
+
+/// An axis-aligned ray in the space of the covering part relative to a connector probe.
+struct Ray {
+    offset: Vec3,
+    axis: usize,
+    /// The direction along `axis` with -1.0 for up on the Y axis.
+    sign: f32,
+    max_distance: f32,
+}
+
+const fn up_ray(x: f32, z: f32) -> Ray {
+    Ray {
+        offset: Vec3::new(x, 0.0, z),
+        axis: 1,
+        sign: -1.0,
+        max_distance: f32::INFINITY,
+    }
+}
+
+const fn side_ray(axis: usize, sign: f32) -> Ray {
+    Ray {
+        offset: Vec3::ZERO,
+        axis,
+        sign,
+        max_distance: f32::INFINITY,
+    }
+}
+
+const fn down_ray(x: f32, z: f32) -> Ray {
+    Ray {
+        offset: Vec3::new(x, ANTI_STUD_RAY_Y, z),
+        axis: 1,
+        sign: 1.0,
+        max_distance: ANTI_STUD_RAY_DISTANCE,
+    }
+}
+
+struct PartShape {
+    bounds: Bounds,
+    faces: PartFaces,
+    connectors: Vec<Connector>,
+}
+
+impl PartShape {
+    fn new(triangles: Vec<[Vec3; 3]>, connectors: Vec<Connector>) -> Option<Self> {
+        let bounds = Bounds::from_points(triangles.iter().flatten().copied())?;
+        Some(Self {
+            bounds,
+            faces: PartFaces::new(triangles),
+            connectors,
+        })
+    }
+}
+
+/// The triangles of a part indexed by their projection along each axis
+/// to find the faces hit by axis-aligned rays.
+struct PartFaces {
+    triangles: Vec<[Vec3; 3]>,
+    projections: [RTree<GeomWithData<Rectangle<[f32; 2]>, usize>>; 3],
+}
+
+impl PartFaces {
+    fn new(triangles: Vec<[Vec3; 3]>) -> Self {
+        let projections = [0, 1, 2].map(|axis| {
+            RTree::bulk_load(
+                triangles
+                    .iter()
+                    .enumerate()
+                    .map(|(i, triangle)| {
+                        let [a, b, c] = triangle.map(|p| project(p, axis));
+                        let rect = Rectangle::from_corners(
+                            (a.min(b).min(c) - RAY_EPSILON).to_array(),
+                            (a.max(b).max(c) + RAY_EPSILON).to_array(),
+                        );
+                        GeomWithData::new(rect, i)
+                    })
+                    .collect(),
+            )
+        });
+        Self {
+            triangles,
+            projections,
+        }
+    }
+
+    /// The distance to the closest face hit by the ray from `origin` along `axis`.
+    fn ray_distance(&self, origin: Vec3, axis: usize, sign: f32) -> Option<f32> {
+        let point = project(origin, axis);
+        self.projections[axis]
+            .locate_all_at_point(&point.to_array())
+            .filter_map(|object| {
+                let [a, b, c] = self.triangles[object.data];
+                let weights =
+                    barycentric(point, project(a, axis), project(b, axis), project(c, axis))?;
+                let hit = weights.x * a[axis] + weights.y * b[axis] + weights.z * c[axis];
+                let distance = (hit - origin[axis]) * sign;
+                (distance >= 0.0).then_some(distance)
+            })
+            .min_by(|a, b| a.total_cmp(b))
+    }
+}
+
+fn project(point: Vec3, axis: usize) -> Vec2 {
+    match axis {
+        0 => vec2(point.y, point.z),
+        1 => vec2(point.x, point.z),
+        _ => vec2(point.x, point.y),
+    }
+}
+
+fn barycentric(p: Vec2, a: Vec2, b: Vec2, c: Vec2) -> Option<Vec3> {
+    // Faces parallel to the ray can't be hit.
+    let area = (b - a).perp_dot(c - a);
+    if area.abs() < f32::EPSILON {
+        return None;
+    }
+    let u = (c - b).perp_dot(p - b) / area;
+    let v = (a - c).perp_dot(p - c) / area;
+    let w = 1.0 - u - v;
+    (u >= -RAY_EPSILON && v >= -RAY_EPSILON && w >= -RAY_EPSILON).then_some(Vec3::new(u, v, w))
+}
+
+struct Instance<'a> {
+    inverse: Mat4,
+    shape: &'a PartShape,
+}
+
+/// The name of the part used for a geometry with culled connectors.
+pub(crate) fn base_name(name: &str) -> &str {
+    name.split(CULLED_SEPARATOR).next().unwrap_or(name)
+}
+
+/// The name for geometry of `name` with some connectors hidden.
+pub(crate) fn variant_name(name: &str, index: usize) -> String {
+    format!("{name}{CULLED_SEPARATOR}{index}")
+}
+
+/// Classify connector primitives like `"stud.dat"` or `"stud4.dat"`.
+pub(crate) fn connector_kind(name: &str) -> Option<ConnectorKind> {
+    let name = name.to_ascii_lowercase();
+    if name.starts_with("stud3") || name.starts_with("stud4") {
+        Some(ConnectorKind::AntiStud)
+    } else if name.starts_with("stud") {
+        Some(ConnectorKind::Stud)
+    } else {
+        None
+    }
+}
+
+/// Replace the geometry for instances with hidden connectors with culled variants.
+/// Each variant has a mask of hidden connectors in the order they appear in the part.
+/// The world transforms use LDUs and LDraw coordinates.
+#[tracing::instrument(skip_all)]
+pub(crate) fn cull_hidden_connectors<'a>(
+    source_map: &'a weldr::SourceMap,
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor<'a>>,
+    geometry_world_transforms: &mut HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: &mut HashMap<(String, ColorCode), Vec<InstanceStep>>,
+    color_table: &HashMap<ColorCode, LDrawColor>,
+) {
+    let shapes: HashMap<_, _> = geometry_descriptors
+        .par_iter()
+        .filter(|(_, descriptor)| descriptor.recursive)
+        .filter_map(|(name, descriptor)| {
+            part_shape(descriptor.source_file, source_map).map(|shape| (name.clone(), shape))
+        })
+        .collect();
+
+    // Sort the keys to number the variants consistently between imports.
+    let mut keys: Vec<_> = geometry_world_transforms.keys().cloned().collect();
+    keys.sort();
+
+    let mut instances = Vec::new();
+    let mut instance_keys = Vec::new();
+    for key in &keys {
+        if let Some(shape) = shapes.get(&key.0) {
+            for (i, transform) in geometry_world_transforms[key].iter().enumerate() {
+                instances.push((*transform, shape, is_opaque(color_table, key.1)));
+                instance_keys.push((key, i));
+            }
+        }
+    }
+
+    // Only opaque parts can hide the connectors of other parts.
+    let tree = RTree::bulk_load(
+        instances
+            .iter()
+            .enumerate()
+            .filter(|(_, (_, _, opaque))| *opaque)
+            .map(|(i, (transform, shape, _))| {
+                let bounds = shape.bounds.transform(transform);
+                let rect = Rectangle::from_corners(
+                    (bounds.min - EPSILON).to_array(),
+                    (bounds.max + EPSILON).to_array(),
+                );
+                GeomWithData::new(rect, i)
+            })
+            .collect(),
+    );
+    let candidates: Vec<_> = instances
+        .iter()
+        .map(|(transform, shape, _)| Instance {
+            inverse: transform.inverse(),
+            shape: *shape,
+        })
+        .collect();
+
+    let masks: Vec<Vec<bool>> = instances
+        .par_iter()
+        .enumerate()
+        .map(|(i, (transform, shape, opaque))| {
+            shape
+                .connectors
+                .iter()
+                .map(|connector| {
+                    // Tubes are still visible through transparent parts.
+                    (connector.kind == ConnectorKind::Stud || *opaque)
+                        && is_covered(&tree, &candidates, i, transform, connector)
+                })
+                .collect()
+        })
+        .collect();
+
+    // Group instances with the same hidden connectors across all colors.
+    let mut variant_names = BTreeMap::new();
+    let mut new_transforms: HashMap<(String, ColorCode), Vec<Mat4>> = HashMap::new();
+    let mut new_steps: HashMap<(String, ColorCode), Vec<InstanceStep>> = HashMap::new();
+    for ((key, i), mask) in instance_keys.into_iter().zip(masks) {
+        let name = if mask.iter().any(|hidden| *hidden) {
+            let count = variant_names.len();
+            variant_names
+                .entry((key.0.clone(), mask))
+                .or_insert_with(|| variant_name(&key.0, count + 1))
+                .clone()
+        } else {
+            key.0.clone()
+        };
+        if let Some(step) = geometry_instance_steps.get(key).and_then(|s| s.get(i)) {
+            new_steps
+                .entry((name.clone(), key.1))
+                .or_default()
+                .push(*step);
+        }
+        new_transforms
+            .entry((name, key.1))
+            .or_default()
+            .push(geometry_world_transforms[key][i]);
+    }
+
+    // Instances of other geometry are unchanged.
+    for (key, transforms) in geometry_world_transforms.drain() {
+        if !shapes.contains_key(&key.0) {
+            new_transforms.insert(key, transforms);
+        }
+    }
+    *geometry_world_transforms = new_transforms;
+
+    for (key, steps) in geometry_instance_steps.drain() {
+        if !shapes.contains_key(&key.0) {
+            new_steps.insert(key, steps);
+        }
+    }
+    *geometry_instance_steps = new_steps;
+
+    for ((name, mask), variant_name) in variant_names {
+        // Use the same instance count as the part to select the same primitive resolution.
+        let descriptor = &geometry_descriptors[&name];
+        let variant = GeometryInitDescriptor {
+            source_file: descriptor.source_file,
+            current_color: descriptor.current_color,
+            recursive: descriptor.recursive,
+            instance_count: descriptor.instance_count,
+            hidden_connectors: mask,
+        };
+        geometry_descriptors.insert(variant_name, variant);
+    }
+
+    // Avoid creating geometry for parts where every instance uses a variant.
+    let used_names: HashSet<_> = geometry_world_transforms.keys().map(|(n, _)| n).collect();
+    geometry_descriptors.retain(|name, _| used_names.contains(name));
+}
+
+fn is_covered(
+    tree: &RTree<GeomWithData<Rectangle<[f32; 3]>, usize>>,
+    candidates: &[Instance],
+    index: usize,
+    transform: &Mat4,
+    connector: &Connector,
+) -> bool {
+    let point = transform.transform_point3(connector.probe);
+    tree.locate_all_at_point(&point.to_array())
+        .filter(|object| object.data != index)
+        .any(|object| {
+            let other = &candidates[object.data];
+            let local = other.inverse.transform_point3(point);
+            covers(other.shape, local, connector.kind)
+        })
+}
+
+fn covers(shape: &PartShape, point: Vec3, kind: ConnectorKind) -> bool {
+    let rays: &[Ray] = match kind {
+        ConnectorKind::Stud => &STUD_RAYS,
+        ConnectorKind::AntiStud => &ANTI_STUD_RAYS,
+    };
+    // Check the bounds first to skip testing the faces of most nearby parts.
+    is_in_connector_space(&shape.bounds, point, kind)
+        && rays.iter().all(|ray| {
+            shape
+                .faces
+                .ray_distance(point + ray.offset, ray.axis, ray.sign)
+                .is_some_and(|distance| distance <= ray.max_distance)
+        })
+}
+
+fn is_in_connector_space(bounds: &Bounds, point: Vec3, kind: ConnectorKind) -> bool {
+    let inside_xz = point.x >= bounds.min.x - EPSILON
+        && point.x <= bounds.max.x + EPSILON
+        && point.z >= bounds.min.z - EPSILON
+        && point.z <= bounds.max.z + EPSILON;
+
+    // LDraw uses -Y as up, so the bottom of a part is at the maximum Y.
+    let inside_y = match kind {
+        // Studs fit into the bottom of the covering part.
+        ConnectorKind::Stud => {
+            point.y >= bounds.max.y - STUD_HEIGHT - EPSILON && point.y <= bounds.max.y + EPSILON
+        }
+        // The covering part below fills the space under the anti-stud.
+        ConnectorKind::AntiStud => {
+            point.y >= bounds.min.y - EPSILON && point.y <= bounds.min.y + STUD_SPACE_HEIGHT
+        }
+    };
+
+    inside_xz && inside_y
+}
+
+fn part_shape(source_file: &weldr::SourceFile, source_map: &weldr::SourceMap) -> Option<PartShape> {
+    let mut connectors = Vec::new();
+    append_connectors(&mut connectors, source_file, source_map, Mat4::IDENTITY);
+    if connectors.is_empty() {
+        return None;
+    }
+
+    let mut triangles = Vec::new();
+    append_triangles(&mut triangles, source_file, source_map, Mat4::IDENTITY);
+    let mut shape = PartShape::new(triangles, connectors)?;
+
+    // Test just below the bottom of the part for anti-studs.
+    for connector in &mut shape.connectors {
+        if connector.kind == ConnectorKind::AntiStud {
+            connector.probe.y = shape.bounds.max.y + STUD_HEIGHT / 2.0;
+        }
+    }
+
+    Some(shape)
+}
+
+fn append_triangles(
+    triangles: &mut Vec<[Vec3; 3]>,
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+    transform: Mat4,
+) {
+    for cmd in &source_file.cmds {
+        match cmd {
+            Command::Triangle(t) => {
+                triangles.push(t.vertices.map(|v| transform.transform_point3(v)));
+            }
+            Command::Quad(q) => {
+                let [a, b, c, d] = q.vertices.map(|v| transform.transform_point3(v));
+                triangles.extend([[a, b, c], [a, c, d]]);
+            }
+            Command::SubFileRef(subfile_cmd) => {
+                if let Some(subfile) = source_map.get(&subfile_cmd.file) {
+                    let transform = transform * subfile_cmd.matrix();
+                    append_triangles(triangles, subfile, source_map, transform);
+                }
+            }
+            _ => (),
+        }
+    }
+}
+
+fn append_connectors(
+    connectors: &mut Vec<Connector>,
+    source_file: &weldr::SourceFile,
+    source_map: &weldr::SourceMap,
+    transform: Mat4,
+) {
+    // This needs to visit connectors in the same order as append_geometry.
+    for cmd in &source_file.cmds {
+        if let Command::SubFileRef(subfile_cmd) = cmd {
+            let transform = transform * subfile_cmd.matrix();
+            match connector_kind(&subfile_cmd.file) {
+                Some(kind) => {
+                    // Test the middle of the stud.
+                    let probe = transform.transform_point3(Vec3::new(0.0, -STUD_HEIGHT / 2.0, 0.0));
+                    connectors.push(Connector { kind, probe });
+                }
+                None => {
+                    if let Some(subfile) = source_map.get(&subfile_cmd.file) {
+                        append_connectors(connectors, subfile, source_map, transform);
+                    }
+                }
+            }
+        }
+    }
+}
+
+fn is_opaque(color_table: &HashMap<ColorCode, LDrawColor>, color: ColorCode) -> bool {
+    // Assume colors not in the table like direct colors are opaque.
+    color_table
+        .get(&color)
+        .map(|c| c.rgba_linear[3] >= 1.0)
+        .unwrap_or(true)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    #[test]
+    fn connector_kinds() {
+        assert_eq!(Some(ConnectorKind::Stud), connector_kind("stud.dat"));
+        assert_eq!(Some(ConnectorKind::Stud), connector_kind("STUD2.DAT"));
+        assert_eq!(Some(ConnectorKind::AntiStud), connector_kind("stud4.dat"));
+        assert_eq!(Some(ConnectorKind::AntiStud), connector_kind("stud3.dat"));
+        assert_eq!(None, connector_kind("box5.dat"));
+        assert_eq!(None, connector_kind("4-4cyli.dat"));
+    }
+
+    #[test]
+    fn base_names() {
+        assert_eq!("3001.dat", base_name("3001.dat"));
+        assert_eq!("3001.dat", base_name("3001.dat#culled12"));
+    }
+
+    fn box_triangles(min: Vec3, max: Vec3) -> Vec<[Vec3; 3]> {
+        let corner = |i: usize| {
+            vec3(
+                if i & 1 == 0 { min.x } else { max.x },
+                if i & 2 == 0 { min.y } else { max.y },
+                if i & 4 == 0 { min.z } else { max.z },
+            )
+        };
+        let quads = [
+            [0, 1, 3, 2],
+            [4, 5, 7, 6],
+            [0, 1, 5, 4],
+            [2, 3, 7, 6],
+            [0, 2, 6, 4],
+            [1, 3, 7, 5],
+        ];
+        quads
+            .iter()
+            .flat_map(|[a, b, c, d]| {
+                [
+                    [corner(*a), corner(*b), corner(*c)],
+                    [corner(*a), corner(*c), corner(*d)],
+                ]
+            })
+            .collect()
+    }
+
+    fn shape(boxes: &[([f32; 3], [f32; 3])]) -> PartShape {
+        let triangles = boxes
+            .iter()
+            .flat_map(|(min, max)| box_triangles(Vec3::from(*min), Vec3::from(*max)))
+            .collect();
+        PartShape::new(triangles, Vec::new()).unwrap()
+    }
+
+    #[test]
+    fn covers_stud_and_anti_stud() {
+        // A hollow 1x1 brick with a stud, its top at 0, and its bottom at 24.
+        let brick = shape(&[
+            ([-6.0, -4.0, -6.0], [6.0, 0.0, 6.0]),
+            ([-10.0, 0.0, -10.0], [10.0, 4.0, 10.0]),
+            ([-10.0, 4.0, -10.0], [-9.0, 24.0, 10.0]),
+            ([9.0, 4.0, -10.0], [10.0, 24.0, 10.0]),
+            ([-10.0, 4.0, -10.0], [10.0, 24.0, -9.0]),
+            ([-10.0, 4.0, 9.0], [10.0, 24.0, 10.0]),
+        ]);
+
+        // The middle of a stud under the brick.
+        assert!(covers(&brick, vec3(0.0, 22.0, 0.0), ConnectorKind::Stud));
+        assert!(!covers(&brick, vec3(0.0, 10.0, 0.0), ConnectorKind::Stud));
+        assert!(!covers(&brick, vec3(20.0, 22.0, 0.0), ConnectorKind::Stud));
+
+        // Just below the bottom of a brick on top.
+        assert!(covers(&brick, vec3(0.0, 2.0, 0.0), ConnectorKind::AntiStud));
+        assert!(!covers(
+            &brick,
+            vec3(0.0, 20.0, 0.0),
+            ConnectorKind::AntiStud
+        ));
+    }
+
+    #[test]
+    fn covers_corner_plate() {
+        // An L-shaped 2x2 corner plate without the +X +Z corner like 2420.
+        let plate = shape(&[
+            ([-20.0, 0.0, -20.0], [0.0, 4.0, 20.0]),
+            ([0.0, 0.0, -20.0], [20.0, 4.0, 0.0]),
+            ([-20.0, 4.0, -20.0], [-19.0, 8.0, 20.0]),
+            ([19.0, 4.0, -20.0], [20.0, 8.0, 0.0]),
+            ([-20.0, 4.0, -20.0], [20.0, 8.0, -19.0]),
+            ([-20.0, 4.0, 19.0], [0.0, 8.0, 20.0]),
+            ([-1.0, 4.0, 0.0], [0.0, 8.0, 20.0]),
+            ([0.0, 4.0, -1.0], [20.0, 8.0, 0.0]),
+        ]);
+
+        // Studs below the plate are only hidden under the L.
+        for (x, z) in [(-10.0, -10.0), (10.0, -10.0), (-10.0, 10.0)] {
+            assert!(covers(&plate, vec3(x, 6.0, z), ConnectorKind::Stud));
+        }
+        assert!(!covers(&plate, vec3(10.0, 6.0, 10.0), ConnectorKind::Stud));
+
+        // Anti-studs above the missing corner are still visible.
+        assert!(covers(
+            &plate,
+            vec3(-10.0, 2.0, -10.0),
+            ConnectorKind::AntiStud
+        ));
+        assert!(!covers(
+            &plate,
+            vec3(10.0, 2.0, 10.0),
+            ConnectorKind::AntiStud
+        ));
+    }
+
+    #[test]
+    fn covers_arch() {
+        // A 1x4 arch like 3659 with legs at each end and an opening between them.
+        let arch = shape(&[
+            ([-40.0, 0.0, -10.0], [40.0, 8.0, 10.0]),
+            ([-40.0, 8.0, -10.0], [-20.0, 24.0, 10.0]),
+            ([20.0, 8.0, -10.0], [40.0, 24.0, 10.0]),
+        ]);
+
+        // Studs under the legs are hidden but studs under the opening are visible from the sides.
+        assert!(covers(&arch, vec3(-30.0, 22.0, 0.0), ConnectorKind::Stud));
+        assert!(covers(&arch, vec3(30.0, 22.0, 0.0), ConnectorKind::Stud));
+        assert!(!covers(&arch, vec3(-10.0, 22.0, 0.0), ConnectorKind::Stud));
+        assert!(!covers(&arch, vec3(10.0, 22.0, 0.0), ConnectorKind::Stud));
+    }
+}
@@ -0,0 +1,175 @@
+//! Combine geometry from aliases and moved parts that resolve to identical buffers.
+use std::{
+    collections::{hash_map::DefaultHasher, HashMap},
+    hash::{Hash, Hasher},
+};
+
+use glam::Mat4;
+use rayon::prelude::*;
+
+use crate::{ColorCode, InstanceStep, LDrawGeometry, LDrawNode};
+
+/// Remove geometry with the same buffers as another geometry.
+/// Returns the canonical name for each removed name.
+///
+/// The canonical name is the lexicographically smallest name to be consistent between imports.
+#[tracing::instrument(skip_all)]
+pub(crate) fn deduplicate_geometry(
+    geometry_cache: &mut HashMap<String, LDrawGeometry>,
+) -> HashMap<String, String> {
+    let hashes: Vec<_> = geometry_cache
+        .par_iter()
+        .map(|(name, geometry)| (geometry_hash(geometry), name.clone()))
+        .collect();
+
+    let mut names_by_hash: HashMap<_, Vec<_>> = HashMap::new();
+    for (hash, name) in hashes {
+        names_by_hash.entry(hash).or_default().push(name);
+    }
+
+    let mut canonical_names = HashMap::new();
+    for mut names in names_by_hash.into_values().filter(|n| n.len() > 1) {
+        names.sort();
+
+        // Compare the buffers to handle hash collisions.
+        let mut canonical: Vec<String> = Vec::new();
+        for name in names {
+            let geometry = &geometry_cache[&name];
+            match canonical.iter().find(|c| &geometry_cache[*c] == geometry) {
+                Some(c) => {
+                    canonical_names.insert(name, c.clone());
+                }
+                None => canonical.push(name),
+            }
+        }
+    }
+
+    geometry_cache.retain(|name, _| !canonical_names.contains_key(name));
+    canonical_names
+}
+
+fn geometry_hash(geometry: &LDrawGeometry) -> u64 {
+    let mut hasher = DefaultHasher::new();
+    for v in &geometry.vertices {
+        v.to_array().map(f32::to_bits).hash(&mut hasher);
+    }
+    geometry.vertex_indices.hash(&mut hasher);
+    geometry.face_start_indices.hash(&mut hasher);
+    geometry.face_sizes.hash(&mut hasher);
+    geometry.face_colors.hash(&mut hasher);
+    geometry.is_face_stud.hash(&mut hasher);
+    geometry.edge_line_indices.hash(&mut hasher);
+    geometry.has_grainy_slopes.hash(&mut hasher);
+    hasher.finish()
+}
+
+/// Update node geometry names to use the canonical names.
+pub(crate) fn rename_node_geometry(
+    node: &mut LDrawNode,
+    canonical_names: &HashMap<String, String>,
+) {
+    if let Some(name) = &mut node.geometry_name {
+        if let Some(canonical) = canonical_names.get(name) {
+            *name = canonical.clone();
+        }
+    }
+    for child in &mut node.children {
+        rename_node_geometry(child, canonical_names);
+    }
+}
+
+/// Combine the instances for duplicate geometry with the instances for the canonical geometry.
+pub(crate) fn rename_instances(
+    geometry_world_transforms: &mut HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: &mut HashMap<(String, ColorCode), Vec<InstanceStep>>,
+    canonical_names: &HashMap<String, String>,
+) {
+    rename_keys(geometry_world_transforms, canonical_names);
+    rename_keys(geometry_instance_steps, canonical_names);
+}
+
+fn rename_keys<T>(
+    values: &mut HashMap<(String, ColorCode), Vec<T>>,
+    canonical_names: &HashMap<String, String>,
+) {
+    let mut renamed: Vec<_> = values
+        .keys()
+        .filter(|(name, _)| canonical_names.contains_key(name))
+        .cloned()
+        .collect();
+
+    // Sort to keep a consistent instance order between imports.
+    // Remove all keys first in case a new name is also renamed.
+    renamed.sort();
+    let removed: Vec<_> = renamed
+        .into_iter()
+        .map(|key| {
+            let items = values.remove(&key).unwrap();
+            ((canonical_names[&key.0].clone(), key.1), items)
+        })
+        .collect();
+    for (key, items) in removed {
+        values.entry(key).or_default().extend(items);
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    fn triangle(x: f32) -> LDrawGeometry {
+        LDrawGeometry {
+            vertices: vec![vec3(x, 0.0, 0.0), vec3(1.0, 0.0, 0.0), vec3(0.0, 1.0, 0.0)],
+            vertex_indices: vec![0, 1, 2],
+            face_start_indices: vec![0],
+            face_sizes: vec![3],
+            face_colors: vec![16],
+            is_face_stud: vec![false],
+            edge_line_indices: Vec::new(),
+            has_grainy_slopes: false,
+        }
+    }
+
+    #[test]
+    fn deduplicate_identical_geometry() {
+        let mut geometry_cache = [
+            ("b.dat".to_string(), triangle(0.0)),
+            ("a.dat".to_string(), triangle(0.0)),
+            ("c.dat".to_string(), triangle(0.5)),
+        ]
+        .into();
+
+        let canonical_names = deduplicate_geometry(&mut geometry_cache);
+        assert_eq!(
+            HashMap::from([("b.dat".to_string(), "a.dat".to_string())]),
+            canonical_names
+        );
+        assert_eq!(2, geometry_cache.len());
+        assert!(geometry_cache.contains_key("a.dat"));
+        assert!(geometry_cache.contains_key("c.dat"));
+    }
+
+    #[test]
+    fn rename_instances_combines_keys() {
+        let canonical_names = HashMap::from([("b.dat".to_string(), "a.dat".to_string())]);
+
+        let mut transforms = HashMap::from([
+            (("a.dat".to_string(), 4), vec![Mat4::IDENTITY]),
+            (("b.dat".to_string(), 4), vec![Mat4::IDENTITY; 2]),
+            (("b.dat".to_string(), 1), vec![Mat4::IDENTITY]),
+        ]);
+        let mut steps = HashMap::from([
+            (("a.dat".to_string(), 4), vec![InstanceStep::default()]),
+            (("b.dat".to_string(), 4), vec![InstanceStep::default(); 2]),
+            (("b.dat".to_string(), 1), vec![InstanceStep::default()]),
+        ]);
+        rename_instances(&mut transforms, &mut steps, &canonical_names);
+
+        assert_eq!(2, transforms.len());
+        assert_eq!(3, transforms[&("a.dat".to_string(), 4)].len());
+        assert_eq!(1, transforms[&("a.dat".to_string(), 1)].len());
+        assert_eq!(3, steps[&("a.dat".to_string(), 4)].len());
+    }
+}
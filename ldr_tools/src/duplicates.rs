@@ -0,0 +1,204 @@
+//! Remove instances of the same part and color placed at the same transform.
+//!
+//! These are often left over from copying and pasting in editors
+//! and only add memory usage and z-fighting.
+use std::collections::HashMap;
+
+use glam::Mat4;
+use rayon::prelude::*;
+
+use crate::{retain_mask, ColorCode, GeometryInitDescriptor, InstanceStep};
+
+// Tolerances for treating transforms as equal.
+// Translations use LDUs, and the rotation and scale columns are unitless.
+const TRANSLATION_TOLERANCE: f32 = 0.01;
+const BASIS_TOLERANCE: f32 = 0.001;
+
+/// Instances of the same part and color at the same transform.
+#[derive(Debug, Clone, PartialEq)]
+pub struct DuplicateInstances {
+    pub name: String,
+    pub color: ColorCode,
+    /// The world transform of the kept instance in LDUs and LDraw coordinates.
+    pub transform: Mat4,
+    /// The number of instances at this transform including the kept instance.
+    pub count: usize,
+    /// The index of the model containing the kept instance.
+    pub submodel: u32,
+}
+
+/// Keep only the first instance in building order for each part, color, and transform.
+/// The world transforms use LDUs and LDraw coordinates.
+#[tracing::instrument(skip_all)]
+pub(crate) fn remove_duplicate_instances(
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor>,
+    geometry_world_transforms: &mut HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: &mut HashMap<(String, ColorCode), Vec<InstanceStep>>,
+) -> Vec<DuplicateInstances> {
+    // Hashing translation cells finds duplicates without comparing every pair of instances.
+    // Transforms within tolerance can be in neighboring cells, so check those as well.
+    let removed: Vec<_> = geometry_world_transforms
+        .par_iter()
+        .filter_map(|(key, transforms)| {
+            let mut kept_by_cell: HashMap<[i64; 3], Vec<usize>> = HashMap::new();
+            let mut keep = vec![false; transforms.len()];
+            let mut counts = vec![0; transforms.len()];
+            for (i, transform) in transforms.iter().enumerate() {
+                let cell = translation_cell(transform);
+                let first = neighbor_cells(cell)
+                    .filter_map(|c| kept_by_cell.get(&c))
+                    .flatten()
+                    .copied()
+                    .filter(|k| is_same_transform(&transforms[*k], transform))
+                    .min();
+                match first {
+                    Some(first) => counts[first] += 1,
+                    None => {
+                        keep[i] = true;
+                        counts[i] = 1;
+                        kept_by_cell.entry(cell).or_default().push(i);
+                    }
+                }
+            }
+            if keep.iter().all(|k| *k) {
+                return None;
+            }
+
+            let duplicates: Vec<_> = counts
+                .into_iter()
+                .enumerate()
+                .filter(|(_, count)| *count > 1)
+                .collect();
+            Some((key.clone(), keep, duplicates))
+        })
+        .collect();
+
+    let mut duplicate_instances = Vec::new();
+    for (key, keep, duplicates) in removed {
+        let transforms = geometry_world_transforms.get_mut(&key).unwrap();
+        let steps = geometry_instance_steps.get_mut(&key);
+
+        for (first, count) in duplicates {
+            duplicate_instances.push(DuplicateInstances {
+                name: key.0.clone(),
+                color: key.1,
+                transform: transforms[first],
+                count,
+                submodel: steps.as_ref().map(|s| s[first].submodel).unwrap_or_default(),
+            });
+            if let Some(descriptor) = geometry_descriptors.get_mut(&key.0) {
+                descriptor.instance_count -= count - 1;
+            }
+        }
+
+        retain_mask(transforms, &keep);
+        if let Some(steps) = steps {
+            retain_mask(steps, &keep);
+        }
+    }
+
+    // Sort to report duplicates in a consistent order between imports.
+    duplicate_instances.sort_by(|a, b| (&a.name, a.color).cmp(&(&b.name, b.color)));
+    duplicate_instances
+}
+
+fn translation_cell(transform: &Mat4) -> [i64; 3] {
+    let translation = transform.w_axis.truncate() / TRANSLATION_TOLERANCE;
+    translation.floor().to_array().map(|x| x as i64)
+}
+
+fn neighbor_cells([x, y, z]: [i64; 3]) -> impl Iterator<Item = [i64; 3]> {
+    (-1..=1).flat_map(move |dx| {
+        (-1..=1).flat_map(move |dy| (-1..=1).map(move |dz| [x + dx, y + dy, z + dz]))
+    })
+}
+
+fn is_same_transform(a: &Mat4, b: &Mat4) -> bool {
+    let basis = |m: &Mat4| [m.x_axis.truncate(), m.y_axis.truncate(), m.z_axis.truncate()];
+    basis(a)
+        .iter()
+        .zip(basis(b))
+        .all(|(a, b)| a.abs_diff_eq(b, BASIS_TOLERANCE))
+        && a.w_axis
+            .truncate()
+            .abs_diff_eq(b.w_axis.truncate(), TRANSLATION_TOLERANCE)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::{vec3, Quat};
+
+    #[test]
+    fn remove_duplicates_within_tolerance() {
+        let key = ("3001.dat".to_string(), 4);
+        let other_key = ("3001.dat".to_string(), 1);
+        let transform = Mat4::from_rotation_translation(
+            Quat::from_rotation_y(std::f32::consts::FRAC_PI_2),
+            vec3(20.0, -24.0, 40.0),
+        );
+        let nudged = Mat4::from_translation(vec3(0.001, 0.0, 0.0)) * transform;
+        let moved = Mat4::from_translation(vec3(20.0, 0.0, 0.0)) * transform;
+
+        let mut geometry_world_transforms = HashMap::from([
+            (key.clone(), vec![transform, moved, nudged, transform]),
+            (other_key.clone(), vec![transform]),
+        ]);
+        let step = |step| InstanceStep { step, submodel: 1 };
+        let mut geometry_instance_steps = HashMap::from([
+            (key.clone(), vec![step(0), step(1), step(2), step(3)]),
+            (other_key.clone(), vec![step(0)]),
+        ]);
+
+        let duplicates = remove_duplicate_instances(
+            &mut HashMap::new(),
+            &mut geometry_world_transforms,
+            &mut geometry_instance_steps,
+        );
+
+        assert_eq!(
+            vec![DuplicateInstances {
+                name: "3001.dat".to_string(),
+                color: 4,
+                transform,
+                count: 3,
+                submodel: 1,
+            }],
+            duplicates
+        );
+        assert_eq!(vec![transform, moved], geometry_world_transforms[&key]);
+        assert_eq!(vec![step(0), step(1)], geometry_instance_steps[&key]);
+        assert_eq!(vec![transform], geometry_world_transforms[&other_key]);
+    }
+
+    #[test]
+    fn remove_duplicates_across_cell_boundary() {
+        // The translations are within tolerance but on opposite sides of a cell boundary.
+        let key = ("3001.dat".to_string(), 4);
+        let transform = Mat4::from_translation(vec3(19.999, 0.0, -0.001));
+        let nudged = Mat4::from_translation(vec3(20.001, 0.0, 0.001));
+        let moved = Mat4::from_translation(vec3(20.02, 0.0, 0.0));
+
+        let mut geometry_world_transforms =
+            HashMap::from([(key.clone(), vec![transform, nudged, moved])]);
+
+        let duplicates = remove_duplicate_instances(
+            &mut HashMap::new(),
+            &mut geometry_world_transforms,
+            &mut HashMap::new(),
+        );
+
+        assert_eq!(
+            vec![DuplicateInstances {
+                name: "3001.dat".to_string(),
+                color: 4,
+                transform,
+                count: 2,
+                submodel: 0,
+            }],
+            duplicates
+        );
+        assert_eq!(vec![transform, moved], geometry_world_transforms[&key]);
+    }
+}
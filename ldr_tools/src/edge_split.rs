@@ -1,4 +1,4 @@
-use std::collections::{BTreeSet, HashSet};
+use std::collections::{BTreeSet, HashMap, HashSet};
 
 /// Calculate new vertices and indices by splitting the edges in `edges_to_split`.
 /// The geometry must be triangulated!
@@ -55,10 +55,149 @@ pub fn split_edges<T: Copy>(
         &mut new_adjacent_faces,
     );
 
-    // TODO: Reindex the vertices to reduce unneeded duplicate elements.
+    // See compact_split_vertices for removing the unused and redundant vertices.
     (split_vertices, split_vertex_indices)
 }
 
+/// The result of [compact_split_vertices].
+#[derive(Debug, PartialEq)]
+pub struct CompactVertices<T> {
+    pub vertices: Vec<T>,
+    pub vertex_indices: Vec<u32>,
+    /// The edges to split using the new vertex indices.
+    /// Each end point uses one of the split copies of the vertex.
+    pub edges: Vec<[u32; 2]>,
+    pub stats: CompactionStats,
+}
+
+/// The vertices removed by [compact_split_vertices].
+#[derive(Debug, Default, Clone, Copy, PartialEq, Eq)]
+pub struct CompactionStats {
+    /// The number of vertices after splitting.
+    pub split_vertices: usize,
+    /// Vertices not used by any face.
+    pub unreferenced: usize,
+    /// Copies of a vertex in faces connected by an edge that is not split.
+    pub merged: usize,
+}
+
+impl CompactionStats {
+    /// The number of vertices after compacting.
+    pub fn vertices(&self) -> usize {
+        self.split_vertices - self.unreferenced - self.merged
+    }
+}
+
+/// Remove the vertices from [split_edges] that are not used by any faces
+/// and merge copies of the same vertex in faces connected by an edge that is not split.
+/// `original_indices` and `edges_to_split` use the vertex indices before splitting.
+///
+/// The new vertices are ordered by their first use in the faces.
+pub fn compact_split_vertices<T: Copy>(
+    vertices: &[T],
+    vertex_indices: &[u32],
+    original_indices: &[u32],
+    face_starts: &[u32],
+    face_sizes: &[u32],
+    edges_to_split: &[[u32; 2]],
+) -> CompactVertices<T> {
+    let sharp_edges: HashSet<_> = edges_to_split.iter().map(|e| sorted_edge(*e)).collect();
+
+    // Faces sharing an edge that is not split should share both vertices of that edge.
+    // Grouping copies with union-find handles any number of faces around a vertex.
+    let mut parents: Vec<u32> = (0..vertices.len() as u32).collect();
+    let mut first_face_edges = HashMap::new();
+    for (start, size) in face_starts.iter().zip(face_sizes) {
+        let start = *start as usize;
+        let size = *size as usize;
+        for i in 0..size {
+            let j = start + i;
+            let k = start + (i + 1) % size;
+            let edge = [original_indices[j], original_indices[k]];
+            if edge[0] == edge[1] || sharp_edges.contains(&sorted_edge(edge)) {
+                continue;
+            }
+
+            // Store the new indices in the same order as the sorted original indices.
+            let new_edge = if edge[0] < edge[1] {
+                [vertex_indices[j], vertex_indices[k]]
+            } else {
+                [vertex_indices[k], vertex_indices[j]]
+            };
+            let first = *first_face_edges
+                .entry(sorted_edge(edge))
+                .or_insert(new_edge);
+            union(&mut parents, first[0], new_edge[0]);
+            union(&mut parents, first[1], new_edge[1]);
+        }
+    }
+
+    let mut is_referenced = vec![false; vertices.len()];
+    for v in vertex_indices {
+        is_referenced[*v as usize] = true;
+    }
+
+    let mut new_indices = vec![u32::MAX; vertices.len()];
+    let mut new_vertices = Vec::new();
+    let new_vertex_indices: Vec<_> = vertex_indices
+        .iter()
+        .map(|v| {
+            let root = find(&mut parents, *v) as usize;
+            if new_indices[root] == u32::MAX {
+                new_indices[root] = new_vertices.len() as u32;
+                new_vertices.push(vertices[root]);
+            }
+            new_indices[root]
+        })
+        .collect();
+
+    // Edges only need one copy of each vertex to find the position.
+    let mut original_vertices = HashMap::new();
+    for (old, new) in original_indices.iter().zip(&new_vertex_indices) {
+        original_vertices.entry(*old).or_insert(*new);
+    }
+    let edges = edges_to_split
+        .iter()
+        .filter_map(|[v0, v1]| Some([*original_vertices.get(v0)?, *original_vertices.get(v1)?]))
+        .collect();
+
+    let referenced = is_referenced.iter().filter(|r| **r).count();
+    let stats = CompactionStats {
+        split_vertices: vertices.len(),
+        unreferenced: vertices.len() - referenced,
+        merged: referenced - new_vertices.len(),
+    };
+
+    CompactVertices {
+        vertices: new_vertices,
+        vertex_indices: new_vertex_indices,
+        edges,
+        stats,
+    }
+}
+
+fn sorted_edge([v0, v1]: [u32; 2]) -> [u32; 2] {
+    [v0.min(v1), v0.max(v1)]
+}
+
+pub(crate) fn find(parents: &mut [u32], mut v: u32) -> u32 {
+    // Path halving keeps the trees shallow without recursion.
+    while parents[v as usize] != v {
+        parents[v as usize] = parents[parents[v as usize] as usize];
+        v = parents[v as usize];
+    }
+    v
+}
+
+pub(crate) fn union(parents: &mut [u32], v0: u32, v1: u32) {
+    // Use the lowest index as the root to prefer the original vertices.
+    let r0 = find(parents, v0);
+    let r1 = find(parents, v1);
+    if r0 != r1 {
+        parents[r0.max(r1) as usize] = r0.min(r1);
+    }
+}
+
 fn adjacent_faces<T>(
     vertices: &[T],
     vertex_indices: &[u32],
@@ -431,4 +570,121 @@ mod tests {
             )
         );
     }
+
+    fn assert_topology_preserved(
+        compacted: &CompactVertices<f32>,
+        original_indices: &[u32],
+        edges: &[[u32; 2]],
+    ) {
+        // The vertex values are the original indices.
+        let positions: Vec<_> = compacted
+            .vertex_indices
+            .iter()
+            .map(|v| compacted.vertices[*v as usize])
+            .collect();
+        let expected: Vec<_> = original_indices.iter().map(|v| *v as f32).collect();
+        assert_eq!(expected, positions);
+
+        let edge_positions: Vec<_> = compacted
+            .edges
+            .iter()
+            .map(|e| e.map(|v| compacted.vertices[v as usize]))
+            .collect();
+        let expected: Vec<_> = edges.iter().map(|e| e.map(|v| v as f32)).collect();
+        assert_eq!(expected, edge_positions);
+    }
+
+    #[test]
+    fn compact_split_vertices_split_two_triangulated_quads() {
+        // 2 - 3    4 - 7
+        // | \ |    | \ |
+        // 0 - 1    5 - 6
+        let vertices = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0];
+        let indices = [0, 1, 2, 2, 1, 3, 3, 1, 5, 3, 5, 4];
+        let face_starts = [0, 3, 6, 9];
+        let face_sizes = [3, 3, 3, 3];
+        let edges = [[1, 3]];
+
+        let (split_vertices, split_indices) =
+            split_edges(&vertices, &indices, &face_starts, &face_sizes, &edges);
+        let compacted = compact_split_vertices(
+            &split_vertices,
+            &split_indices,
+            &indices,
+            &face_starts,
+            &face_sizes,
+            &edges,
+        );
+
+        assert_eq!(
+            vec![0.0, 1.0, 2.0, 3.0, 3.0, 1.0, 5.0, 4.0],
+            compacted.vertices
+        );
+        assert_eq!(
+            vec![0, 1, 2, 2, 1, 3, 4, 5, 6, 4, 6, 7],
+            compacted.vertex_indices
+        );
+        assert_eq!(
+            CompactionStats {
+                split_vertices: 10,
+                unreferenced: 2,
+                merged: 0
+            },
+            compacted.stats
+        );
+        assert_eq!(8, compacted.stats.vertices());
+        assert_topology_preserved(&compacted, &indices, &edges);
+    }
+
+    #[test]
+    fn compact_split_vertices_merge_smooth_edge() {
+        // The second triangle uses copies of 1 and 2 across a smooth edge.
+        // 2 - 3
+        // | \ |
+        // 0 - 1
+        let indices = [0, 1, 2, 2, 1, 3];
+        let compacted = compact_split_vertices(
+            &[0.0, 1.0, 2.0, 3.0, 1.0, 2.0],
+            &[0, 1, 2, 5, 4, 3],
+            &indices,
+            &[0, 3],
+            &[3, 3],
+            &[],
+        );
+
+        assert_eq!(vec![0.0, 1.0, 2.0, 3.0], compacted.vertices);
+        assert_eq!(vec![0, 1, 2, 2, 1, 3], compacted.vertex_indices);
+        assert_eq!(
+            CompactionStats {
+                split_vertices: 6,
+                unreferenced: 0,
+                merged: 2
+            },
+            compacted.stats
+        );
+        assert_topology_preserved(&compacted, &indices, &[]);
+    }
+
+    #[test]
+    fn compact_split_vertices_keep_sharp_edge() {
+        // 2 - 3
+        // | \ |
+        // 0 - 1
+        let indices = [0, 1, 2, 2, 1, 3];
+        let edges = [[2, 1]];
+        let compacted = compact_split_vertices(
+            &[0.0, 1.0, 2.0, 3.0, 1.0, 2.0],
+            &[0, 1, 2, 5, 4, 3],
+            &indices,
+            &[0, 3],
+            &[3, 3],
+            &edges,
+        );
+
+        assert_eq!(vec![0.0, 1.0, 2.0, 2.0, 1.0, 3.0], compacted.vertices);
+        assert_eq!(vec![0, 1, 2, 3, 4, 5], compacted.vertex_indices);
+        assert_eq!(vec![[2, 1]], compacted.edges);
+        assert_eq!(0, compacted.stats.merged);
+        assert_topology_preserved(&compacted, &indices, &edges);
+    }
 }
@@ -3,8 +3,11 @@ use rstar::{primitives::GeomWithData, RTree};
 use weldr::Command;
 
 use crate::{
-    edge_split::split_edges, replace_color, slope::is_slope_piece, ColorCode, GeometrySettings,
-    StudType,
+    coplanar::merge_coplanar_faces,
+    culling::{base_name, connector_kind},
+    edge_split::{compact_split_vertices, split_edges},
+    primitive_variant_name, reorder::reorder_for_locality, replace_color, slope::is_slope_piece,
+    ColorCode, GeometrySettings, PrimitiveResolution, StudType,
 };
 
 // TODO: Document the data layout for these fields.
@@ -32,6 +35,15 @@ struct GeometryContext {
     inverted: bool,
     is_stud: bool,
     is_slope: bool,
+    primitive_resolution: PrimitiveResolution,
+    /// `true` for geometry within a stud or anti-stud of the part.
+    is_connector: bool,
+}
+
+/// The studs and anti-studs to skip in the order they appear in the part.
+struct ConnectorCulling<'a> {
+    hidden: &'a [bool],
+    index: usize,
 }
 
 #[derive(Debug, Clone, Copy, PartialEq, Eq)]
@@ -85,8 +97,13 @@ pub fn create_geometry(
     name: &str,
     current_color: ColorCode,
     recursive: bool,
+    primitive_resolution: PrimitiveResolution,
+    hidden_connectors: &[bool],
     settings: &GeometrySettings,
 ) -> LDrawGeometry {
+    // Geometry with culled connectors uses the same part name with a suffix.
+    let name = base_name(name);
+
     let mut geometry = LDrawGeometry {
         vertices: Vec::new(),
         vertex_indices: Vec::new(),
@@ -106,10 +123,16 @@ pub fn create_geometry(
         inverted: false,
         is_stud: is_stud(name),
         is_slope: is_slope_piece(name),
+        primitive_resolution,
+        is_connector: false,
     };
 
     let mut vertex_map = VertexMap::new();
     let mut hard_edges = Vec::new();
+    let mut culling = ConnectorCulling {
+        hidden: hidden_connectors,
+        index: 0,
+    };
 
     append_geometry(
         &mut geometry,
@@ -119,14 +142,20 @@ pub fn create_geometry(
         source_map,
         ctx,
         recursive,
+        &mut culling,
         settings,
     );
 
     geometry.edge_line_indices = edge_indices(&hard_edges, &vertex_map);
 
-    // TODO: make this optional.
+    // Merge before splitting edges since merging requires shared vertices.
+    if settings.merge_coplanar_faces && !settings.triangulate {
+        merge_coplanar_faces(&mut geometry);
+    }
+
     // TODO: Should this be disabled when not welding vertices?
-    if !geometry.edge_line_indices.is_empty() {
+    // Applications can mark the edges as sharp instead to keep vertices welded.
+    if !settings.mark_sharp_edges && !geometry.edge_line_indices.is_empty() {
         let (split_positions, split_indices) = split_edges(
             &geometry.vertices,
             &geometry.vertex_indices,
@@ -134,9 +163,22 @@ pub fn create_geometry(
             &geometry.face_sizes,
             &geometry.edge_line_indices,
         );
-        // The edge indices are still valid since splitting only adds new vertices.
-        geometry.vertices = split_positions;
-        geometry.vertex_indices = split_indices;
+        // Splitting leaves unused vertices and copies that can still be shared.
+        let compacted = compact_split_vertices(
+            &split_positions,
+            &split_indices,
+            &geometry.vertex_indices,
+            &geometry.face_start_indices,
+            &geometry.face_sizes,
+            &geometry.edge_line_indices,
+        );
+        geometry.vertices = compacted.vertices;
+        geometry.vertex_indices = compacted.vertex_indices;
+        geometry.edge_line_indices = compacted.edges;
+    }
+
+    if settings.reorder_for_locality {
+        reorder_for_locality(&mut geometry);
     }
 
     // Optimize the case where all face colors are the same.
@@ -170,8 +212,9 @@ pub fn create_geometry(
 
     // Apply the scale last to use LDUs as the unit for vertex welding.
     // This avoids small floating point comparisons for small scene scales.
+    let axes = settings.axis_convention.matrix();
     for vertex in &mut geometry.vertices {
-        *vertex *= scale;
+        *vertex = axes.transform_vector3(*vertex * scale);
     }
 
     geometry
@@ -220,6 +263,7 @@ fn append_geometry(
     source_map: &weldr::SourceMap,
     ctx: GeometryContext,
     recursive: bool,
+    culling: &mut ConnectorCulling,
     settings: &GeometrySettings,
 ) {
     // BFC Extension: https://www.ldraw.org/article/415.html
@@ -309,9 +353,22 @@ fn append_geometry(
             }
             Command::SubFileRef(subfile_cmd) => {
                 if recursive {
+                    // Count connectors in the same order as the culling pass.
+                    let is_connector = ctx.is_connector
+                        || (!culling.hidden.is_empty()
+                            && connector_kind(&subfile_cmd.file).is_some());
+                    if is_connector && !ctx.is_connector {
+                        let hidden = culling.hidden.get(culling.index).copied().unwrap_or(false);
+                        culling.index += 1;
+                        if hidden {
+                            invert_next = false;
+                            continue;
+                        }
+                    }
+
                     let subfilename = replace_studs(subfile_cmd, settings.stud_type);
 
-                    if let Some(subfile) = source_map.get(subfilename) {
+                    if let Some(subfile) = find_subfile(source_map, subfilename, &ctx) {
                         // Subfiles of slopes or studs are still slopes or studs.
                         let is_stud = ctx.is_stud || is_stud(subfilename);
                         let is_slope = ctx.is_slope || is_slope_piece(subfilename);
@@ -339,6 +396,8 @@ fn append_geometry(
                             },
                             is_stud,
                             is_slope,
+                            primitive_resolution: ctx.primitive_resolution,
+                            is_connector,
                         };
 
                         // Don't invert additional subfile reference commands.
@@ -348,7 +407,7 @@ fn append_geometry(
                         // TODO: Will studs ever need to be welded to other geometry?
                         append_geometry(
                             geometry, hard_edges, vertex_map, subfile, source_map, child_ctx,
-                            recursive, settings,
+                            recursive, culling, settings,
                         );
                     }
                 }
@@ -358,7 +417,19 @@ fn append_geometry(
     }
 }
 
-fn replace_studs(subfile_cmd: &weldr::SubFileRefCmd, stud_type: StudType) -> &str {
+fn find_subfile<'a>(
+    source_map: &'a weldr::SourceMap,
+    name: &str,
+    ctx: &GeometryContext,
+) -> Option<&'a weldr::SourceFile> {
+    // Prefer the primitive resolution selected for this part if available.
+    // Other resolutions are only loaded into the source map for adaptive resolution or proxies.
+    primitive_variant_name(name, ctx.primitive_resolution)
+        .and_then(|variant| source_map.get(&variant))
+        .or_else(|| source_map.get(name))
+}
+
+pub(crate) fn replace_studs(subfile_cmd: &weldr::SubFileRefCmd, stud_type: StudType) -> &str {
     // https://wiki.ldraw.org/wiki/Studs_with_Logos
     match stud_type {
         StudType::Disabled => match subfile_cmd.file.as_str() {
@@ -538,6 +609,8 @@ mod tests {
             "",
             7,
             true,
+            PrimitiveResolution::Normal,
+            &[],
             &GeometrySettings {
                 weld_vertices: true,
                 ..Default::default()
@@ -555,6 +628,96 @@ mod tests {
         assert_eq!(vec![7, 2, 3, 1, 4, 5, 7, 8,], geometry.face_colors);
     }
 
+    #[test]
+    fn create_geometry_mark_sharp_edges() {
+        let mut source_map = weldr::SourceMap::new();
+
+        // Two quads folded along a hard edge.
+        let document = indoc! {"
+            4 16 0 0 0 1 0 0 1 1 0 0 1 0
+            4 16 0 0 0 0 1 0 0 1 1 0 0 1
+            2 24 0 0 0 0 1 0
+        "};
+
+        let mut resolver = DummyResolver::new();
+        resolver.files.insert("root", document.as_bytes().to_vec());
+
+        let main_model_name = weldr::parse("root", &resolver, &mut source_map).unwrap();
+        let source_file = source_map.get(&main_model_name).unwrap();
+
+        let create = |mark_sharp_edges| {
+            create_geometry(
+                &source_file,
+                &source_map,
+                "",
+                16,
+                true,
+                PrimitiveResolution::Normal,
+                &[],
+                &GeometrySettings {
+                    weld_vertices: true,
+                    mark_sharp_edges,
+                    ..Default::default()
+                },
+            )
+        };
+
+        // Marking edges keeps the shared vertices welded.
+        let marked = create(true);
+        assert_eq!(6, marked.vertices.len());
+        assert_eq!(1, marked.edge_line_indices.len());
+
+        // Splitting only duplicates the two vertices on the edge.
+        let split = create(false);
+        assert_eq!(8, split.vertices.len());
+        assert_eq!(marked.vertex_indices.len(), split.vertex_indices.len());
+        assert_eq!(1, split.edge_line_indices.len());
+    }
+
+    #[test]
+    fn create_geometry_merge_coplanar_faces() {
+        let mut source_map = weldr::SourceMap::new();
+
+        // Two quads side by side with an edge line along the bottom.
+        let document = indoc! {"
+            4 16 0 0 0 1 0 0 1 1 0 0 1 0
+            4 16 1 0 0 2 0 0 2 1 0 1 1 0
+            2 24 0 0 0 2 0 0
+        "};
+
+        let mut resolver = DummyResolver::new();
+        resolver.files.insert("root", document.as_bytes().to_vec());
+
+        let main_model_name = weldr::parse("root", &resolver, &mut source_map).unwrap();
+        let source_file = source_map.get(&main_model_name).unwrap();
+
+        let create = |merge_coplanar_faces| {
+            create_geometry(
+                &source_file,
+                &source_map,
+                "",
+                16,
+                true,
+                PrimitiveResolution::Normal,
+                &[],
+                &GeometrySettings {
+                    weld_vertices: true,
+                    mark_sharp_edges: true,
+                    merge_coplanar_faces,
+                    ..Default::default()
+                },
+            )
+        };
+
+        assert_eq!(vec![4, 4], create(false).face_sizes);
+
+        let merged = create(true);
+        assert_eq!(vec![6], merged.face_sizes);
+        assert_eq!(vec![0], merged.face_start_indices);
+        assert_eq!(6, merged.vertices.len());
+        assert_eq!(vec![false], merged.is_face_stud);
+    }
+
     #[test]
     fn create_geometry_ccw() {
         let mut source_map = weldr::SourceMap::new();
@@ -577,6 +740,8 @@ mod tests {
             "",
             16,
             true,
+            PrimitiveResolution::Normal,
+            &[],
             &GeometrySettings {
                 weld_vertices: true,
                 ..Default::default()
@@ -609,6 +774,8 @@ mod tests {
             "",
             16,
             true,
+            PrimitiveResolution::Normal,
+            &[],
             &GeometrySettings {
                 weld_vertices: true,
                 ..Default::default()
@@ -652,6 +819,8 @@ mod tests {
             "",
             16,
             true,
+            PrimitiveResolution::Normal,
+            &[],
             &GeometrySettings {
                 weld_vertices: true,
                 ..Default::default()
@@ -665,6 +834,54 @@ mod tests {
         assert_eq!(vec![3, 3, 3, 3], geometry.face_sizes);
     }
 
+    #[test]
+    fn create_geometry_adaptive_primitive_variant() {
+        let mut source_map = weldr::SourceMap::new();
+
+        let document = indoc! {"
+            1 16 0 0 0 1 0 0 0 1 0 0 0 1 prim.dat
+        "};
+
+        let mut resolver = DummyResolver::new();
+        resolver.files.insert("root", document.as_bytes().to_vec());
+        resolver.files.insert("prim.dat", b"3 16 1 0 0 0 1 0 0 0 1\n".to_vec());
+        resolver.files.insert("8/prim.dat", b"4 16 1 0 0 0 1 0 0 0 1 1 1 1\n".to_vec());
+
+        let main_model_name = weldr::parse("root", &resolver, &mut source_map).unwrap();
+        weldr::parse("8/prim.dat", &resolver, &mut source_map).unwrap();
+        let source_file = source_map.get(&main_model_name).unwrap();
+
+        let settings = GeometrySettings {
+            primitive_resolution: PrimitiveResolution::Adaptive,
+            ..Default::default()
+        };
+
+        // Use the variant if present and fall back to the original file.
+        let low = create_geometry(
+            &source_file,
+            &source_map,
+            "",
+            16,
+            true,
+            PrimitiveResolution::Low,
+            &[],
+            &settings,
+        );
+        assert_eq!(vec![4], low.face_sizes);
+
+        let high = create_geometry(
+            &source_file,
+            &source_map,
+            "",
+            16,
+            true,
+            PrimitiveResolution::High,
+            &[],
+            &settings,
+        );
+        assert_eq!(vec![3], high.face_sizes);
+    }
+
     // TODO: Test create geometry with and without welding and triangulate options
 
     // TODO: Add tests for BFC certified superfiles.
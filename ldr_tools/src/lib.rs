@@ -1,17 +1,24 @@
 use std::{
-    collections::HashMap,
+    collections::{HashMap, HashSet},
     path::{Path, PathBuf},
+    sync::Mutex,
+    time::SystemTime,
 };
 use geometry::create_geometry;
-use glam::{vec4, Mat4, Vec3};
+use glam::{vec4, Mat4, Quat, Vec3, Vec4};
+use memory::{GeometryMemory, MemoryReport};
 use rayon::prelude::*;
 use weldr::{Command, FileRefResolver, ResolveError};
 
 use pyo3::prelude::*;
 
+pub use bounds::Bounds;
 pub use color::{load_color_table, LDrawColor};
+pub use duplicates::DuplicateInstances;
 pub use geometry::LDrawGeometry;
 pub use glam;
+pub use merge::MergedGeometry;
+pub use spatial::{InstanceIndex, Region};
 pub use weldr::Color;
 
 pub type ColorCode = u32;
@@ -19,13 +26,29 @@ pub type ColorCode = u32;
 // Special color code that "inherits" the existing color.
 const CURRENT_COLOR: ColorCode = 16;
 
+pub mod analysis;
+mod bounds;
 mod color;
+mod coplanar;
+mod culling;
+mod dedupe;
+mod duplicates;
 mod edge_split;
 mod geometry;
+pub mod memory;
+mod merge;
+pub mod profile;
+mod reorder;
 mod slope;
+mod spatial;
+pub mod synthetic;
 
 pub struct LDrawNode {
     pub name: String,
+    /// A name like `"3001.dat#0042"` that is unique within the scene and short enough for Blender.
+    /// Counts start at 0 for each scene, so applications that add multiple scenes
+    /// should offset the counts past any names already in use.
+    pub object_name: String,
     pub transform: Mat4,
     /// The name of the geometry in [geometry_cache](struct.LDrawScene.html#structfield.geometry_cache)
     /// or `None` for internal nodes.
@@ -38,6 +61,22 @@ pub struct LDrawNode {
 
 struct DiskResolver {
     base_paths: Vec<PathBuf>,
+    /// Files like the main model for [load_bytes] that take priority over files on disk.
+    /// The keys use [memory_file_key].
+    memory_files: HashMap<String, Vec<u8>>,
+    /// Files that could not be found in any folder.
+    missing_files: Mutex<Vec<String>>,
+    /// Files read from disk with keys from [memory_file_key].
+    resolved_files: Mutex<HashMap<String, ResolvedFile>>,
+}
+
+/// The location and state of a file read from disk while loading a scene.
+/// Applications can compare the modified time and size to detect changed files.
+#[derive(Debug, Clone, PartialEq)]
+pub struct ResolvedFile {
+    pub path: PathBuf,
+    pub modified: Option<SystemTime>,
+    pub len: u64,
 }
 
 impl DiskResolver {
@@ -74,7 +113,8 @@ impl DiskResolver {
                     base_paths.insert(8, catalog_path.join("UnOfficial").join("p").join("8"));
                 }
             },
-            PrimitiveResolution::Normal => (),
+            // Adaptive resolution finds variants for each part after parsing.
+            PrimitiveResolution::Normal | PrimitiveResolution::Adaptive => (),
             PrimitiveResolution::High => {
                 base_paths.insert(0, catalog_path.join("p").join("48"));
                 base_paths.insert(3, catalog_path.join("parts").join("s").join("48"));
@@ -95,7 +135,7 @@ impl DiskResolver {
                 PrimitiveResolution::High => {
                     base_paths.push(path.join("p").join("48"));
                 },
-                PrimitiveResolution::Normal => ()
+                PrimitiveResolution::Normal | PrimitiveResolution::Adaptive => ()
             }
             base_paths.push(path.join("p"));
             base_paths.push(path.join("parts"));
@@ -103,26 +143,80 @@ impl DiskResolver {
         }
         println!("{:#?}", base_paths);
 
-        Self { base_paths }
+        Self {
+            base_paths,
+            memory_files: HashMap::new(),
+            missing_files: Mutex::new(Vec::new()),
+            resolved_files: Mutex::new(HashMap::new()),
+        }
+    }
+
+    fn with_memory_files(mut self, files: HashMap<String, Vec<u8>>) -> Self {
+        self.memory_files = files
+            .into_iter()
+            .map(|(name, contents)| (memory_file_key(&name), contents))
+            .collect();
+        self
+    }
+
+    /// The files read from disk sorted by path.
+    fn resolved_files(&self) -> Vec<ResolvedFile> {
+        let mut files: Vec<_> = self.resolved_files.lock().unwrap().values().cloned().collect();
+        files.sort_by(|a, b| a.path.cmp(&b.path));
+        files
     }
+
+    /// Find the path of the first folder that contains the given file.
+    fn find<P: AsRef<Path>>(&self, filename: P) -> Option<PathBuf> {
+        self.base_paths
+            .iter()
+            .map(|prefix| prefix.join(filename.as_ref()))
+            .find(|path| path.is_file())
+    }
+}
+
+/// File references are case insensitive and may use either path separator.
+fn memory_file_key(name: &str) -> String {
+    name.to_lowercase().replace('\\', "/")
 }
 
 impl FileRefResolver for DiskResolver {
     fn resolve<P: AsRef<Path>>(&self, filename: P) -> Result<Vec<u8>, ResolveError> {
         let filename = filename.as_ref();
+        if let Some(contents) = self
+            .memory_files
+            .get(&memory_file_key(&filename.to_string_lossy()))
+        {
+            return Ok(contents.clone());
+        }
 
         // Find the first folder that contains the given file.
-        let contents = self
-            .base_paths
-            .iter()
-            .find_map(|prefix| std::fs::read(prefix.join(filename)).ok());
+        let contents = self.base_paths.iter().find_map(|prefix| {
+            let path = prefix.join(filename);
+            std::fs::read(&path).ok().map(|contents| (path, contents))
+        });
 
         match contents {
-            Some(contents) => Ok(contents),
+            Some((path, contents)) => {
+                let modified = std::fs::metadata(&path).and_then(|m| m.modified()).ok();
+                self.resolved_files.lock().unwrap().insert(
+                    memory_file_key(&filename.to_string_lossy()),
+                    ResolvedFile {
+                        path,
+                        modified,
+                        len: contents.len() as u64,
+                    },
+                );
+                Ok(contents)
+            }
             None => {
                 // TODO: Is there a better way to allow partial imports with resolve errors?
                 println!("Error resolving {filename:?}");
                 println!("Error resolving {contents:?}");
+                self.missing_files
+                    .lock()
+                    .unwrap()
+                    .push(filename.to_string_lossy().to_string());
                 Ok(Vec::new())
             }
         }
@@ -132,19 +226,83 @@ impl FileRefResolver for DiskResolver {
 pub struct LDrawScene {
     pub root_node: LDrawNode,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    /// Low resolution geometry with the same names as `geometry_cache`.
+    /// This is empty unless [GeometrySettings::viewport_proxies] is enabled.
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory: MemoryReport,
+    /// The model and library files read from disk while loading the scene.
+    pub resolved_files: Vec<ResolvedFile>,
 }
 
 pub struct LDrawSceneInstanced {
     pub main_model_name: String,
     pub geometry_world_transforms: HashMap<(String, ColorCode), Vec<Mat4>>,
+    /// The build step for each transform in `geometry_world_transforms`.
+    pub geometry_instance_steps: HashMap<(String, ColorCode), Vec<InstanceStep>>,
+    /// The names of the models containing instances in the order they were first visited.
+    pub submodel_names: Vec<String>,
+    /// The world bounds of the instances in `geometry_world_transforms`.
+    pub instance_index: InstanceIndex,
+    /// Instances removed by [GeometrySettings::remove_duplicate_instances].
+    pub duplicate_instances: Vec<DuplicateInstances>,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    /// Low resolution geometry with the same names as `geometry_cache`.
+    /// This is empty unless [GeometrySettings::viewport_proxies] is enabled.
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory: MemoryReport,
+    /// The model and library files read from disk while loading the scene.
+    pub resolved_files: Vec<ResolvedFile>,
 }
 
 pub struct LDrawSceneInstancedPoints {
     pub main_model_name: String,
     /// Decomposed instance transforms for unique part and color.
     pub geometry_point_instances: HashMap<(String, ColorCode), PointInstances>,
+    /// The names for the indices in [PointInstances::submodels].
+    pub submodel_names: Vec<String>,
+    /// The world bounds of the instances in `geometry_point_instances`.
+    pub instance_index: InstanceIndex,
+    /// Instances removed by [GeometrySettings::remove_duplicate_instances].
+    pub duplicate_instances: Vec<DuplicateInstances>,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    /// Low resolution geometry with the same names as `geometry_cache`.
+    /// This is empty unless [GeometrySettings::viewport_proxies] is enabled.
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory: MemoryReport,
+    /// The model and library files read from disk while loading the scene.
+    pub resolved_files: Vec<ResolvedFile>,
+}
+
+/// Scenes for multiple files sharing the same geometry.
+pub struct LDrawScenesInstancedPoints {
+    /// The instances for each file in the same order as the input paths.
+    pub scenes: Vec<LDrawModelInstancedPoints>,
+    /// The geometry for the instances of all scenes.
+    pub geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory: MemoryReport,
+}
+
+/// The instances for a single file in [LDrawScenesInstancedPoints].
+pub struct LDrawModelInstancedPoints {
+    pub main_model_name: String,
+    /// Decomposed instance transforms for unique part and color.
+    pub geometry_point_instances: HashMap<(String, ColorCode), PointInstances>,
+    /// The names for the indices in [PointInstances::submodels].
+    pub submodel_names: Vec<String>,
+    /// The world bounds of the instances in `geometry_point_instances`.
+    pub instance_index: InstanceIndex,
+    /// Instances removed by [GeometrySettings::remove_duplicate_instances].
+    pub duplicate_instances: Vec<DuplicateInstances>,
+}
+
+pub struct LDrawSceneMerged {
+    pub main_model_name: String,
+    /// Geometry for all instances with world transforms applied
+    /// for each color and whether the faces belong to slope pieces with grainy faces.
+    pub merged_geometry: HashMap<(ColorCode, bool), MergedGeometry>,
+    /// Instances removed by [GeometrySettings::remove_duplicate_instances].
+    pub duplicate_instances: Vec<DuplicateInstances>,
+    pub memory: MemoryReport,
 }
 
 #[derive(Debug, PartialEq)]
@@ -154,9 +312,39 @@ pub struct PointInstances {
     /// The angle of the rotation in radians.
     pub rotations_angle: Vec<f32>,
     pub scales: Vec<Vec3>,
+    /// The build step for each instance in building order across all submodels.
+    pub steps: Vec<u32>,
+    /// The index of the model containing each instance.
+    pub submodels: Vec<u32>,
+}
+
+impl PointInstances {
+    /// Recompose the world transform of each instance.
+    pub fn transforms(&self) -> Vec<Mat4> {
+        self.translations
+            .iter()
+            .zip(&self.rotations_axis)
+            .zip(&self.rotations_angle)
+            .zip(&self.scales)
+            .map(|(((translation, axis), angle), scale)| {
+                let rotation = Quat::from_axis_angle(*axis, *angle);
+                Mat4::from_scale_rotation_translation(*scale, rotation, *translation)
+            })
+            .collect()
+    }
+}
+
+/// The build step and model for a single instance.
+#[derive(Debug, Default, Clone, Copy, PartialEq, Eq)]
+pub struct InstanceStep {
+    /// The number of non empty `0 STEP` commands before this instance
+    /// when building submodels in the order they are referenced.
+    pub step: u32,
+    /// The index of the model containing this instance.
+    pub submodel: u32,
 }
 
-#[derive(Debug, PartialEq, Eq, Clone, Copy)]
+#[derive(Debug, PartialEq, Eq, Clone, Copy, Hash)]
 #[pyclass(get_all, set_all)]
 pub enum StudType {
     /// Removes Lego logo from stud - Good for high brick count models
@@ -175,7 +363,33 @@ impl Default for StudType {
     }
 }
  
-#[derive(Debug, PartialEq, Eq, Clone, Copy)]
+#[derive(Debug, PartialEq, Eq, Clone, Copy, Hash)]
+#[pyclass(get_all, set_all)]
+pub enum AxisConvention {
+    /// LDraw coordinates with -Y up.
+    LDraw,
+    /// Right-handed coordinates with +Z up like Blender.
+    ZUp,
+}
+
+impl Default for AxisConvention {
+    fn default() -> Self {
+        Self::LDraw
+    }
+}
+
+impl AxisConvention {
+    /// The change of basis from LDraw coordinates to this convention.
+    pub fn matrix(&self) -> Mat4 {
+        match self {
+            Self::LDraw => Mat4::IDENTITY,
+            // Map -Y to +Z with a rotation to preserve the face winding.
+            Self::ZUp => Mat4::from_cols(Vec4::X, Vec4::NEG_Z, Vec4::Y, Vec4::W),
+        }
+    }
+}
+
+#[derive(Debug, PartialEq, Eq, Clone, Copy, Hash)]
 #[pyclass(get_all, set_all)]
 pub enum PrimitiveResolution {
     /// Low poly Primitives in the `p/8` folder.
@@ -184,6 +398,8 @@ pub enum PrimitiveResolution {
     Normal, 
     /// High quality Primitives in the `p/48` folder.
     High, 
+    /// Select the resolution for each part using [PrimitivePolicy].
+    Adaptive,
 }
 
 impl Default for PrimitiveResolution {
@@ -192,8 +408,83 @@ impl Default for PrimitiveResolution {
     }
 }
 
+/// Rules for selecting the primitive resolution of each part
+/// when using [PrimitiveResolution::Adaptive].
+/// Rules are checked in order, and parts not matching any rule use [PrimitiveResolution::Normal].
+#[derive(Debug, Clone, PartialEq)]
+pub struct PrimitivePolicy {
+    /// Part file names like `"3001.dat"` that always use high resolution primitives.
+    pub high_resolution_parts: Vec<String>,
+    /// Parts with at least this many instances use low resolution primitives.
+    pub low_resolution_min_instances: Option<usize>,
+    /// Parts with a bounding box diagonal of at least this many LDUs use high resolution primitives.
+    pub high_resolution_min_size: Option<f32>,
+    /// Parts with a bounding box diagonal below this many LDUs use low resolution primitives.
+    pub low_resolution_max_size: Option<f32>,
+}
+
+impl Default for PrimitivePolicy {
+    fn default() -> Self {
+        Self {
+            high_resolution_parts: Vec::new(),
+            low_resolution_min_instances: Some(100),
+            high_resolution_min_size: Some(200.0),
+            low_resolution_max_size: Some(30.0),
+        }
+    }
+}
+
+impl PrimitivePolicy {
+    /// Select the resolution for the part `name`.
+    /// The part bounds are only calculated if needed for the size thresholds.
+    pub fn resolution(
+        &self,
+        name: &str,
+        instance_count: usize,
+        bounds: impl FnOnce() -> Option<Bounds>,
+    ) -> PrimitiveResolution {
+        if self
+            .high_resolution_parts
+            .iter()
+            .any(|part| part.eq_ignore_ascii_case(name))
+        {
+            return PrimitiveResolution::High;
+        }
+
+        if matches!(self.low_resolution_min_instances, Some(count) if instance_count >= count) {
+            return PrimitiveResolution::Low;
+        }
+
+        if self.high_resolution_min_size.is_some() || self.low_resolution_max_size.is_some() {
+            let size = bounds().map(|b| b.size()).unwrap_or_default();
+            if matches!(self.high_resolution_min_size, Some(min) if size >= min) {
+                return PrimitiveResolution::High;
+            }
+            if matches!(self.low_resolution_max_size, Some(max) if size < max) {
+                return PrimitiveResolution::Low;
+            }
+        }
+
+        PrimitiveResolution::Normal
+    }
+}
+
+/// The name of the low or high resolution version of the primitive `name` like `"8/4-4cyli.dat"`.
+fn primitive_variant_name(name: &str, resolution: PrimitiveResolution) -> Option<String> {
+    // Some files already reference a specific resolution.
+    if name.contains(['/', '\\']) {
+        return None;
+    }
+
+    match resolution {
+        PrimitiveResolution::Low => Some(format!("8/{name}")),
+        PrimitiveResolution::High => Some(format!("48/{name}")),
+        PrimitiveResolution::Normal | PrimitiveResolution::Adaptive => None,
+    }
+}
+
 // TODO: Come up with a better name.
-#[derive(Debug)]
+#[derive(Debug, Clone)]
 pub struct GeometrySettings {
     pub triangulate: bool,
     pub add_gap_between_parts: bool,
@@ -201,8 +492,42 @@ pub struct GeometrySettings {
     pub stud_type: StudType,
     pub weld_vertices: bool, // TODO: default to true?
     pub primitive_resolution: PrimitiveResolution,
+    pub primitive_policy: PrimitivePolicy,
+    /// The scale applied to vertices and translations in LDUs like `0.01` for meters.
     pub scene_scale: f32,
+    /// The axes for vertices, transforms, and instances.
+    pub axis_convention: AxisConvention,
     pub unofficial_parts: bool,
+    /// Remove studs and anti-studs hidden by neighboring opaque parts.
+    /// This only applies to instanced scenes and may create multiple geometries for each part.
+    pub cull_hidden_studs: bool,
+    /// Remove instances of the same part and color at the same transform
+    /// like parts pasted twice in an editor.
+    /// This only applies to instanced scenes, which list the removed instances in `duplicate_instances`.
+    pub remove_duplicate_instances: bool,
+    /// The names of the submodels to import instead of the main model.
+    /// Import the main model if this is empty.
+    pub submodels: Vec<String>,
+    /// Only import the build steps up to and including this step index.
+    /// Steps are counted in building order across submodels like [InstanceStep::step].
+    pub max_step: Option<usize>,
+    /// Keep vertices welded along type 2 lines instead of splitting them for hard edges.
+    /// Applications should mark the edges in `edge_line_indices` as sharp.
+    pub mark_sharp_edges: bool,
+    /// Also create a lightweight version of each geometry for viewports in `proxy_geometry_cache`.
+    /// Proxies use `p/8` primitives and studs without logos and never split edges.
+    /// This only applies to [load_file], [load_file_instanced], and [load_file_instanced_points].
+    pub viewport_proxies: bool,
+    /// Reorder faces and vertices so faces sharing vertices are close together in the buffers.
+    /// This can improve cache usage for applications processing the geometry.
+    pub reorder_for_locality: bool,
+    /// Merge adjacent coplanar faces with the same color and stud flag into n-gons
+    /// without crossing edges in `edge_line_indices`.
+    /// This has no effect when triangulating.
+    pub merge_coplanar_faces: bool,
+    /// Only import parts with world bounds intersecting this region.
+    /// The region uses the scene scale and axis convention.
+    pub region: Option<Region>,
 }
 
 impl Default for GeometrySettings {
@@ -213,12 +538,42 @@ impl Default for GeometrySettings {
             stud_type: Default::default(),
             weld_vertices: Default::default(),
             primitive_resolution: Default::default(),
+            primitive_policy: Default::default(),
             scene_scale: 1.0,
+            axis_convention: Default::default(),
             unofficial_parts: Default::default(),
+            cull_hidden_studs: Default::default(),
+            remove_duplicate_instances: Default::default(),
+            submodels: Vec::new(),
+            max_step: None,
+            mark_sharp_edges: Default::default(),
+            viewport_proxies: Default::default(),
+            reorder_for_locality: Default::default(),
+            merge_coplanar_faces: Default::default(),
+            region: None,
+        }
+    }
+}
+
+impl GeometrySettings {
+    /// The settings for the geometry in `proxy_geometry_cache`.
+    fn proxy_settings(&self) -> Self {
+        Self {
+            stud_type: StudType::Disabled,
+            primitive_resolution: PrimitiveResolution::Low,
+            mark_sharp_edges: true,
+            viewport_proxies: false,
+            ..self.clone()
         }
     }
 }
 
+/// Keep the values with `true` in `mask` in their original order.
+fn retain_mask<T>(values: &mut Vec<T>, mask: &[bool]) {
+    let mut mask = mask.iter();
+    values.retain(|_| *mask.next().unwrap());
+}
+
 fn replace_color(color: ColorCode, current_color: ColorCode) -> ColorCode {
     if color == CURRENT_COLOR {
         current_color
@@ -227,11 +582,77 @@ fn replace_color(color: ColorCode, current_color: ColorCode) -> ColorCode {
     }
 }
 
-#[derive(Debug)]
+#[derive(Debug, Clone)]
 struct GeometryInitDescriptor<'a> {
     source_file: &'a weldr::SourceFile,
     current_color: ColorCode,
     recursive: bool,
+    /// The number of nodes or instances using this geometry.
+    instance_count: usize,
+    /// Studs and anti-studs to skip in the order they appear in the file.
+    /// This is empty if no connectors are hidden.
+    hidden_connectors: Vec<bool>,
+}
+
+/// The current build step while visiting the scene in building order.
+/// Every traversal counts steps this way so [GeometrySettings::max_step]
+/// and [InstanceStep::step] use the same step indices.
+#[derive(Debug, Default)]
+struct BuildSteps {
+    step: u32,
+    /// Whether any instances were added since the last step.
+    has_instances: bool,
+}
+
+impl BuildSteps {
+    fn add_instance(&mut self) {
+        self.has_instances = true;
+    }
+
+    fn end_step(&mut self) {
+        // Skip empty steps like a step ending a submodel followed by a step in the parent model.
+        if self.has_instances {
+            self.step += 1;
+            self.has_instances = false;
+        }
+    }
+
+    /// Steps only increase, so all remaining commands can be skipped once this is true.
+    fn is_after(&self, max_step: Option<usize>) -> bool {
+        max_step.map(|max| self.step as usize > max).unwrap_or(false)
+    }
+}
+
+/// Assign build steps to instances while visiting the scene in building order.
+#[derive(Debug, Default)]
+struct InstanceStepTracker {
+    build_steps: BuildSteps,
+    submodel_names: Vec<String>,
+    submodel_indices: HashMap<String, u32>,
+    geometry_instance_steps: HashMap<(String, ColorCode), Vec<InstanceStep>>,
+}
+
+impl InstanceStepTracker {
+    fn submodel_index(&mut self, name: &str) -> u32 {
+        if let Some(index) = self.submodel_indices.get(name) {
+            return *index;
+        }
+        let index = self.submodel_names.len() as u32;
+        self.submodel_names.push(name.to_string());
+        self.submodel_indices.insert(name.to_string(), index);
+        index
+    }
+
+    fn add_instance(&mut self, key: (String, ColorCode), submodel: u32) {
+        self.build_steps.add_instance();
+        self.geometry_instance_steps
+            .entry(key)
+            .or_default()
+            .push(InstanceStep {
+                step: self.build_steps.step,
+                submodel,
+            });
+    }
 }
 
 // TODO: Add tests for this using files from models?
@@ -246,29 +667,188 @@ pub fn load_file(
     custom_mesh_path: &str,
     settings: &GeometrySettings,
 ) -> LDrawScene {
-    let (source_map, main_model_name) = parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
-    let source_file = source_map.get(&main_model_name).unwrap();
+    let (source_map, main_model_name, resolved_files) =
+        parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+    load_source_map(&source_map, main_model_name, resolved_files, settings)
+}
 
+fn load_source_map(
+    source_map: &weldr::SourceMap,
+    main_model_name: String,
+    resolved_files: Vec<ResolvedFile>,
+    settings: &GeometrySettings,
+) -> LDrawScene {
     // Collect the scene hierarchy and geometry descriptors.
     let mut geometry_descriptors = HashMap::new();
-    let root_node = load_node(
-        source_file,
-        &main_model_name,
-        &Mat4::IDENTITY,
-        &source_map,
-        &mut geometry_descriptors,
-        CURRENT_COLOR,
-        settings,
-    );
+    let mut root_nodes = Vec::new();
+    let mut steps = BuildSteps::default();
+    for (name, source_file) in root_models(source_map, &main_model_name, settings) {
+        let node = load_node(
+            source_file,
+            &name,
+            &Mat4::IDENTITY,
+            source_map,
+            &mut geometry_descriptors,
+            CURRENT_COLOR,
+            settings.max_step,
+            &mut steps,
+            settings,
+        );
+        root_nodes.push(node);
+    }
+
+    // Group multiple submodels under a single root.
+    let mut root_node = if root_nodes.len() == 1 {
+        root_nodes.pop().unwrap()
+    } else {
+        LDrawNode {
+            name: main_model_name.clone(),
+            object_name: String::new(),
+            transform: Mat4::IDENTITY,
+            geometry_name: None,
+            current_color: CURRENT_COLOR,
+            children: root_nodes,
+        }
+    };
+
+    if let Some(region) = &settings.region {
+        spatial::retain_nodes_in_region(
+            region,
+            source_map,
+            &mut geometry_descriptors,
+            &mut root_node,
+            settings,
+        );
+    }
 
-    let geometry_cache = create_geometry_cache(geometry_descriptors, &source_map, settings);
+    let ((mut geometry_cache, mut proxy_geometry_cache), peak_bytes) =
+        memory::measure_peak(|| {
+            let proxy_geometry_cache =
+                create_proxy_geometry_cache(&geometry_descriptors, source_map, settings);
+            let geometry_cache = create_geometry_cache(geometry_descriptors, source_map, settings);
+            (geometry_cache, proxy_geometry_cache)
+        });
+
+    // Aliases and moved parts often produce identical geometry.
+    let canonical_names = dedupe::deduplicate_geometry(&mut geometry_cache);
+    proxy_geometry_cache.retain(|name, _| !canonical_names.contains_key(name));
+    dedupe::rename_node_geometry(&mut root_node, &canonical_names);
+
+    assign_object_names(&mut root_node, &mut HashMap::new());
+
+    let memory = MemoryReport::new(&geometry_cache, peak_bytes)
+        .with_proxy_geometry(&proxy_geometry_cache)
+        .with_nodes(&root_node);
 
     LDrawScene {
         root_node,
         geometry_cache,
+        proxy_geometry_cache,
+        memory,
+        resolved_files,
+    }
+}
+
+/// The maximum length in bytes for Blender object names.
+const MAX_OBJECT_NAME_BYTES: usize = 63;
+
+/// Number nodes with the same name in depth first order to create stable unique names.
+fn assign_object_names(node: &mut LDrawNode, counts: &mut HashMap<String, usize>) {
+    // Leave space for the separator and up to 7 digits.
+    // Long names are truncated, so count names using the truncated name.
+    let mut end = node.name.len().min(MAX_OBJECT_NAME_BYTES - 8);
+    while !node.name.is_char_boundary(end) {
+        end -= 1;
+    }
+    let prefix = &node.name[..end];
+
+    let count = counts.entry(prefix.to_string()).or_default();
+    node.object_name = format!("{prefix}#{count:04}");
+    *count += 1;
+
+    for child in &mut node.children {
+        assign_object_names(child, counts);
     }
 }
 
+/// Load a model from memory like [load_file] instead of reading the model from disk.
+/// `subfiles` are additional files referenced by name from the model like submodels.
+/// Library files are still found in `ldraw_path` and `additional_paths`.
+#[tracing::instrument(skip(contents, subfiles))]
+pub fn load_bytes(
+    name: &str,
+    contents: Vec<u8>,
+    subfiles: HashMap<String, Vec<u8>>,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> LDrawScene {
+    let (source_map, main_model_name, resolved_files) = parse_bytes(
+        name,
+        contents,
+        subfiles,
+        ldraw_path,
+        additional_paths,
+        custom_mesh_path,
+        settings,
+    );
+    load_source_map(&source_map, main_model_name, resolved_files, settings)
+}
+
+/// Load a model from memory like [load_file_instanced_points].
+/// See [load_bytes] for details.
+#[tracing::instrument(skip(contents, subfiles))]
+pub fn load_bytes_instanced_points(
+    name: &str,
+    contents: Vec<u8>,
+    subfiles: HashMap<String, Vec<u8>>,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> LDrawSceneInstancedPoints {
+    let (source_map, main_model_name, resolved_files) = parse_bytes(
+        name,
+        contents,
+        subfiles,
+        ldraw_path,
+        additional_paths,
+        custom_mesh_path,
+        settings,
+    );
+    let scene = load_source_map_instanced(
+        &source_map,
+        main_model_name,
+        resolved_files,
+        ldraw_path,
+        settings,
+    );
+    instanced_points(scene)
+}
+
+fn parse_bytes(
+    name: &str,
+    contents: Vec<u8>,
+    mut subfiles: HashMap<String, Vec<u8>>,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> (weldr::SourceMap, String, Vec<ResolvedFile>) {
+    subfiles.insert(name.to_string(), contents);
+    let resolver = DiskResolver::new_from_library(
+        ldraw_path,
+        additional_paths.iter().cloned(),
+        custom_mesh_path,
+        settings.primitive_resolution,
+        settings.unofficial_parts,
+    )
+    .with_memory_files(subfiles);
+    let (source_map, main_model_name) = parse_with_resolver(name, &resolver, settings);
+    (source_map, main_model_name, resolver.resolved_files())
+}
+
 #[tracing::instrument]
 fn parse_file(
     path: &str,
@@ -276,7 +856,7 @@ fn parse_file(
     additional_paths: &[&str],
     custom_mesh_path: &str,
     settings: &GeometrySettings,
-) -> (weldr::SourceMap, String) {
+) -> (weldr::SourceMap, String, Vec<ResolvedFile>) {
     let resolver = DiskResolver::new_from_library(
         ldraw_path,
         additional_paths.iter().cloned(),
@@ -284,10 +864,49 @@ fn parse_file(
         settings.primitive_resolution,
         settings.unofficial_parts,
     );
-    let mut source_map = weldr::SourceMap::new();
-    ensure_studs(settings, &resolver, &mut source_map);
+    let (source_map, main_model_name) = parse_with_resolver(path, &resolver, settings);
+    (source_map, main_model_name, resolver.resolved_files())
+}
+
+/// The folders searched for library files in priority order.
+/// Files found in earlier folders replace files with the same name in later folders.
+pub fn library_paths(
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> Vec<PathBuf> {
+    DiskResolver::new_from_library(
+        ldraw_path,
+        additional_paths.iter().cloned(),
+        custom_mesh_path,
+        settings.primitive_resolution,
+        settings.unofficial_parts,
+    )
+    .base_paths
+}
 
-    let main_model_name = weldr::parse(path, &resolver, &mut source_map).unwrap();
+fn parse_with_resolver(
+    path: &str,
+    resolver: &DiskResolver,
+    settings: &GeometrySettings,
+) -> (weldr::SourceMap, String) {
+    let mut source_map = weldr::SourceMap::new();
+    ensure_studs(settings, resolver, &mut source_map);
+
+    let main_model_name = weldr::parse(path, resolver, &mut source_map).unwrap();
+    if settings.primitive_resolution == PrimitiveResolution::Adaptive {
+        add_primitive_variants(
+            settings,
+            &[PrimitiveResolution::Low, PrimitiveResolution::High],
+            resolver,
+            &mut source_map,
+            &main_model_name,
+        );
+    }
+    if settings.viewport_proxies {
+        add_proxy_files(settings, resolver, &mut source_map, &main_model_name);
+    }
     // Remove
     let mut parts = main_model_name.rsplit("/");
     let fname = parts.next().unwrap_or("");
@@ -300,6 +919,105 @@ fn parse_file(
     (source_map, main_model_name)
 }
 
+/// The submodels selected in `settings` or the main model if no submodels are selected.
+fn root_models<'a>(
+    source_map: &'a weldr::SourceMap,
+    main_model_name: &str,
+    settings: &GeometrySettings,
+) -> Vec<(String, &'a weldr::SourceFile)> {
+    if settings.submodels.is_empty() {
+        let source_file = source_map.get(main_model_name).unwrap();
+        vec![(main_model_name.to_string(), source_file)]
+    } else {
+        settings
+            .submodels
+            .iter()
+            .filter_map(|name| match source_map.get(name) {
+                Some(source_file) => Some((name.clone(), source_file)),
+                None => {
+                    println!("Submodel {name:?} not found");
+                    None
+                }
+            })
+            .collect()
+    }
+}
+
+/// List the submodel names in the order they appear in an MPD file
+/// by scanning for `0 FILE` lines without parsing any commands.
+/// The first name is the main model.
+/// Single model files without any `0 FILE` lines have no submodels.
+pub fn list_submodels<P: AsRef<Path>>(path: P) -> std::io::Result<Vec<String>> {
+    let bytes = std::fs::read(path)?;
+    let text = String::from_utf8_lossy(&bytes);
+    Ok(text.lines().filter_map(submodel_name).collect())
+}
+
+/// The prefix for the embedded files of the model at `index` in [load_files_instanced_points].
+fn file_namespace(index: usize) -> String {
+    format!("{index}>")
+}
+
+/// Add `namespace` to the names of the files embedded in an MPD file and the references to them.
+fn namespace_embedded_files(contents: &[u8], namespace: &str) -> Vec<u8> {
+    let text = String::from_utf8_lossy(contents);
+    let names: HashSet<_> = text
+        .lines()
+        .filter_map(submodel_name)
+        .map(|name| memory_file_key(&name))
+        .collect();
+    if names.is_empty() {
+        return contents.to_vec();
+    }
+
+    let mut output = String::with_capacity(text.len());
+    for line in text.lines() {
+        // Both `0 FILE` lines and subfile references end with a name that may contain spaces.
+        let mut words = line.split_whitespace();
+        let name_word = match (words.next(), words.next()) {
+            (Some("0"), Some("FILE")) => Some(2),
+            (Some("1"), _) => Some(14),
+            _ => None,
+        };
+        let name_start = name_word
+            .and_then(|n| line.split_whitespace().nth(n))
+            .map(|word| word.as_ptr() as usize - line.as_ptr() as usize);
+
+        match name_start {
+            Some(start) if names.contains(&memory_file_key(&normalize_name(&line[start..]))) => {
+                output.push_str(&line[..start]);
+                output.push_str(namespace);
+                output.push_str(&line[start..]);
+            }
+            _ => output.push_str(line),
+        }
+        output.push('\n');
+    }
+    output.into_bytes()
+}
+
+fn normalize_name(name: &str) -> String {
+    name.split_whitespace().collect::<Vec<_>>().join(" ")
+}
+
+fn submodel_name(line: &str) -> Option<String> {
+    let mut words = line.split_whitespace();
+    if words.next()? != "0" || words.next()? != "FILE" {
+        return None;
+    }
+    // Names may contain spaces.
+    let name = words.collect::<Vec<_>>().join(" ");
+    (!name.is_empty()).then_some(name)
+}
+
+/// Check if `cmd` is a `0 STEP` or `0 ROTSTEP` command ending a build step.
+fn is_step(cmd: &Command) -> bool {
+    match cmd {
+        Command::Comment(c) => matches!(c.text.split_whitespace().next(), Some("STEP" | "ROTSTEP")),
+        _ => false,
+    }
+}
+
 fn ensure_studs(
     settings: &GeometrySettings,
     resolver: &DiskResolver,
@@ -307,21 +1025,75 @@ fn ensure_studs(
 ) {
     // The replaced studs likely won't be referenced by existing files.
     // Make sure the selected stud type is in the source map.
-    if settings.stud_type == StudType::Logo4 {
-        weldr::parse("stud-logo4.dat", resolver, source_map).unwrap();
-        weldr::parse("stud2-logo4.dat", resolver, source_map).unwrap();
-    } else if settings.stud_type == StudType::Normal {
-        weldr::parse("stud-logo3.dat", resolver, source_map).unwrap();
-        weldr::parse("stud2-logo3.dat", resolver, source_map).unwrap();
-    } else if settings.stud_type == StudType::HighContrast {
-        weldr::parse("stud-high-contrast.dat", resolver, source_map).unwrap();
-        weldr::parse("stud2-high-contrast.dat", resolver, source_map).unwrap();
-    } else {
-        weldr::parse("stud-logo.dat", resolver, source_map).unwrap();
-        weldr::parse("stud2-logo.dat", resolver, source_map).unwrap();
+    for name in stud_file_names(settings.stud_type) {
+        weldr::parse(name, resolver, source_map).unwrap();
+    }
+}
+
+fn stud_file_names(stud_type: StudType) -> [&'static str; 2] {
+    match stud_type {
+        StudType::Logo4 => ["stud-logo4.dat", "stud2-logo4.dat"],
+        StudType::Normal => ["stud-logo3.dat", "stud2-logo3.dat"],
+        StudType::HighContrast => ["stud-high-contrast.dat", "stud2-high-contrast.dat"],
+        StudType::Disabled => ["stud-logo.dat", "stud2-logo.dat"],
+    }
+}
+
+/// Parse the `resolutions` versions of each file referenced by the model if present.
+/// This allows selecting the primitive resolution for each part when creating geometry.
+fn add_primitive_variants(
+    settings: &GeometrySettings,
+    resolutions: &[PrimitiveResolution],
+    resolver: &DiskResolver,
+    source_map: &mut weldr::SourceMap,
+    main_model_name: &str,
+) {
+    let mut names = HashSet::new();
+    let mut stack: Vec<String> = std::iter::once(main_model_name)
+        .chain(stud_file_names(settings.stud_type))
+        .map(|n| n.to_string())
+        .collect();
+    while let Some(name) = stack.pop() {
+        if let Some(source_file) = source_map.get(&name) {
+            for cmd in &source_file.cmds {
+                if let Command::SubFileRef(sfr_cmd) = cmd {
+                    if names.insert(sfr_cmd.file.clone()) {
+                        stack.push(sfr_cmd.file.clone());
+                    }
+                }
+            }
+        }
+    }
+
+    for name in names {
+        for resolution in resolutions {
+            if let Some(variant) = primitive_variant_name(&name, *resolution) {
+                if source_map.get(&variant).is_none() && resolver.find(&variant).is_some() {
+                    weldr::parse(&variant, resolver, source_map).ok();
+                }
+            }
+        }
     }
 }
 
+/// Parse the studs and low resolution primitives used for the proxy geometry.
+fn add_proxy_files(
+    settings: &GeometrySettings,
+    resolver: &DiskResolver,
+    source_map: &mut weldr::SourceMap,
+    main_model_name: &str,
+) {
+    let proxy_settings = settings.proxy_settings();
+    ensure_studs(&proxy_settings, resolver, source_map);
+    add_primitive_variants(
+        &proxy_settings,
+        &[PrimitiveResolution::Low],
+        resolver,
+        source_map,
+        main_model_name,
+    );
+}
+
 fn load_node<'a>(
     source_file: &'a weldr::SourceFile,
     filename: &str,
@@ -329,6 +1101,8 @@ fn load_node<'a>(
     source_map: &'a weldr::SourceMap,
     geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor<'a>>,
     current_color: ColorCode,
+    max_step: Option<usize>,
+    steps: &mut BuildSteps,
     settings: &GeometrySettings,
 ) -> LDrawNode {
     let mut children = Vec::new();
@@ -343,9 +1117,13 @@ fn load_node<'a>(
                 source_file,
                 current_color: CURRENT_COLOR,
                 recursive: true,
-            });
+                instance_count: 0,
+                hidden_connectors: Vec::new(),
+            })
+            .instance_count += 1;
 
         geometry = Some(filename.to_string());
+        steps.add_instance();
     } else if has_geometry(source_file) {
         // Just add geometry for this node.
         // Use the current color at this node since this geometry might not be referenced elsewhere.
@@ -355,11 +1133,21 @@ fn load_node<'a>(
                 source_file,
                 current_color,
                 recursive: false,
-            });
+                instance_count: 0,
+                hidden_connectors: Vec::new(),
+            })
+            .instance_count += 1;
 
         geometry = Some(filename.to_string());
+        steps.add_instance();
     } else {
         for cmd in &source_file.cmds {
+            if steps.is_after(max_step) {
+                break;
+            }
+            if is_step(cmd) {
+                steps.end_step();
+            }
             if let Command::SubFileRef(sfr_cmd) = cmd {
                 if let Some(subfile) = source_map.get(&sfr_cmd.file) {
                     // Don't apply node transforms to preserve the scene hierarchy.
@@ -376,6 +1164,8 @@ fn load_node<'a>(
                         source_map,
                         geometry_descriptors,
                         child_color,
+                        max_step,
+                        steps,
                         settings,
                     );
                     children.push(child_node);
@@ -384,10 +1174,11 @@ fn load_node<'a>(
         }
     }
 
-    let transform = scaled_transform(transform, settings.scene_scale);
+    let transform = scene_transform(transform, settings);
 
     LDrawNode {
         name: filename.to_string(),
+        object_name: String::new(),
         transform,
         geometry_name: geometry,
         current_color,
@@ -406,32 +1197,150 @@ fn create_geometry_cache(
     geometry_descriptors
         .into_par_iter()
         .map(|(name, descriptor)| {
-            let GeometryInitDescriptor {
-                source_file,
-                current_color,
-                recursive,
-            } = descriptor;
-
-            let geometry = create_geometry(
-                source_file,
-                source_map,
-                &name,
-                current_color,
-                recursive,
-                settings,
-            );
-
+            let geometry = create_descriptor_geometry(&name, descriptor, source_map, settings);
             (name, geometry)
         })
         .collect()
 }
 
-fn scaled_transform(transform: &Mat4, scale: f32) -> Mat4 {
-    // Only scale the translation so that the scale doesn't accumulate.
-    // TODO: Is this the best way to handle scale?
-    let mut transform = *transform;
-    transform.w_axis *= vec4(scale, scale, scale, 1.0);
-    transform
+/// Create the low resolution geometry for `geometry_descriptors`
+/// or no geometry if viewport proxies are disabled.
+fn create_proxy_geometry_cache(
+    geometry_descriptors: &HashMap<String, GeometryInitDescriptor>,
+    source_map: &weldr::SourceMap,
+    settings: &GeometrySettings,
+) -> HashMap<String, LDrawGeometry> {
+    if settings.viewport_proxies {
+        create_geometry_cache(
+            geometry_descriptors.clone(),
+            source_map,
+            &settings.proxy_settings(),
+        )
+    } else {
+        HashMap::new()
+    }
+}
+
+/// Create geometry in batches of at most `max_batch_bytes` to limit peak memory usage.
+/// Only a single geometry larger than the limit creates a larger batch.
+/// Each full batch is moved to `on_batch` before adding more geometry.
+///
+/// Returns the buffer sizes for all created geometry and the last batch,
+/// so the caller can release the source files before handing off the last batch.
+fn create_geometry_batches<E>(
+    geometry_descriptors: HashMap<String, GeometryInitDescriptor>,
+    source_map: &weldr::SourceMap,
+    settings: &GeometrySettings,
+    max_batch_bytes: usize,
+    mut on_batch: impl FnMut(HashMap<String, LDrawGeometry>) -> Result<(), E>,
+) -> Result<
+    (
+        HashMap<String, GeometryMemory>,
+        HashMap<String, LDrawGeometry>,
+    ),
+    E,
+> {
+    // Sort to create the same batches between imports.
+    let mut descriptors: Vec<_> = geometry_descriptors.into_iter().collect();
+    descriptors.sort_by(|a, b| a.0.cmp(&b.0));
+
+    // Only create a few geometries per thread at a time.
+    // This limits how much geometry exists outside of the current batch.
+    let chunk_size = rayon::current_num_threads() * 4;
+
+    let mut geometry_memory = HashMap::new();
+    let mut batch = HashMap::new();
+    let mut batch_bytes = 0;
+    let mut descriptors = descriptors.into_iter();
+    loop {
+        let chunk: Vec<_> = descriptors.by_ref().take(chunk_size).collect();
+        if chunk.is_empty() {
+            break;
+        }
+
+        let created: Vec<_> = chunk
+            .into_par_iter()
+            .map(|(name, descriptor)| {
+                let geometry = create_descriptor_geometry(&name, descriptor, source_map, settings);
+                (name, geometry)
+            })
+            .collect();
+
+        for (name, geometry) in created {
+            let memory = GeometryMemory::new(&geometry);
+
+            // Hand off the batch before it would go over the limit.
+            if !batch.is_empty() && batch_bytes + memory.total() > max_batch_bytes {
+                on_batch(std::mem::take(&mut batch))?;
+                batch_bytes = 0;
+            }
+
+            batch_bytes += memory.total();
+            geometry_memory.insert(name.clone(), memory);
+            batch.insert(name, geometry);
+        }
+    }
+
+    Ok((geometry_memory, batch))
+}
+
+fn create_descriptor_geometry(
+    name: &str,
+    descriptor: GeometryInitDescriptor,
+    source_map: &weldr::SourceMap,
+    settings: &GeometrySettings,
+) -> LDrawGeometry {
+    let GeometryInitDescriptor {
+        source_file,
+        current_color,
+        recursive,
+        instance_count,
+        hidden_connectors,
+    } = descriptor;
+
+    let primitive_resolution = match settings.primitive_resolution {
+        PrimitiveResolution::Adaptive => {
+            settings
+                .primitive_policy
+                .resolution(culling::base_name(name), instance_count, || {
+                    bounds::file_bounds(source_file, source_map)
+                })
+        }
+        resolution => resolution,
+    };
+
+    create_geometry(
+        source_file,
+        source_map,
+        name,
+        current_color,
+        recursive,
+        primitive_resolution,
+        &hidden_connectors,
+        settings,
+    )
+}
+
+/// Convert a transform in LDUs and LDraw coordinates
+/// to the scene scale and axis convention in `settings`.
+fn scene_transform(transform: &Mat4, settings: &GeometrySettings) -> Mat4 {
+    // Only scale the translation so that the scale doesn't accumulate.
+    // TODO: Is this the best way to handle scale?
+    let scale = settings.scene_scale;
+    let mut transform = *transform;
+    transform.w_axis *= vec4(scale, scale, scale, 1.0);
+
+    // The geometry uses the same axes, so change the basis on both sides.
+    // This also works for transforms relative to a parent transform.
+    let axes = settings.axis_convention.matrix();
+    axes * transform * axes.transpose()
+}
+
+/// Convert bounds in LDUs and LDraw coordinates
+/// to the scene scale and axis convention in `settings`.
+fn scene_bounds(bounds: &Bounds, settings: &GeometrySettings) -> Bounds {
+    let scale = Mat4::from_scale(Vec3::splat(settings.scene_scale));
+    bounds.transform(&(settings.axis_convention.matrix() * scale))
 }
 
 #[tracing::instrument]
@@ -443,25 +1352,313 @@ pub fn load_file_instanced_points(
     settings: &GeometrySettings,
 ) -> LDrawSceneInstancedPoints {
     let scene = load_file_instanced(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+    instanced_points(scene)
+}
+
+fn instanced_points(scene: LDrawSceneInstanced) -> LDrawSceneInstancedPoints {
+    let geometry_point_instances =
+        decompose_instances(scene.geometry_world_transforms, &scene.geometry_instance_steps);
+
+    let memory = scene
+        .memory
+        .with_point_instances(geometry_point_instances.values());
+
+    LDrawSceneInstancedPoints {
+        main_model_name: scene.main_model_name,
+        geometry_point_instances,
+        submodel_names: scene.submodel_names,
+        instance_index: scene.instance_index,
+        duplicate_instances: scene.duplicate_instances,
+        geometry_cache: scene.geometry_cache,
+        proxy_geometry_cache: scene.proxy_geometry_cache,
+        memory,
+        resolved_files: scene.resolved_files,
+    }
+}
+
+/// Geometry created by [load_file_instanced_points_batched].
+pub struct GeometryBatch {
+    pub geometry: HashMap<String, LDrawGeometry>,
+    /// The colors of the instances using each geometry.
+    pub colors: HashMap<String, Vec<ColorCode>>,
+}
+
+/// Load the file like [load_file_instanced_points] but pass geometry to `on_batch`
+/// in batches of at most `max_batch_bytes` instead of storing it in the geometry cache.
+/// More geometry is only added after `on_batch` returns,
+/// so the caller can release each batch to limit peak memory usage for very large scenes.
+/// The parsed files are released before the last batch is passed to `on_batch`.
+///
+/// The returned scene has an empty geometry cache.
+/// Identical geometry is not deduplicated since the batches are never all in memory.
+#[tracing::instrument(skip(on_batch))]
+pub fn load_file_instanced_points_batched<E>(
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+    max_batch_bytes: usize,
+    mut on_batch: impl FnMut(GeometryBatch) -> Result<(), E>,
+) -> Result<LDrawSceneInstancedPoints, E> {
+    let (source_map, main_model_name, resolved_files) =
+        parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+
+    let color_table = culling_color_table(ldraw_path, settings);
+    let mut geometry_descriptors = HashMap::new();
+    let model = load_model_instances(
+        &source_map,
+        main_model_name,
+        &mut geometry_descriptors,
+        &color_table,
+        settings,
+    );
+
+    let mut colors: HashMap<String, Vec<ColorCode>> = HashMap::new();
+    for (name, color) in model.geometry_world_transforms.keys() {
+        colors.entry(name.clone()).or_default().push(*color);
+    }
+
+    // Only keep the bounds of each batch for the instance index.
+    let mut geometry_bounds = HashMap::new();
+    let mut handle_batch = |geometry: HashMap<String, LDrawGeometry>| {
+        geometry_bounds.extend(spatial::geometry_bounds(&geometry));
+        let colors = geometry
+            .keys()
+            .map(|name| (name.clone(), colors.remove(name).unwrap_or_default()))
+            .collect();
+        on_batch(GeometryBatch { geometry, colors })
+    };
+    let (created, peak_bytes) = memory::measure_peak(|| {
+        create_geometry_batches(
+            geometry_descriptors,
+            &source_map,
+            settings,
+            max_batch_bytes,
+            &mut handle_batch,
+        )
+    });
+    let (geometry_memory, last_batch) = created?;
+
+    // The parsed files are shared by all batches and only needed to create geometry.
+    drop(source_map);
+    if !last_batch.is_empty() {
+        handle_batch(last_batch)?;
+    }
+
+    let instance_index = InstanceIndex::new(&geometry_bounds, &model.geometry_world_transforms);
+    let geometry_point_instances =
+        decompose_instances(model.geometry_world_transforms, &model.geometry_instance_steps);
+
+    let memory = MemoryReport {
+        geometry: geometry_memory,
+        geometry_cache_peak_bytes: peak_bytes,
+        ..Default::default()
+    }
+    .with_point_instances(geometry_point_instances.values());
+
+    Ok(LDrawSceneInstancedPoints {
+        main_model_name: model.main_model_name,
+        geometry_point_instances,
+        submodel_names: model.submodel_names,
+        instance_index,
+        duplicate_instances: model.duplicate_instances,
+        geometry_cache: HashMap::new(),
+        proxy_geometry_cache: HashMap::new(),
+        memory,
+        resolved_files,
+    })
+}
+
+/// Load multiple files like the separate models of a city layout.
+/// Library files are parsed once and each unique geometry is only created once for all files.
+///
+/// Files embedded in each MPD file only apply to that file,
+/// so different files can define submodels with the same name.
+/// Geometry names for parts embedded in a file start with a prefix unique to that file.
+#[tracing::instrument]
+pub fn load_files_instanced_points(
+    paths: &[&str],
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> LDrawScenesInstancedPoints {
+    // The source map is shared and keyed by name, so rename the embedded files in each model.
+    // Missing files are left to the resolver to report while parsing.
+    let memory_files = paths
+        .iter()
+        .enumerate()
+        .filter_map(|(i, path)| {
+            let contents = std::fs::read(path).ok()?;
+            Some((path.to_string(), namespace_embedded_files(&contents, &file_namespace(i))))
+        })
+        .collect();
+    let resolver = DiskResolver::new_from_library(
+        ldraw_path,
+        additional_paths.iter().cloned(),
+        custom_mesh_path,
+        settings.primitive_resolution,
+        settings.unofficial_parts,
+    )
+    .with_memory_files(memory_files);
+
+    // Files already in the source map are skipped when parsing later models.
+    let mut source_map = weldr::SourceMap::new();
+    ensure_studs(settings, &resolver, &mut source_map);
+    let main_model_names: Vec<_> = paths
+        .iter()
+        .map(|path| weldr::parse(path, &resolver, &mut source_map).unwrap())
+        .collect();
+    if settings.primitive_resolution == PrimitiveResolution::Adaptive {
+        for main_model_name in &main_model_names {
+            add_primitive_variants(
+                settings,
+                &[PrimitiveResolution::Low, PrimitiveResolution::High],
+                &resolver,
+                &mut source_map,
+                main_model_name,
+            );
+        }
+    }
+
+    // Combine the descriptors to count instances across all files for adaptive resolution.
+    let color_table = culling_color_table(ldraw_path, settings);
+    let mut geometry_descriptors = HashMap::new();
+    let mut variant_names = HashMap::new();
+    let mut models: Vec<_> = main_model_names
+        .into_iter()
+        .map(|main_model_name| {
+            let mut descriptors = HashMap::new();
+            let mut model = load_model_instances(
+                &source_map,
+                main_model_name,
+                &mut descriptors,
+                &color_table,
+                settings,
+            );
+            merge_descriptors(
+                &mut geometry_descriptors,
+                &mut variant_names,
+                descriptors,
+                &mut model,
+            );
+            model
+        })
+        .collect();
+
+    // Use the combined instance count of the part to select the same primitive resolution.
+    let instance_counts: HashMap<_, _> = geometry_descriptors
+        .iter()
+        .map(|(name, descriptor)| (name.clone(), descriptor.instance_count))
+        .collect();
+    for (name, descriptor) in &mut geometry_descriptors {
+        if let Some(count) = instance_counts.get(culling::base_name(name)) {
+            descriptor.instance_count = *count;
+        }
+    }
+
+    let (mut geometry_cache, peak_bytes) = memory::measure_peak(|| {
+        create_geometry_cache(geometry_descriptors, &source_map, settings)
+    });
+
+    let canonical_names = dedupe::deduplicate_geometry(&mut geometry_cache);
+    for model in &mut models {
+        dedupe::rename_instances(
+            &mut model.geometry_world_transforms,
+            &mut model.geometry_instance_steps,
+            &canonical_names,
+        );
+    }
 
-    let geometry_point_instances = scene
-        .geometry_world_transforms
+    let geometry_bounds = spatial::geometry_bounds(&geometry_cache);
+    let scenes: Vec<_> = models
+        .into_iter()
+        .enumerate()
+        .map(|(i, model)| {
+            let instance_index =
+                InstanceIndex::new(&geometry_bounds, &model.geometry_world_transforms);
+
+            // Report the names used in the file itself.
+            let namespace = file_namespace(i);
+            let strip = |name: String| match name.strip_prefix(&namespace) {
+                Some(stripped) => stripped.to_string(),
+                None => name,
+            };
+            LDrawModelInstancedPoints {
+                main_model_name: strip(model.main_model_name),
+                geometry_point_instances: decompose_instances(
+                    model.geometry_world_transforms,
+                    &model.geometry_instance_steps,
+                ),
+                submodel_names: model.submodel_names.into_iter().map(strip).collect(),
+                instance_index,
+                duplicate_instances: model
+                    .duplicate_instances
+                    .into_iter()
+                    .map(|d| DuplicateInstances {
+                        name: strip(d.name),
+                        ..d
+                    })
+                    .collect(),
+            }
+        })
+        .collect();
+
+    let memory = MemoryReport::new(&geometry_cache, peak_bytes)
+        .with_point_instances(scenes.iter().flat_map(|s| s.geometry_point_instances.values()));
+
+    LDrawScenesInstancedPoints {
+        scenes,
+        geometry_cache,
+        memory,
+    }
+}
+
+fn decompose_instances(
+    geometry_world_transforms: HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: &HashMap<(String, ColorCode), Vec<InstanceStep>>,
+) -> HashMap<(String, ColorCode), PointInstances> {
+    geometry_world_transforms
         .into_par_iter()
         .map(|(k, transforms)| {
-            let instances = geometry_point_instances(transforms);
+            let steps = geometry_instance_steps
+                .get(&k)
+                .map(Vec::as_slice)
+                .unwrap_or_default();
+            let instances = geometry_point_instances(transforms, steps);
             (k, instances)
         })
-        .collect();
+        .collect()
+}
 
-    LDrawSceneInstancedPoints {
+/// Merge all instances into a single geometry for each color.
+/// This avoids the overhead of many objects or instances for static scenes.
+#[tracing::instrument]
+pub fn load_file_merged(
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: &[&str],
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> LDrawSceneMerged {
+    let scene = load_file_instanced(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+
+    let merged_geometry =
+        merge::merge_instances(&scene.geometry_cache, &scene.geometry_world_transforms);
+
+    let memory = scene.memory.with_merged_geometry(&merged_geometry);
+
+    LDrawSceneMerged {
         main_model_name: scene.main_model_name,
-        geometry_point_instances,
-        geometry_cache: scene.geometry_cache,
+        merged_geometry,
+        duplicate_instances: scene.duplicate_instances,
+        memory,
     }
 }
 
 #[tracing::instrument]
-fn geometry_point_instances(transforms: Vec<Mat4>) -> PointInstances {
+fn geometry_point_instances(transforms: Vec<Mat4>, steps: &[InstanceStep]) -> PointInstances {
     let mut translations = Vec::new();
     let mut rotations_axis = Vec::new();
     let mut rotations_angle = Vec::new();
@@ -486,6 +1683,8 @@ fn geometry_point_instances(transforms: Vec<Mat4>) -> PointInstances {
         rotations_axis,
         rotations_angle,
         scales,
+        steps: steps.iter().map(|s| s.step).collect(),
+        submodels: steps.iter().map(|s| s.submodel).collect(),
     }
 }
 
@@ -501,30 +1700,211 @@ pub fn load_file_instanced(
     custom_mesh_path: &str,
     settings: &GeometrySettings,
 ) -> LDrawSceneInstanced {
-    let (source_map, main_model_name) = parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
-    let source_file = source_map.get(&main_model_name).unwrap();
+    let (source_map, main_model_name, resolved_files) =
+        parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+    load_source_map_instanced(&source_map, main_model_name, resolved_files, ldraw_path, settings)
+}
 
-    // Find the world transforms for each geometry.
-    // This allows applications to more easily use instancing.
+fn load_source_map_instanced(
+    source_map: &weldr::SourceMap,
+    main_model_name: String,
+    resolved_files: Vec<ResolvedFile>,
+    ldraw_path: &str,
+    settings: &GeometrySettings,
+) -> LDrawSceneInstanced {
+    let color_table = culling_color_table(ldraw_path, settings);
     let mut geometry_descriptors = HashMap::new();
-    let mut geometry_world_transforms = HashMap::new();
-    load_node_instanced(
-        source_file,
-        &main_model_name,
-        &Mat4::IDENTITY,
-        &source_map,
+    let mut model = load_model_instances(
+        source_map,
+        main_model_name,
         &mut geometry_descriptors,
-        &mut geometry_world_transforms,
-        CURRENT_COLOR,
+        &color_table,
         settings,
     );
 
-    let geometry_cache = create_geometry_cache(geometry_descriptors, &source_map, settings);
+    let ((mut geometry_cache, mut proxy_geometry_cache), peak_bytes) =
+        memory::measure_peak(|| {
+            let proxy_geometry_cache =
+                create_proxy_geometry_cache(&geometry_descriptors, source_map, settings);
+            let geometry_cache = create_geometry_cache(geometry_descriptors, source_map, settings);
+            (geometry_cache, proxy_geometry_cache)
+        });
+
+    // Aliases and moved parts often produce identical geometry.
+    // Identical geometry also has identical proxies.
+    let canonical_names = dedupe::deduplicate_geometry(&mut geometry_cache);
+    proxy_geometry_cache.retain(|name, _| !canonical_names.contains_key(name));
+    dedupe::rename_instances(
+        &mut model.geometry_world_transforms,
+        &mut model.geometry_instance_steps,
+        &canonical_names,
+    );
+
+    let instance_index = InstanceIndex::new(
+        &spatial::geometry_bounds(&geometry_cache),
+        &model.geometry_world_transforms,
+    );
+
+    let memory = MemoryReport::new(&geometry_cache, peak_bytes)
+        .with_proxy_geometry(&proxy_geometry_cache)
+        .with_world_transforms(&model.geometry_world_transforms);
 
     LDrawSceneInstanced {
+        main_model_name: model.main_model_name,
+        geometry_world_transforms: model.geometry_world_transforms,
+        geometry_instance_steps: model.geometry_instance_steps,
+        submodel_names: model.submodel_names,
+        instance_index,
+        duplicate_instances: model.duplicate_instances,
+        geometry_cache,
+        proxy_geometry_cache,
+        memory,
+        resolved_files,
+    }
+}
+
+/// The instances for a single model before creating geometry.
+struct ModelInstances {
+    main_model_name: String,
+    geometry_world_transforms: HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: HashMap<(String, ColorCode), Vec<InstanceStep>>,
+    submodel_names: Vec<String>,
+    duplicate_instances: Vec<DuplicateInstances>,
+}
+
+/// Find the world transforms for each geometry in the model
+/// and add any new geometry to `geometry_descriptors`.
+fn load_model_instances<'a>(
+    source_map: &'a weldr::SourceMap,
+    main_model_name: String,
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor<'a>>,
+    color_table: &HashMap<ColorCode, LDrawColor>,
+    settings: &GeometrySettings,
+) -> ModelInstances {
+    let mut geometry_world_transforms = HashMap::new();
+    let mut steps = InstanceStepTracker::default();
+    for (name, source_file) in root_models(source_map, &main_model_name, settings) {
+        let submodel = steps.submodel_index(&name);
+        load_node_instanced(
+            source_file,
+            &name,
+            &Mat4::IDENTITY,
+            source_map,
+            geometry_descriptors,
+            &mut geometry_world_transforms,
+            CURRENT_COLOR,
+            settings.max_step,
+            submodel,
+            &mut steps,
+            settings,
+        );
+    }
+    let mut geometry_instance_steps = steps.geometry_instance_steps;
+
+    // Filter before culling since parts outside the region no longer hide any studs.
+    if let Some(region) = &settings.region {
+        spatial::retain_instances_in_region(
+            region,
+            source_map,
+            geometry_descriptors,
+            &mut geometry_world_transforms,
+            &mut geometry_instance_steps,
+            settings,
+        );
+    }
+
+    let duplicate_instances = if settings.remove_duplicate_instances {
+        duplicates::remove_duplicate_instances(
+            geometry_descriptors,
+            &mut geometry_world_transforms,
+            &mut geometry_instance_steps,
+        )
+    } else {
+        Vec::new()
+    };
+
+    if settings.cull_hidden_studs {
+        culling::cull_hidden_connectors(
+            source_map,
+            geometry_descriptors,
+            &mut geometry_world_transforms,
+            &mut geometry_instance_steps,
+            color_table,
+        );
+    }
+
+    // Culling uses LDUs, so only convert the transforms at the end.
+    geometry_world_transforms
+        .par_iter_mut()
+        .for_each(|(_, transforms)| {
+            for transform in transforms {
+                *transform = scene_transform(transform, settings);
+            }
+        });
+
+    ModelInstances {
         main_model_name,
         geometry_world_transforms,
-        geometry_cache,
+        geometry_instance_steps,
+        submodel_names: steps.submodel_names,
+        duplicate_instances,
+    }
+}
+
+/// Add the descriptors for a single model to the descriptors shared by all models.
+/// Culled variants are numbered separately for each model,
+/// so variants are matched by their hidden connectors and renamed if needed.
+fn merge_descriptors<'a>(
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor<'a>>,
+    variant_names: &mut HashMap<(String, Vec<bool>), String>,
+    descriptors: HashMap<String, GeometryInitDescriptor<'a>>,
+    model: &mut ModelInstances,
+) {
+    // Sort to number the variants consistently between imports.
+    let mut descriptors: Vec<_> = descriptors.into_iter().collect();
+    descriptors.sort_by(|a, b| a.0.cmp(&b.0));
+
+    let mut renamed = HashMap::new();
+    for (name, descriptor) in descriptors {
+        let base_name = culling::base_name(&name);
+        let name = if base_name != name {
+            let count = variant_names.len();
+            let variant_name = variant_names
+                .entry((base_name.to_string(), descriptor.hidden_connectors.clone()))
+                .or_insert_with(|| culling::variant_name(base_name, count + 1))
+                .clone();
+            if variant_name != name {
+                renamed.insert(name, variant_name.clone());
+            }
+            variant_name
+        } else {
+            name
+        };
+
+        match geometry_descriptors.get_mut(&name) {
+            Some(existing) => existing.instance_count += descriptor.instance_count,
+            None => {
+                geometry_descriptors.insert(name, descriptor);
+            }
+        }
+    }
+
+    dedupe::rename_instances(
+        &mut model.geometry_world_transforms,
+        &mut model.geometry_instance_steps,
+        &renamed,
+    );
+}
+
+fn culling_color_table(
+    ldraw_path: &str,
+    settings: &GeometrySettings,
+) -> HashMap<ColorCode, LDrawColor> {
+    // Transparency is only defined for colors in the library.
+    if settings.cull_hidden_studs && Path::new(ldraw_path).join("LDConfig.ldr").is_file() {
+        load_color_table(ldraw_path)
+    } else {
+        HashMap::new()
     }
 }
 
@@ -537,6 +1917,9 @@ fn load_node_instanced<'a>(
     geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor<'a>>,
     geometry_world_transforms: &mut HashMap<(String, ColorCode), Vec<Mat4>>,
     current_color: ColorCode,
+    max_step: Option<usize>,
+    submodel: u32,
+    steps: &mut InstanceStepTracker,
     settings: &GeometrySettings,
 ) {
     // TODO: Find a way to avoid repetition.
@@ -550,14 +1933,18 @@ fn load_node_instanced<'a>(
                 source_file,
                 current_color: CURRENT_COLOR,
                 recursive: true,
-            });
+                instance_count: 0,
+                hidden_connectors: Vec::new(),
+            })
+            .instance_count += 1;
 
         // Add another instance of the current geometry.
         // Also key by the color in case a part appears in multiple colors.
         geometry_world_transforms
             .entry((filename.to_string(), current_color))
             .or_default()
-            .push(scaled_transform(world_transform, settings.scene_scale));
+            .push(*world_transform);
+        steps.add_instance((filename.to_string(), current_color), submodel);
     } else if has_geometry(source_file) {
         // Just add geometry for this node.
         // Use the current color at this node since this geometry might not be referenced elsewhere.
@@ -567,19 +1954,30 @@ fn load_node_instanced<'a>(
                 source_file,
                 current_color,
                 recursive: false,
-            });
+                instance_count: 0,
+                hidden_connectors: Vec::new(),
+            })
+            .instance_count += 1;
 
         // Add another instance of the current geometry.
         // Also key by the color in case a part appears in multiple colors.
         geometry_world_transforms
             .entry((filename.to_string(), current_color))
             .or_default()
-            .push(scaled_transform(world_transform, settings.scene_scale));
+            .push(*world_transform);
+        steps.add_instance((filename.to_string(), current_color), submodel);
     }
 
     // Recursion is already handled for parts.
     if !is_part {
+        let child_submodel = steps.submodel_index(filename);
         for cmd in &source_file.cmds {
+            if steps.build_steps.is_after(max_step) {
+                break;
+            }
+            if is_step(cmd) {
+                steps.build_steps.end_step();
+            }
             if let Command::SubFileRef(sfr_cmd) = cmd {
                 if let Some(subfile) = source_map.get(&sfr_cmd.file) {
                     // Accumulate transforms.
@@ -596,6 +1994,9 @@ fn load_node_instanced<'a>(
                         geometry_descriptors,
                         geometry_world_transforms,
                         child_color,
+                        max_step,
+                        child_submodel,
+                        steps,
                         settings,
                     );
                 }
@@ -618,6 +2019,83 @@ fn has_geometry(source_file: &weldr::SourceFile) -> bool {
         .any(|c| matches!(c, Command::Triangle(_) | Command::Quad(_)))
 }
 
+/// Individual pipeline stages for the benchmarks in `benches`.
+/// These functions are not part of the public API and may change at any time.
+#[doc(hidden)]
+pub mod bench {
+    use super::*;
+
+    pub use crate::edge_split::{compact_split_vertices, split_edges, CompactionStats};
+
+    pub fn parse_file(
+        path: &str,
+        ldraw_path: &str,
+        additional_paths: &[&str],
+        custom_mesh_path: &str,
+        settings: &GeometrySettings,
+    ) -> (weldr::SourceMap, String) {
+        let (source_map, main_model_name, _) =
+            super::parse_file(path, ldraw_path, additional_paths, custom_mesh_path, settings);
+        (source_map, main_model_name)
+    }
+
+    /// Find the world transforms for each geometry without creating any geometry.
+    pub fn geometry_world_transforms(
+        source_map: &weldr::SourceMap,
+        main_model_name: &str,
+        settings: &GeometrySettings,
+    ) -> HashMap<(String, ColorCode), Vec<Mat4>> {
+        let source_file = source_map.get(main_model_name).unwrap();
+
+        let mut geometry_descriptors = HashMap::new();
+        let mut geometry_world_transforms = HashMap::new();
+        load_node_instanced(
+            source_file,
+            main_model_name,
+            &Mat4::IDENTITY,
+            source_map,
+            &mut geometry_descriptors,
+            &mut geometry_world_transforms,
+            CURRENT_COLOR,
+            settings.max_step,
+            0,
+            &mut InstanceStepTracker::default(),
+            settings,
+        );
+        geometry_world_transforms
+    }
+
+    /// Create the geometry for all parts referenced by the main model.
+    pub fn create_geometry_cache(
+        source_map: &weldr::SourceMap,
+        main_model_name: &str,
+        settings: &GeometrySettings,
+    ) -> HashMap<String, LDrawGeometry> {
+        let source_file = source_map.get(main_model_name).unwrap();
+
+        let mut geometry_descriptors = HashMap::new();
+        let mut geometry_world_transforms = HashMap::new();
+        load_node_instanced(
+            source_file,
+            main_model_name,
+            &Mat4::IDENTITY,
+            source_map,
+            &mut geometry_descriptors,
+            &mut geometry_world_transforms,
+            CURRENT_COLOR,
+            settings.max_step,
+            0,
+            &mut InstanceStepTracker::default(),
+            settings,
+        );
+        super::create_geometry_cache(geometry_descriptors, source_map, settings)
+    }
+
+    pub fn geometry_point_instances(transforms: Vec<Mat4>) -> PointInstances {
+        super::geometry_point_instances(transforms, &[])
+    }
+}
+
 #[cfg(test)]
 mod tests {
     use approx::assert_relative_eq;
@@ -625,6 +2103,781 @@ mod tests {
 
     use super::*;
 
+    fn synthetic_library(name: &str) -> std::path::PathBuf {
+        let path = std::env::temp_dir().join(format!("ldr_tools_test_{name}"));
+        synthetic::write_library(&path).unwrap();
+        path
+    }
+
+    #[test]
+    fn load_file_instanced_synthetic_submodels() {
+        let ldraw_path = synthetic_library("load_file_instanced");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 100,
+                submodel_depth: 2,
+                submodel_reuse: 2,
+            },
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scene = load_file_instanced(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+
+        // Each of the 25 parts in the innermost submodel is instanced 4 times.
+        let instance_count: usize = scene
+            .geometry_world_transforms
+            .values()
+            .map(|t| t.len())
+            .sum();
+        assert_eq!(100, instance_count);
+        assert_eq!(synthetic::SYNTHETIC_PARTS.len(), scene.geometry_cache.len());
+        assert!(scene
+            .geometry_cache
+            .values()
+            .all(|g| !g.vertices.is_empty()));
+
+        assert_eq!(100, scene.memory.instance_count);
+        assert_eq!(100 * 64, scene.memory.transform_bytes);
+        assert_eq!(scene.geometry_cache.len(), scene.memory.geometry.len());
+        assert!(scene.memory.geometry_bytes() > 0);
+    }
+
+    #[test]
+    fn load_file_submodels_and_steps() {
+        let ldraw_path = synthetic_library("load_file_submodels");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 100,
+                submodel_depth: 2,
+                submodel_reuse: 2,
+            },
+        )
+        .unwrap();
+
+        assert_eq!(
+            vec!["main.ldr", "submodel1.ldr", "submodel2.ldr"],
+            list_submodels(&model_path).unwrap()
+        );
+
+        let model_path = model_path.to_str().unwrap();
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let instance_count = |settings: &GeometrySettings| -> usize {
+            load_file_instanced(model_path, ldraw_path, &[], ldraw_path, settings)
+                .geometry_world_transforms
+                .values()
+                .map(|t| t.len())
+                .sum()
+        };
+
+        // Steps are counted in building order starting with the innermost submodel.
+        // The innermost submodel has a step after every 10 parts.
+        let settings = GeometrySettings {
+            max_step: Some(0),
+            ..Default::default()
+        };
+        assert_eq!(10, instance_count(&settings));
+        fn geometry_count(node: &LDrawNode) -> usize {
+            node.geometry_name.iter().count()
+                + node.children.iter().map(geometry_count).sum::<usize>()
+        }
+        let scene = load_file(model_path, ldraw_path, &[], ldraw_path, &settings);
+        assert_eq!(10, geometry_count(&scene.root_node));
+
+        // The 25 parts in each submodel instance use steps of 10, 10, and 5 parts.
+        let settings = GeometrySettings {
+            max_step: Some(3),
+            ..Default::default()
+        };
+        assert_eq!(35, instance_count(&settings));
+
+        let settings = GeometrySettings {
+            submodels: vec!["submodel2.ldr".to_string()],
+            max_step: Some(1),
+            ..Default::default()
+        };
+        assert_eq!(20, instance_count(&settings));
+
+        // Multiple submodels are grouped under the main model.
+        let settings = GeometrySettings {
+            submodels: vec!["submodel1.ldr".to_string(), "submodel2.ldr".to_string()],
+            ..Default::default()
+        };
+        assert_eq!(75, instance_count(&settings));
+        let scene = load_file(model_path, ldraw_path, &[], ldraw_path, &settings);
+        assert_eq!("main.ldr", scene.root_node.name);
+        assert_eq!(2, scene.root_node.children.len());
+        assert_eq!("submodel2.ldr", scene.root_node.children[1].name);
+    }
+
+    #[test]
+    fn load_file_instanced_points_steps() {
+        let ldraw_path = synthetic_library("load_file_instanced_points_steps");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 40,
+                submodel_depth: 1,
+                submodel_reuse: 2,
+            },
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scene = load_file_instanced_points(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+        assert_eq!(vec!["main.ldr", "submodel1.ldr"], scene.submodel_names);
+
+        // Each of the two submodel instances has two steps of 10 parts.
+        // The empty step after each submodel reference is skipped.
+        let mut step_counts = vec![0; 4];
+        for instances in scene.geometry_point_instances.values() {
+            assert_eq!(instances.translations.len(), instances.steps.len());
+            assert!(instances.submodels.iter().all(|i| *i == 1));
+            for step in &instances.steps {
+                step_counts[*step as usize] += 1;
+            }
+        }
+        assert_eq!(vec![10; 4], step_counts);
+    }
+
+    #[test]
+    fn load_file_instanced_points_batched_geometry() {
+        let ldraw_path = synthetic_library("load_file_instanced_points_batched");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(&model_path, &synthetic::SyntheticModelSettings::default())
+            .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let model_path = model_path.to_str().unwrap();
+        let settings = GeometrySettings::default();
+        let expected = load_file_instanced_points(model_path, ldraw_path, &[], ldraw_path, &settings);
+
+        let mut names = Vec::new();
+        let mut keys = Vec::new();
+        let scene = load_file_instanced_points_batched(
+            model_path,
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+            1,
+            |batch| {
+                for (name, colors) in batch.colors {
+                    keys.extend(colors.into_iter().map(|c| (name.clone(), c)));
+                }
+                names.extend(batch.geometry.into_keys());
+                Ok::<(), ()>(())
+            },
+        )
+        .unwrap();
+        assert!(scene.geometry_cache.is_empty());
+        assert_eq!(expected.geometry_point_instances, scene.geometry_point_instances);
+        assert_eq!(expected.memory.geometry, scene.memory.geometry);
+
+        names.sort();
+        let mut expected_names: Vec<_> = expected.geometry_cache.into_keys().collect();
+        expected_names.sort();
+        assert_eq!(expected_names, names);
+
+        keys.sort();
+        let mut expected_keys: Vec<_> = expected.geometry_point_instances.into_keys().collect();
+        expected_keys.sort();
+        assert_eq!(expected_keys, keys);
+
+        // Errors stop creating geometry.
+        let result = load_file_instanced_points_batched(
+            model_path,
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+            1,
+            |_| Err("stop"),
+        );
+        assert!(matches!(result, Err("stop")));
+    }
+
+    #[test]
+    fn namespace_embedded_files_only_renames_embedded_files() {
+        let contents = b"0 FILE main.ldr\r\n\
+                         1 16 0 0 0 1 0 0 0 1 0 0 0 1 Sub  Model.ldr\r\n\
+                         1 16 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\r\n\
+                         0 FILE sub model.ldr\r\n";
+        assert_eq!(
+            "0 FILE 1>main.ldr\n\
+             1 16 0 0 0 1 0 0 0 1 0 0 0 1 1>Sub  Model.ldr\n\
+             1 16 0 0 0 1 0 0 0 1 0 0 0 1 3001.dat\n\
+             0 FILE 1>sub model.ldr\n",
+            String::from_utf8(namespace_embedded_files(contents, "1>")).unwrap()
+        );
+
+        // Files without embedded files are unchanged.
+        let contents = b"1 16 0 0 0 1 0 0 0 1 0 0 0 1 main.ldr\r\n";
+        assert_eq!(contents.to_vec(), namespace_embedded_files(contents, "1>"));
+    }
+
+    #[test]
+    fn load_files_instanced_points_same_submodel_names() {
+        let ldraw_path = synthetic_library("load_files_instanced_points_same_submodel_names");
+        let path_a = ldraw_path.join("a.mpd");
+        let path_b = ldraw_path.join("b.mpd");
+        std::fs::write(
+            &path_a,
+            "0 FILE main.ldr\n\
+             1 16 0 0 0 1 0 0 0 1 0 0 0 1 Sub Model.ldr\n\
+             0 FILE Sub Model.ldr\n\
+             1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n",
+        )
+        .unwrap();
+        std::fs::write(
+            &path_b,
+            "0 FILE main.ldr\n\
+             1 16 0 0 0 1 0 0 0 1 0 0 0 1 sub model.ldr\n\
+             1 16 40 0 0 1 0 0 0 1 0 0 0 1 sub model.ldr\n\
+             0 FILE sub model.ldr\n\
+             1 1 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n",
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scenes = load_files_instanced_points(
+            &[path_a.to_str().unwrap(), path_b.to_str().unwrap()],
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+
+        // Each file uses its own definition of the submodel.
+        let brick_2x4 = ("synth-brick-2x4.dat".to_string(), 4);
+        let brick_1x1 = ("synth-brick-1x1.dat".to_string(), 1);
+        let a = &scenes.scenes[0];
+        let b = &scenes.scenes[1];
+        assert_eq!(vec![&brick_2x4], a.geometry_point_instances.keys().collect::<Vec<_>>());
+        assert_eq!(vec![&brick_1x1], b.geometry_point_instances.keys().collect::<Vec<_>>());
+        assert_eq!(2, b.geometry_point_instances[&brick_1x1].translations.len());
+
+        // Names don't include the prefix for each file.
+        assert_eq!("main.ldr", a.main_model_name);
+        assert_eq!("main.ldr", b.main_model_name);
+        assert!(a.submodel_names.iter().all(|n| !n.contains('>')));
+    }
+
+    #[test]
+    fn load_files_instanced_points_shared_geometry() {
+        let ldraw_path = synthetic_library("load_files_instanced_points_shared_geometry");
+        let path_a = ldraw_path.join("a.ldr");
+        let path_b = ldraw_path.join("b.ldr");
+        std::fs::write(&path_a, "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n").unwrap();
+        std::fs::write(
+            &path_b,
+            "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 4 80 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 1 0 -24 0 1 0 0 0 1 0 0 0 1 3039.dat\n",
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scenes = load_files_instanced_points(
+            &[path_a.to_str().unwrap(), path_b.to_str().unwrap()],
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+        assert_eq!(2, scenes.scenes.len());
+        assert_eq!(2, scenes.geometry_cache.len());
+
+        let brick = ("synth-brick-2x4.dat".to_string(), 4);
+        assert_eq!(1, scenes.scenes[0].geometry_point_instances.len());
+        assert_eq!(
+            1,
+            scenes.scenes[0].geometry_point_instances[&brick].translations.len()
+        );
+        assert_eq!(2, scenes.scenes[1].geometry_point_instances.len());
+        assert_eq!(
+            2,
+            scenes.scenes[1].geometry_point_instances[&brick].translations.len()
+        );
+        assert_eq!(4, scenes.memory.instance_count);
+    }
+
+    #[test]
+    fn load_bytes_subfiles() {
+        let ldraw_path = synthetic_library("load_bytes_subfiles");
+        let ldraw_path = ldraw_path.to_str().unwrap();
+
+        // Subfile references are case insensitive like files on disk.
+        let contents = b"1 4 0 0 0 1 0 0 0 1 0 0 0 1 Wall.ldr\n\
+                         1 4 0 -24 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n"
+            .to_vec();
+        let subfiles = HashMap::from([(
+            "wall.ldr".to_string(),
+            b"1 16 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n\
+              1 16 20 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n"
+                .to_vec(),
+        )]);
+
+        let scene = load_bytes_instanced_points(
+            "memory.ldr",
+            contents.clone(),
+            subfiles.clone(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+        assert_eq!("memory.ldr", scene.main_model_name);
+        let brick_1x1 = ("synth-brick-1x1.dat".to_string(), 4);
+        let brick_2x4 = ("synth-brick-2x4.dat".to_string(), 4);
+        assert_eq!(2, scene.geometry_point_instances[&brick_1x1].translations.len());
+        assert_eq!(1, scene.geometry_point_instances[&brick_2x4].translations.len());
+        assert_eq!(2, scene.geometry_cache.len());
+
+        let scene = load_bytes(
+            "memory.ldr",
+            contents,
+            subfiles,
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings::default(),
+        );
+        assert_eq!(2, scene.root_node.children.len());
+        assert_eq!(2, scene.root_node.children[0].children.len());
+
+        // Only the library files are read from disk.
+        let part_path = Path::new(ldraw_path).join("parts").join("synth-brick-2x4.dat");
+        assert!(scene
+            .resolved_files
+            .iter()
+            .any(|f| f.path == part_path && f.modified.is_some() && f.len > 0));
+        assert!(!scene
+            .resolved_files
+            .iter()
+            .any(|f| f.path.ends_with("wall.ldr") || f.path.ends_with("memory.ldr")));
+    }
+
+    #[test]
+    fn load_file_instanced_viewport_proxies() {
+        let ldraw_path = synthetic_library("load_file_instanced_viewport_proxies");
+        let model_path = ldraw_path.join("proxies.ldr");
+        std::fs::write(&model_path, "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n").unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scene = load_file_instanced(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings {
+                viewport_proxies: true,
+                ..Default::default()
+            },
+        );
+        assert_eq!(1, scene.proxy_geometry_cache.len());
+
+        // Proxies use fewer cylinder segments and studs without logos.
+        let geometry = &scene.geometry_cache["synth-brick-2x4.dat"];
+        let proxy = &scene.proxy_geometry_cache["synth-brick-2x4.dat"];
+        assert!(proxy.face_sizes.len() < geometry.face_sizes.len());
+        assert!(proxy.vertices.len() < geometry.vertices.len());
+        assert!(scene.memory.geometry.contains_key("synth-brick-2x4.dat (proxy)"));
+    }
+
+    #[test]
+    fn load_file_instanced_z_up_meters() {
+        let ldraw_path = synthetic_library("load_file_instanced_z_up_meters");
+        let model_path = ldraw_path.join("z_up.ldr");
+        std::fs::write(&model_path, "1 4 10 -24 80 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n").unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let load = |settings| {
+            load_file_instanced(
+                model_path.to_str().unwrap(),
+                ldraw_path,
+                &[],
+                ldraw_path,
+                &settings,
+            )
+        };
+        let ldraw = load(GeometrySettings::default());
+        let z_up = load(GeometrySettings {
+            scene_scale: 0.01,
+            axis_convention: AxisConvention::ZUp,
+            ..Default::default()
+        });
+
+        let key = ("synth-brick-2x4.dat".to_string(), 4);
+        let transform = z_up.geometry_world_transforms[&key][0];
+        assert_relative_eq!(
+            transform.w_axis.to_array()[..],
+            [0.1, 0.8, 0.24, 1.0],
+            epsilon = 1e-6
+        );
+
+        // LDraw uses -Y up, so the top of the brick has the highest Z value.
+        let geometry = &ldraw.geometry_cache["synth-brick-2x4.dat"];
+        let converted = &z_up.geometry_cache["synth-brick-2x4.dat"];
+        let min_y = geometry.vertices.iter().map(|v| v.y).fold(f32::MAX, f32::min);
+        let max_z = converted.vertices.iter().map(|v| v.z).fold(f32::MIN, f32::max);
+        assert_relative_eq!(-min_y * 0.01, max_z, epsilon = 1e-6);
+    }
+
+    #[test]
+    fn load_file_instanced_remove_duplicates() {
+        let ldraw_path = synthetic_library("load_file_instanced_remove_duplicates");
+        let model_path = ldraw_path.join("duplicates.ldr");
+        std::fs::write(
+            &model_path,
+            "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 1 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 4 0 -24 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n",
+        )
+        .unwrap();
+
+        let model_path = model_path.to_str().unwrap();
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let load = |remove_duplicate_instances| {
+            load_file_instanced(
+                model_path,
+                ldraw_path,
+                &[],
+                ldraw_path,
+                &GeometrySettings {
+                    remove_duplicate_instances,
+                    ..Default::default()
+                },
+            )
+        };
+
+        let scene = load(false);
+        assert_eq!(4, scene.memory.instance_count);
+        assert!(scene.duplicate_instances.is_empty());
+
+        // Only parts with the same color and transform are duplicates.
+        let scene = load(true);
+        assert_eq!(3, scene.memory.instance_count);
+        assert_eq!(
+            vec![DuplicateInstances {
+                name: "synth-brick-2x4.dat".to_string(),
+                color: 4,
+                transform: Mat4::IDENTITY,
+                count: 2,
+                submodel: 0,
+            }],
+            scene.duplicate_instances
+        );
+    }
+
+    #[test]
+    fn load_file_region() {
+        let ldraw_path = synthetic_library("load_file_region");
+        let model_path = ldraw_path.join("region.ldr");
+        std::fs::write(
+            &model_path,
+            "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 1 400 0 0 1 0 0 0 1 0 0 0 1 synth-brick-1x1.dat\n",
+        )
+        .unwrap();
+
+        let model_path = model_path.to_str().unwrap();
+        let ldraw_path = ldraw_path.to_str().unwrap();
+
+        // The region uses meters with Z up like Blender.
+        let settings = GeometrySettings {
+            scene_scale: 0.01,
+            axis_convention: AxisConvention::ZUp,
+            region: Some(Region::Box(Bounds {
+                min: vec3(-1.0, -1.0, -1.0),
+                max: vec3(1.0, 1.0, 1.0),
+            })),
+            ..Default::default()
+        };
+
+        let scene = load_file_instanced(model_path, ldraw_path, &[], ldraw_path, &settings);
+        let brick = ("synth-brick-2x4.dat".to_string(), 4);
+        assert_eq!(
+            vec![&brick],
+            scene.geometry_world_transforms.keys().collect::<Vec<_>>()
+        );
+        assert_eq!(1, scene.geometry_cache.len());
+
+        let scene = load_file(model_path, ldraw_path, &[], ldraw_path, &settings);
+        assert_eq!(1, scene.root_node.children.len());
+        assert_eq!(1, scene.geometry_cache.len());
+
+        // Queries find instances in the same space.
+        let scene = load_file_instanced(
+            model_path,
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings {
+                region: None,
+                ..settings
+            },
+        );
+        assert_eq!(2, scene.instance_index.len());
+        assert_eq!(
+            vec![(&brick, 0)],
+            scene.instance_index.query_frustum(&[vec4(-1.0, 0.0, 0.0, 1.0)])
+        );
+    }
+
+    fn node(name: &str, children: Vec<LDrawNode>) -> LDrawNode {
+        LDrawNode {
+            name: name.to_string(),
+            object_name: String::new(),
+            transform: Mat4::IDENTITY,
+            geometry_name: None,
+            current_color: CURRENT_COLOR,
+            children,
+        }
+    }
+
+    #[test]
+    fn assign_object_names_unique() {
+        let long_name = "a".repeat(100);
+        let mut root = node(
+            "main.ldr",
+            vec![
+                node("3001.dat", Vec::new()),
+                node("sub.ldr", vec![node("3001.dat", Vec::new())]),
+                node(&long_name, Vec::new()),
+                node(&format!("{long_name}b"), Vec::new()),
+                node("é".repeat(40).as_str(), Vec::new()),
+            ],
+        );
+        assign_object_names(&mut root, &mut HashMap::new());
+
+        assert_eq!("main.ldr#0000", root.object_name);
+        assert_eq!("3001.dat#0000", root.children[0].object_name);
+        assert_eq!("3001.dat#0001", root.children[1].children[0].object_name);
+        assert_eq!(format!("{}#0000", "a".repeat(55)), root.children[2].object_name);
+        assert_eq!(format!("{}#0001", "a".repeat(55)), root.children[3].object_name);
+        assert_eq!(format!("{}#0000", "é".repeat(27)), root.children[4].object_name);
+        assert!(root.children.iter().all(|c| c.object_name.len() <= 63));
+    }
+
+    #[test]
+    fn submodel_names() {
+        assert_eq!(Some("main.ldr".to_string()), submodel_name("0 FILE main.ldr"));
+        assert_eq!(Some("my model.ldr".to_string()), submodel_name("  0  FILE my model.ldr\r"));
+        assert_eq!(None, submodel_name("0 FILE"));
+        assert_eq!(None, submodel_name("0 NOFILE"));
+        assert_eq!(None, submodel_name("1 16 0 0 0 1 0 0 0 1 0 0 0 1 main.ldr"));
+    }
+
+    #[test]
+    fn primitive_policy_resolution() {
+        let policy = PrimitivePolicy {
+            high_resolution_parts: vec!["3001.dat".to_string()],
+            low_resolution_min_instances: Some(10),
+            high_resolution_min_size: Some(100.0),
+            low_resolution_max_size: Some(10.0),
+        };
+        let bounds = |size: f32| {
+            move || {
+                Some(Bounds {
+                    min: Vec3::ZERO,
+                    max: vec3(size, 0.0, 0.0),
+                })
+            }
+        };
+
+        assert_eq!(
+            PrimitiveResolution::High,
+            policy.resolution("3001.DAT", 1000, bounds(1.0))
+        );
+        assert_eq!(
+            PrimitiveResolution::Low,
+            policy.resolution("3003.dat", 10, bounds(1000.0))
+        );
+        assert_eq!(
+            PrimitiveResolution::High,
+            policy.resolution("3003.dat", 1, bounds(100.0))
+        );
+        assert_eq!(
+            PrimitiveResolution::Low,
+            policy.resolution("3003.dat", 1, bounds(5.0))
+        );
+        assert_eq!(
+            PrimitiveResolution::Normal,
+            policy.resolution("3003.dat", 1, bounds(50.0))
+        );
+    }
+
+    #[test]
+    fn load_file_instanced_adaptive_resolution() {
+        let ldraw_path = synthetic_library("adaptive_resolution");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 20,
+                ..Default::default()
+            },
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let load = |primitive_resolution, primitive_policy| {
+            load_file_instanced(
+                model_path.to_str().unwrap(),
+                ldraw_path,
+                &[],
+                ldraw_path,
+                &GeometrySettings {
+                    primitive_resolution,
+                    primitive_policy,
+                    ..Default::default()
+                },
+            )
+        };
+        let vertex_count = |scene: &LDrawSceneInstanced, name: &str| {
+            scene.geometry_cache[name].vertices.len()
+        };
+
+        let normal = load(PrimitiveResolution::Normal, PrimitivePolicy::default());
+        let adaptive = load(
+            PrimitiveResolution::Adaptive,
+            PrimitivePolicy {
+                high_resolution_parts: vec!["synth-brick-2x4.dat".to_string()],
+                low_resolution_min_instances: Some(1),
+                high_resolution_min_size: None,
+                low_resolution_max_size: None,
+            },
+        );
+
+        // Studs use 16 segment primitives by default.
+        assert!(
+            vertex_count(&adaptive, "synth-brick-2x4.dat")
+                > vertex_count(&normal, "synth-brick-2x4.dat")
+        );
+        assert!(
+            vertex_count(&adaptive, "synth-brick-1x1.dat")
+                < vertex_count(&normal, "synth-brick-1x1.dat")
+        );
+    }
+
+    #[test]
+    fn load_file_instanced_cull_hidden_studs() {
+        let ldraw_path = synthetic_library("cull_hidden_studs");
+        let model_path = ldraw_path.join("stacked.ldr");
+
+        // Stack two opaque bricks with a transparent brick on top.
+        std::fs::write(
+            &model_path,
+            "1 4 0 0 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 1 0 -24 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n\
+             1 47 0 -48 0 1 0 0 0 1 0 0 0 1 synth-brick-2x4.dat\n",
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let scene = load_file_instanced(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &GeometrySettings {
+                cull_hidden_studs: true,
+                ..Default::default()
+            },
+        );
+
+        // The middle brick hides its tubes, and the bottom brick hides its studs.
+        // Studs under the transparent brick are still visible.
+        let mut keys: Vec<_> = scene.geometry_world_transforms.keys().cloned().collect();
+        keys.sort();
+        assert_eq!(
+            vec![
+                ("synth-brick-2x4.dat".to_string(), 47),
+                ("synth-brick-2x4.dat#culled1".to_string(), 1),
+                ("synth-brick-2x4.dat#culled2".to_string(), 4),
+            ],
+            keys
+        );
+
+        let vertex_count = |name: &str| scene.geometry_cache[name].vertices.len();
+        assert!(vertex_count("synth-brick-2x4.dat#culled1") < vertex_count("synth-brick-2x4.dat"));
+        assert!(vertex_count("synth-brick-2x4.dat#culled2") < vertex_count("synth-brick-2x4.dat"));
+    }
+
+    #[test]
+    fn load_file_merged_synthetic() {
+        let ldraw_path = synthetic_library("load_file_merged");
+        let model_path = ldraw_path.join("model.mpd");
+        synthetic::write_model(
+            &model_path,
+            &synthetic::SyntheticModelSettings {
+                part_count: 20,
+                ..Default::default()
+            },
+        )
+        .unwrap();
+
+        let ldraw_path = ldraw_path.to_str().unwrap();
+        let settings = GeometrySettings::default();
+        let instanced = load_file_instanced(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+        );
+        let merged = load_file_merged(
+            model_path.to_str().unwrap(),
+            ldraw_path,
+            &[],
+            ldraw_path,
+            &settings,
+        );
+
+        // Every face of every instance should be in exactly one merged geometry.
+        let expected_faces: usize = instanced
+            .geometry_world_transforms
+            .iter()
+            .map(|((name, _), t)| t.len() * instanced.geometry_cache[name].face_sizes.len())
+            .sum();
+        let faces: usize = merged
+            .merged_geometry
+            .values()
+            .map(|m| m.geometry.face_sizes.len())
+            .sum();
+        assert_eq!(expected_faces, faces);
+
+        for ((_, is_slope), m) in &merged.merged_geometry {
+            assert_eq!(1, m.geometry.face_colors.len());
+            if *is_slope {
+                assert_eq!(m.geometry.vertex_indices.len(), m.part_normals.len());
+            } else {
+                assert!(m.part_normals.is_empty());
+            }
+        }
+        assert_eq!(0, merged.memory.transform_bytes);
+        assert_eq!(merged.merged_geometry.len(), merged.memory.geometry.len());
+    }
+
     #[test]
     fn geometry_point_instances_flip() {
         // Some LDraw models use negative scaling.
@@ -648,7 +2901,7 @@ mod tests {
             .transpose(),
         ];
 
-        let instances = geometry_point_instances(transforms);
+        let instances = geometry_point_instances(transforms, &[]);
 
         assert_relative_eq!(instances.rotations_axis[0].to_array()[..], [0.0, 1.0, 0.0]);
         assert_relative_eq!(instances.rotations_axis[1].to_array()[..], [0.0, 1.0, 0.0]);
@@ -661,4 +2914,26 @@ mod tests {
             vec![vec3(1.0, 1.0, 1.0), vec3(-1.0, 1.0, 1.0)]
         );
     }
+
+    #[test]
+    fn point_instances_transforms() {
+        let transforms = vec![
+            Mat4::from_translation(vec3(1.0, 2.0, 3.0)),
+            Mat4::from_scale_rotation_translation(
+                vec3(-1.0, 1.0, 1.0),
+                Quat::from_rotation_y(std::f32::consts::FRAC_PI_2),
+                vec3(-4.0, 0.0, 8.0),
+            ),
+        ];
+
+        let instances = geometry_point_instances(transforms.clone(), &[]);
+
+        for (expected, actual) in transforms.iter().zip(instances.transforms()) {
+            assert_relative_eq!(
+                expected.to_cols_array()[..],
+                actual.to_cols_array()[..],
+                epsilon = 1e-5
+            );
+        }
+    }
 }
@@ -0,0 +1,306 @@
+//! Memory accounting for loaded scenes.
+//!
+//! Buffer sizes are always reported.
+//! Peak allocations are only reported if the application installs [CountingAllocator]:
+//! ```rust ignore
+//! #[global_allocator]
+//! static ALLOCATOR: ldr_tools::memory::CountingAllocator = ldr_tools::memory::CountingAllocator;
+//! ```
+//! Counting adds shared atomic updates to every allocation,
+//! so applications should only install the allocator when the peaks are needed.
+use std::{
+    alloc::{GlobalAlloc, Layout, System},
+    collections::HashMap,
+    mem::size_of,
+    sync::atomic::{AtomicUsize, Ordering},
+};
+
+use glam::{Mat4, Vec3};
+
+use crate::{ColorCode, LDrawGeometry, LDrawNode, MergedGeometry, PointInstances};
+
+static CURRENT_BYTES: AtomicUsize = AtomicUsize::new(0);
+static PEAK_BYTES: AtomicUsize = AtomicUsize::new(0);
+// The number of active calls to measure_peak.
+// The peak is only updated while measuring to avoid contention on PEAK_BYTES.
+static MEASURING: AtomicUsize = AtomicUsize::new(0);
+
+/// A wrapper around the system allocator that tracks current and peak allocated bytes.
+pub struct CountingAllocator;
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        let ptr = System.alloc(layout);
+        if !ptr.is_null() {
+            add_bytes(layout.size());
+        }
+        ptr
+    }
+
+    unsafe fn alloc_zeroed(&self, layout: Layout) -> *mut u8 {
+        let ptr = System.alloc_zeroed(layout);
+        if !ptr.is_null() {
+            add_bytes(layout.size());
+        }
+        ptr
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        System.dealloc(ptr, layout);
+        CURRENT_BYTES.fetch_sub(layout.size(), Ordering::Relaxed);
+    }
+
+    unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+        let new_ptr = System.realloc(ptr, layout, new_size);
+        if !new_ptr.is_null() {
+            CURRENT_BYTES.fetch_sub(layout.size(), Ordering::Relaxed);
+            add_bytes(new_size);
+        }
+        new_ptr
+    }
+}
+
+fn add_bytes(size: usize) {
+    let current = CURRENT_BYTES.fetch_add(size, Ordering::Relaxed) + size;
+    if MEASURING.load(Ordering::Relaxed) > 0 {
+        PEAK_BYTES.fetch_max(current, Ordering::Relaxed);
+    }
+}
+
+/// The bytes currently allocated or `None` if [CountingAllocator] is not installed.
+pub fn allocated_bytes() -> Option<usize> {
+    // Any program with an installed allocator has made at least one allocation.
+    match CURRENT_BYTES.load(Ordering::Relaxed) {
+        0 => None,
+        bytes => Some(bytes),
+    }
+}
+
+/// Run `f` and return the peak bytes allocated above the starting allocation.
+/// Allocations from other threads while `f` is running are also included.
+///
+/// This function is not reentrant.
+/// Each call resets the single global peak,
+/// so nested or concurrent calls report incorrect peaks for the calls that started first.
+pub fn measure_peak<T>(f: impl FnOnce() -> T) -> (T, Option<usize>) {
+    let start = allocated_bytes();
+    PEAK_BYTES.store(start.unwrap_or_default(), Ordering::Relaxed);
+    MEASURING.fetch_add(1, Ordering::Relaxed);
+
+    let result = f();
+
+    MEASURING.fetch_sub(1, Ordering::Relaxed);
+    let peak = start.map(|start| PEAK_BYTES.load(Ordering::Relaxed).saturating_sub(start));
+    (result, peak)
+}
+
+/// The size in bytes of each buffer in an [LDrawGeometry].
+#[derive(Debug, Default, Clone, Copy, PartialEq, Eq)]
+pub struct GeometryMemory {
+    pub vertices: usize,
+    pub vertex_indices: usize,
+    pub face_start_indices: usize,
+    pub face_sizes: usize,
+    pub face_colors: usize,
+    pub is_face_stud: usize,
+    pub edge_line_indices: usize,
+}
+
+impl GeometryMemory {
+    pub fn new(geometry: &LDrawGeometry) -> Self {
+        Self {
+            vertices: buffer_bytes(&geometry.vertices),
+            vertex_indices: buffer_bytes(&geometry.vertex_indices),
+            face_start_indices: buffer_bytes(&geometry.face_start_indices),
+            face_sizes: buffer_bytes(&geometry.face_sizes),
+            face_colors: buffer_bytes(&geometry.face_colors),
+            is_face_stud: buffer_bytes(&geometry.is_face_stud),
+            edge_line_indices: buffer_bytes(&geometry.edge_line_indices),
+        }
+    }
+
+    pub fn total(&self) -> usize {
+        self.vertices
+            + self.vertex_indices
+            + self.face_start_indices
+            + self.face_sizes
+            + self.face_colors
+            + self.is_face_stud
+            + self.edge_line_indices
+    }
+}
+
+/// The memory used by the data in a loaded scene.
+#[derive(Debug, Default, Clone, PartialEq)]
+pub struct MemoryReport {
+    /// The buffer sizes for each geometry in the geometry cache.
+    pub geometry: HashMap<String, GeometryMemory>,
+    /// The bytes for node transforms or world transforms.
+    pub transform_bytes: usize,
+    /// The bytes for decomposed point instances.
+    pub instance_bytes: usize,
+    /// The total number of nodes or instances in the scene.
+    pub instance_count: usize,
+    /// The peak bytes allocated while creating the geometry cache
+    /// or `None` if [CountingAllocator] is not installed.
+    pub geometry_cache_peak_bytes: Option<usize>,
+}
+
+impl MemoryReport {
+    pub(crate) fn new(
+        geometry_cache: &HashMap<String, LDrawGeometry>,
+        geometry_cache_peak_bytes: Option<usize>,
+    ) -> Self {
+        Self {
+            geometry: geometry_cache
+                .iter()
+                .map(|(name, geometry)| (name.clone(), GeometryMemory::new(geometry)))
+                .collect(),
+            geometry_cache_peak_bytes,
+            ..Default::default()
+        }
+    }
+
+    pub(crate) fn with_proxy_geometry(
+        mut self,
+        proxy_geometry_cache: &HashMap<String, LDrawGeometry>,
+    ) -> Self {
+        // Proxies have the same names as the full resolution geometry.
+        self.geometry.extend(proxy_geometry_cache.iter().map(|(name, geometry)| {
+            (format!("{name} (proxy)"), GeometryMemory::new(geometry))
+        }));
+        self
+    }
+
+    pub(crate) fn with_nodes(mut self, root_node: &LDrawNode) -> Self {
+        self.instance_count = node_count(root_node);
+        self.transform_bytes = self.instance_count * size_of::<Mat4>();
+        self
+    }
+
+    pub(crate) fn with_world_transforms(
+        mut self,
+        transforms: &HashMap<(String, ColorCode), Vec<Mat4>>,
+    ) -> Self {
+        self.instance_count = transforms.values().map(Vec::len).sum();
+        self.transform_bytes = transforms.values().map(|t| buffer_bytes(t)).sum();
+        self
+    }
+
+    pub(crate) fn with_point_instances<'a>(
+        mut self,
+        instances: impl Iterator<Item = &'a PointInstances>,
+    ) -> Self {
+        // The world transforms are no longer stored after decomposing.
+        self.instance_count = 0;
+        self.transform_bytes = 0;
+        self.instance_bytes = 0;
+        for instances in instances {
+            self.instance_count += instances.translations.len();
+            self.instance_bytes += point_instance_bytes(instances);
+        }
+        self
+    }
+
+    pub(crate) fn with_merged_geometry(
+        mut self,
+        merged_geometry: &HashMap<(ColorCode, bool), MergedGeometry>,
+    ) -> Self {
+        // The part geometry and transforms are no longer stored after merging.
+        // Part normals are included with the vertices.
+        self.geometry = merged_geometry
+            .iter()
+            .map(|((color, is_slope), merged)| {
+                let name = if *is_slope {
+                    format!("{color}_slope")
+                } else {
+                    color.to_string()
+                };
+                let mut memory = GeometryMemory::new(&merged.geometry);
+                memory.vertices += buffer_bytes(&merged.part_normals);
+                (name, memory)
+            })
+            .collect();
+        self.transform_bytes = 0;
+        self
+    }
+
+    /// The total bytes for all geometry buffers.
+    pub fn geometry_bytes(&self) -> usize {
+        self.geometry.values().map(GeometryMemory::total).sum()
+    }
+
+    /// The total bytes for all geometry, transforms, and instances.
+    pub fn total_bytes(&self) -> usize {
+        self.geometry_bytes() + self.transform_bytes + self.instance_bytes
+    }
+}
+
+fn buffer_bytes<T>(values: &[T]) -> usize {
+    std::mem::size_of_val(values)
+}
+
+fn node_count(node: &LDrawNode) -> usize {
+    1 + node.children.iter().map(node_count).sum::<usize>()
+}
+
+fn point_instance_bytes(instances: &PointInstances) -> usize {
+    buffer_bytes::<Vec3>(&instances.translations)
+        + buffer_bytes::<Vec3>(&instances.rotations_axis)
+        + buffer_bytes::<f32>(&instances.rotations_angle)
+        + buffer_bytes::<Vec3>(&instances.scales)
+        + buffer_bytes::<u32>(&instances.steps)
+        + buffer_bytes::<u32>(&instances.submodels)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    #[test]
+    fn geometry_memory_buffers() {
+        let geometry = LDrawGeometry {
+            vertices: vec![Vec3::ZERO; 4],
+            vertex_indices: vec![0, 1, 2, 3],
+            face_start_indices: vec![0],
+            face_sizes: vec![4],
+            face_colors: vec![16],
+            is_face_stud: vec![false],
+            edge_line_indices: vec![[0, 1], [1, 2]],
+            has_grainy_slopes: false,
+        };
+        let memory = GeometryMemory::new(&geometry);
+        assert_eq!(
+            GeometryMemory {
+                vertices: 48,
+                vertex_indices: 16,
+                face_start_indices: 4,
+                face_sizes: 4,
+                face_colors: 4,
+                is_face_stud: 1,
+                edge_line_indices: 16,
+            },
+            memory
+        );
+        assert_eq!(93, memory.total());
+    }
+
+    #[test]
+    fn report_point_instances() {
+        let instances = PointInstances {
+            translations: vec![vec3(1.0, 2.0, 3.0); 2],
+            rotations_axis: vec![Vec3::Y; 2],
+            rotations_angle: vec![0.0; 2],
+            scales: vec![Vec3::ONE; 2],
+            steps: vec![0, 1],
+            submodels: vec![0; 2],
+        };
+        let report = MemoryReport::default().with_point_instances([instances].iter());
+        assert_eq!(2, report.instance_count);
+        assert_eq!(0, report.transform_bytes);
+        assert_eq!(96, report.instance_bytes);
+        assert_eq!(96, report.total_bytes());
+    }
+}
@@ -0,0 +1,355 @@
+//! Combine all part instances into a few large meshes for static scenes.
+use std::collections::HashMap;
+
+use glam::{Mat4, Vec3};
+use rayon::prelude::*;
+
+use crate::{replace_color, ColorCode, LDrawGeometry};
+
+/// Geometry combined from many part instances with the same color.
+#[derive(Debug, PartialEq)]
+pub struct MergedGeometry {
+    /// The combined geometry with world transforms applied.
+    /// All faces use the single color in `face_colors`.
+    pub geometry: LDrawGeometry,
+    /// The normal for each face corner before applying the instance transform.
+    /// This is only set if `has_grainy_slopes` is `true`.
+    pub part_normals: Vec<Vec3>,
+}
+
+/// The faces of a part geometry with a single color.
+struct Piece<'a> {
+    geometry: MergedGeometry,
+    transforms: &'a [Mat4],
+}
+
+/// Bake the world transforms into the geometry of each instance
+/// and merge faces by color and whether they belong to slope pieces.
+#[tracing::instrument(skip_all)]
+pub(crate) fn merge_instances(
+    geometry_cache: &HashMap<String, LDrawGeometry>,
+    geometry_world_transforms: &HashMap<(String, ColorCode), Vec<Mat4>>,
+) -> HashMap<(ColorCode, bool), MergedGeometry> {
+    let pieces: Vec<_> = geometry_world_transforms
+        .par_iter()
+        .flat_map_iter(|((name, color), transforms)| {
+            let geometry = &geometry_cache[name];
+            split_by_color(geometry, *color)
+                .into_iter()
+                .map(move |(key, geometry)| {
+                    let piece = Piece {
+                        geometry,
+                        transforms: transforms.as_slice(),
+                    };
+                    (key, piece)
+                })
+        })
+        .collect();
+
+    let mut pieces_by_key: HashMap<_, Vec<_>> = HashMap::new();
+    for (key, piece) in pieces {
+        pieces_by_key.entry(key).or_default().push(piece);
+    }
+
+    pieces_by_key
+        .into_iter()
+        .map(|((color, is_slope), pieces)| {
+            ((color, is_slope), merge_pieces(&pieces, color, is_slope))
+        })
+        .collect()
+}
+
+fn split_by_color(
+    geometry: &LDrawGeometry,
+    current_color: ColorCode,
+) -> Vec<((ColorCode, bool), MergedGeometry)> {
+    let face_color = |i: usize| {
+        let color = geometry
+            .face_colors
+            .get(i)
+            .or(geometry.face_colors.first())
+            .copied()
+            .unwrap_or(current_color);
+        replace_color(color, current_color)
+    };
+
+    let mut faces_by_color: HashMap<_, Vec<_>> = HashMap::new();
+    for i in 0..geometry.face_sizes.len() {
+        faces_by_color.entry(face_color(i)).or_default().push(i);
+    }
+
+    faces_by_color
+        .into_iter()
+        .map(|(color, faces)| {
+            let piece = geometry_piece(geometry, &faces, color);
+            ((color, geometry.has_grainy_slopes), piece)
+        })
+        .collect()
+}
+
+fn geometry_piece(geometry: &LDrawGeometry, faces: &[usize], color: ColorCode) -> MergedGeometry {
+    // Only include the vertices used by these faces.
+    let mut vertex_remap = vec![u32::MAX; geometry.vertices.len()];
+    let mut vertices = Vec::new();
+    let mut vertex_indices = Vec::new();
+    let mut face_start_indices = Vec::new();
+    let mut face_sizes = Vec::new();
+    let mut is_face_stud = Vec::new();
+    let mut part_normals = Vec::new();
+
+    for &face in faces {
+        let start = geometry.face_start_indices[face] as usize;
+        let size = geometry.face_sizes[face] as usize;
+        let face_indices = &geometry.vertex_indices[start..start + size];
+
+        face_start_indices.push(vertex_indices.len() as u32);
+        face_sizes.push(size as u32);
+        is_face_stud.push(geometry.is_face_stud.get(face).copied().unwrap_or_default());
+
+        for &i in face_indices {
+            if vertex_remap[i as usize] == u32::MAX {
+                vertex_remap[i as usize] = vertices.len() as u32;
+                vertices.push(geometry.vertices[i as usize]);
+            }
+            vertex_indices.push(vertex_remap[i as usize]);
+        }
+
+        if geometry.has_grainy_slopes {
+            let normal = face_normal(face_indices.iter().map(|i| geometry.vertices[*i as usize]));
+            part_normals.extend(std::iter::repeat(normal).take(size));
+        }
+    }
+
+    // Keep the hard edges with both vertices in this piece.
+    let edge_line_indices = geometry
+        .edge_line_indices
+        .iter()
+        .filter_map(|[v0, v1]| {
+            let v0 = vertex_remap[*v0 as usize];
+            let v1 = vertex_remap[*v1 as usize];
+            (v0 != u32::MAX && v1 != u32::MAX).then_some([v0, v1])
+        })
+        .collect();
+
+    MergedGeometry {
+        geometry: LDrawGeometry {
+            vertices,
+            vertex_indices,
+            face_start_indices,
+            face_sizes,
+            face_colors: vec![color],
+            is_face_stud,
+            edge_line_indices,
+            has_grainy_slopes: geometry.has_grainy_slopes,
+        },
+        part_normals,
+    }
+}
+
+fn face_normal(positions: impl Iterator<Item = Vec3> + Clone) -> Vec3 {
+    // Newell's method works for any planar or nearly planar polygon.
+    let next = positions.clone().cycle().skip(1);
+    positions
+        .zip(next)
+        .fold(Vec3::ZERO, |n, (a, b)| {
+            n + Vec3::new(
+                (a.y - b.y) * (a.z + b.z),
+                (a.z - b.z) * (a.x + b.x),
+                (a.x - b.x) * (a.y + b.y),
+            )
+        })
+        .normalize_or_zero()
+}
+
+fn merge_pieces(pieces: &[Piece], color: ColorCode, is_slope: bool) -> MergedGeometry {
+    let instances: Vec<_> = pieces
+        .iter()
+        .flat_map(|p| p.transforms.iter().map(move |t| (&p.geometry, t)))
+        .collect();
+
+    // Find the starting vertex and corner for each instance.
+    let mut vertex_offsets = Vec::with_capacity(instances.len());
+    let mut corner_offsets = Vec::with_capacity(instances.len());
+    let mut vertex_count = 0;
+    let mut corner_count = 0;
+    for (piece, _) in &instances {
+        vertex_offsets.push(vertex_count);
+        corner_offsets.push(corner_count);
+        vertex_count += piece.geometry.vertices.len() as u32;
+        corner_count += piece.geometry.vertex_indices.len() as u32;
+    }
+
+    // Rayon preserves the order when collecting.
+    let vertices = instances
+        .par_iter()
+        .flat_map_iter(|(piece, transform)| {
+            piece
+                .geometry
+                .vertices
+                .iter()
+                .map(move |v| transform.transform_point3(*v))
+        })
+        .collect();
+
+    let vertex_indices = instances
+        .par_iter()
+        .zip(vertex_offsets.par_iter())
+        .flat_map_iter(|((piece, transform), offset)| {
+            instance_vertex_indices(&piece.geometry, transform, *offset)
+        })
+        .collect();
+
+    let face_start_indices = instances
+        .par_iter()
+        .zip(corner_offsets.par_iter())
+        .flat_map_iter(|((piece, _), offset)| {
+            piece.geometry.face_start_indices.iter().map(move |i| i + offset)
+        })
+        .collect();
+
+    let face_sizes = instances
+        .par_iter()
+        .flat_map_iter(|(piece, _)| piece.geometry.face_sizes.iter().copied())
+        .collect();
+
+    let is_face_stud = instances
+        .par_iter()
+        .flat_map_iter(|(piece, _)| piece.geometry.is_face_stud.iter().copied())
+        .collect();
+
+    let edge_line_indices = instances
+        .par_iter()
+        .zip(vertex_offsets.par_iter())
+        .flat_map_iter(|((piece, _), offset)| {
+            piece
+                .geometry
+                .edge_line_indices
+                .iter()
+                .map(move |[v0, v1]| [v0 + offset, v1 + offset])
+        })
+        .collect();
+
+    // Reversing the corners of a face doesn't change its part normal.
+    let part_normals = instances
+        .par_iter()
+        .flat_map_iter(|(piece, _)| piece.part_normals.iter().copied())
+        .collect();
+
+    MergedGeometry {
+        geometry: LDrawGeometry {
+            vertices,
+            vertex_indices,
+            face_start_indices,
+            face_sizes,
+            face_colors: vec![color],
+            is_face_stud,
+            edge_line_indices,
+            has_grainy_slopes: is_slope,
+        },
+        part_normals,
+    }
+}
+
+fn instance_vertex_indices(geometry: &LDrawGeometry, transform: &Mat4, offset: u32) -> Vec<u32> {
+    // Mirrored instances need to reverse the winding to keep faces pointing outward.
+    let flip = transform.determinant() < 0.0;
+
+    let mut indices = Vec::with_capacity(geometry.vertex_indices.len());
+    for (start, size) in geometry.face_start_indices.iter().zip(&geometry.face_sizes) {
+        let face = &geometry.vertex_indices[*start as usize..(*start + *size) as usize];
+        if flip {
+            indices.extend(face.iter().rev().map(|i| i + offset));
+        } else {
+            indices.extend(face.iter().map(|i| i + offset));
+        }
+    }
+    indices
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::vec3;
+
+    fn quad_geometry(face_colors: Vec<ColorCode>) -> LDrawGeometry {
+        LDrawGeometry {
+            vertices: vec![
+                vec3(0.0, 0.0, 0.0),
+                vec3(1.0, 0.0, 0.0),
+                vec3(1.0, 0.0, 1.0),
+                vec3(0.0, 0.0, 1.0),
+                vec3(2.0, 0.0, 0.0),
+                vec3(2.0, 0.0, 1.0),
+            ],
+            vertex_indices: vec![0, 1, 2, 3, 1, 4, 5, 2],
+            face_start_indices: vec![0, 4],
+            face_sizes: vec![4, 4],
+            face_colors,
+            is_face_stud: vec![false, true],
+            edge_line_indices: vec![[0, 1]],
+            has_grainy_slopes: true,
+        }
+    }
+
+    #[test]
+    fn split_by_color_multiple_colors() {
+        let geometry = quad_geometry(vec![16, 4]);
+        let mut pieces = split_by_color(&geometry, 1);
+        pieces.sort_by_key(|(key, _)| *key);
+
+        assert_eq!(2, pieces.len());
+        let ((color, is_slope), piece) = &pieces[0];
+        assert_eq!((1, true), (*color, *is_slope));
+        assert_eq!(vec![0, 1, 2, 3], piece.geometry.vertex_indices);
+        assert_eq!(vec![false], piece.geometry.is_face_stud);
+        assert_eq!(vec![-Vec3::Y; 4], piece.part_normals);
+
+        let ((color, _), piece) = &pieces[1];
+        assert_eq!(4, *color);
+        assert_eq!(4, piece.geometry.vertices.len());
+        assert_eq!(vec![0, 1, 2, 3], piece.geometry.vertex_indices);
+        assert_eq!(vec![true], piece.geometry.is_face_stud);
+        assert!(piece.geometry.edge_line_indices.is_empty());
+    }
+
+    #[test]
+    fn merge_instances_transforms() {
+        let geometry_cache = [("a.dat".to_string(), quad_geometry(vec![16]))].into();
+        let transforms = [(
+            ("a.dat".to_string(), 4),
+            vec![
+                Mat4::IDENTITY,
+                Mat4::from_translation(vec3(0.0, 10.0, 0.0)),
+                Mat4::from_scale(vec3(-1.0, 1.0, 1.0)),
+            ],
+        )]
+        .into();
+
+        let merged = merge_instances(&geometry_cache, &transforms);
+        assert_eq!(1, merged.len());
+
+        let merged = &merged[&(4, true)];
+        assert_eq!(18, merged.geometry.vertices.len());
+        assert_eq!(vec3(0.0, 10.0, 0.0), merged.geometry.vertices[6]);
+        assert_eq!(vec3(-2.0, 0.0, 0.0), merged.geometry.vertices[16]);
+        assert_eq!(vec![0, 4, 8, 12, 16, 20], merged.geometry.face_start_indices);
+        assert_eq!(vec![4; 6], merged.geometry.face_sizes);
+        assert_eq!(vec![4], merged.geometry.face_colors);
+        assert_eq!(24, merged.part_normals.len());
+        assert_eq!(
+            vec![[0, 1], [6, 7], [12, 13]],
+            merged.geometry.edge_line_indices
+        );
+
+        // The mirrored instance has reversed winding.
+        assert_eq!(
+            vec![0, 1, 2, 3, 1, 4, 5, 2],
+            merged.geometry.vertex_indices[..8]
+        );
+        assert_eq!(
+            vec![15, 14, 13, 12, 14, 17, 16, 13],
+            merged.geometry.vertex_indices[16..]
+        );
+    }
+}
@@ -0,0 +1,227 @@
+//! Opt-in profiling of the loading pipeline using the existing tracing spans.
+//!
+//! Spans are collected from all threads including the rayon thread pool.
+//! Applications can record their own events on the same timeline with [record_event].
+//! The results can be viewed in `chrome://tracing` or [Perfetto](https://ui.perfetto.dev).
+use std::{
+    fmt::Write as _,
+    path::Path,
+    sync::{
+        atomic::{AtomicBool, AtomicU64, Ordering},
+        Mutex, OnceLock,
+    },
+    time::Instant,
+};
+
+use tracing::{span, Subscriber};
+use tracing_subscriber::{layer::Context, prelude::*, registry::LookupSpan, Layer};
+
+static ENABLED: AtomicBool = AtomicBool::new(false);
+static INSTALLED: OnceLock<bool> = OnceLock::new();
+static EPOCH: Mutex<Option<Instant>> = Mutex::new(None);
+static EVENTS: Mutex<Vec<TraceEvent>> = Mutex::new(Vec::new());
+static THREAD_NAMES: Mutex<Vec<(u64, String)>> = Mutex::new(Vec::new());
+static NEXT_THREAD_ID: AtomicU64 = AtomicU64::new(1);
+
+thread_local! {
+    static THREAD_ID: u64 = {
+        let id = NEXT_THREAD_ID.fetch_add(1, Ordering::Relaxed);
+        let name = match (std::thread::current().name(), rayon::current_thread_index()) {
+            (Some(name), _) => name.to_string(),
+            (None, Some(index)) => format!("rayon {index}"),
+            (None, None) => format!("thread {id}"),
+        };
+        THREAD_NAMES.lock().unwrap().push((id, name));
+        id
+    };
+}
+
+/// A completed span or application event.
+#[derive(Debug, Clone, PartialEq)]
+pub struct TraceEvent {
+    pub name: String,
+    pub category: String,
+    pub thread_id: u64,
+    /// The start time in microseconds since profiling started.
+    pub start_us: f64,
+    pub duration_us: f64,
+}
+
+/// The events collected between [start_profiling] and [stop_profiling].
+#[derive(Debug, Clone, PartialEq)]
+pub struct Profile {
+    pub events: Vec<TraceEvent>,
+    /// The display name for each thread ID used in [events](#structfield.events).
+    pub thread_names: Vec<(u64, String)>,
+}
+
+impl Profile {
+    /// Write the events in the Chrome trace event JSON format.
+    pub fn write_chrome_trace<P: AsRef<Path>>(&self, path: P) -> std::io::Result<()> {
+        std::fs::write(path, self.chrome_trace_json())
+    }
+
+    fn chrome_trace_json(&self) -> String {
+        let mut entries = Vec::new();
+        for (id, name) in &self.thread_names {
+            entries.push(format!(
+                r#"{{"name":"thread_name","ph":"M","pid":1,"tid":{id},"args":{{"name":"{}"}}}}"#,
+                escape(name)
+            ));
+        }
+        for event in &self.events {
+            entries.push(format!(
+                r#"{{"name":"{}","cat":"{}","ph":"X","pid":1,"tid":{},"ts":{:.3},"dur":{:.3}}}"#,
+                escape(&event.name),
+                escape(&event.category),
+                event.thread_id,
+                event.start_us,
+                event.duration_us
+            ));
+        }
+
+        let mut output = String::from("{\"traceEvents\":[\n");
+        output.push_str(&entries.join(",\n"));
+        output.push_str("\n],\"displayTimeUnit\":\"ms\"}\n");
+        output
+    }
+}
+
+fn escape(s: &str) -> String {
+    let mut output = String::new();
+    for c in s.chars() {
+        match c {
+            '"' => output.push_str("\\\""),
+            '\\' => output.push_str("\\\\"),
+            c if c.is_control() => write!(&mut output, "\\u{:04x}", c as u32).unwrap(),
+            c => output.push(c),
+        }
+    }
+    output
+}
+
+/// Start collecting spans and events from all threads.
+///
+/// This installs a global tracing subscriber the first time it is called.
+/// Returns `false` if a different global subscriber has already been set by the application.
+pub fn start_profiling() -> bool {
+    let installed = *INSTALLED.get_or_init(|| {
+        let subscriber = tracing_subscriber::registry().with(ProfileLayer);
+        tracing::subscriber::set_global_default(subscriber).is_ok()
+    });
+
+    if installed {
+        EVENTS.lock().unwrap().clear();
+        *EPOCH.lock().unwrap() = Some(Instant::now());
+        ENABLED.store(true, Ordering::SeqCst);
+    }
+    installed
+}
+
+/// Stop profiling and return all events collected since [start_profiling].
+pub fn stop_profiling() -> Profile {
+    ENABLED.store(false, Ordering::SeqCst);
+
+    let events = std::mem::take(&mut *EVENTS.lock().unwrap());
+    let thread_names = THREAD_NAMES.lock().unwrap().clone();
+    Profile {
+        events,
+        thread_names,
+    }
+}
+
+pub fn is_profiling() -> bool {
+    ENABLED.load(Ordering::Relaxed)
+}
+
+/// The current time in microseconds since profiling started.
+/// This allows applications to time their own events using the same clock.
+pub fn profile_timestamp() -> f64 {
+    let epoch = *EPOCH.lock().unwrap();
+    epoch
+        .map(|epoch| epoch.elapsed().as_secs_f64() * 1e6)
+        .unwrap_or_default()
+}
+
+/// Record an event on the current thread with timestamps from [profile_timestamp].
+pub fn record_event(name: &str, category: &str, start_us: f64, end_us: f64) {
+    if is_profiling() {
+        push_event(name, category, start_us, end_us - start_us);
+    }
+}
+
+fn push_event(name: &str, category: &str, start_us: f64, duration_us: f64) {
+    let event = TraceEvent {
+        name: name.to_string(),
+        category: category.to_string(),
+        thread_id: THREAD_ID.with(|id| *id),
+        start_us,
+        duration_us,
+    };
+    EVENTS.lock().unwrap().push(event);
+}
+
+struct SpanStart(Instant);
+
+struct ProfileLayer;
+
+impl<S> Layer<S> for ProfileLayer
+where
+    S: Subscriber + for<'a> LookupSpan<'a>,
+{
+    fn on_enter(&self, id: &span::Id, ctx: Context<'_, S>) {
+        if !is_profiling() {
+            return;
+        }
+
+        if let Some(span) = ctx.span(id) {
+            span.extensions_mut().replace(SpanStart(Instant::now()));
+        }
+    }
+
+    fn on_exit(&self, id: &span::Id, ctx: Context<'_, S>) {
+        if !is_profiling() {
+            return;
+        }
+
+        if let Some(span) = ctx.span(id) {
+            let start = span.extensions_mut().remove::<SpanStart>();
+            let epoch = *EPOCH.lock().unwrap();
+            if let (Some(SpanStart(start)), Some(epoch)) = (start, epoch) {
+                let start_us = start.saturating_duration_since(epoch).as_secs_f64() * 1e6;
+                let duration_us = start.elapsed().as_secs_f64() * 1e6;
+                push_event(span.name(), span.metadata().target(), start_us, duration_us);
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn chrome_trace_json() {
+        let profile = Profile {
+            events: vec![TraceEvent {
+                name: "create_\"geometry\"".to_string(),
+                category: "ldr_tools".to_string(),
+                thread_id: 2,
+                start_us: 1.5,
+                duration_us: 10.0,
+            }],
+            thread_names: vec![(2, "rayon 0".to_string())],
+        };
+
+        assert_eq!(
+            concat!(
+                "{\"traceEvents\":[\n",
+                r#"{"name":"thread_name","ph":"M","pid":1,"tid":2,"args":{"name":"rayon 0"}},"#,
+                "\n",
+                r#"{"name":"create_\"geometry\"","cat":"ldr_tools","ph":"X","pid":1,"tid":2,"ts":1.500,"dur":10.000}"#,
+                "\n],\"displayTimeUnit\":\"ms\"}\n"
+            ),
+            profile.chrome_trace_json()
+        );
+    }
+}
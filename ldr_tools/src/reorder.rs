@@ -0,0 +1,152 @@
+//! Reorder geometry buffers so faces sharing vertices are close together.
+//!
+//! Parts combine many primitives, so faces and vertices for the same region of the part
+//! can be far apart in the buffers after splitting edges or merging vertices.
+use std::collections::VecDeque;
+
+use crate::LDrawGeometry;
+
+/// Reorder the faces in breadth-first order over shared vertices
+/// and the vertices in the order they are first used by the faces.
+/// The per face data like colors and stud flags is reordered to match.
+pub fn reorder_for_locality(geometry: &mut LDrawGeometry) {
+    let face_order = face_order(
+        geometry.vertices.len(),
+        &geometry.vertex_indices,
+        &geometry.face_start_indices,
+        &geometry.face_sizes,
+    );
+
+    let mut vertex_indices = Vec::with_capacity(geometry.vertex_indices.len());
+    let mut face_start_indices = Vec::with_capacity(face_order.len());
+    let mut face_sizes = Vec::with_capacity(face_order.len());
+    for f in &face_order {
+        let start = geometry.face_start_indices[*f] as usize;
+        let size = geometry.face_sizes[*f] as usize;
+        face_start_indices.push(vertex_indices.len() as u32);
+        face_sizes.push(size as u32);
+        vertex_indices.extend_from_slice(&geometry.vertex_indices[start..start + size]);
+    }
+
+    // A single color applies to all faces.
+    if geometry.face_colors.len() == face_order.len() {
+        geometry.face_colors = face_order.iter().map(|f| geometry.face_colors[*f]).collect();
+    }
+    geometry.is_face_stud = face_order.iter().map(|f| geometry.is_face_stud[*f]).collect();
+
+    // Keep any vertices not used by faces at the end to preserve the edge indices.
+    let mut new_indices = vec![u32::MAX; geometry.vertices.len()];
+    let mut vertices = Vec::with_capacity(geometry.vertices.len());
+    let vertex_count = geometry.vertices.len() as u32;
+    for v in vertex_indices.iter().copied().chain(0..vertex_count) {
+        if new_indices[v as usize] == u32::MAX {
+            new_indices[v as usize] = vertices.len() as u32;
+            vertices.push(geometry.vertices[v as usize]);
+        }
+    }
+    for v in &mut vertex_indices {
+        *v = new_indices[*v as usize];
+    }
+    for edge in &mut geometry.edge_line_indices {
+        *edge = edge.map(|v| new_indices[v as usize]);
+    }
+
+    geometry.vertices = vertices;
+    geometry.vertex_indices = vertex_indices;
+    geometry.face_start_indices = face_start_indices;
+    geometry.face_sizes = face_sizes;
+}
+
+fn face_order(
+    vertex_count: usize,
+    vertex_indices: &[u32],
+    face_starts: &[u32],
+    face_sizes: &[u32],
+) -> Vec<usize> {
+    let face_vertices = move |f: usize| {
+        let start = face_starts[f] as usize;
+        &vertex_indices[start..start + face_sizes[f] as usize]
+    };
+
+    let mut vertex_faces = vec![Vec::new(); vertex_count];
+    for f in 0..face_starts.len() {
+        for v in face_vertices(f) {
+            vertex_faces[*v as usize].push(f);
+        }
+    }
+
+    // Start a new search from the next unvisited face for disconnected parts of the mesh.
+    let mut visited = vec![false; face_starts.len()];
+    let mut order = Vec::with_capacity(face_starts.len());
+    let mut queue = VecDeque::new();
+    for start in 0..face_starts.len() {
+        if visited[start] {
+            continue;
+        }
+        visited[start] = true;
+        queue.push_back(start);
+
+        while let Some(f) = queue.pop_front() {
+            order.push(f);
+            for v in face_vertices(f) {
+                for adjacent in &vertex_faces[*v as usize] {
+                    if !visited[*adjacent] {
+                        visited[*adjacent] = true;
+                        queue.push_back(*adjacent);
+                    }
+                }
+            }
+        }
+    }
+    order
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::{vec3, Vec3};
+
+    #[test]
+    fn reorder_for_locality_interleaved_quads() {
+        // The faces alternate between two separate quads of two triangles.
+        // 6 - 7    2 - 3
+        // | \ |    | \ |
+        // 4 - 5    0 - 1
+        let vertices: Vec<_> = (0..8).map(|i| vec3(i as f32, 0.0, 0.0)).collect();
+        let mut geometry = LDrawGeometry {
+            vertices: vertices.clone(),
+            vertex_indices: vec![4, 5, 6, 0, 1, 2, 6, 5, 7, 2, 1, 3],
+            face_start_indices: vec![0, 3, 6, 9],
+            face_sizes: vec![3, 3, 3, 3],
+            face_colors: vec![1, 2, 1, 2],
+            is_face_stud: vec![false, true, false, true],
+            edge_line_indices: vec![[0, 1]],
+            has_grainy_slopes: false,
+        };
+        let original = geometry.vertex_indices.clone();
+
+        reorder_for_locality(&mut geometry);
+
+        assert_eq!(vec![0, 1, 2, 2, 1, 3, 4, 5, 6, 6, 5, 7], geometry.vertex_indices);
+        assert_eq!(vec![0, 3, 6, 9], geometry.face_start_indices);
+        assert_eq!(vec![1, 1, 2, 2], geometry.face_colors);
+        assert_eq!(vec![false, false, true, true], geometry.is_face_stud);
+        assert_eq!(vec![[4, 5]], geometry.edge_line_indices);
+
+        // Each face uses the same positions in the new order.
+        let positions = |geometry: &LDrawGeometry| -> Vec<Vec3> {
+            geometry
+                .vertex_indices
+                .iter()
+                .map(|v| geometry.vertices[*v as usize])
+                .collect()
+        };
+        let expected: Vec<_> = [0, 6, 3, 9]
+            .iter()
+            .flat_map(|start| &original[*start..*start + 3])
+            .map(|v| vertices[*v as usize])
+            .collect();
+        assert_eq!(expected, positions(&geometry));
+    }
+}
@@ -0,0 +1,361 @@
+//! Spatial queries over the world bounds of instances.
+//!
+//! Regions and queries use the scene scale and axis convention from the [GeometrySettings].
+use std::collections::HashMap;
+
+use glam::{Mat4, Vec3, Vec4};
+use rayon::prelude::*;
+use rstar::{
+    primitives::{GeomWithData, Rectangle},
+    RTree, RTreeObject, SelectionFunction, AABB,
+};
+
+use crate::{
+    bounds::file_bounds, retain_mask, scene_bounds, Bounds, ColorCode, GeometryInitDescriptor,
+    GeometrySettings, InstanceStep, LDrawGeometry, LDrawNode, PointInstances,
+};
+
+/// A region of the scene for limiting imports or querying instances.
+#[derive(Debug, Clone, PartialEq)]
+pub enum Region {
+    /// An axis-aligned box.
+    Box(Bounds),
+    /// The space in front of every plane like the view frustum of a camera.
+    /// Each plane is `(normal, distance)` with `normal.dot(point) + distance >= 0.0` for points inside.
+    Frustum(Vec<Vec4>),
+}
+
+impl Region {
+    /// Returns `true` if `bounds` may overlap this region.
+    /// Frustum tests are conservative and may include boxes just outside the corners.
+    pub fn intersects(&self, bounds: &Bounds) -> bool {
+        match self {
+            Region::Box(b) => b.min.cmple(bounds.max).all() && bounds.min.cmple(b.max).all(),
+            Region::Frustum(planes) => frustum_intersects(planes, bounds),
+        }
+    }
+}
+
+fn frustum_intersects(planes: &[Vec4], bounds: &Bounds) -> bool {
+    planes.iter().all(|plane| {
+        // The box is outside if even its corner furthest along the normal is behind the plane.
+        let normal = plane.truncate();
+        let corner = Vec3::select(normal.cmpge(Vec3::ZERO), bounds.max, bounds.min);
+        normal.dot(corner) + plane.w >= 0.0
+    })
+}
+
+type InstanceEntry = GeomWithData<Rectangle<[f32; 3]>, (u32, u32)>;
+
+/// A bounding volume hierarchy over the world bounds of every instance.
+/// Queries return the key and index of each instance in `geometry_world_transforms`
+/// or `geometry_point_instances` sorted by key and then index.
+#[derive(Debug)]
+pub struct InstanceIndex {
+    keys: Vec<(String, ColorCode)>,
+    tree: RTree<InstanceEntry>,
+}
+
+impl InstanceIndex {
+    pub fn new(
+        geometry_bounds: &HashMap<String, Bounds>,
+        geometry_world_transforms: &HashMap<(String, ColorCode), Vec<Mat4>>,
+    ) -> Self {
+        let mut keys: Vec<_> = geometry_world_transforms.keys().cloned().collect();
+        keys.sort();
+
+        // Instances of geometry without any faces can never be visible.
+        let entries = keys
+            .iter()
+            .enumerate()
+            .filter_map(|(k, key)| {
+                let bounds = geometry_bounds.get(&key.0)?;
+                Some((k, bounds, &geometry_world_transforms[key]))
+            })
+            .flat_map(|(k, bounds, transforms)| {
+                transforms.iter().enumerate().map(move |(i, transform)| {
+                    let bounds = bounds.transform(transform);
+                    let rect =
+                        Rectangle::from_corners(bounds.min.to_array(), bounds.max.to_array());
+                    GeomWithData::new(rect, (k as u32, i as u32))
+                })
+            })
+            .collect();
+
+        Self {
+            keys,
+            tree: RTree::bulk_load(entries),
+        }
+    }
+
+    /// Create the index from decomposed instances like those in [crate::LDrawSceneInstancedPoints].
+    pub fn from_point_instances(
+        geometry_bounds: &HashMap<String, Bounds>,
+        geometry_point_instances: &HashMap<(String, ColorCode), PointInstances>,
+    ) -> Self {
+        let geometry_world_transforms = geometry_point_instances
+            .iter()
+            .map(|(key, instances)| (key.clone(), instances.transforms()))
+            .collect();
+        Self::new(geometry_bounds, &geometry_world_transforms)
+    }
+
+    /// The number of instances in the index.
+    pub fn len(&self) -> usize {
+        self.tree.size()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// The instances with world bounds intersecting `bounds`.
+    pub fn query_box(&self, bounds: &Bounds) -> Vec<(&(String, ColorCode), usize)> {
+        let envelope = AABB::from_corners(bounds.min.to_array(), bounds.max.to_array());
+        self.instances(self.tree.locate_in_envelope_intersecting(&envelope))
+    }
+
+    /// The instances with world bounds in front of every plane.
+    /// See [Region::Frustum] for the plane convention.
+    pub fn query_frustum(&self, planes: &[Vec4]) -> Vec<(&(String, ColorCode), usize)> {
+        self.instances(
+            self.tree
+                .locate_with_selection_function(SelectFrustum { planes }),
+        )
+    }
+
+    /// The instances with world bounds intersecting `region`.
+    pub fn query(&self, region: &Region) -> Vec<(&(String, ColorCode), usize)> {
+        match region {
+            Region::Box(bounds) => self.query_box(bounds),
+            Region::Frustum(planes) => self.query_frustum(planes),
+        }
+    }
+
+    fn instances<'a>(
+        &'a self,
+        entries: impl Iterator<Item = &'a InstanceEntry>,
+    ) -> Vec<(&'a (String, ColorCode), usize)> {
+        let mut ids: Vec<_> = entries.map(|entry| entry.data).collect();
+        ids.sort_unstable();
+        ids.into_iter()
+            .map(|(k, i)| (&self.keys[k as usize], i as usize))
+            .collect()
+    }
+}
+
+/// Skip any nodes of the tree that are entirely outside the frustum.
+struct SelectFrustum<'a> {
+    planes: &'a [Vec4],
+}
+
+impl SelectionFunction<InstanceEntry> for SelectFrustum<'_> {
+    fn should_unpack_parent(&self, envelope: &AABB<[f32; 3]>) -> bool {
+        frustum_intersects(self.planes, &envelope_bounds(envelope))
+    }
+
+    fn should_unpack_leaf(&self, leaf: &InstanceEntry) -> bool {
+        frustum_intersects(self.planes, &envelope_bounds(&leaf.envelope()))
+    }
+}
+
+fn envelope_bounds(envelope: &AABB<[f32; 3]>) -> Bounds {
+    Bounds {
+        min: envelope.lower().into(),
+        max: envelope.upper().into(),
+    }
+}
+
+/// The bounds of the vertices of each geometry.
+pub(crate) fn geometry_bounds(
+    geometry_cache: &HashMap<String, LDrawGeometry>,
+) -> HashMap<String, Bounds> {
+    geometry_cache
+        .par_iter()
+        .filter_map(|(name, geometry)| {
+            let bounds = Bounds::from_points(geometry.vertices.iter().copied())?;
+            Some((name.clone(), bounds))
+        })
+        .collect()
+}
+
+/// The bounds in LDUs of the faces for each descriptor before creating any geometry.
+fn descriptor_bounds(
+    geometry_descriptors: &HashMap<String, GeometryInitDescriptor>,
+    source_map: &weldr::SourceMap,
+) -> HashMap<String, Bounds> {
+    geometry_descriptors
+        .par_iter()
+        .filter_map(|(name, descriptor)| {
+            let bounds = file_bounds(descriptor.source_file, source_map)?;
+            Some((name.clone(), bounds))
+        })
+        .collect()
+}
+
+/// Remove instances outside `region` and any descriptors without remaining instances.
+/// The world transforms use LDUs and LDraw coordinates.
+#[tracing::instrument(skip_all)]
+pub(crate) fn retain_instances_in_region(
+    region: &Region,
+    source_map: &weldr::SourceMap,
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor>,
+    geometry_world_transforms: &mut HashMap<(String, ColorCode), Vec<Mat4>>,
+    geometry_instance_steps: &mut HashMap<(String, ColorCode), Vec<InstanceStep>>,
+    settings: &GeometrySettings,
+) {
+    let bounds = descriptor_bounds(geometry_descriptors, source_map);
+
+    let mut instance_counts: HashMap<String, usize> = HashMap::new();
+    for (key, transforms) in geometry_world_transforms.iter_mut() {
+        let inside: Vec<_> = transforms
+            .iter()
+            .map(|transform| {
+                bounds.get(&key.0).is_some_and(|b| {
+                    region.intersects(&scene_bounds(&b.transform(transform), settings))
+                })
+            })
+            .collect();
+
+        retain_mask(transforms, &inside);
+        if let Some(steps) = geometry_instance_steps.get_mut(key) {
+            retain_mask(steps, &inside);
+        }
+        *instance_counts.entry(key.0.clone()).or_default() += transforms.len();
+    }
+
+    geometry_world_transforms.retain(|_, transforms| !transforms.is_empty());
+    geometry_instance_steps.retain(|key, _| geometry_world_transforms.contains_key(key));
+    retain_counted_descriptors(geometry_descriptors, &instance_counts);
+}
+
+/// Remove nodes with geometry outside `region` and any nodes left without geometry or children.
+/// The node transforms use the scene scale and axis convention.
+#[tracing::instrument(skip_all)]
+pub(crate) fn retain_nodes_in_region(
+    region: &Region,
+    source_map: &weldr::SourceMap,
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor>,
+    root_node: &mut LDrawNode,
+    settings: &GeometrySettings,
+) {
+    let bounds: HashMap<_, _> = descriptor_bounds(geometry_descriptors, source_map)
+        .into_iter()
+        .map(|(name, b)| (name, scene_bounds(&b, settings)))
+        .collect();
+
+    let mut instance_counts = HashMap::new();
+    retain_node(root_node, &Mat4::IDENTITY, region, &bounds, &mut instance_counts);
+    retain_counted_descriptors(geometry_descriptors, &instance_counts);
+}
+
+fn retain_node(
+    node: &mut LDrawNode,
+    parent_transform: &Mat4,
+    region: &Region,
+    bounds: &HashMap<String, Bounds>,
+    instance_counts: &mut HashMap<String, usize>,
+) -> bool {
+    let world_transform = *parent_transform * node.transform;
+
+    if let Some(name) = &node.geometry_name {
+        let inside = bounds
+            .get(name)
+            .is_some_and(|b| region.intersects(&b.transform(&world_transform)));
+        if inside {
+            *instance_counts.entry(name.clone()).or_default() += 1;
+        } else {
+            node.geometry_name = None;
+        }
+    }
+
+    node.children.retain_mut(|child| {
+        retain_node(child, &world_transform, region, bounds, instance_counts)
+    });
+
+    node.geometry_name.is_some() || !node.children.is_empty()
+}
+
+fn retain_counted_descriptors(
+    geometry_descriptors: &mut HashMap<String, GeometryInitDescriptor>,
+    instance_counts: &HashMap<String, usize>,
+) {
+    // Adaptive resolution should only consider the imported instances.
+    geometry_descriptors.retain(|name, descriptor| {
+        descriptor.instance_count = instance_counts.get(name).copied().unwrap_or_default();
+        descriptor.instance_count > 0
+    });
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    use glam::{vec3, vec4};
+
+    fn unit_bounds() -> Bounds {
+        Bounds {
+            min: Vec3::ZERO,
+            max: Vec3::ONE,
+        }
+    }
+
+    #[test]
+    fn region_intersects_box() {
+        let region = Region::Box(Bounds {
+            min: vec3(0.5, 0.5, 0.5),
+            max: vec3(2.0, 2.0, 2.0),
+        });
+        assert!(region.intersects(&unit_bounds()));
+        assert!(!region.intersects(&Bounds {
+            min: vec3(-1.0, 0.0, 0.0),
+            max: vec3(0.0, 1.0, 1.0)
+        }));
+    }
+
+    #[test]
+    fn region_intersects_frustum() {
+        // The half space x >= 0.5.
+        let region = Region::Frustum(vec![vec4(1.0, 0.0, 0.0, -0.5)]);
+        assert!(region.intersects(&unit_bounds()));
+        assert!(!region.intersects(&Bounds {
+            min: vec3(-1.0, 0.0, 0.0),
+            max: vec3(0.25, 1.0, 1.0)
+        }));
+    }
+
+    #[test]
+    fn instance_index_queries() {
+        let geometry_bounds = [("a.dat".to_string(), unit_bounds())].into();
+        let translations = [vec3(0.0, 0.0, 0.0), vec3(10.0, 0.0, 0.0), vec3(20.0, 0.0, 0.0)];
+        let geometry_world_transforms = [
+            (
+                ("a.dat".to_string(), 1),
+                translations
+                    .iter()
+                    .map(|t| Mat4::from_translation(*t))
+                    .collect::<Vec<_>>(),
+            ),
+            (("b.dat".to_string(), 1), vec![Mat4::IDENTITY]),
+        ]
+        .into();
+
+        // Geometry without bounds is not indexed.
+        let index = InstanceIndex::new(&geometry_bounds, &geometry_world_transforms);
+        assert_eq!(3, index.len());
+
+        let key = ("a.dat".to_string(), 1);
+        assert_eq!(
+            vec![(&key, 1), (&key, 2)],
+            index.query_box(&Bounds {
+                min: vec3(10.5, 0.0, 0.0),
+                max: vec3(30.0, 1.0, 1.0)
+            })
+        );
+        assert_eq!(
+            vec![(&key, 0)],
+            index.query_frustum(&[vec4(-1.0, 0.0, 0.0, 5.0)])
+        );
+        assert!(index.query_frustum(&[vec4(0.0, 1.0, 0.0, -2.0)]).is_empty());
+    }
+}
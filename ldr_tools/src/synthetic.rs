@@ -0,0 +1,355 @@
+//! Generate a small self-consistent LDraw library and models for testing.
+//!
+//! The generated files are not accurate LEGO geometry,
+//! but they use the same folder layout, primitives, and stud files as the official library.
+//! This allows benchmarking and testing without an LDraw installation.
+use std::{fmt::Write as _, path::Path};
+
+/// The parts written by [write_library] that can be referenced by models.
+pub const SYNTHETIC_PARTS: &[&str] = &[
+    "synth-brick-1x1.dat",
+    "synth-brick-1x2.dat",
+    "synth-brick-1x4.dat",
+    "synth-brick-2x2.dat",
+    "synth-brick-2x4.dat",
+    "synth-plate-1x2.dat",
+    "synth-plate-2x2.dat",
+    "synth-plate-2x4.dat",
+    "3039.dat",
+];
+
+/// The color codes defined in the generated `LDConfig.ldr`.
+pub const SYNTHETIC_COLORS: &[u32] = &[0, 1, 2, 4, 14, 15, 47, 256, 383];
+
+const LDCONFIG: &str = "\
+0 LDraw.org Configuration File
+0 Name: LDConfig.ldr
+0 !COLOUR Black CODE 0 VALUE #1B2A34 EDGE #808080
+0 !COLOUR Blue CODE 1 VALUE #1E5AA8 EDGE #333333
+0 !COLOUR Green CODE 2 VALUE #00852B EDGE #333333
+0 !COLOUR Red CODE 4 VALUE #B40000 EDGE #333333
+0 !COLOUR Yellow CODE 14 VALUE #FAC80A EDGE #333333
+0 !COLOUR White CODE 15 VALUE #F4F4F4 EDGE #333333
+0 !COLOUR Main_Colour CODE 16 VALUE #7F7F7F EDGE #333333
+0 !COLOUR Edge_Colour CODE 24 VALUE #7F7F7F EDGE #333333
+0 !COLOUR Trans_Clear CODE 47 VALUE #FCFCFC EDGE #C3C3C3 ALPHA 128
+0 !COLOUR Rubber_Black CODE 256 VALUE #212121 EDGE #595959 RUBBER
+0 !COLOUR Chrome_Silver CODE 383 VALUE #E0E0E0 EDGE #A4A4A4 CHROME
+";
+
+/// Settings for the models generated by [write_model].
+#[derive(Debug, Clone)]
+pub struct SyntheticModelSettings {
+    /// The approximate number of parts in the model.
+    /// The actual count is rounded up to fill each submodel.
+    pub part_count: usize,
+    /// The number of nested submodels between the main model and the parts.
+    pub submodel_depth: usize,
+    /// The number of times each submodel is referenced by its parent.
+    pub submodel_reuse: usize,
+}
+
+impl Default for SyntheticModelSettings {
+    fn default() -> Self {
+        Self {
+            part_count: 1000,
+            submodel_depth: 0,
+            submodel_reuse: 1,
+        }
+    }
+}
+
+/// Write a small LDraw library with `LDConfig.ldr`, primitives, studs, and parts to `path`.
+/// Primitives are written at low, normal, and high resolution to `p/8`, `p`, and `p/48`.
+pub fn write_library<P: AsRef<Path>>(path: P) -> std::io::Result<()> {
+    let path = path.as_ref();
+    let p = path.join("p");
+    let parts = path.join("parts");
+    let subparts = parts.join("s");
+    for dir in [&p, &p.join("8"), &p.join("48"), &parts, &subparts] {
+        std::fs::create_dir_all(dir)?;
+    }
+
+    std::fs::write(path.join("LDConfig.ldr"), LDCONFIG)?;
+
+    for (dir, segments) in [(p.join("8"), 8), (p.clone(), 16), (p.join("48"), 48)] {
+        std::fs::write(dir.join("4-4cyli.dat"), cylinder(segments))?;
+        std::fs::write(dir.join("4-4disc.dat"), disc(segments))?;
+        std::fs::write(dir.join("4-4edge.dat"), edge(segments))?;
+    }
+    std::fs::write(p.join("box5.dat"), BOX5)?;
+
+    for (name, logo_quads) in [
+        ("stud.dat", 0),
+        ("stud-logo.dat", 0),
+        ("stud-logo3.dat", 8),
+        ("stud-logo4.dat", 32),
+        ("stud-high-contrast.dat", 0),
+    ] {
+        std::fs::write(p.join(name), stud(name, logo_quads, false))?;
+    }
+    for (name, logo_quads) in [
+        ("stud2.dat", 0),
+        ("stud2-logo.dat", 0),
+        ("stud2-logo3.dat", 8),
+        ("stud2-logo4.dat", 32),
+        ("stud2-high-contrast.dat", 0),
+    ] {
+        std::fs::write(p.join(name), stud(name, logo_quads, true))?;
+    }
+    std::fs::write(p.join("stud4.dat"), STUD4)?;
+
+    for (width, length) in [(1, 1), (1, 2), (1, 4), (2, 2), (2, 4)] {
+        let name = format!("synth-brick-{width}x{length}.dat");
+        std::fs::write(parts.join(&name), brick(&name, width, length, 24))?;
+    }
+    for (width, length) in [(1, 2), (2, 2), (2, 4)] {
+        let name = format!("synth-plate-{width}x{length}.dat");
+        std::fs::write(parts.join(&name), brick(&name, width, length, 8))?;
+    }
+    std::fs::write(subparts.join("3039s01.dat"), SLOPE_SUBPART)?;
+    std::fs::write(parts.join("3039.dat"), SLOPE)?;
+
+    Ok(())
+}
+
+/// Write an MPD model referencing the parts from [write_library] to `path`.
+///
+/// Parts are placed in a grid in the most deeply nested submodel
+/// with a `0 STEP` after every 10 parts.
+/// Each submodel is referenced [submodel_reuse](struct.SyntheticModelSettings.html#structfield.submodel_reuse)
+/// times by its parent to test instancing.
+pub fn write_model<P: AsRef<Path>>(
+    path: P,
+    settings: &SyntheticModelSettings,
+) -> std::io::Result<()> {
+    std::fs::write(path, model(settings))
+}
+
+fn model(settings: &SyntheticModelSettings) -> String {
+    let reuse = settings.submodel_reuse.max(1);
+    let instances = reuse.pow(settings.submodel_depth as u32);
+    let leaf_part_count = (settings.part_count + instances - 1) / instances;
+
+    // The names from the main model to the model containing the parts.
+    let names: Vec<_> = std::iter::once("main.ldr".to_string())
+        .chain((1..=settings.submodel_depth).map(|i| format!("submodel{i}.ldr")))
+        .collect();
+
+    // Space parts far enough apart to not overlap.
+    let spacing = 100.0;
+    let columns = (leaf_part_count as f32).sqrt().ceil().max(1.0) as usize;
+
+    let mut output = String::new();
+    let mut extent = columns as f32 * spacing;
+    let mut submodels = Vec::new();
+
+    // Write the models from the innermost submodel outwards.
+    let mut leaf = format!("0 FILE {}\n0 Synthetic Model\n", names.last().unwrap());
+    for i in 0..leaf_part_count {
+        let part = SYNTHETIC_PARTS[i % SYNTHETIC_PARTS.len()];
+        let color = SYNTHETIC_COLORS[(i * 7) % SYNTHETIC_COLORS.len()];
+        let x = (i % columns) as f32 * spacing;
+        let z = (i / columns) as f32 * spacing;
+        writeln!(&mut leaf, "1 {color} {x} 0 {z} 1 0 0 0 1 0 0 0 1 {part}").unwrap();
+        if (i + 1) % 10 == 0 {
+            leaf.push_str("0 STEP\n");
+        }
+    }
+    submodels.push(leaf);
+
+    for level in (0..settings.submodel_depth).rev() {
+        let mut text = format!("0 FILE {}\n", names[level]);
+        for i in 0..reuse {
+            // Alternate between the X and Z axes to keep the model roughly square.
+            let offset = i as f32 * (extent + spacing);
+            let (x, z) = if level % 2 == 0 {
+                (offset, 0.0)
+            } else {
+                (0.0, offset)
+            };
+            writeln!(
+                &mut text,
+                "1 16 {x} 0 {z} 1 0 0 0 1 0 0 0 1 {}",
+                names[level + 1]
+            )
+            .unwrap();
+            text.push_str("0 STEP\n");
+        }
+        extent = reuse as f32 * (extent + spacing);
+        submodels.push(text);
+    }
+
+    // The main model should be the first file.
+    for text in submodels.iter().rev() {
+        output.push_str(text);
+        output.push_str("0 NOFILE\n");
+    }
+    output
+}
+
+fn circle_point(i: usize, segments: usize) -> (f32, f32) {
+    let angle = i as f32 / segments as f32 * std::f32::consts::TAU;
+    (angle.cos(), angle.sin())
+}
+
+fn cylinder(segments: usize) -> String {
+    let mut output = format!("0 Cylinder 1.0 ({segments} segments)\n0 BFC CERTIFY CCW\n");
+    for i in 0..segments {
+        let (x0, z0) = circle_point(i, segments);
+        let (x1, z1) = circle_point(i + 1, segments);
+        writeln!(
+            &mut output,
+            "4 16 {x1} 1 {z1} {x0} 1 {z0} {x0} 0 {z0} {x1} 0 {z1}"
+        )
+        .unwrap();
+    }
+    output
+}
+
+fn disc(segments: usize) -> String {
+    let mut output = format!("0 Disc 1.0 ({segments} segments)\n0 BFC CERTIFY CCW\n");
+    for i in 0..segments {
+        let (x0, z0) = circle_point(i, segments);
+        let (x1, z1) = circle_point(i + 1, segments);
+        writeln!(&mut output, "3 16 0 0 0 {x1} 0 {z1} {x0} 0 {z0}").unwrap();
+    }
+    output
+}
+
+fn edge(segments: usize) -> String {
+    let mut output = format!("0 Circle 1.0 ({segments} segments)\n0 BFC CERTIFY CCW\n");
+    for i in 0..segments {
+        let (x0, z0) = circle_point(i, segments);
+        let (x1, z1) = circle_point(i + 1, segments);
+        writeln!(&mut output, "2 24 {x0} 0 {z0} {x1} 0 {z1}").unwrap();
+    }
+    output
+}
+
+fn stud(name: &str, logo_quads: usize, hollow: bool) -> String {
+    let mut output = format!("0 Stud\n0 Name: {name}\n0 BFC CERTIFY CCW\n");
+    output.push_str("1 16 0 0 0 6 0 0 0 -4 0 0 0 6 4-4cyli.dat\n");
+    output.push_str("1 16 0 -4 0 6 0 0 0 1 0 0 0 6 4-4disc.dat\n");
+    output.push_str("1 16 0 0 0 6 0 0 0 1 0 0 0 6 4-4edge.dat\n");
+    output.push_str("1 16 0 -4 0 6 0 0 0 1 0 0 0 6 4-4edge.dat\n");
+    if hollow {
+        output.push_str("0 BFC INVERTNEXT\n");
+        output.push_str("1 16 0 0 0 4 0 0 0 -4 0 0 0 4 4-4cyli.dat\n");
+    }
+
+    // Add some small raised faces to approximate the cost of more detailed logos.
+    for i in 0..logo_quads {
+        let x = (i % 4) as f32 - 2.0;
+        let z = (i / 4) as f32 - 2.0;
+        writeln!(
+            &mut output,
+            "4 16 {x} -4.1 {z} {} -4.1 {z} {} -4.1 {} {x} -4.1 {}",
+            x + 0.5,
+            x + 0.5,
+            z + 0.5,
+            z + 0.5
+        )
+        .unwrap();
+    }
+    output
+}
+
+fn brick(name: &str, width: usize, length: usize, height: usize) -> String {
+    let mut output = format!("0 Synthetic Brick {width} x {length}\n0 Name: {name}\n");
+    output.push_str("0 !LDRAW_ORG Part UNOFFICIAL\n0 BFC CERTIFY CCW\n");
+
+    // The part origin is at the center of the top face like official parts.
+    let half_x = width as f32 * 10.0;
+    let half_z = length as f32 * 10.0;
+    writeln!(
+        &mut output,
+        "1 16 0 0 0 {half_x} 0 0 0 {height} 0 0 0 {half_z} box5.dat"
+    )
+    .unwrap();
+
+    for i in 0..width {
+        for j in 0..length {
+            let x = i as f32 * 20.0 - half_x + 10.0;
+            let z = j as f32 * 20.0 - half_z + 10.0;
+            writeln!(&mut output, "1 16 {x} 0 {z} 1 0 0 0 1 0 0 0 1 stud.dat").unwrap();
+        }
+    }
+
+    // Tubes on the bottom between each group of four studs.
+    if height > 8 {
+        for i in 1..width {
+            for j in 1..length {
+                let x = i as f32 * 20.0 - half_x;
+                let z = j as f32 * 20.0 - half_z;
+                writeln!(
+                    &mut output,
+                    "1 16 {x} 4 {z} 1 0 0 0 {} 0 0 0 1 stud4.dat",
+                    height - 4
+                )
+                .unwrap();
+            }
+        }
+    }
+    output
+}
+
+const BOX5: &str = "\
+0 Box with 5 Faces
+0 Name: box5.dat
+0 BFC CERTIFY CCW
+2 24 1 0 1 -1 0 1
+2 24 -1 0 1 -1 0 -1
+2 24 -1 0 -1 1 0 -1
+2 24 1 0 -1 1 0 1
+2 24 1 1 1 -1 1 1
+2 24 -1 1 1 -1 1 -1
+2 24 -1 1 -1 1 1 -1
+2 24 1 1 -1 1 1 1
+2 24 1 0 1 1 1 1
+2 24 -1 0 1 -1 1 1
+2 24 -1 0 -1 -1 1 -1
+2 24 1 0 -1 1 1 -1
+4 16 -1 0 1 1 0 1 1 0 -1 -1 0 -1
+4 16 -1 1 1 1 1 1 1 0 1 -1 0 1
+4 16 -1 1 -1 -1 1 1 -1 0 1 -1 0 -1
+4 16 1 1 -1 -1 1 -1 -1 0 -1 1 0 -1
+4 16 1 1 1 1 1 -1 1 0 -1 1 0 1
+";
+
+const STUD4: &str = "\
+0 Stud Tube Open
+0 Name: stud4.dat
+0 BFC CERTIFY CCW
+1 16 0 0 0 8 0 0 0 1 0 0 0 8 4-4cyli.dat
+0 BFC INVERTNEXT
+1 16 0 0 0 6 0 0 0 1 0 0 0 6 4-4cyli.dat
+1 16 0 1 0 8 0 0 0 1 0 0 0 8 4-4edge.dat
+1 16 0 1 0 6 0 0 0 1 0 0 0 6 4-4edge.dat
+";
+
+const SLOPE_SUBPART: &str = "\
+0 ~Slope Brick 45 2 x 2 Faces
+0 Name: 3039s01.dat
+0 BFC CERTIFY CCW
+4 16 -20 0 -20 -20 0 -10 20 0 -10 20 0 -20
+4 16 -20 0 -10 -20 20 20 20 20 20 20 0 -10
+4 16 -20 20 20 -20 24 20 20 24 20 20 20 20
+4 16 -20 0 -20 20 0 -20 20 24 -20 -20 24 -20
+4 16 -20 0 -20 -20 24 -20 -20 24 20 -20 20 20
+3 16 -20 0 -20 -20 20 20 -20 0 -10
+4 16 20 0 -20 20 20 20 20 24 20 20 24 -20
+3 16 20 0 -20 20 0 -10 20 20 20
+2 24 -20 0 -10 20 0 -10
+2 24 -20 20 20 20 20 20
+2 24 -20 0 -20 20 0 -20
+";
+
+const SLOPE: &str = "\
+0 Slope Brick 45 2 x 2
+0 Name: 3039.dat
+0 BFC CERTIFY CCW
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 3039s01.dat
+1 16 -10 0 -15 1 0 0 0 1 0 0 0 1 stud.dat
+1 16 10 0 -15 1 0 0 0 1 0 0 0 1 stud.dat
+";
@@ -1,5 +1,7 @@
 import bpy
 from . import operator
+from . import file_watcher
+from . import viewport_proxies
 
 bl_info = {
     "name": "ldr_tools_blender",
@@ -37,7 +39,12 @@ def register():
 
     bpy.types.TOPBAR_MT_file_import.append(menuImport)
 
+    viewport_proxies.register()
+
 def unregister():
+    file_watcher.unwatch_all()
+    viewport_proxies.unregister()
+
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
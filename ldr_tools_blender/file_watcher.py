@@ -0,0 +1,50 @@
+import os
+from typing import Callable
+
+import bpy
+
+# The number of seconds between checking watched files for changes.
+WATCH_INTERVAL = 1.0
+
+# The root object name, update callback, last imported modified time,
+# and last seen modified time for each file.
+watched_files: dict[str, list] = {}
+
+
+def watch_file(filepath: str, root_name: str, update: Callable[[], None]):
+    # Call update whenever the file changes until the imported root object is removed.
+    mtime = os.path.getmtime(filepath)
+    watched_files[os.path.abspath(filepath)] = [root_name, update, mtime, mtime]
+    if not bpy.app.timers.is_registered(check_files):
+        bpy.app.timers.register(check_files, first_interval=WATCH_INTERVAL)
+
+
+def unwatch_all():
+    watched_files.clear()
+    if bpy.app.timers.is_registered(check_files):
+        bpy.app.timers.unregister(check_files)
+
+
+def check_files():
+    for filepath, state in list(watched_files.items()):
+        root_name, update, imported_mtime, seen_mtime = state
+        if root_name not in bpy.data.objects:
+            del watched_files[filepath]
+            continue
+
+        try:
+            mtime = os.path.getmtime(filepath)
+        except OSError:
+            continue
+
+        # Wait until the file stops changing to avoid reading a partially saved file.
+        state[3] = mtime
+        if mtime != imported_mtime and mtime == seen_mtime:
+            state[2] = mtime
+            try:
+                update()
+            except Exception as e:
+                print(f'Error updating {filepath}: {e}')
+
+    # Returning None stops the timer.
+    return WATCH_INTERVAL if watched_files else None
@@ -4,18 +4,25 @@ import mathutils
 from mathutils import Vector
 import math
 import os
+from types import SimpleNamespace
 
 # TODO: Create a pyi type stub file?
 from . import ldr_tools_py
 
 from .ldr_tools_py import LDrawNode, LDrawGeometry, LDrawColor, GeometrySettings
 
-from .material import get_material
+from .material import get_material, get_instance_color_material, instance_color_values, INSTANCE_COLOR_ATTRIBUTES
 from .environment import set_enviroment, selectLDR
+from .profiling import profile_import, phase
+from .memory_report import import_memory_report
+from . import snapshot
+from . import viewport_proxies
 
 # TODO: Add type hints for all functions.
 
-global op
+# The operator for reporting warnings set by import_ldraw.
+# Scripts calling the import functions directly only print messages to the console.
+op = None
 
 def import_ldraw(
         operator: bpy.types.Operator,
@@ -26,37 +33,159 @@ def import_ldraw(
         add_gap_between_parts: bool,
         primitive_resolution: str,
         stud_type: str,
+        cull_hidden_studs: bool,
+        remove_duplicate_parts: bool,
+        mark_sharp_edges: bool,
+        merge_coplanar_faces: bool,
+        viewport_proxies: bool,
+        submodel: str,
+        max_step: int,
+        frames_per_step: int,
+        share_part_meshes: bool,
+        use_snapshot_cache: bool,
+        geometry_batch_mb: int,
         ground_object: bool,
         unofficial_parts: bool,
         custom_mesh_path: str,
         environment_settings: bool,
+        update_existing: bool = False,
     ):
     global op
     op = operator
+    with profile_import():
+        return import_ldraw_profiled(filepath, ldraw_path, additional_paths, instance_type, add_gap_between_parts,
+                              primitive_resolution, stud_type, cull_hidden_studs, remove_duplicate_parts, mark_sharp_edges, merge_coplanar_faces, viewport_proxies, submodel, max_step,
+                              frames_per_step, share_part_meshes, use_snapshot_cache, geometry_batch_mb, ground_object, unofficial_parts,
+                              custom_mesh_path,
+                              environment_settings, update_existing)
+
+def import_ldraw_profiled(
+        filepath: str,
+        ldraw_path: str,
+        additional_paths: list[str],
+        instance_type: str,
+        add_gap_between_parts: bool,
+        primitive_resolution: str,
+        stud_type: str,
+        cull_hidden_studs: bool,
+        remove_duplicate_parts: bool,
+        mark_sharp_edges: bool,
+        merge_coplanar_faces: bool,
+        viewport_proxies: bool,
+        submodel: str,
+        max_step: int,
+        frames_per_step: int,
+        share_part_meshes: bool,
+        use_snapshot_cache: bool,
+        geometry_batch_mb: int,
+        ground_object: bool,
+        unofficial_parts: bool,
+        custom_mesh_path: str,
+        environment_settings: bool,
+        update_existing: bool,
+    ):
     color_by_code = ldr_tools_py.load_color_table(ldraw_path)
-    settings = GeometrySettings()
-    settings.primitive_resolution = match_primitive(primitive_resolution)
-    settings.stud_type = match_stud(stud_type)
-    settings.triangulate = False
-    settings.add_gap_between_parts = add_gap_between_parts
-    settings.scene_scale = 1.0
-    settings.unofficial_parts = unofficial_parts
-    # Required for calculated normals.
-    settings.weld_vertices = True
+    settings = create_settings(add_gap_between_parts, primitive_resolution, stud_type, cull_hidden_studs,
+                               remove_duplicate_parts, mark_sharp_edges, merge_coplanar_faces, submodel, max_step,
+                               unofficial_parts)
+    # Proxies aren't created for merged meshes or geometry batches.
+    settings.viewport_proxies = viewport_proxies and (
+        instance_type == 'LinkedDuplicates' or (instance_type == 'GeometryNodes' and geometry_batch_mb == 0))
 
     obj_name = os.path.split(filepath)
 
+    # Only apply the changes since the previous import of this file.
+    # Meshes are reused, so only added parts create new meshes.
+    previous_root = find_previous_import(filepath, instance_type) if update_existing else None
+    if previous_root is not None and instance_type == 'LinkedDuplicates':
+        return update_objects(previous_root, filepath, ldraw_path, additional_paths, custom_mesh_path,
+                              color_by_code, settings, use_snapshot_cache)
+    elif previous_root is not None and instance_type == 'GeometryNodes' and not share_part_meshes:
+        return update_instanced(previous_root, filepath, ldraw_path, additional_paths, custom_mesh_path,
+                                color_by_code, settings, frames_per_step, use_snapshot_cache)
+    elif previous_root is not None:
+        # Merged meshes and shared part meshes can't be updated in place.
+        remove_import(previous_root)
+
     # TODO: Add an option to make the lowest point have a height of 0 using obj.dimensions?
     if instance_type == 'GeometryNodes' and obj_name[1] != "":
-        import_instanced(filepath, ldraw_path, additional_paths, custom_mesh_path, color_by_code, settings, environment_settings, ground_object)
+        return import_instanced(filepath, ldraw_path, additional_paths, custom_mesh_path, color_by_code, settings, environment_settings, ground_object, frames_per_step, use_snapshot_cache, geometry_batch_mb, share_part_meshes)
     elif instance_type == 'LinkedDuplicates' and obj_name[1] != "":
-        import_objects(filepath, ldraw_path, additional_paths, custom_mesh_path,
+        return import_objects(filepath, ldraw_path, additional_paths, custom_mesh_path,
+                color_by_code, settings, environment_settings, ground_object, use_snapshot_cache)
+    elif instance_type == 'Merged' and obj_name[1] != "":
+        return import_merged(filepath, ldraw_path, additional_paths, custom_mesh_path,
                 color_by_code, settings, environment_settings, ground_object)
     else:
-        set_enviroment(
-            environment_settings,
-            obj_name[1]
-        )
+        with phase('set_enviroment'):
+            set_enviroment(
+                environment_settings,
+                obj_name[1]
+            )
+
+def import_ldraw_files(
+        operator: bpy.types.Operator,
+        filepaths: list[str],
+        ldraw_path: str,
+        additional_paths: list[str],
+        add_gap_between_parts: bool,
+        primitive_resolution: str,
+        stud_type: str,
+        cull_hidden_studs: bool,
+        remove_duplicate_parts: bool,
+        mark_sharp_edges: bool,
+        merge_coplanar_faces: bool,
+        max_step: int,
+        frames_per_step: int,
+        share_part_meshes: bool,
+        ground_object: bool,
+        unofficial_parts: bool,
+        custom_mesh_path: str,
+        environment_settings: bool,
+    ):
+    # Import multiple files like the separate models of a layout with geometry node instancing.
+    global op
+    op = operator
+    with profile_import():
+        color_by_code = ldr_tools_py.load_color_table(ldraw_path)
+        # Submodel names are specific to a single file.
+        settings = create_settings(add_gap_between_parts, primitive_resolution, stud_type, cull_hidden_studs,
+                                   remove_duplicate_parts, mark_sharp_edges, merge_coplanar_faces, '', max_step,
+                                   unofficial_parts)
+        return import_instanced_files(filepaths, ldraw_path, additional_paths, custom_mesh_path, color_by_code,
+                                      settings, environment_settings, ground_object, frames_per_step, share_part_meshes)
+
+def create_settings(
+        add_gap_between_parts: bool,
+        primitive_resolution: str,
+        stud_type: str,
+        cull_hidden_studs: bool,
+        remove_duplicate_parts: bool,
+        mark_sharp_edges: bool,
+        merge_coplanar_faces: bool,
+        submodel: str,
+        max_step: int,
+        unofficial_parts: bool,
+    ) -> GeometrySettings:
+    settings = GeometrySettings()
+    settings.primitive_resolution = match_primitive(primitive_resolution)
+    settings.stud_type = match_stud(stud_type)
+    settings.triangulate = False
+    settings.add_gap_between_parts = add_gap_between_parts
+    # Blender uses meters with Z up instead of LDraw units with -Y up.
+    settings.scene_scale = 0.01
+    settings.axis_convention = ldr_tools_py.AxisConvention.ZUp
+    settings.unofficial_parts = unofficial_parts
+    settings.cull_hidden_studs = cull_hidden_studs
+    settings.remove_duplicate_instances = remove_duplicate_parts
+    settings.mark_sharp_edges = mark_sharp_edges
+    settings.merge_coplanar_faces = merge_coplanar_faces
+    # An empty submodel imports the main model and a negative step imports all steps.
+    settings.submodels = [submodel] if submodel else []
+    settings.max_step = max_step if max_step >= 0 else None
+    # Required for calculated normals.
+    settings.weld_vertices = True
+    return settings
 
 def match_stud(stud_type) -> any:
     match stud_type:
@@ -71,37 +200,55 @@ def match_primitive(primitive_resolution) -> any:
         case 'Low': return ldr_tools_py.PrimitiveResolution.Low
         case 'Normal': return ldr_tools_py.PrimitiveResolution.Normal
         case 'High': return ldr_tools_py.PrimitiveResolution.High
+        case 'Adaptive': return ldr_tools_py.PrimitiveResolution.Adaptive
         case _: return ldr_tools_py.PrimitiveResolution.Normal
 
-def import_objects(filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool):
+def load_scene(load_fn, use_snapshot_cache: bool, *args):
+    # Reuse the scene from a snapshot of an identical previous import if enabled.
+    if use_snapshot_cache:
+        return snapshot.load_cached(load_fn, *args)
+    return load_fn(*args)
+
+def report_duplicates(scene):
+    # Duplicates are usually parts pasted twice in an editor, so list them to fix the source file.
+    duplicates = getattr(scene, 'duplicate_instances', [])
+    submodel_names = getattr(scene, 'submodel_names', [])
+    for duplicate in duplicates:
+        x, y, z = duplicate.transform[3][:3]
+        submodel = submodel_names[duplicate.submodel] if duplicate.submodel < len(submodel_names) else ''
+        print(f'Removed {duplicate.count - 1} duplicate {duplicate.name} with color {duplicate.color} at ({x}, {y}, {z}) in {submodel}')
+
+    if duplicates and op is not None:
+        removed = sum(duplicate.count - 1 for duplicate in duplicates)
+        op.report({'WARNING'}, f'Removed {removed} duplicate parts. See the console for their locations.')
+
+def import_objects(filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool, use_snapshot_cache: bool = False):
     # Create an object for each part in the scene.
     # This still uses instances the mesh data blocks for reduced memory usage.
     blender_mesh_cache = {}
-    scene = ldr_tools_py.load_file(
-        filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
-
-    root_obj = add_nodes(scene.root_node, scene.geometry_cache,
-                         blender_mesh_cache, color_by_code)
+    proxy_mesh_cache = {}
+    with phase('load_file'):
+        scene = load_scene(ldr_tools_py.load_file, use_snapshot_cache,
+            filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    with phase('add_nodes'):
+        root_obj = add_nodes(scene.root_node, scene.geometry_cache, scene.proxy_geometry_cache,
+                             blender_mesh_cache, proxy_mesh_cache, color_by_code, ObjectNames())
     
     o_name = os.path.split(filepath)
     root_obj.name = o_name[1]
-
-    # Account for Blender having a different coordinate system.
-    # Apply a scene scale to match the previous version.
-    # TODO: make scene scale configurable.
-    root_obj.rotation_euler = mathutils.Euler(
-        (math.radians(-90.0), 0.0, 0.0), 'XYZ')
-    root_obj.scale = (0.01, 0.01, 0.01)
+    tag_import_root(root_obj, filepath, 'LinkedDuplicates')
 
     if ground_object:
-        bpy.context.view_layer.update()
-        objectOnGround(root_obj.name)
-    
-    # Normalise object and child object scales to 1.0
-    applyScaleTransform(root_obj.name)
+        with phase('ground_object'):
+            bpy.context.view_layer.update()
+            objectOnGround(root_obj.name)
 
     # check and set any environment properties 
-    set_enviroment( environment_settings,  root_obj.name)
+    with phase('set_enviroment'):
+        set_enviroment( environment_settings,  root_obj.name)
+
+    return import_memory_report(scene, list(blender_mesh_cache.values()) + list(proxy_mesh_cache.values()))
 
 def objectOnGround(obj):
     bpy.ops.object.select_all(action='DESELECT')
@@ -118,130 +265,606 @@ def objectOnGround(obj):
         minz = min(bbox_verts)
         bpy.context.scene.objects[obj].matrix_world.translation.z -= minz
     except Exception:
-        op.report({"ERROR"}, "An exception occurred - No vertices found")
+        if op is not None:
+            op.report({"ERROR"}, "An exception occurred - No vertices found")
         print("An exception occurred - No vertices found")
 
     bpy.ops.object.select_all(action='DESELECT')
 
-def applyScaleTransform(root_obj):
-    bpy.ops.object.select_all(action='DESELECT')
-    obj = bpy.context.scene.objects[root_obj]
-    obj.select_set(True)
-    selectLDR(root_obj, ["MESH","EMPTY"])
-    # apply Scale transform to Delta - Avoids having to make objects single user
-    bpy.ops.object.transforms_to_deltas(mode="SCALE")
-    bpy.ops.object.select_all(action='DESELECT')
 
-def add_nodes(node: LDrawNode,
-              geometry_cache: dict[str, LDrawGeometry],
-              blender_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
-              color_by_code: dict[str, LDrawColor]):
+# The maximum length in bytes for Blender object names.
+MAX_OBJECT_NAME_BYTES = 63
 
-    if node.geometry_name is not None:
-        geometry = geometry_cache[node.geometry_name]
-        
-        # Cache meshes to optimize import times and instance mesh data.
-        # Linking an existing mesh data block greatly reduces memory usage.
-        mesh_key = (node.geometry_name, node.current_color)
 
-        blender_mesh = blender_mesh_cache.get(mesh_key)
-        if blender_mesh is None:
-            mesh = create_colored_mesh_from_geometry(
-                node.name, node.current_color, color_by_code, geometry)
+def split_object_name(name: str):
+    # Split names like 3001.dat#0042 into the prefix and count.
+    prefix, separator, count = name.rpartition('#')
+    if separator and count.isdigit():
+        return prefix, int(count)
+    return name, None
 
-            blender_mesh_cache[mesh_key] = mesh
-            obj = bpy.data.objects.new(node.name, mesh)
-        else:
-            # Use an existing mesh data block like with linked duplicates (alt+d).
-            obj = bpy.data.objects.new(node.name, blender_mesh)
 
-    else:
-        # Create an empty by setting the data to None.
-        obj = bpy.data.objects.new(node.name, None)
+class ObjectNames:
+    # Object names from ldr_tools like 3001.dat#0042 are only unique within a single scene.
+    # Offset the counts past the names already in the file to keep names unique
+    # across multiple files, imports, and updates without Blender renaming each object.
+    def __init__(self):
+        self.offsets = {}
+        for obj in bpy.data.objects:
+            prefix, count = split_object_name(obj.name)
+            if count is not None:
+                self.offsets[prefix] = max(self.offsets.get(prefix, 0), count + 1)
+
+    def scene_name(self, object_name: str) -> str:
+        # Names from the same scene use consecutive counts for each prefix.
+        prefix, count = split_object_name(object_name)
+        return f'{prefix}#{count + self.offsets.get(prefix, 0):04}'
+
+    def next_name(self, name: str) -> str:
+        # Match the truncation in ldr_tools to stay within Blender's 63 byte limit.
+        prefix = name.encode()[:MAX_OBJECT_NAME_BYTES - 8].decode(errors='ignore')
+        count = self.offsets.get(prefix, 0)
+        self.offsets[prefix] = count + 1
+        return f'{prefix}#{count:04}'
+
+
+def add_nodes(node: LDrawNode,
+              geometry_cache: dict[str, LDrawGeometry],
+              proxy_geometry_cache: dict[str, LDrawGeometry],
+              blender_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+              proxy_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+              color_by_code: dict[str, LDrawColor],
+              object_names: ObjectNames,
+              path: str = ''):
+
+    mesh, proxy_mesh = get_node_meshes(node, geometry_cache, proxy_geometry_cache,
+                                       blender_mesh_cache, proxy_mesh_cache, color_by_code)
+
+    # Create an empty by setting the data to None.
+    # Use an existing mesh data block like with linked duplicates (alt+d).
+    # Unique names avoid Blender searching for a free name for every object.
+    obj = bpy.data.objects.new(object_names.scene_name(node.object_name), mesh)
+    obj['ldr_node_path'] = path
+    if proxy_mesh is not None:
+        viewport_proxies.use_proxy(obj, proxy_mesh)
 
     # Each node is transformed relative to its parent.
     obj.matrix_local = mathutils.Matrix(node.transform).transposed()
     bpy.context.collection.objects.link(obj)
 
-    for child in node.children:
-        child_obj = add_nodes(child, geometry_cache,
-                              blender_mesh_cache, color_by_code)
+    for child, child_path in child_node_paths(node, path):
+        child_obj = add_nodes(child, geometry_cache, proxy_geometry_cache,
+                              blender_mesh_cache, proxy_mesh_cache, color_by_code, object_names, child_path)
         child_obj.parent = obj
 
     return obj
 
 
-def import_instanced(filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool):
+def get_node_meshes(node: LDrawNode,
+                    geometry_cache: dict[str, LDrawGeometry],
+                    proxy_geometry_cache: dict[str, LDrawGeometry],
+                    blender_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+                    proxy_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+                    color_by_code: dict[str, LDrawColor]):
+    # The full resolution mesh and the viewport proxy mesh if present.
+    if node.geometry_name is None:
+        return None, None
+
+    mesh = get_node_mesh(node, geometry_cache, blender_mesh_cache, color_by_code)
+    proxy_mesh = None
+    if node.geometry_name in proxy_geometry_cache:
+        proxy_mesh = get_node_mesh(node, proxy_geometry_cache, proxy_mesh_cache, color_by_code)
+    return mesh, proxy_mesh
+
+
+def get_node_mesh(node: LDrawNode,
+                  geometry_cache: dict[str, LDrawGeometry],
+                  blender_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+                  color_by_code: dict[str, LDrawColor]) -> bpy.types.Mesh:
+    # Cache meshes to optimize import times and instance mesh data.
+    # Linking an existing mesh data block greatly reduces memory usage.
+    mesh_key = (node.geometry_name, node.current_color)
+
+    mesh = blender_mesh_cache.get(mesh_key)
+    if mesh is None:
+        geometry = geometry_cache[node.geometry_name]
+        mesh = create_colored_mesh_from_geometry(
+            node.name, node.current_color, color_by_code, geometry)
+
+        # Store the key to reuse this mesh when updating the import.
+        mesh['ldr_geometry'] = node.geometry_name
+        mesh['ldr_color'] = node.current_color
+        blender_mesh_cache[mesh_key] = mesh
+
+    return mesh
+
+
+def child_node_paths(node: LDrawNode, path: str):
+    # Identify children by name and occurrence rather than index.
+    # This keeps paths stable when other parts are added or removed.
+    counts = {}
+    for child in node.children:
+        index = counts.get(child.name, 0)
+        counts[child.name] = index + 1
+        yield child, f'{path}/{child.name}#{index}'
+
+
+def tag_import_root(root_obj: bpy.types.Object, filepath: str, instance_type: str):
+    # Store the source file to find this import when updating it later.
+    root_obj['ldr_filepath'] = os.path.abspath(filepath)
+    root_obj['ldr_instance_type'] = instance_type
+
+
+def find_previous_import(filepath: str, instance_type: str):
+    filepath = os.path.abspath(filepath)
+    for obj in bpy.context.scene.objects:
+        if obj.get('ldr_filepath') == filepath and obj.get('ldr_instance_type') == instance_type:
+            return obj
+    return None
+
+
+def remove_import(root_obj: bpy.types.Object):
+    for obj in root_obj.children_recursive:
+        bpy.data.objects.remove(obj)
+    bpy.data.objects.remove(root_obj)
+
+
+def matrices_close(a: mathutils.Matrix, b: mathutils.Matrix, epsilon: float = 1e-4) -> bool:
+    return all(abs(x - y) <= epsilon for row_a, row_b in zip(a, b) for x, y in zip(row_a, row_b))
+
+
+def update_objects(root_obj: bpy.types.Object, filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, use_snapshot_cache: bool = False):
+    # Only create, delete, or move the objects that changed since the previous import.
+    with phase('load_file'):
+        scene = load_scene(ldr_tools_py.load_file, use_snapshot_cache,
+            filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    existing = {obj['ldr_node_path']: obj for obj in root_obj.children_recursive
+                if 'ldr_node_path' in obj}
+
+    blender_mesh_cache = {}
+    proxy_mesh_cache = {}
+    for obj in existing.values():
+        for cache, mesh in [(blender_mesh_cache, viewport_proxies.render_mesh(obj)),
+                            (proxy_mesh_cache, obj.get(viewport_proxies.PROXY_MESH))]:
+            if mesh is not None and 'ldr_geometry' in mesh:
+                cache[(mesh['ldr_geometry'], mesh['ldr_color'])] = mesh
+
+    changes = {'created': 0, 'deleted': 0, 'updated': 0}
+    visited = set()
+    object_names = ObjectNames()
+    with phase('update_nodes'):
+        for child, path in child_node_paths(scene.root_node, ''):
+            update_node(child, path, root_obj, existing, visited, scene.geometry_cache,
+                        scene.proxy_geometry_cache, blender_mesh_cache, proxy_mesh_cache,
+                        color_by_code, object_names, changes)
+
+        for path, obj in existing.items():
+            if path not in visited:
+                bpy.data.objects.remove(obj)
+                changes['deleted'] += 1
+
+    print(f'Updated {root_obj.name}: {changes}')
+    return changes
+
+
+def update_node(node: LDrawNode,
+                path: str,
+                parent: bpy.types.Object,
+                existing: dict[str, bpy.types.Object],
+                visited: set[str],
+                geometry_cache: dict[str, LDrawGeometry],
+                proxy_geometry_cache: dict[str, LDrawGeometry],
+                blender_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+                proxy_mesh_cache: dict[tuple[str, int], bpy.types.Mesh],
+                color_by_code: dict[str, LDrawColor],
+                object_names: ObjectNames,
+                changes: dict[str, int]):
+    visited.add(path)
+
+    mesh, proxy_mesh = get_node_meshes(node, geometry_cache, proxy_geometry_cache,
+                                       blender_mesh_cache, proxy_mesh_cache, color_by_code)
+
+    obj = existing.get(path)
+    if obj is not None and (obj.data is None) != (mesh is None):
+        # Objects can't change between empties and meshes.
+        bpy.data.objects.remove(obj)
+        obj = None
+
+    transform = mathutils.Matrix(node.transform).transposed()
+    if obj is None:
+        obj = bpy.data.objects.new(object_names.scene_name(node.object_name), mesh)
+        obj['ldr_node_path'] = path
+        if proxy_mesh is not None:
+            viewport_proxies.use_proxy(obj, proxy_mesh)
+        bpy.context.collection.objects.link(obj)
+        obj.parent = parent
+        obj.matrix_local = transform
+        changes['created'] += 1
+    else:
+        changed = False
+        if viewport_proxies.render_mesh(obj) != mesh or obj.get(viewport_proxies.PROXY_MESH) != proxy_mesh:
+            viewport_proxies.set_meshes(obj, mesh, proxy_mesh)
+            changed = True
+        if obj.parent != parent:
+            obj.parent = parent
+        if not matrices_close(obj.matrix_local, transform):
+            obj.matrix_local = transform
+            changed = True
+        changes['updated'] += changed
+
+    for child, child_path in child_node_paths(node, path):
+        update_node(child, child_path, obj, existing, visited, geometry_cache,
+                    proxy_geometry_cache, blender_mesh_cache, proxy_mesh_cache,
+                    color_by_code, object_names, changes)
+
+
+def import_instanced(filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool, frames_per_step: int = 0, use_snapshot_cache: bool = False, geometry_batch_mb: int = 0, share_part_meshes: bool = False):
     # Instance each part on the points of a mesh.
     # This avoids overhead from object creation for large scenes.
-    scene = ldr_tools_py.load_file_instanced_points(
-        filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+    blender_mesh_cache = {}
+    proxy_mesh_cache = {}
+    if geometry_batch_mb > 0:
+        # Create meshes while loading to only keep one batch of geometry in memory at a time.
+        # Snapshots require the full geometry cache, so they aren't used here.
+        def create_batch_meshes(geometry_cache: dict[str, LDrawGeometry], colors: dict[str, list[int]]):
+            with phase('create_meshes'):
+                for name, geometry in geometry_cache.items():
+                    for color in ([None] if share_part_meshes else colors[name]):
+                        blender_mesh_cache[mesh_key(name, color)] = create_colored_mesh_from_geometry(
+                            name, color, color_by_code, geometry)
+
+        with phase('load_file_instanced_points_batched'):
+            scene = ldr_tools_py.load_file_instanced_points_batched(
+                filepath, ldraw_path, additional_paths, custom_mesh_path, settings,
+                geometry_batch_mb * 1024 * 1024, create_batch_meshes)
+        report_duplicates(scene)
+    else:
+        with phase('load_file_instanced_points'):
+            scene = load_scene(ldr_tools_py.load_file_instanced_points, use_snapshot_cache,
+                filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+        report_duplicates(scene)
+
+        # First create all the meshes and materials.
+        with phase('create_meshes'):
+            create_instanced_meshes(scene, scene.geometry_cache, color_by_code, blender_mesh_cache, share_part_meshes)
+            create_instanced_meshes(scene, scene.proxy_geometry_cache, color_by_code, proxy_mesh_cache, share_part_meshes)
+
+    root_obj, instancer_meshes = add_instanced_root(
+        scene, filepath, blender_mesh_cache, color_by_code, ground_object, frames_per_step, ObjectNames(),
+        share_part_meshes, proxy_mesh_cache)
+
+    # check and set any environment properties 
+    with phase('set_enviroment'):
+        set_enviroment( environment_settings,  root_obj.name)
+
+    meshes = list(blender_mesh_cache.values()) + list(proxy_mesh_cache.values())
+    return import_memory_report(scene, meshes + instancer_meshes)
+
+def import_instanced_files(filepaths: list[str], ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool, frames_per_step: int = 0, share_part_meshes: bool = False):
+    # Load all files at once to only parse library files and create each part mesh once.
+    # Each file still gets its own root object.
+    if not filepaths:
+        return None
+
+    with phase('load_files_instanced_points'):
+        scenes = ldr_tools_py.load_files_instanced_points(
+            filepaths, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    for scene in scenes.scenes:
+        report_duplicates(scene)
 
-    # First create all the meshes and materials.
     blender_mesh_cache = {}
+    with phase('create_meshes'):
+        for scene in scenes.scenes:
+            create_instanced_meshes(scene, scenes.geometry_cache, color_by_code, blender_mesh_cache, share_part_meshes)
+
+    meshes = list(blender_mesh_cache.values())
+    # Share the names for all files since the same parts appear in many files.
+    object_names = ObjectNames()
+    root_objs = []
+    for filepath, scene in zip(filepaths, scenes.scenes):
+        root_obj, instancer_meshes = add_instanced_root(
+            scene, filepath, blender_mesh_cache, color_by_code, ground_object, frames_per_step, object_names,
+            share_part_meshes)
+        root_objs.append(root_obj)
+        meshes += instancer_meshes
+
+    # The lighting and ground plane are shared by all files, so only set up the environment once.
+    # The camera frames the first file like importing that file on its own.
+    with phase('set_enviroment'):
+        set_enviroment(environment_settings, root_objs[0].name)
+
+    return import_memory_report(scenes, meshes)
+
+def create_instanced_meshes(scene, geometry_cache: dict[str, LDrawGeometry], color_by_code: dict[int, LDrawColor], blender_mesh_cache: dict, share_part_meshes: bool = False):
+    # Only create meshes not already created for another scene.
+    # Proxies aren't created for every geometry, so skip missing geometry.
     for name, color in scene.geometry_point_instances:
-        geometry = scene.geometry_cache[name]
+        if share_part_meshes:
+            color = None
+        if mesh_key(name, color) not in blender_mesh_cache and name in geometry_cache:
+            geometry = geometry_cache[name]
 
-        mesh = create_colored_mesh_from_geometry(
-            name, color, color_by_code, geometry)
+            mesh = create_colored_mesh_from_geometry(
+                name, color, color_by_code, geometry)
+
+            blender_mesh_cache[mesh_key(name, color)] = mesh
 
-        blender_mesh_cache[(name, color)] = mesh
+def mesh_key(name: str, color: int | None):
+    # Shared part meshes use the color of each instance instead.
+    return name if color is None else (name, color)
 
+def add_instanced_root(scene, filepath: str, blender_mesh_cache: dict, color_by_code: dict[int, LDrawColor], ground_object: bool, frames_per_step: int, object_names: ObjectNames, share_part_meshes: bool = False, proxy_mesh_cache: dict | None = None):
     root_obj = bpy.data.objects.new(scene.main_model_name, None)
-    # Account for Blender having a different coordinate system.
-    # TODO: make scene scale configurable.
-    root_obj.rotation_euler = mathutils.Euler(
-        (math.radians(-90.0), 0.0, 0.0), 'XYZ')
-    root_obj.scale = (0.01, 0.01, 0.01)
+    tag_import_root(root_obj, filepath, 'GeometryNodes')
+    # The ldr_submodel point attribute indexes into this list.
+    root_obj['ldr_submodels'] = scene.submodel_names
 
     bpy.context.collection.objects.link(root_obj)
 
     # Instant each unique colored part on the faces of a mesh.
-    for (name, color), instances in scene.geometry_point_instances.items():
-        instancer_mesh = create_instancer_mesh(
-            f'{name}_{color}_instancer', instances)
+    proxy_mesh_cache = proxy_mesh_cache or {}
+    instancer_meshes = []
+    if share_part_meshes:
+        # Use a single instancer for each part with the color stored on each instance.
+        instances_by_name = {}
+        for (name, color), instances in scene.geometry_point_instances.items():
+            instances_by_name.setdefault(name, []).append((color, instances))
+
+        for name, color_instances in instances_by_name.items():
+            instances = combine_instances(color_instances)
+            instancer_object = add_instancer(
+                root_obj, name, 16, instances, blender_mesh_cache[name], frames_per_step, object_names,
+                proxy_mesh_cache.get(name))
+            add_instance_colors(instancer_object.data, instances.colors, color_by_code)
+            instancer_meshes.append(instancer_object.data)
+    else:
+        for (name, color), instances in scene.geometry_point_instances.items():
+            instancer_object = add_instancer(
+                root_obj, name, color, instances, blender_mesh_cache[(name, color)], frames_per_step, object_names,
+                proxy_mesh_cache.get((name, color)))
+            instancer_meshes.append(instancer_object.data)
 
-        instancer_object = bpy.data.objects.new(
-            f'{name}_{color}_instancer', instancer_mesh)
-        instancer_object.parent = root_obj
+    if ground_object:
+        with phase('ground_object'):
+            bpy.context.view_layer.update()
+            objectOnGround(root_obj.name)
 
-        bpy.context.collection.objects.link(instancer_object)
+    # Clean-up: Remove temporary Bounding Box Geometry from instancer object modifiers
+    with phase('remove_geometry_instancing_bbox'):
+        bpy.ops.object.select_all(action='DESELECT')
+        selectLDR(root_obj.name)
+        for obj in bpy.context.selected_objects:
+            geo_nodes = obj.modifiers["GeometryNodes"].node_group
+            remove_geometry_instancing_bbox(geo_nodes)
+        bpy.ops.object.select_all(action='DESELECT')
+
+    return root_obj, instancer_meshes
+
+def combine_instances(color_instances: list[tuple[int, ldr_tools_py.PointInstances]]):
+    # Combine the instances for all colors of a part into a single set of points.
+    arrays = {a: np.concatenate([getattr(instances, a) for _, instances in color_instances])
+              for a in snapshot.INSTANCE_ARRAYS}
+    colors = np.concatenate([np.full(instances.translations.shape[0], color, dtype=np.int32)
+                             for color, instances in color_instances])
+    return SimpleNamespace(**arrays, colors=colors)
+
+def add_instance_colors(instancer_mesh: bpy.types.Mesh, colors: np.ndarray, color_by_code: dict[int, LDrawColor]):
+    # Look up the material values for each unique color in the palette once.
+    # The instance color material reads these point attributes from each instance.
+    codes, inverse = np.unique(colors, return_inverse=True)
+    palette = [instance_color_values(color_by_code, int(code)) for code in codes]
+
+    attribute = instancer_mesh.attributes.new(name='ldr_color', type='INT', domain='POINT')
+    attribute.data.foreach_set('value', colors)
+    for name, type, key in INSTANCE_COLOR_ATTRIBUTES:
+        values = np.array([color_values[name] for color_values in palette], dtype=np.float32)
+        attribute = instancer_mesh.attributes.new(name=name, type=type, domain='POINT')
+        attribute.data.foreach_set(key, values[inverse].reshape(-1))
+
+def add_instancer(root_obj: bpy.types.Object, name: str, color: int, instances: ldr_tools_py.PointInstances, mesh: bpy.types.Mesh, frames_per_step: int, object_names: ObjectNames, proxy_mesh: bpy.types.Mesh | None = None):
+    instancer_name = object_names.next_name(f'{name}_{color}_instancer')
+    with phase('create_instancer_mesh'):
+        instancer_mesh = create_instancer_mesh(instancer_name, instances)
+
+    instancer_object = bpy.data.objects.new(instancer_name, instancer_mesh)
+    instancer_object.parent = root_obj
+    # Store the key to find this instancer when updating the import.
+    instancer_object['ldr_geometry'] = name
+    instancer_object['ldr_color'] = color
+
+    bpy.context.collection.objects.link(instancer_object)
+
+    instance_object = bpy.data.objects.new(
+        object_names.next_name(f'{name}_{color}_instance'), mesh)
+    instance_object.parent = instancer_object
+    bpy.context.collection.objects.link(instance_object)
+
+    # Hide the original instanced object to avoid cluttering the viewport.
+    # Make sure the object is in the view layer before hiding.
+    instance_object.hide_set(True)
+    instance_object.hide_render = True
+
+    proxy_object = None
+    if proxy_mesh is not None:
+        proxy_object = bpy.data.objects.new(
+            object_names.next_name(f'{name}_{color}_proxy'), proxy_mesh)
+        proxy_object.parent = instancer_object
+        bpy.context.collection.objects.link(proxy_object)
+        proxy_object.hide_set(True)
+        proxy_object.hide_render = True
+
+    # Set up geometry nodes for the actual instancing.
+    # Geometry nodes are more reliable than instancing on faces.
+    # This also avoids performance overhead from object creation.
+    with phase('create_geometry_node_instancing'):
+        create_geometry_node_instancing(instancer_object, instance_object, frames_per_step, proxy_object)
+
+    return instancer_object
+
+
+def update_instanced(root_obj: bpy.types.Object, filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, frames_per_step: int, use_snapshot_cache: bool = False):
+    # Only replace the instancer points for parts that changed since the previous import.
+    with phase('load_file_instanced_points'):
+        scene = load_scene(ldr_tools_py.load_file_instanced_points, use_snapshot_cache,
+            filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    report_duplicates(scene)
+
+    existing = {(obj['ldr_geometry'], obj['ldr_color']): obj for obj in root_obj.children
+                if 'ldr_geometry' in obj}
+    root_obj['ldr_submodels'] = scene.submodel_names
+
+    changes = {'created': 0, 'deleted': 0, 'updated': 0}
+    object_names = ObjectNames()
+    with phase('update_instancers'):
+        for (name, color), instances in scene.geometry_point_instances.items():
+            instancer_object = existing.get((name, color))
+            if instancer_object is None:
+                mesh = create_colored_mesh_from_geometry(
+                    name, color, color_by_code, scene.geometry_cache[name])
+                proxy_mesh = None
+                if name in scene.proxy_geometry_cache:
+                    proxy_mesh = create_colored_mesh_from_geometry(
+                        name, color, color_by_code, scene.proxy_geometry_cache[name])
+                instancer_object = add_instancer(root_obj, name, color, instances, mesh, frames_per_step, object_names,
+                                                 proxy_mesh)
+                remove_geometry_instancing_bbox(
+                    instancer_object.modifiers["GeometryNodes"].node_group)
+                changes['created'] += 1
+            elif not instances_match(instancer_object.data, instances):
+                old_mesh = instancer_object.data
+                with phase('create_instancer_mesh'):
+                    instancer_object.data = create_instancer_mesh(instancer_object.name, instances)
+                bpy.data.meshes.remove(old_mesh)
+                changes['updated'] += 1
+
+        for key, instancer_object in existing.items():
+            if key not in scene.geometry_point_instances:
+                remove_import(instancer_object)
+                changes['deleted'] += 1
+
+    print(f'Updated {root_obj.name}: {changes}')
+    return changes
+
+
+def instances_match(instancer_mesh: bpy.types.Mesh, instances: ldr_tools_py.PointInstances) -> bool:
+    count = instances.translations.shape[0]
+    if len(instancer_mesh.vertices) != count:
+        return False
+    if count == 0:
+        return True
+
+    positions = np.zeros(count * 3, dtype=np.float32)
+    instancer_mesh.vertices.foreach_get('co', positions)
+    if not np.allclose(positions, instances.translations.reshape(-1), atol=1e-4):
+        return False
+
+    for name, prop, values, dtype in [
+        ('instance_scale', 'vector', instances.scales, np.float32),
+        ('instance_rotation_axis', 'vector', instances.rotations_axis, np.float32),
+        ('instance_rotation_angle', 'value', instances.rotations_angle, np.float32),
+        ('ldr_step', 'value', instances.steps, np.int32),
+    ]:
+        attribute = instancer_mesh.attributes.get(name)
+        if attribute is None:
+            return False
+        data = np.zeros(values.size, dtype=dtype)
+        attribute.data.foreach_get(prop, data)
+        if not np.allclose(data, values.reshape(-1), atol=1e-4):
+            return False
+
+    return True
+
+
+def import_merged(filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, color_by_code: dict[int, LDrawColor], settings: GeometrySettings, environment_settings: dict, ground_object: bool):
+    # Create a single object for each material with all parts combined.
+    # This avoids object and instance overhead for static scenes.
+    with phase('load_file_merged'):
+        scene = ldr_tools_py.load_file_merged(
+            filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    report_duplicates(scene)
 
-        mesh = blender_mesh_cache[(name, color)]
-        instance_object = bpy.data.objects.new(
-            f'{name}_{color}_instance', mesh)
-        instance_object.parent = instancer_object
-        bpy.context.collection.objects.link(instance_object)
+    root_obj = bpy.data.objects.new(scene.main_model_name, None)
+    tag_import_root(root_obj, filepath, 'Merged')
+
+    bpy.context.collection.objects.link(root_obj)
 
-        # Hide the original instanced object to avoid cluttering the viewport.
-        # Make sure the object is in the view layer before hiding.
-        instance_object.hide_set(True)
-        instance_object.hide_render = True
+    meshes = []
+    for (color, is_slope), merged in scene.merged_geometry.items():
+        name = f'{scene.main_model_name}_{color}_slope' if is_slope else f'{scene.main_model_name}_{color}'
+        with phase('create_merged_mesh'):
+            mesh = create_merged_mesh(name, color, is_slope, color_by_code, merged)
+        meshes.append(mesh)
 
-        # Set up geometry nodes for the actual instancing.
-        # Geometry nodes are more reliable than instancing on faces.
-        # This also avoids performance overhead from object creation.
-        create_geometry_node_instancing(instancer_object, instance_object)
+        obj = bpy.data.objects.new(name, mesh)
+        obj.parent = root_obj
+        bpy.context.collection.objects.link(obj)
 
     if ground_object:
-        bpy.context.view_layer.update()
-        objectOnGround(root_obj.name)
-    
-    # Normalise object and child object scales to 1.0
-    applyScaleTransform(root_obj.name)
+        with phase('ground_object'):
+            bpy.context.view_layer.update()
+            objectOnGround(root_obj.name)
 
-    # check and set any environment properties 
-    set_enviroment( environment_settings,  root_obj.name)
+    # check and set any environment properties
+    with phase('set_enviroment'):
+        set_enviroment(environment_settings, root_obj.name)
 
-    # Clean-up: Remove temporary Bounding Box Geometry from instancer object modifiers
-    bpy.ops.object.select_all(action='DESELECT')
-    selectLDR(root_obj.name)
-    for obj in bpy.context.selected_objects:
-        geo_nodes = obj.modifiers["GeometryNodes"].node_group
-        remove_geometry_instancing_bbox(geo_nodes)
-    bpy.ops.object.select_all(action='DESELECT')
+    return import_memory_report(scene, meshes)
+
+def create_merged_mesh(name: str, color: int, is_slope: bool, color_by_code: dict[int, LDrawColor], merged: ldr_tools_py.MergedGeometry):
+    # Merged geometry already has the final color for all faces.
+    with phase('create_mesh_from_geometry'):
+        mesh = create_mesh_from_geometry(name, merged.geometry)
+
+    with phase('assign_materials'):
+        mesh.materials.append(get_material(color_by_code, color, is_slope))
+
+    # The world transforms are already applied to the vertices.
+    # Use the normals before applying transforms to detect grainy faces.
+    if is_slope and merged.part_normals.shape[0] > 0:
+        with phase('ldr_normals'):
+            normals = mesh.attributes.new(
+                name='ldr_normals', type='FLOAT_VECTOR', domain='CORNER')
+            normals.data.foreach_set('vector', merged.part_normals.reshape(-1))
+
+    with phase('validate_mesh'):
+        mesh.validate()
+        mesh.update()
 
-def create_geometry_node_instancing(instancer_object: bpy.types.Object, instance_object: bpy.types.Object):
+    with phase('mark_sharp_edges'):
+        mark_sharp_edges(mesh, merged.geometry.edge_line_indices)
+
+    return mesh
+
+def mark_sharp_edges(mesh: bpy.types.Mesh, edge_line_indices: np.ndarray):
+    # Mark the mesh edges matching LDraw lines as sharp.
+    # This keeps hard edges without splitting vertices when edges aren't already split.
+    if edge_line_indices.shape[0] == 0 or len(mesh.edges) == 0:
+        return
+
+    edges = np.zeros(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+
+    # Compare undirected edges using a single integer key.
+    vertex_count = len(mesh.vertices)
+    def edge_keys(edges):
+        edges = edges.reshape(-1, 2).astype(np.int64)
+        return edges.min(axis=1) * vertex_count + edges.max(axis=1)
+
+    is_sharp = np.isin(edge_keys(edges), edge_keys(edge_line_indices))
+    if not is_sharp.any():
+        return
+
+    sharp_edge = mesh.attributes.get('sharp_edge')
+    if sharp_edge is None:
+        sharp_edge = mesh.attributes.new(name='sharp_edge', type='BOOLEAN', domain='EDGE')
+    sharp_edge.data.foreach_set('value', is_sharp)
+
+def create_geometry_node_instancing(instancer_object: bpy.types.Object, instance_object: bpy.types.Object, frames_per_step: int = 0, proxy_object: bpy.types.Object | None = None):
     modifier = instancer_object.modifiers.new(
         name="GeometryNodes", type='NODES')
     node_tree = bpy.data.node_groups.new('GeometryNodes', 'GeometryNodeTree')
@@ -284,8 +907,24 @@ def create_geometry_node_instancing(instancer_object: bpy.types.Object, instance
     # Set the instance mesh.
     instance_info = nodes.new(type="GeometryNodeObjectInfo")
     instance_info.inputs[0].default_value = instance_object
-    links.new(instance_info.outputs["Geometry"],
-              instance_points.inputs["Instance"])
+    if proxy_object is None:
+        links.new(instance_info.outputs["Geometry"],
+                  instance_points.inputs["Instance"])
+    else:
+        # Instance the proxy mesh in the viewport and the full mesh when rendering.
+        proxy_info = nodes.new(type="GeometryNodeObjectInfo")
+        proxy_info.inputs[0].default_value = proxy_object
+
+        is_viewport = nodes.new(type="GeometryNodeIsViewport")
+        switch = nodes.new(type="GeometryNodeSwitch")
+        switch.input_type = 'GEOMETRY'
+        # Only the sockets for the selected type are enabled in older versions.
+        def socket(sockets, name):
+            return next(s for s in sockets if s.name == name and s.enabled)
+        links.new(is_viewport.outputs["Is Viewport"], socket(switch.inputs, "Switch"))
+        links.new(instance_info.outputs["Geometry"], socket(switch.inputs, "False"))
+        links.new(proxy_info.outputs["Geometry"], socket(switch.inputs, "True"))
+        links.new(socket(switch.outputs, "Output"), instance_points.inputs["Instance"])
 
     # Scale instances from the custom attribute.
     scale_attribute = nodes.new(type="GeometryNodeInputNamedAttribute")
@@ -314,6 +953,28 @@ def create_geometry_node_instancing(instancer_object: bpy.types.Object, instance
 
     links.new(rotation.outputs["Rotation"], instance_points.inputs["Rotation"])
 
+    if frames_per_step > 0:
+        # Show the parts for each build step after frames_per_step frames.
+        # This animates the whole model with a single threshold and no keyframes.
+        step_attribute = nodes.new(type="GeometryNodeInputNamedAttribute")
+        step_attribute.data_type = 'INT'
+        step_attribute.inputs["Name"].default_value = "ldr_step"
+
+        scene_time = nodes.new(type="GeometryNodeInputSceneTime")
+        current_step = nodes.new(type="ShaderNodeMath")
+        current_step.operation = 'DIVIDE'
+        links.new(scene_time.outputs["Frame"], current_step.inputs[0])
+        current_step.inputs[1].default_value = frames_per_step
+
+        compare = nodes.new(type="FunctionNodeCompare")
+        compare.data_type = 'FLOAT'
+        compare.operation = 'LESS_EQUAL'
+        # Only one of the outputs is enabled for the selected data type.
+        step_output = next(o for o in step_attribute.outputs if o.enabled)
+        links.new(step_output, compare.inputs[0])
+        links.new(current_step.outputs["Value"], compare.inputs[1])
+        links.new(compare.outputs["Result"], instance_points.inputs["Selection"])
+
 def remove_geometry_instancing_bbox(node_grp: bpy.types.NodeGroup):
     if node_grp.type == "GEOMETRY":
         list = ["Bounding Box", "Realize Instances", "Delete Geometry", "Join Geometry"]
@@ -355,59 +1016,80 @@ def create_instancer_mesh(name: str, instances: ldr_tools_py.PointInstances):
         rot_angle_attribute.data.foreach_set(
             'value', instances.rotations_angle)
 
+        # Store the build step and submodel for step animations and selections.
+        for attribute_name, values in [('ldr_step', instances.steps), ('ldr_submodel', instances.submodels)]:
+            if values.shape[0] == positions.shape[0]:
+                attribute = instancer_mesh.attributes.new(
+                    name=attribute_name, type='INT', domain='POINT')
+                attribute.data.foreach_set('value', values.astype(np.int32))
+
     instancer_mesh.validate()
     instancer_mesh.update()
     return instancer_mesh
 
 
-def create_colored_mesh_from_geometry(name: str, color: int, color_by_code: dict[int, LDrawColor], geometry: LDrawGeometry):
-    mesh = create_mesh_from_geometry(name, geometry)
+def create_colored_mesh_from_geometry(name: str, color: int | None, color_by_code: dict[int, LDrawColor], geometry: LDrawGeometry):
+    with phase('create_mesh_from_geometry'):
+        mesh = create_mesh_from_geometry(name, geometry)
 
-    assign_materials(mesh, color, color_by_code, geometry)
+    with phase('assign_materials'):
+        assign_materials(mesh, color, color_by_code, geometry)
 
     # TODO: Why does this need to be done here to avoid messing up face colors?
     # TODO: Can blender adjust faces in these calls?
-    mesh.validate()
-    mesh.update()
+    with phase('validate_mesh'):
+        mesh.validate()
+        mesh.update()
+
+    # Edges are only created after validating.
+    with phase('mark_sharp_edges'):
+        mark_sharp_edges(mesh, geometry.edge_line_indices)
 
     # Add attributes needed to render grainy slopes properly.
     if geometry.has_grainy_slopes:
         # Get custom normals now that everything has been initialized.
         # This won't include any object transforms.
-        mesh.calc_normals_split()
-        loop_normals = np.zeros(len(mesh.loops) * 3)
-        mesh.loops.foreach_get('normal', loop_normals)
+        with phase('ldr_normals'):
+            # Blender 4.1 and later calculate corner normals automatically.
+            if hasattr(mesh, 'calc_normals_split'):
+                mesh.calc_normals_split()
+            loop_normals = np.zeros(len(mesh.loops) * 3)
+            mesh.loops.foreach_get('normal', loop_normals)
 
-        normals = mesh.attributes.new(
-            name='ldr_normals', type='FLOAT_VECTOR', domain='CORNER')
-        normals.data.foreach_set('vector', loop_normals)
+            normals = mesh.attributes.new(
+                name='ldr_normals', type='FLOAT_VECTOR', domain='CORNER')
+            normals.data.foreach_set('vector', loop_normals)
 
     return mesh
 
 
-def assign_materials(mesh: bpy.types.Mesh, current_color: int, color_by_code: dict[int, LDrawColor], geometry: LDrawGeometry):
+def assign_materials(mesh: bpy.types.Mesh, current_color: int | None, color_by_code: dict[int, LDrawColor], geometry: LDrawGeometry):
     if len(geometry.face_colors) == 1:
-        # Geometry is cached with code 16, so also handle color replacement.
-        face_color = geometry.face_colors[0]
-        color = current_color if face_color == 16 else face_color
-
         # Cache materials by name.
-        material = get_material(color_by_code, color,
-                                geometry.has_grainy_slopes)
+        material = get_face_material(
+            color_by_code, current_color, geometry.face_colors[0], geometry.has_grainy_slopes)
         mesh.materials.append(material)
     else:
         # Handle the case where not all faces have the same color.
         # This includes patterned (printed) parts and stickers.
         for face, face_color in zip(mesh.polygons, geometry.face_colors):
-            color = current_color if face_color == 16 else face_color
-
-            material = get_material(
-                color_by_code, color, geometry.has_grainy_slopes)
+            material = get_face_material(
+                color_by_code, current_color, face_color, geometry.has_grainy_slopes)
             if mesh.materials.get(material.name) is None:
                 mesh.materials.append(material)
             face.material_index = mesh.materials.find(material.name)
 
 
+def get_face_material(color_by_code: dict[int, LDrawColor], current_color: int | None, face_color: int, is_slope: bool) -> bpy.types.Material:
+    # Geometry is cached with code 16, so also handle color replacement.
+    # A current color of None uses the color stored on each instance.
+    if face_color == 16:
+        if current_color is None:
+            return get_instance_color_material(color_by_code, is_slope)
+        face_color = current_color
+    return get_material(color_by_code, face_color, is_slope)
+
+
 def create_mesh_from_geometry(name: str, geometry: LDrawGeometry):
     mesh = bpy.data.meshes.new(name)
     if geometry.vertices.shape[0] > 0:
@@ -426,14 +1108,16 @@ def create_mesh_from_geometry(name: str, geometry: LDrawGeometry):
         mesh.polygons.foreach_set('loop_total', geometry.face_sizes)
 
         # Enable autosmooth to handle some cases where edges aren't split.
-        mesh.use_auto_smooth = True
-        mesh.auto_smooth_angle = math.radians(30.0)
+        # Blender 4.1 removed autosmooth in favor of sharp edges.
+        if hasattr(mesh, 'use_auto_smooth'):
+            mesh.use_auto_smooth = True
+            mesh.auto_smooth_angle = math.radians(30.0)
         mesh.polygons.foreach_set('use_smooth', [True] * len(mesh.polygons))
 
         # Add attributes needed to render grainy slopes properly.
         if geometry.has_grainy_slopes:
             is_stud = mesh.attributes.new(
                 name='ldr_is_stud', type='FLOAT', domain='FACE')
-            is_stud.data.foreach_set('value', geometry.is_face_stud)
+            is_stud.data.foreach_set('value', geometry.is_face_stud.astype(np.float32))
 
     return mesh
@@ -34,24 +34,15 @@ def get_material(color_by_code: dict[int, LDrawColor], code: int, is_slope: bool
         if ldraw_color is not None:
             bsdf = material.node_tree.nodes["Principled BSDF"]
 
-            # Alpha is specified using transmission instead.
-            r, g, b, a = ldraw_color.rgba_linear
-
             # Set the color in the viewport.
             # This can use the default LDraw color for familiarity.
-            material.diffuse_color = [r, g, b, a]
+            material.diffuse_color = ldraw_color.rgba_linear
 
-            # Partially complete alternatives to LDraw colors for better realism.
-            if code in rgb_ldr_tools_by_code:
-                r, g, b = rgb_ldr_tools_by_code[code]
-            elif code in rgb_peeron_by_code:
-                r, g, b = rgb_peeron_by_code[code]
+            (r, g, b), metallic, roughness_min, roughness_max, transmission = material_parameters(
+                ldraw_color, code)
 
             bsdf.inputs['Base Color'].default_value = [r, g, b, 1.0]
 
-            # Transparent colors specify an alpha of 128 / 255.
-            is_transmissive = a <= 0.6
-
             # RANDOM_WALK is more accurate but has discoloration around thin corners.
             # TODO: This is in Blender units and should depend on scene scale
             bsdf.subsurface_method = 'BURLEY'
@@ -67,36 +58,11 @@ def get_material(color_by_code: dict[int, LDrawColor], code: int, is_slope: bool
             material.node_tree.links.new(
                 roughness_node.outputs['Roughness'], bsdf.inputs['Roughness'])
 
-            # Normal opaque materials.
-            roughness_node.inputs['Min'].default_value = 0.075
-            roughness_node.inputs['Max'].default_value = 0.2
-
-            # TODO: Have a case for each finish type?
-            # Rubber - turn roughness right up
-            if ldraw_color.finish_name == 'Rubber':
-                roughness_node.inputs['Min'].default_value = 0.6
-                roughness_node.inputs['Max'].default_value = 0.8
-            # Metals   
-            if ldraw_color.finish_name == 'MatteMetallic':
-                bsdf.inputs['Metallic'].default_value = 1.0
-            elif ldraw_color.finish_name == 'Chrome':
-                # Glossy metal coating.
-                bsdf.inputs['Metallic'].default_value = 1.0
-                roughness_node.inputs['Min'].default_value = 0.075
-                roughness_node.inputs['Max'].default_value = 0.1
-            elif ldraw_color.finish_name == 'Metal':
-                # Rougher metals.
-                bsdf.inputs['Metallic'].default_value = 1.0
-                roughness_node.inputs['Min'].default_value = 0.15
-                roughness_node.inputs['Max'].default_value = 0.3
-            elif ldraw_color.finish_name == 'Pearlescent':
-                bsdf.inputs['Metallic'].default_value = 0.35
-                roughness_node.inputs['Min'].default_value = 0.3
-                roughness_node.inputs['Max'].default_value = 0.5
-            elif ldraw_color.finish_name == 'Speckle':
-                # TODO: Are all speckled colors metals?
-                bsdf.inputs['Metallic'].default_value = 1.0
+            roughness_node.inputs['Min'].default_value = roughness_min
+            roughness_node.inputs['Max'].default_value = roughness_max
+            bsdf.inputs['Metallic'].default_value = metallic
 
+            if ldraw_color.finish_name == 'Speckle':
                 speckle_node = create_node_group(
                     material, 'ldr_tools_speckle', create_speckle_node_group)
 
@@ -117,81 +83,246 @@ def get_material(color_by_code: dict[int, LDrawColor], code: int, is_slope: bool
                 material.node_tree.links.new(
                     mix_rgb.outputs['Color'], bsdf.inputs['Base Color'])
 
-            if is_transmissive:
-                bsdf.inputs['Transmission Weight'].default_value = 1.0
+            if transmission > 0.0:
+                bsdf.inputs['Transmission Weight'].default_value = transmission
                 bsdf.inputs['IOR'].default_value = 1.55
 
-                if ldraw_color.finish_name == 'Rubber':
-                    # Make the transparent rubber appear cloudy.
-                    roughness_node.inputs['Min'].default_value = 0.1
-                    roughness_node.inputs['Max'].default_value = 0.35
-                else:
-                    roughness_node.inputs['Min'].default_value = 0.01
-                    roughness_node.inputs['Max'].default_value = 0.15
-
-            # Procedural normals.
-            normals = create_node_group(
-                material, 'ldr_tools_normal', create_normals_node_group)
-
-            if is_slope:
-                # Apply grainy normals to faces that aren't vertical or horizontal.
-                # Use non transformed normals to not consider object rotation.
-                ldr_normals = material.node_tree.nodes.new(
-                    'ShaderNodeAttribute')
-                ldr_normals.attribute_name = 'ldr_normals'
-
-                separate = material.node_tree.nodes.new(
-                    'ShaderNodeSeparateXYZ')
-                material.node_tree.links.new(
-                    ldr_normals.outputs['Vector'], separate.inputs['Vector'])
+            add_normals(material, bsdf, is_slope)
 
-                # Use normal.y to check if the face is horizontal (-1.0 or 1.0) or vertical (0.0).
-                # Any values in between are considered "slopes" and use grainy normals.
-                absolute = material.node_tree.nodes.new('ShaderNodeMath')
-                absolute.operation = 'ABSOLUTE'
-                material.node_tree.links.new(
-                    separate.outputs['Y'], absolute.inputs['Value'])
+    return material
 
-                compare = material.node_tree.nodes.new('ShaderNodeMath')
-                compare.operation = 'COMPARE'
-                compare.inputs[1].default_value = 0.5
-                compare.inputs[2].default_value = 0.45
-                material.node_tree.links.new(
-                    absolute.outputs['Value'], compare.inputs['Value'])
 
-                slope_normals = create_node_group(
-                    material, 'ldr_tools_slope_normal', create_slope_normals_node_group)
+def material_parameters(ldraw_color: LDrawColor, code: int) -> tuple[tuple[float, float, float], float, float, float, float]:
+    # The base color, metallic, roughness min, roughness max, and transmission for a color.
+    r, g, b, a = ldraw_color.rgba_linear
+
+    # Partially complete alternatives to LDraw colors for better realism.
+    if code in rgb_ldr_tools_by_code:
+        r, g, b = rgb_ldr_tools_by_code[code]
+    elif code in rgb_peeron_by_code:
+        r, g, b = rgb_peeron_by_code[code]
+
+    # Normal opaque materials.
+    metallic = 0.0
+    roughness_min = 0.075
+    roughness_max = 0.2
+
+    # TODO: Have a case for each finish type?
+    # Rubber - turn roughness right up
+    if ldraw_color.finish_name == 'Rubber':
+        roughness_min = 0.6
+        roughness_max = 0.8
+    # Metals   
+    if ldraw_color.finish_name == 'MatteMetallic':
+        metallic = 1.0
+    elif ldraw_color.finish_name == 'Chrome':
+        # Glossy metal coating.
+        metallic = 1.0
+        roughness_min = 0.075
+        roughness_max = 0.1
+    elif ldraw_color.finish_name == 'Metal':
+        # Rougher metals.
+        metallic = 1.0
+        roughness_min = 0.15
+        roughness_max = 0.3
+    elif ldraw_color.finish_name == 'Pearlescent':
+        metallic = 0.35
+        roughness_min = 0.3
+        roughness_max = 0.5
+    elif ldraw_color.finish_name == 'Speckle':
+        # TODO: Are all speckled colors metals?
+        metallic = 1.0
+
+    # Transparent colors specify an alpha of 128 / 255.
+    # Alpha is specified using transmission instead.
+    transmission = 0.0
+    if a <= 0.6:
+        transmission = 1.0
+        if ldraw_color.finish_name == 'Rubber':
+            # Make the transparent rubber appear cloudy.
+            roughness_min = 0.1
+            roughness_max = 0.35
+        else:
+            roughness_min = 0.01
+            roughness_max = 0.15
+
+    return (r, g, b), metallic, roughness_min, roughness_max, transmission
+
+
+# The point attributes read by get_instance_color_material with their type and data key.
+INSTANCE_COLOR_ATTRIBUTES = [
+    ('ldr_base_color', 'FLOAT_COLOR', 'color'),
+    ('ldr_speckle_color', 'FLOAT_COLOR', 'color'),
+    ('ldr_speckle', 'FLOAT', 'value'),
+    ('ldr_finish', 'FLOAT_VECTOR', 'vector'),
+    ('ldr_subsurface', 'FLOAT', 'value'),
+    ('ldr_transmission', 'FLOAT', 'value'),
+]
+
+
+def instance_color_values(color_by_code: dict[int, LDrawColor], code: int) -> dict:
+    # The values for INSTANCE_COLOR_ATTRIBUTES that match get_material for this code.
+    ldraw_color = color_by_code.get(code)
+    if ldraw_color is None:
+        # Unknown codes use the default Principled BSDF values like get_material.
+        return {
+            'ldr_base_color': [0.8, 0.8, 0.8, 1.0],
+            'ldr_speckle_color': [0.8, 0.8, 0.8, 1.0],
+            'ldr_speckle': 0.0,
+            'ldr_finish': [0.0, 0.5, 0.5],
+            'ldr_subsurface': 0.0,
+            'ldr_transmission': 0.0,
+        }
+
+    (r, g, b), metallic, roughness_min, roughness_max, transmission = material_parameters(
+        ldraw_color, code)
+    is_speckle = ldraw_color.finish_name == 'Speckle'
+    speckle_r, speckle_g, speckle_b, _ = ldraw_color.speckle_rgba_linear if is_speckle else (r, g, b, 1.0)
+    return {
+        'ldr_base_color': [r, g, b, 1.0],
+        'ldr_speckle_color': [speckle_r, speckle_g, speckle_b, 1.0],
+        'ldr_speckle': 1.0 if is_speckle else 0.0,
+        'ldr_finish': [metallic, roughness_min, roughness_max],
+        'ldr_subsurface': 1.0,
+        'ldr_transmission': transmission,
+    }
+
+
+def get_instance_color_material(color_by_code: dict[int, LDrawColor], is_slope: bool) -> bpy.types.Material:
+    # A single material for faces using the current color of each geometry node instance.
+    # The color values are stored on the instances by add_instance_colors.
+    name = 'ldr_tools instance color'
+    if is_slope:
+        name += ' slope'
 
-                is_stud = material.node_tree.nodes.new('ShaderNodeAttribute')
-                is_stud.attribute_name = 'ldr_is_stud'
+    material = bpy.data.materials.get(name)
+    if material is None:
+        material = bpy.data.materials.new(name)
+        material.use_nodes = True
 
-                # Don't apply the grainy slopes to any faces marked as studs.
-                # We use an attribute here to avoid per face material assignment.
-                subtract_studs = material.node_tree.nodes.new('ShaderNodeMath')
-                subtract_studs.operation = 'SUBTRACT'
-                material.node_tree.links.new(
-                    compare.outputs['Value'], subtract_studs.inputs[0])
-                material.node_tree.links.new(
-                    is_stud.outputs[2], subtract_studs.inputs[1])
+        # The viewport color can't vary per instance, so use the main color like parts in color 16.
+        main_color = color_by_code.get(16)
+        if main_color is not None:
+            material.diffuse_color = main_color.rgba_linear
+
+        nodes = material.node_tree.nodes
+        links = material.node_tree.links
+        bsdf = nodes["Principled BSDF"]
+
+        def instance_attribute(name: str):
+            attribute = nodes.new('ShaderNodeAttribute')
+            attribute.attribute_type = 'INSTANCER'
+            attribute.attribute_name = name
+            return attribute
+
+        base_color = instance_attribute('ldr_base_color')
+
+        # Blend between the two speckle colors like get_material.
+        # Colors without speckles have a speckle factor of 0.
+        speckle_node = create_node_group(
+            material, 'ldr_tools_speckle', create_speckle_node_group)
+        speckle_node.inputs['Min'].default_value = 0.5
+        speckle_node.inputs['Max'].default_value = 0.6
+
+        speckle_factor = nodes.new('ShaderNodeMath')
+        speckle_factor.operation = 'MULTIPLY'
+        links.new(speckle_node.outputs['Fac'], speckle_factor.inputs[0])
+        links.new(instance_attribute('ldr_speckle').outputs['Fac'], speckle_factor.inputs[1])
+
+        mix_rgb = nodes.new('ShaderNodeMixRGB')
+        links.new(speckle_factor.outputs['Value'], mix_rgb.inputs['Fac'])
+        links.new(base_color.outputs['Color'], mix_rgb.inputs[1])
+        links.new(instance_attribute('ldr_speckle_color').outputs['Color'], mix_rgb.inputs[2])
+        links.new(mix_rgb.outputs['Color'], bsdf.inputs['Base Color'])
+
+        bsdf.subsurface_method = 'BURLEY'
+        links.new(base_color.outputs['Vector'], bsdf.inputs['Subsurface Radius'])
+        links.new(instance_attribute('ldr_subsurface').outputs['Fac'], bsdf.inputs['Subsurface Weight'])
+        bsdf.inputs['Subsurface Scale'].default_value = 0.0125
+
+        # The metallic, roughness min, and roughness max.
+        finish = instance_attribute('ldr_finish')
+        separate = nodes.new('ShaderNodeSeparateXYZ')
+        links.new(finish.outputs['Vector'], separate.inputs['Vector'])
+        links.new(separate.outputs['X'], bsdf.inputs['Metallic'])
+
+        roughness_node = create_node_group(
+            material, 'ldr_tools_roughness', create_roughness_node_group)
+        links.new(separate.outputs['Y'], roughness_node.inputs['Min'])
+        links.new(separate.outputs['Z'], roughness_node.inputs['Max'])
+        links.new(roughness_node.outputs['Roughness'], bsdf.inputs['Roughness'])
+
+        transmission = instance_attribute('ldr_transmission')
+        links.new(transmission.outputs['Fac'], bsdf.inputs['Transmission Weight'])
+        bsdf.inputs['IOR'].default_value = 1.55
+
+        add_normals(material, bsdf, is_slope)
 
-                # Choose between grainy and smooth normals depending on the face.
-                mix_normals = material.node_tree.nodes.new('ShaderNodeMix')
-                mix_normals.data_type = 'VECTOR'
-                material.node_tree.links.new(
-                    subtract_studs.outputs['Value'], mix_normals.inputs['Factor'])
-                material.node_tree.links.new(
-                    normals.outputs['Normal'], mix_normals.inputs[4])
-                material.node_tree.links.new(
-                    slope_normals.outputs['Normal'], mix_normals.inputs[5])
+    return material
 
-                # The second output is the vector output.
-                material.node_tree.links.new(
-                    mix_normals.outputs[1], bsdf.inputs['Normal'])
-            else:
-                material.node_tree.links.new(
-                    normals.outputs['Normal'], bsdf.inputs['Normal'])
 
-    return material
+def add_normals(material: bpy.types.Material, bsdf: bpy.types.Node, is_slope: bool):
+    # Procedural normals.
+    normals = create_node_group(
+        material, 'ldr_tools_normal', create_normals_node_group)
+
+    if is_slope:
+        # Apply grainy normals to faces that aren't vertical or horizontal.
+        # Use non transformed normals to not consider object rotation.
+        ldr_normals = material.node_tree.nodes.new(
+            'ShaderNodeAttribute')
+        ldr_normals.attribute_name = 'ldr_normals'
+
+        separate = material.node_tree.nodes.new(
+            'ShaderNodeSeparateXYZ')
+        material.node_tree.links.new(
+            ldr_normals.outputs['Vector'], separate.inputs['Vector'])
+
+        # Use normal.z to check if the face is horizontal (-1.0 or 1.0) or vertical (0.0).
+        # Any values in between are considered "slopes" and use grainy normals.
+        absolute = material.node_tree.nodes.new('ShaderNodeMath')
+        absolute.operation = 'ABSOLUTE'
+        material.node_tree.links.new(
+            separate.outputs['Z'], absolute.inputs['Value'])
+
+        compare = material.node_tree.nodes.new('ShaderNodeMath')
+        compare.operation = 'COMPARE'
+        compare.inputs[1].default_value = 0.5
+        compare.inputs[2].default_value = 0.45
+        material.node_tree.links.new(
+            absolute.outputs['Value'], compare.inputs['Value'])
+
+        slope_normals = create_node_group(
+            material, 'ldr_tools_slope_normal', create_slope_normals_node_group)
+
+        is_stud = material.node_tree.nodes.new('ShaderNodeAttribute')
+        is_stud.attribute_name = 'ldr_is_stud'
+
+        # Don't apply the grainy slopes to any faces marked as studs.
+        # We use an attribute here to avoid per face material assignment.
+        subtract_studs = material.node_tree.nodes.new('ShaderNodeMath')
+        subtract_studs.operation = 'SUBTRACT'
+        material.node_tree.links.new(
+            compare.outputs['Value'], subtract_studs.inputs[0])
+        material.node_tree.links.new(
+            is_stud.outputs[2], subtract_studs.inputs[1])
+
+        # Choose between grainy and smooth normals depending on the face.
+        mix_normals = material.node_tree.nodes.new('ShaderNodeMix')
+        mix_normals.data_type = 'VECTOR'
+        material.node_tree.links.new(
+            subtract_studs.outputs['Value'], mix_normals.inputs['Factor'])
+        material.node_tree.links.new(
+            normals.outputs['Normal'], mix_normals.inputs[4])
+        material.node_tree.links.new(
+            slope_normals.outputs['Normal'], mix_normals.inputs[5])
+
+        # The second output is the vector output.
+        material.node_tree.links.new(
+            mix_normals.outputs[1], bsdf.inputs['Normal'])
+    else:
+        material.node_tree.links.new(
+            normals.outputs['Normal'], bsdf.inputs['Normal'])
 
 
 def create_node_group(material: bpy.types.Material, name: str, create_group: Callable[[str], bpy.types.NodeTree]):
@@ -294,7 +425,8 @@ def create_normals_node_group(name: str) -> bpy.types.NodeTree:
     # Faces of bricks are never perfectly flat.
     # Create a very low frequency noise to break up highlights
     noise = nodes.new('ShaderNodeTexNoise')
-    noise.inputs['Scale'].default_value = 0.01  # TODO: scene scale?
+    # Object coordinates are in meters.
+    noise.inputs['Scale'].default_value = 1.0
     noise.inputs['Detail'].default_value = 1.0
     noise.inputs['Roughness'].default_value = 1.0
     noise.inputs['Distortion'].default_value = 0.0
@@ -333,7 +465,7 @@ def create_slope_normals_node_group(name: str) -> bpy.types.NodeTree:
 
     # TODO: Set node positions.
     noise = nodes.new('ShaderNodeTexNoise')
-    noise.inputs['Scale'].default_value = 5.5
+    noise.inputs['Scale'].default_value = 550.0
     noise.inputs['Detail'].default_value = 3.0
     noise.inputs['Roughness'].default_value = 0.6
     noise.inputs['Lacunarity'].default_value = 2.0
@@ -0,0 +1,96 @@
+import json
+import os
+
+import bpy
+import numpy as np
+
+# Set this environment variable to a file path to write a JSON memory report for each import.
+REPORT_ENV_VAR = 'LDR_TOOLS_MEMORY_REPORT'
+
+# Bytes per element for each attribute data type.
+ATTRIBUTE_TYPE_BYTES = {
+    'FLOAT': 4,
+    'INT': 4,
+    'FLOAT_VECTOR': 12,
+    'FLOAT_COLOR': 16,
+    'BYTE_COLOR': 4,
+    'STRING': 8,
+    'BOOLEAN': 1,
+    'FLOAT2': 8,
+    'INT8': 1,
+    'INT32_2D': 8,
+    'QUATERNION': 16,
+}
+
+
+def array_bytes(value) -> int:
+    # Sum every array attribute to include arrays added to ldr_tools_py later.
+    size = 0
+    for name in dir(value):
+        if not name.startswith('_'):
+            attribute = getattr(value, name)
+            if isinstance(attribute, np.ndarray):
+                size += attribute.nbytes
+    return size
+
+
+def numpy_bytes(scene) -> dict:
+    # The actual buffer sizes for the arrays passed to Python.
+    geometries = list(getattr(scene, 'geometry_cache', {}).values())
+    geometries += list(getattr(scene, 'proxy_geometry_cache', {}).values())
+    for merged in getattr(scene, 'merged_geometry', {}).values():
+        geometries += [merged, merged.geometry]
+
+    geometry_bytes = sum(array_bytes(geometry) for geometry in geometries)
+
+    # Scenes loaded together share the geometry but not the instances.
+    point_instances = list(getattr(scene, 'geometry_point_instances', {}).values())
+    for model in getattr(scene, 'scenes', []):
+        point_instances += model.geometry_point_instances.values()
+
+    instance_bytes = sum(array_bytes(instances) for instances in point_instances)
+
+    for transforms in getattr(scene, 'geometry_world_transforms', {}).values():
+        instance_bytes += transforms.nbytes
+
+    return {
+        'geometry_bytes': geometry_bytes,
+        'instance_bytes': instance_bytes,
+        'total_bytes': geometry_bytes + instance_bytes,
+    }
+
+
+def mesh_bytes(mesh: bpy.types.Mesh) -> int:
+    # Estimate the size of the mesh data from its attributes.
+    # This includes built in attributes like positions and corner indices.
+    domain_sizes = {
+        'POINT': len(mesh.vertices),
+        'EDGE': len(mesh.edges),
+        'FACE': len(mesh.polygons),
+        'CORNER': len(mesh.loops),
+    }
+    size = 0
+    for attribute in mesh.attributes:
+        size += domain_sizes.get(attribute.domain, 0) * \
+            ATTRIBUTE_TYPE_BYTES.get(attribute.data_type, 4)
+
+    # Face offsets aren't stored as an attribute.
+    size += (len(mesh.polygons) + 1) * 4
+    return size
+
+
+def import_memory_report(scene, meshes: list[bpy.types.Mesh]) -> dict:
+    report = dict(scene.memory_report)
+    report['numpy'] = numpy_bytes(scene)
+    report['blender'] = {
+        'mesh_count': len(meshes),
+        'mesh_bytes': sum(mesh_bytes(mesh) for mesh in meshes),
+    }
+
+    path = os.environ.get(REPORT_ENV_VAR)
+    if path:
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Wrote import memory report to {path}')
+
+    return report
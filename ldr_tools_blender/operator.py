@@ -1,16 +1,45 @@
+import functools
 import os
 import json
 import bpy
 import numpy
-from bpy.props import StringProperty, EnumProperty, BoolProperty, FloatVectorProperty
+from bpy.props import StringProperty, EnumProperty, BoolProperty, FloatVectorProperty, IntProperty, CollectionProperty
 from bpy_extras.io_utils import ImportHelper
 from typing import Any
 import platform
 
-from .importldr import import_ldraw
+from .importldr import import_ldraw, import_ldraw_files, find_previous_import
+from . import file_watcher
+from . import ldr_tools_py
 
 custom_mesh_dir = os.path.dirname(os.path.abspath(__file__))+"/meshes"
 
+MAIN_MODEL = 'MAIN_MODEL'
+
+# Blender requires keeping a reference to dynamic enum items.
+# Only list the submodels again if the selected file changes.
+submodel_items_cache = {'key': None, 'items': []}
+
+
+def submodel_items(self, context):
+    try:
+        key = (self.filepath, os.path.getmtime(self.filepath))
+    except OSError:
+        key = None
+
+    if key != submodel_items_cache['key']:
+        try:
+            names = ldr_tools_py.list_submodels(self.filepath) if key else []
+        except Exception:
+            names = []
+        # The first file in an MPD is the main model.
+        items = [(MAIN_MODEL, "Main Model", "Import the main model")]
+        items += [(name, name, f"Import only {name}") for name in names[1:]]
+        submodel_items_cache['key'] = key
+        submodel_items_cache['items'] = items
+
+    return submodel_items_cache['items']
+
 def find_ldraw_library() -> str:
     # Get list of possible ldraw installation directories for the platform
     if platform.system() == 'Windows':
@@ -67,6 +96,16 @@ class Preferences():
         self.ground_object = True
         self.resolution = 'Normal'
         self.stud_logo = 'Normal'
+        self.cull_hidden_studs = False
+        self.remove_duplicate_parts = False
+        self.mark_sharp_edges = False
+        self.merge_coplanar_faces = False
+        self.viewport_proxies = False
+        self.update_existing = False
+        self.watch_file = False
+        self.share_part_meshes = False
+        self.use_snapshot_cache = False
+        self.geometry_batch_mb = 0
         self.unofficial_parts = True
         self.add_camera = False
         self.add_env_lighting = False
@@ -94,6 +133,26 @@ class Preferences():
             'resolution', defaults.resolution)
         self.stud_logo = dict.get(
             'stud_logo', defaults.stud_logo)
+        self.cull_hidden_studs = dict.get(
+            'cull_hidden_studs', defaults.cull_hidden_studs)
+        self.remove_duplicate_parts = dict.get(
+            'remove_duplicate_parts', defaults.remove_duplicate_parts)
+        self.mark_sharp_edges = dict.get(
+            'mark_sharp_edges', defaults.mark_sharp_edges)
+        self.merge_coplanar_faces = dict.get(
+            'merge_coplanar_faces', defaults.merge_coplanar_faces)
+        self.viewport_proxies = dict.get(
+            'viewport_proxies', defaults.viewport_proxies)
+        self.update_existing = dict.get(
+            'update_existing', defaults.update_existing)
+        self.watch_file = dict.get(
+            'watch_file', defaults.watch_file)
+        self.share_part_meshes = dict.get(
+            'share_part_meshes', defaults.share_part_meshes)
+        self.use_snapshot_cache = dict.get(
+            'use_snapshot_cache', defaults.use_snapshot_cache)
+        self.geometry_batch_mb = dict.get(
+            'geometry_batch_mb', defaults.geometry_batch_mb)
         self.add_camera = dict.get(
             'add_camera', defaults.add_camera)
         self.add_env_lighting = dict.get(
@@ -213,6 +272,17 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
         options={"HIDDEN"}
     ) # type: ignore
 
+    # Selecting multiple files imports each file with its own root object.
+    files: CollectionProperty(
+        type=bpy.types.OperatorFileListElement,
+        options={"HIDDEN", "SKIP_SAVE"}
+    ) # type: ignore
+
+    directory: StringProperty(
+        subtype="DIR_PATH",
+        options={"HIDDEN", "SKIP_SAVE"}
+    ) # type: ignore
+
     ldraw_path: StringProperty(
         name="",
         default=preferences.ldraw_path
@@ -224,7 +294,9 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
             ("LinkedDuplicates", "Linked Duplicates",
              "Objects with linked mesh data blocks (Alt+D). Easy to edit."),
             ('GeometryNodes', "Geometry Nodes",
-             "Geometry node instances on an instancer mesh. Faster imports for large scenes but #harder to edit.")
+             "Geometry node instances on an instancer mesh. Faster imports for large scenes but #harder to edit."),
+            ('Merged', "Merged",
+             "A single mesh for each material with all parts combined. Fastest for static render-only scenes but parts can't be edited individually.")
         ],
         description="The method to use for instancing part meshes",
         # TODO: this doesn't set properly?
@@ -251,12 +323,13 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
 
     resolution: EnumProperty(
         name="Resolution of primitives",
-        description="Resolution of primitive geometry (segments) - 8-Low, 16-Normal, 48-High",
+        description="Resolution of primitive geometry (segments) - 8-Low, 16-Normal, 48-High, or Adaptive per part",
         default=preferences.resolution,
         items=(
             ("Low",     "Low (8-seg)", "Import using low resolution primitives."),
             ("Normal",  "Normal (16-seg)", "Import using standard resolution primitives."),
-            ("High",    "High (48-seg)", "High resolution primitives - Added rendering and memory overheads ** Advise against using for complex models **")
+            ("High",    "High (48-seg)", "High resolution primitives - Added rendering and memory overheads ** Advise against using for complex models **"),
+            ("Adaptive", "Adaptive", "Select the resolution for each part. Large parts use high resolution and small or frequently repeated parts use low resolution.")
         )
     ) # type: ignore
 
@@ -272,6 +345,87 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
         )
     ) # type: ignore
 
+    cull_hidden_studs: BoolProperty(
+        name="Remove Hidden Studs",
+        description="Remove studs and tubes covered by other opaque parts. Not used for Linked Duplicates",
+        default=preferences.cull_hidden_studs
+    ) # type: ignore
+
+    remove_duplicate_parts: BoolProperty(
+        name="Remove Duplicate Parts",
+        description="Remove parts with the same color at the same position and rotation as another part. Not used for Linked Duplicates",
+        default=preferences.remove_duplicate_parts
+    ) # type: ignore
+
+    mark_sharp_edges: BoolProperty(
+        name="Mark Sharp Edges",
+        description="Mark hard edges as sharp instead of splitting vertices. Creates smaller meshes. Requires Blender 4.1 or later for correct shading",
+        default=preferences.mark_sharp_edges
+    ) # type: ignore
+
+    merge_coplanar_faces: BoolProperty(
+        name="Merge Coplanar Faces",
+        description="Merge adjacent flat faces with the same color into a single polygon. Creates smaller meshes for flat parts like plates and tiles",
+        default=preferences.merge_coplanar_faces
+    ) # type: ignore
+
+    viewport_proxies: BoolProperty(
+        name="Viewport Proxies",
+        description="Display low resolution parts without stud logos in the viewport and full resolution parts in renders. Not used for Merged or Geometry Batch Size",
+        default=preferences.viewport_proxies
+    ) # type: ignore
+
+    submodel: EnumProperty(
+        name="Submodel",
+        description="The submodel of an MPD file to import instead of the main model",
+        items=submodel_items
+    ) # type: ignore
+
+    max_step: IntProperty(
+        name="Max Step",
+        description="Only import the parts in the build steps up to and including this step. Steps are counted in building order across all submodels starting from 0, and steps without parts are skipped. -1 imports all steps",
+        default=-1,
+        min=-1
+    ) # type: ignore
+
+    frames_per_step: IntProperty(
+        name="Frames Per Step",
+        description="Animate the build by showing each build step after this many frames. Steps are counted the same way as Max Step. 0 shows all parts. Only used for Geometry Nodes",
+        default=0,
+        min=0
+    ) # type: ignore
+
+    share_part_meshes: BoolProperty(
+        name="Share Part Meshes",
+        description="Create one mesh for each part and store the color on each instance instead of creating a mesh for each part and color. Only used for Geometry Nodes",
+        default=preferences.share_part_meshes
+    ) # type: ignore
+
+    use_snapshot_cache: BoolProperty(
+        name="Snapshot Cache",
+        description="Save the loaded scene to a cache file and reuse it when importing the same unchanged model with the same settings",
+        default=preferences.use_snapshot_cache
+    ) # type: ignore
+
+    geometry_batch_mb: IntProperty(
+        name="Geometry Batch Size (MB)",
+        description="Create part meshes in batches of at most this size to limit peak memory usage for very large scenes. 0 creates all geometry at once. Only used for Geometry Nodes",
+        default=preferences.geometry_batch_mb,
+        min=0
+    ) # type: ignore
+
+    update_existing: BoolProperty(
+        name="Update Previous Import",
+        description="Only add, remove, or move the parts that changed since the last import of this file. Merged imports are replaced",
+        default=preferences.update_existing
+    ) # type: ignore
+
+    watch_file: BoolProperty(
+        name="Watch for Changes",
+        description="Update the import whenever the file is saved until the imported object is deleted",
+        default=preferences.watch_file
+    ) # type: ignore
+
     add_camera: BoolProperty(
         name="Add a Camera",
         description="Camera will be positioned and targeted towards the imported object",
@@ -344,6 +498,16 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
         ImportOperator.preferences.ground_object = self.ground_object
         ImportOperator.preferences.resolution = self.resolution
         ImportOperator.preferences.stud_logo = self.stud_logo
+        ImportOperator.preferences.cull_hidden_studs = self.cull_hidden_studs
+        ImportOperator.preferences.remove_duplicate_parts = self.remove_duplicate_parts
+        ImportOperator.preferences.mark_sharp_edges = self.mark_sharp_edges
+        ImportOperator.preferences.merge_coplanar_faces = self.merge_coplanar_faces
+        ImportOperator.preferences.viewport_proxies = self.viewport_proxies
+        ImportOperator.preferences.update_existing = self.update_existing
+        ImportOperator.preferences.watch_file = self.watch_file
+        ImportOperator.preferences.share_part_meshes = self.share_part_meshes
+        ImportOperator.preferences.use_snapshot_cache = self.use_snapshot_cache
+        ImportOperator.preferences.geometry_batch_mb = self.geometry_batch_mb
         ImportOperator.preferences.add_camera = self.add_camera
         ImportOperator.preferences.add_env_lighting = self.add_env_lighting
         ImportOperator.preferences.remove_lights = self.remove_lights
@@ -370,28 +534,85 @@ class ImportOperator(bpy.types.Operator, ImportHelper):
             "bg_color": bg_col_array,
         }
 
+        filepaths = [os.path.join(self.directory, f.name) for f in self.files if f.name]
+        if len(filepaths) <= 1:
+            filepaths = [self.filepath]
+
         import time
         start = time.time()
-        import_ldraw(
-            self,
-            self.filepath,
+        if len(filepaths) > 1 and self.instance_type == 'GeometryNodes':
+            # Share parsing and part meshes between files like the separate models of a layout.
+            import_ldraw_files(
+                self,
+                filepaths,
+                self.ldraw_path,
+                ImportOperator.preferences.additional_paths,
+                self.add_gap_between_parts,
+                self.resolution,
+                self.stud_logo,
+                self.cull_hidden_studs,
+                self.remove_duplicate_parts,
+                self.mark_sharp_edges,
+                self.merge_coplanar_faces,
+                self.max_step,
+                self.frames_per_step,
+                self.share_part_meshes,
+                self.ground_object,
+                self.unofficial_parts,
+                custom_mesh_dir,
+                env_settings
+            )
+            if self.watch_file:
+                for filepath in filepaths:
+                    self.watch_import(self.import_args(filepath, env_settings))
+        else:
+            for filepath in filepaths:
+                import_args = self.import_args(filepath, env_settings)
+                import_ldraw(self, *import_args, self.update_existing)
+                if self.watch_file:
+                    self.watch_import(import_args)
+        end = time.time()
+        print(f'Import: {round(end - start, 3)}s')
+
+        # Save preferences to disk for loading next time.
+        ImportOperator.preferences.save()
+        return {'FINISHED'}
+
+    def import_args(self, filepath: str, env_settings: dict) -> tuple:
+        # A submodel is only selected for a single file.
+        submodel = '' if self.submodel == MAIN_MODEL or len(self.files) > 1 else self.submodel
+        return (
+            filepath,
             self.ldraw_path,
             ImportOperator.preferences.additional_paths,
             self.instance_type,
             self.add_gap_between_parts,
             self.resolution,
             self.stud_logo,
+            self.cull_hidden_studs,
+            self.remove_duplicate_parts,
+            self.mark_sharp_edges,
+            self.merge_coplanar_faces,
+            self.viewport_proxies,
+            submodel,
+            self.max_step,
+            self.frames_per_step,
+            self.share_part_meshes,
+            self.use_snapshot_cache,
+            self.geometry_batch_mb,
             self.ground_object,
             self.unofficial_parts,
             custom_mesh_dir,
             env_settings
         )
-        end = time.time()
-        print(f'Import: {round(end - start, 3)}s')
 
-        # Save preferences to disk for loading next time.
-        ImportOperator.preferences.save()
-        return {'FINISHED'}
+    def watch_import(self, import_args: tuple):
+        # The operator is no longer valid when the file changes later.
+        filepath = import_args[0]
+        root_obj = find_previous_import(filepath, self.instance_type)
+        if root_obj is not None:
+            update = functools.partial(import_ldraw, None, *import_args, True)
+            file_watcher.watch_file(filepath, root_obj.name, update)
 
 class GEOMETRY_OPTIONS_PT_Panel(bpy.types.Panel):
     bl_space_type = 'FILE_BROWSER'
@@ -425,6 +646,32 @@ class GEOMETRY_OPTIONS_PT_Panel(bpy.types.Panel):
         col = row.column(align=True)
         col.prop(operator, "stud_logo", expand=True)
         row = layout.row()
+        row.prop(operator, "cull_hidden_studs")
+        row = layout.row()
+        row.prop(operator, "remove_duplicate_parts")
+        row = layout.row()
+        row.prop(operator, "mark_sharp_edges")
+        row = layout.row()
+        row.prop(operator, "merge_coplanar_faces")
+        row = layout.row()
+        row.prop(operator, "viewport_proxies")
+        row = layout.row()
+        row.prop(operator, "submodel")
+        row = layout.row()
+        row.prop(operator, "max_step")
+        row = layout.row()
+        row.prop(operator, "frames_per_step")
+        row = layout.row()
+        row.prop(operator, "share_part_meshes")
+        row = layout.row()
+        row.prop(operator, "use_snapshot_cache")
+        row = layout.row()
+        row.prop(operator, "geometry_batch_mb")
+        row = layout.row()
+        row.prop(operator, "update_existing")
+        row = layout.row()
+        row.prop(operator, "watch_file")
+        row = layout.row()
         row.prop(operator, "ground_object")
 
 
@@ -0,0 +1,38 @@
+import contextlib
+import os
+
+from . import ldr_tools_py
+
+# Set this environment variable to a file path to write a Chrome trace for each import.
+# The trace combines the ldr_tools spans from all threads with the importer phases below.
+TRACE_ENV_VAR = 'LDR_TOOLS_TRACE'
+
+
+@contextlib.contextmanager
+def profile_import():
+    path = os.environ.get(TRACE_ENV_VAR)
+    if not path or not ldr_tools_py.start_profiling():
+        yield
+        return
+
+    try:
+        with phase('import_ldraw'):
+            yield
+    finally:
+        ldr_tools_py.stop_profiling(path)
+        print(f'Wrote import trace to {path}')
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    # Avoid any overhead beyond a single call when profiling is disabled.
+    if not ldr_tools_py.is_profiling():
+        yield
+        return
+
+    start = ldr_tools_py.profile_timestamp()
+    try:
+        yield
+    finally:
+        ldr_tools_py.record_profile_event(
+            name, 'ldr_tools_blender', start, ldr_tools_py.profile_timestamp())
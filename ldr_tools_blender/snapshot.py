@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from . import ldr_tools_py
+
+# Set this environment variable to share snapshots between machines like render farm nodes.
+SNAPSHOT_DIR_ENV_VAR = 'LDR_TOOLS_SNAPSHOT_DIR'
+
+# Increment the version when changing the layout to ignore older snapshots.
+MAGIC = b'LDRSNAP1'
+FORMAT_VERSION = 5
+
+# Align arrays to allow viewing the memory map as any dtype without copies.
+ALIGNMENT = 64
+
+SETTINGS_FIELDS = ['triangulate', 'add_gap_between_parts', 'stud_type', 'primitive_resolution',
+                   'weld_vertices', 'scene_scale', 'axis_convention', 'unofficial_parts', 'cull_hidden_studs',
+                   'remove_duplicate_instances',
+                   'submodels', 'max_step', 'mark_sharp_edges', 'viewport_proxies',
+                   'reorder_for_locality', 'merge_coplanar_faces', 'region']
+
+POLICY_FIELDS = ['high_resolution_parts', 'low_resolution_min_instances',
+                 'high_resolution_min_size', 'low_resolution_max_size']
+
+GEOMETRY_ARRAYS = ['vertices', 'vertex_indices', 'face_start_indices', 'face_sizes',
+                   'face_colors', 'is_face_stud', 'edge_line_indices']
+
+INSTANCE_ARRAYS = ['translations', 'rotations_axis', 'rotations_angle', 'scales',
+                   'steps', 'submodels']
+
+
+def load_cached(load_fn, filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, settings):
+    # Load the scene from a previous snapshot or call load_fn and save a snapshot for next time.
+    # Only load_file and load_file_instanced_points scenes are supported.
+    kind = load_fn.__name__
+    if kind not in ['load_file', 'load_file_instanced_points']:
+        return load_fn(filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+
+    path = snapshot_path(kind, filepath, ldraw_path,
+                         additional_paths, custom_mesh_path, settings)
+    if os.path.isfile(path):
+        try:
+            scene = read_snapshot(path)
+            if scene is not None:
+                print(f'Loaded snapshot {path}')
+                return scene
+            print(f'Snapshot {path} is out of date')
+        except Exception as e:
+            print(f'Error reading snapshot {path}: {e}')
+
+    scene = load_fn(filepath, ldraw_path, additional_paths, custom_mesh_path, settings)
+    try:
+        write_snapshot(path, kind, scene)
+    except OSError as e:
+        print(f'Error writing snapshot {path}: {e}')
+    return scene
+
+
+def snapshot_dir() -> str:
+    return os.environ.get(SNAPSHOT_DIR_ENV_VAR) or os.path.join(tempfile.gettempdir(), 'ldr_tools_snapshots')
+
+
+def snapshot_path(kind: str, filepath: str, ldraw_path: str, additional_paths: list[str], custom_mesh_path: str, settings) -> str:
+    model_hash = file_hash(filepath)
+    library_hash = library_state_hash(
+        ldraw_path, ldr_tools_py.library_paths(ldraw_path, additional_paths, custom_mesh_path, settings))
+    settings_hash = hashlib.sha256(json.dumps(
+        settings_values(settings), sort_keys=True).encode()).hexdigest()
+
+    key = hashlib.sha256(
+        f'{FORMAT_VERSION}:{kind}:{model_hash}:{library_hash}:{settings_hash}'.encode()).hexdigest()
+    return os.path.join(snapshot_dir(), f'{key}.ldrsnap')
+
+
+def file_hash(path: str) -> str:
+    hash = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def library_state_hash(ldraw_path: str, library_paths: list[str]) -> str:
+    # Use the color table and the modified times of every folder searched for parts.
+    # Folders change modified times when files are added, removed, or replaced by updates.
+    # Edits to existing files are detected by checking the files used by each snapshot when reading.
+    hash = hashlib.sha256()
+    for path in [os.path.join(ldraw_path, 'LDConfig.ldr')] + library_paths:
+        hash.update(path.encode())
+        try:
+            stat = os.stat(path)
+            hash.update(f':{stat.st_mtime_ns}:{stat.st_size}'.encode())
+        except OSError:
+            pass
+    return hash.hexdigest()
+
+
+def files_changed(resolved_files: list[dict]) -> bool:
+    for file in resolved_files:
+        try:
+            stat = os.stat(file['path'])
+        except OSError:
+            return True
+        if stat.st_mtime_ns != file['modified_ns'] or stat.st_size != file['len']:
+            return True
+    return False
+
+
+def settings_values(settings) -> dict:
+    values = {name: str(getattr(settings, name)) for name in SETTINGS_FIELDS}
+    # Accessing the policy returns a copy, so only access it once.
+    policy = settings.primitive_policy
+    values['primitive_policy'] = {name: str(getattr(policy, name)) for name in POLICY_FIELDS}
+    return values
+
+
+def align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+
+    def add(self, array) -> dict:
+        # Store the location of each array in the JSON header.
+        array = np.ascontiguousarray(array)
+        offset = align(self.size)
+        self.arrays.append((offset, array))
+        self.size = offset + array.nbytes
+        return {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    def write(self, path: str, header: dict):
+        header_bytes = json.dumps(header).encode()
+        data_start = align(len(MAGIC) + 8 + len(header_bytes))
+
+        # Write to a temporary file first so other processes never read a partial snapshot.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(len(header_bytes).to_bytes(8, 'little'))
+            file.write(header_bytes)
+            for offset, array in self.arrays:
+                file.seek(data_start + offset)
+                file.write(array.tobytes())
+        os.replace(temp_path, path)
+
+
+def write_snapshot(path: str, kind: str, scene):
+    writer = SnapshotWriter()
+
+    geometry_cache = {name: encode_geometry(writer, geometry)
+                      for name, geometry in scene.geometry_cache.items()}
+    proxy_geometry_cache = {name: encode_geometry(writer, geometry)
+                            for name, geometry in scene.proxy_geometry_cache.items()}
+
+    header = {
+        'kind': kind,
+        'geometry_cache': geometry_cache,
+        'proxy_geometry_cache': proxy_geometry_cache,
+        'memory_report': scene.memory_report,
+        'resolved_files': [{'path': f.path, 'modified_ns': f.modified_ns, 'len': f.len}
+                           for f in scene.resolved_files],
+    }
+    if kind == 'load_file':
+        header['root_node'] = encode_node(scene.root_node)
+    else:
+        header['main_model_name'] = scene.main_model_name
+        header['submodel_names'] = scene.submodel_names
+        header['duplicate_instances'] = [
+            {'name': d.name, 'color': d.color, 'transform': [list(column) for column in d.transform],
+             'count': d.count, 'submodel': d.submodel}
+            for d in scene.duplicate_instances
+        ]
+        header['geometry_point_instances'] = [
+            {'name': name, 'color': color,
+             **{a: writer.add(getattr(instances, a)) for a in INSTANCE_ARRAYS}}
+            for (name, color), instances in scene.geometry_point_instances.items()
+        ]
+
+    writer.write(path, header)
+
+
+def encode_geometry(writer: SnapshotWriter, geometry) -> dict:
+    encoded = {a: writer.add(getattr(geometry, a)) for a in GEOMETRY_ARRAYS}
+    encoded['has_grainy_slopes'] = geometry.has_grainy_slopes
+    return encoded
+
+
+def encode_node(node) -> dict:
+    return {
+        'name': node.name,
+        'object_name': node.object_name,
+        'transform': [list(column) for column in node.transform],
+        'geometry_name': node.geometry_name,
+        'current_color': node.current_color,
+        'children': [encode_node(child) for child in node.children],
+    }
+
+
+def read_snapshot(path: str):
+    # Arrays are views into the memory map, so only the accessed pages are read from disk.
+    # Returns None if any of the model or library files changed since writing the snapshot
+    # or the restored scene is missing fields of the scene returned by ldr_tools_py.
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not an ldr_tools snapshot')
+
+    header_size = int.from_bytes(bytes(data[len(MAGIC):len(MAGIC) + 8]), 'little')
+    header_start = len(MAGIC) + 8
+    header = json.loads(bytes(data[header_start:header_start + header_size]))
+    data_start = align(header_start + header_size)
+
+    if files_changed(header['resolved_files']):
+        return None
+    resolved_files = [SimpleNamespace(**f) for f in header['resolved_files']]
+
+    def array(entry: dict):
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        count = int(np.prod(entry['shape']))
+        return data[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+
+    geometry_cache = {name: decode_geometry(array, geometry)
+                      for name, geometry in header['geometry_cache'].items()}
+    proxy_geometry_cache = {name: decode_geometry(array, geometry)
+                            for name, geometry in header['proxy_geometry_cache'].items()}
+
+    if header['kind'] == 'load_file':
+        root_node = decode_node(header['root_node'])
+        scene = SimpleNamespace(
+            root_node=root_node,
+            geometry_cache=geometry_cache,
+            proxy_geometry_cache=proxy_geometry_cache,
+            memory_report=header['memory_report'],
+            resolved_files=resolved_files,
+        )
+        values = [(scene, ldr_tools_py.LDrawScene), (root_node, ldr_tools_py.LDrawNode)]
+    else:
+        geometry_point_instances = {
+            (instances['name'], instances['color']): SimpleNamespace(
+                **{a: array(instances[a]) for a in INSTANCE_ARRAYS})
+            for instances in header['geometry_point_instances']
+        }
+        duplicate_instances = [SimpleNamespace(**d) for d in header['duplicate_instances']]
+        scene = SimpleNamespace(
+            main_model_name=header['main_model_name'],
+            geometry_point_instances=geometry_point_instances,
+            submodel_names=header['submodel_names'],
+            # The index isn't stored since it's quick to rebuild from the instances.
+            instance_index=ldr_tools_py.point_instance_index(geometry_cache, geometry_point_instances),
+            duplicate_instances=duplicate_instances,
+            geometry_cache=geometry_cache,
+            proxy_geometry_cache=proxy_geometry_cache,
+            memory_report=header['memory_report'],
+            resolved_files=resolved_files,
+        )
+        values = [(scene, ldr_tools_py.LDrawSceneInstancedPoints)]
+        values += [(i, ldr_tools_py.PointInstances) for i in geometry_point_instances.values()]
+        values += [(d, ldr_tools_py.DuplicateInstances) for d in duplicate_instances]
+
+    values += [(g, ldr_tools_py.LDrawGeometry) for g in geometry_cache.values()]
+    values += [(g, ldr_tools_py.LDrawGeometry) for g in proxy_geometry_cache.values()]
+    values += [(f, ldr_tools_py.ResolvedFile) for f in resolved_files]
+    if not all(has_fields(value, cls) for value, cls in values):
+        return None
+    return scene
+
+
+def has_fields(value, cls) -> bool:
+    # Code using fields added to ldr_tools_py would fail on scenes restored from older snapshots.
+    return all(hasattr(value, name) for name in dir(cls) if not name.startswith('_'))
+
+
+def decode_geometry(array, geometry: dict):
+    return SimpleNamespace(
+        **{a: array(geometry[a]) for a in GEOMETRY_ARRAYS},
+        has_grainy_slopes=geometry['has_grainy_slopes'],
+    )
+
+
+def decode_node(node: dict):
+    return SimpleNamespace(
+        name=node['name'],
+        object_name=node['object_name'],
+        transform=node['transform'],
+        geometry_name=node['geometry_name'],
+        current_color=node['current_color'],
+        children=[decode_node(child) for child in node['children']],
+    )
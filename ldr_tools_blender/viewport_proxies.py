@@ -0,0 +1,65 @@
+import bpy
+from bpy.app.handlers import persistent
+
+# Objects with proxies show the proxy mesh and swap to the full mesh while rendering.
+# Both meshes are stored on the object to survive saving and reopening the file.
+PROXY_MESH = 'ldr_proxy_mesh'
+RENDER_MESH = 'ldr_render_mesh'
+
+
+def use_proxy(obj: bpy.types.Object, proxy_mesh: bpy.types.Mesh):
+    obj[RENDER_MESH] = obj.data
+    obj[PROXY_MESH] = proxy_mesh
+    obj.data = proxy_mesh
+
+
+def render_mesh(obj: bpy.types.Object) -> bpy.types.Mesh | None:
+    # The full resolution mesh even if the proxy is currently shown.
+    return obj.get(RENDER_MESH, obj.data)
+
+
+def set_meshes(obj: bpy.types.Object, mesh: bpy.types.Mesh, proxy_mesh: bpy.types.Mesh | None):
+    if proxy_mesh is not None:
+        obj.data = mesh
+        use_proxy(obj, proxy_mesh)
+    else:
+        for key in [RENDER_MESH, PROXY_MESH]:
+            if key in obj:
+                del obj[key]
+        obj.data = mesh
+
+
+def swap_meshes(key: str):
+    for obj in bpy.data.objects:
+        mesh = obj.get(key)
+        if mesh is not None and obj.data != mesh:
+            obj.data = mesh
+
+
+@persistent
+def use_render_meshes(*args):
+    swap_meshes(RENDER_MESH)
+
+
+@persistent
+def use_proxy_meshes(*args):
+    swap_meshes(PROXY_MESH)
+
+
+HANDLERS = [
+    (bpy.app.handlers.render_pre, use_render_meshes),
+    (bpy.app.handlers.render_post, use_proxy_meshes),
+    (bpy.app.handlers.render_cancel, use_proxy_meshes),
+]
+
+
+def register():
+    for handlers, handler in HANDLERS:
+        if handler not in handlers:
+            handlers.append(handler)
+
+
+def unregister():
+    for handlers, handler in HANDLERS:
+        if handler in handlers:
+            handlers.remove(handler)
@@ -1,7 +1,14 @@
-use std::collections::HashMap;
+use std::{collections::HashMap, sync::Arc};
 
-use numpy::IntoPyArray;
-use pyo3::prelude::*;
+use ldr_tools::glam::Vec3;
+use numpy::{IntoPyArray, PyReadonlyArray1, PyReadonlyArray2};
+use pyo3::{buffer::PyBuffer, prelude::*, types::PyDict};
+
+// Track allocations to report the peak memory usage for each import.
+// Counting slows down every allocation, so this requires the count-allocations feature.
+#[cfg(feature = "count-allocations")]
+#[global_allocator]
+static ALLOCATOR: ldr_tools::memory::CountingAllocator = ldr_tools::memory::CountingAllocator;
 
 macro_rules! python_enum {
     ($py_ty:ident, $rust_ty:ty, $( $i:ident ),+) => {
@@ -34,6 +41,7 @@ macro_rules! python_enum {
 #[derive(Debug, Clone)]
 pub struct LDrawNode {
     name: String,
+    object_name: String,
     transform: [[f32; 4]; 4],
     geometry_name: Option<String>,
     current_color: u32,
@@ -44,6 +52,7 @@ impl From<ldr_tools::LDrawNode> for LDrawNode {
     fn from(node: ldr_tools::LDrawNode) -> Self {
         Self {
             name: node.name,
+            object_name: node.object_name,
             transform: node.transform.to_cols_array_2d(),
             geometry_name: node.geometry_name,
             current_color: node.current_color,
@@ -57,6 +66,9 @@ impl From<ldr_tools::LDrawNode> for LDrawNode {
 pub struct LDrawScene {
     pub root_node: LDrawNode,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory_report: PyObject,
+    pub resolved_files: Vec<ResolvedFile>,
 }
 
 #[pyclass(get_all)]
@@ -64,7 +76,12 @@ pub struct LDrawScene {
 pub struct LDrawSceneInstanced {
     pub main_model_name: String,
     pub geometry_world_transforms: HashMap<(String, u32), PyObject>,
+    pub instance_index: InstanceIndex,
+    pub duplicate_instances: Vec<DuplicateInstances>,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory_report: PyObject,
+    pub resolved_files: Vec<ResolvedFile>,
 }
 
 #[pyclass(get_all)]
@@ -72,7 +89,104 @@ pub struct LDrawSceneInstanced {
 pub struct LDrawSceneInstancedPoints {
     pub main_model_name: String,
     pub geometry_point_instances: HashMap<(String, u32), PointInstances>,
+    pub submodel_names: Vec<String>,
+    pub instance_index: InstanceIndex,
+    pub duplicate_instances: Vec<DuplicateInstances>,
+    pub geometry_cache: HashMap<String, LDrawGeometry>,
+    pub proxy_geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory_report: PyObject,
+    pub resolved_files: Vec<ResolvedFile>,
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct LDrawScenesInstancedPoints {
+    pub scenes: Vec<LDrawModelInstancedPoints>,
     pub geometry_cache: HashMap<String, LDrawGeometry>,
+    pub memory_report: PyObject,
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct LDrawModelInstancedPoints {
+    pub main_model_name: String,
+    pub geometry_point_instances: HashMap<(String, u32), PointInstances>,
+    pub submodel_names: Vec<String>,
+    pub instance_index: InstanceIndex,
+    pub duplicate_instances: Vec<DuplicateInstances>,
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct LDrawSceneMerged {
+    pub main_model_name: String,
+    pub merged_geometry: HashMap<(u32, bool), MergedGeometry>,
+    pub duplicate_instances: Vec<DuplicateInstances>,
+    pub memory_report: PyObject,
+}
+
+/// Instances of the same part and color at the same transform.
+/// The transform of the kept instance uses LDUs and LDraw coordinates.
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct DuplicateInstances {
+    name: String,
+    color: u32,
+    transform: [[f32; 4]; 4],
+    count: usize,
+    submodel: u32,
+}
+
+impl From<ldr_tools::DuplicateInstances> for DuplicateInstances {
+    fn from(value: ldr_tools::DuplicateInstances) -> Self {
+        Self {
+            name: value.name,
+            color: value.color,
+            transform: value.transform.to_cols_array_2d(),
+            count: value.count,
+            submodel: value.submodel,
+        }
+    }
+}
+
+fn py_duplicate_instances(
+    duplicate_instances: Vec<ldr_tools::DuplicateInstances>,
+) -> Vec<DuplicateInstances> {
+    duplicate_instances.into_iter().map(Into::into).collect()
+}
+
+/// A file read from disk while loading a scene.
+/// The modified time uses nanoseconds since the Unix epoch like `os.stat().st_mtime_ns`.
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct ResolvedFile {
+    path: String,
+    modified_ns: Option<u64>,
+    len: u64,
+}
+
+impl From<ldr_tools::ResolvedFile> for ResolvedFile {
+    fn from(value: ldr_tools::ResolvedFile) -> Self {
+        Self {
+            path: value.path.to_string_lossy().to_string(),
+            modified_ns: value
+                .modified
+                .and_then(|t| t.duration_since(std::time::UNIX_EPOCH).ok())
+                .map(|d| d.as_nanos() as u64),
+            len: value.len,
+        }
+    }
+}
+
+fn py_resolved_files(resolved_files: Vec<ldr_tools::ResolvedFile>) -> Vec<ResolvedFile> {
+    resolved_files.into_iter().map(Into::into).collect()
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct MergedGeometry {
+    geometry: LDrawGeometry,
+    part_normals: PyObject,
 }
 
 // Use numpy arrays (PyObject) for reduced overhead.
@@ -84,7 +198,7 @@ pub struct LDrawGeometry {
     face_start_indices: PyObject,
     face_sizes: PyObject,
     face_colors: PyObject,
-    is_face_stud: Vec<bool>,
+    is_face_stud: PyObject,
     edge_line_indices: PyObject,
     has_grainy_slopes: bool,
 }
@@ -101,7 +215,7 @@ impl LDrawGeometry {
             face_start_indices: geometry.face_start_indices.into_pyarray(py).into(),
             face_sizes: geometry.face_sizes.into_pyarray(py).into(),
             face_colors: geometry.face_colors.into_pyarray(py).into(),
-            is_face_stud: geometry.is_face_stud,
+            is_face_stud: geometry.is_face_stud.into_pyarray(py).into(),
             edge_line_indices: geometry
                 .edge_line_indices
                 .into_iter()
@@ -144,9 +258,137 @@ pub struct GeometrySettings {
     add_gap_between_parts: bool,
     stud_type: StudType,
     primitive_resolution: PrimitiveResolution,
+    primitive_policy: PrimitivePolicy,
     weld_vertices: bool,
     scene_scale: f32,
+    axis_convention: AxisConvention,
     unofficial_parts: bool,
+    cull_hidden_studs: bool,
+    remove_duplicate_instances: bool,
+    submodels: Vec<String>,
+    max_step: Option<usize>,
+    mark_sharp_edges: bool,
+    viewport_proxies: bool,
+    reorder_for_locality: bool,
+    merge_coplanar_faces: bool,
+    region: Option<Region>,
+}
+
+/// A region for `GeometrySettings.region` or spatial queries.
+/// Regions use the scene scale and axis convention of the settings.
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct Region {
+    region: ldr_tools::Region,
+}
+
+#[pymethods]
+impl Region {
+    #[staticmethod]
+    fn from_box(min: [f32; 3], max: [f32; 3]) -> Self {
+        Self {
+            region: ldr_tools::Region::Box(ldr_tools::Bounds {
+                min: min.into(),
+                max: max.into(),
+            }),
+        }
+    }
+
+    /// Each plane is `[x, y, z, w]` with `dot([x, y, z], point) + w >= 0.0` for points inside.
+    #[staticmethod]
+    fn from_frustum(planes: Vec<[f32; 4]>) -> Self {
+        Self {
+            region: ldr_tools::Region::Frustum(planes.into_iter().map(Into::into).collect()),
+        }
+    }
+
+    fn __repr__(&self) -> String {
+        format!("{:?}", self.region)
+    }
+}
+
+/// Spatial queries over the world bounds of instances.
+/// Queries return the `(name, color)` key and index of each instance.
+#[pyclass]
+#[derive(Debug, Clone)]
+pub struct InstanceIndex {
+    index: Arc<ldr_tools::InstanceIndex>,
+}
+
+#[pymethods]
+impl InstanceIndex {
+    fn query_box(&self, min: [f32; 3], max: [f32; 3]) -> Vec<((String, u32), usize)> {
+        instance_ids(self.index.query_box(&ldr_tools::Bounds {
+            min: min.into(),
+            max: max.into(),
+        }))
+    }
+
+    fn query_frustum(&self, planes: Vec<[f32; 4]>) -> Vec<((String, u32), usize)> {
+        let planes: Vec<_> = planes.into_iter().map(Into::into).collect();
+        instance_ids(self.index.query_frustum(&planes))
+    }
+
+    fn query(&self, region: &Region) -> Vec<((String, u32), usize)> {
+        instance_ids(self.index.query(&region.region))
+    }
+
+    fn __len__(&self) -> usize {
+        self.index.len()
+    }
+}
+
+impl From<ldr_tools::InstanceIndex> for InstanceIndex {
+    fn from(index: ldr_tools::InstanceIndex) -> Self {
+        Self {
+            index: Arc::new(index),
+        }
+    }
+}
+
+fn instance_ids(ids: Vec<(&(String, u32), usize)>) -> Vec<((String, u32), usize)> {
+    ids.into_iter().map(|(key, i)| (key.clone(), i)).collect()
+}
+
+/// Assign a new policy to `GeometrySettings.primitive_policy` after making changes,
+/// since accessing the field returns a copy.
+#[pyclass(get_all, set_all)]
+#[derive(Debug, Clone)]
+pub struct PrimitivePolicy {
+    high_resolution_parts: Vec<String>,
+    low_resolution_min_instances: Option<usize>,
+    high_resolution_min_size: Option<f32>,
+    low_resolution_max_size: Option<f32>,
+}
+
+#[pymethods]
+impl PrimitivePolicy {
+    #[new]
+    fn new() -> Self {
+        ldr_tools::PrimitivePolicy::default().into()
+    }
+}
+
+impl From<ldr_tools::PrimitivePolicy> for PrimitivePolicy {
+    fn from(value: ldr_tools::PrimitivePolicy) -> Self {
+        Self {
+            high_resolution_parts: value.high_resolution_parts,
+            low_resolution_min_instances: value.low_resolution_min_instances,
+            high_resolution_min_size: value.high_resolution_min_size,
+            low_resolution_max_size: value.low_resolution_max_size,
+        }
+    }
+}
+
+impl From<&PrimitivePolicy> for ldr_tools::PrimitivePolicy {
+    fn from(value: &PrimitivePolicy) -> Self {
+        Self {
+            high_resolution_parts: value.high_resolution_parts.clone(),
+            low_resolution_min_instances: value.low_resolution_min_instances,
+            high_resolution_min_size: value.high_resolution_min_size,
+            low_resolution_max_size: value.low_resolution_max_size,
+        }
+    }
 }
 
 python_enum!(
@@ -158,12 +400,15 @@ python_enum!(
     HighContrast
 );
 
+python_enum!(AxisConvention, ldr_tools::AxisConvention, LDraw, ZUp);
+
 python_enum!(
     PrimitiveResolution,
     ldr_tools::PrimitiveResolution,
     Low,
     Normal,
-    High
+    High,
+    Adaptive
 );
 
 #[pymethods]
@@ -181,9 +426,20 @@ impl From<ldr_tools::GeometrySettings> for GeometrySettings {
             add_gap_between_parts: value.add_gap_between_parts,
             stud_type: value.stud_type.into(),
             primitive_resolution: value.primitive_resolution.into(),
+            primitive_policy: value.primitive_policy.into(),
             weld_vertices: value.weld_vertices,
             scene_scale: value.scene_scale,
+            axis_convention: value.axis_convention.into(),
             unofficial_parts: value.unofficial_parts,
+            cull_hidden_studs: value.cull_hidden_studs,
+            remove_duplicate_instances: value.remove_duplicate_instances,
+            submodels: value.submodels,
+            max_step: value.max_step,
+            mark_sharp_edges: value.mark_sharp_edges,
+            viewport_proxies: value.viewport_proxies,
+            reorder_for_locality: value.reorder_for_locality,
+            merge_coplanar_faces: value.merge_coplanar_faces,
+            region: value.region.map(|region| Region { region }),
         }
     }
 }
@@ -195,8 +451,19 @@ impl From<&GeometrySettings> for ldr_tools::GeometrySettings {
             stud_type: value.stud_type.into(),
             weld_vertices: value.weld_vertices,
             primitive_resolution: value.primitive_resolution.into(),
+            primitive_policy: (&value.primitive_policy).into(),
             scene_scale: value.scene_scale,
-            unofficial_parts: value.unofficial_parts
+            axis_convention: value.axis_convention.into(),
+            unofficial_parts: value.unofficial_parts,
+            cull_hidden_studs: value.cull_hidden_studs,
+            remove_duplicate_instances: value.remove_duplicate_instances,
+            submodels: value.submodels.clone(),
+            max_step: value.max_step,
+            mark_sharp_edges: value.mark_sharp_edges,
+            viewport_proxies: value.viewport_proxies,
+            reorder_for_locality: value.reorder_for_locality,
+            merge_coplanar_faces: value.merge_coplanar_faces,
+            region: value.region.as_ref().map(|r| r.region.clone()),
         }
     }
 }
@@ -208,6 +475,8 @@ pub struct PointInstances {
     rotations_axis: PyObject,
     rotations_angle: PyObject,
     scales: PyObject,
+    steps: PyObject,
+    submodels: PyObject,
 }
 
 impl PointInstances {
@@ -217,10 +486,22 @@ impl PointInstances {
             rotations_axis: pyarray_vec3(py, instances.rotations_axis),
             rotations_angle: instances.rotations_angle.into_pyarray(py).into(),
             scales: pyarray_vec3(py, instances.scales),
+            steps: instances.steps.into_pyarray(py).into(),
+            submodels: instances.submodels.into_pyarray(py).into(),
         }
     }
 }
 
+fn py_geometry_cache(
+    py: Python,
+    geometry_cache: HashMap<String, ldr_tools::LDrawGeometry>,
+) -> HashMap<String, LDrawGeometry> {
+    geometry_cache
+        .into_iter()
+        .map(|(k, v)| (k, LDrawGeometry::from_geometry(py, v)))
+        .collect()
+}
+
 #[pyfunction]
 fn load_file(
     py: Python,
@@ -233,17 +514,67 @@ fn load_file(
     // TODO: This timing code doesn't need to be here.
     let start = std::time::Instant::now();
     let scene = ldr_tools::load_file(path, ldraw_path, &additional_paths, custom_mesh_path, &settings.into());
+    let scene = py_scene(py, scene);
+    println!("load_file: {:?}", start.elapsed());
+    scene
+}
+
+/// Load a model from `contents` like `load_file` without reading the model from disk.
+/// `subfiles` maps file names referenced by the model to their contents.
+/// Library parts are still loaded from `ldraw_path` and `additional_paths`.
+#[pyfunction]
+fn load_bytes(
+    py: Python,
+    name: &str,
+    contents: PyBuffer<u8>,
+    subfiles: HashMap<String, PyBuffer<u8>>,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> PyResult<LDrawScene> {
+    let start = std::time::Instant::now();
+    let (contents, subfiles) = buffer_contents(py, contents, subfiles)?;
+    let scene = ldr_tools::load_bytes(
+        name,
+        contents,
+        subfiles,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+    );
+    let scene = py_scene(py, scene);
+    println!("load_bytes: {:?}", start.elapsed());
+    scene
+}
+
+fn buffer_contents(
+    py: Python,
+    contents: PyBuffer<u8>,
+    subfiles: HashMap<String, PyBuffer<u8>>,
+) -> PyResult<(Vec<u8>, HashMap<String, Vec<u8>>)> {
+    let subfiles = subfiles
+        .into_iter()
+        .map(|(name, buffer)| Ok((name, buffer.to_vec(py)?)))
+        .collect::<PyResult<_>>()?;
+    Ok((contents.to_vec(py)?, subfiles))
+}
 
+fn py_scene(py: Python, scene: ldr_tools::LDrawScene) -> PyResult<LDrawScene> {
     let geometry_cache = scene
         .geometry_cache
         .into_iter()
         .map(|(k, v)| (k, LDrawGeometry::from_geometry(py, v)))
         .collect();
-    println!("load_file: {:?}", start.elapsed());
+    let proxy_geometry_cache = py_geometry_cache(py, scene.proxy_geometry_cache);
 
     Ok(LDrawScene {
         root_node: scene.root_node.into(),
         geometry_cache,
+        proxy_geometry_cache,
+        memory_report: memory_report_dict(py, &scene.memory)?,
+        resolved_files: py_resolved_files(scene.resolved_files),
     })
 }
 
@@ -288,12 +619,19 @@ fn load_file_instanced(
         })
         .collect();
 
+    let proxy_geometry_cache = py_geometry_cache(py, scene.proxy_geometry_cache);
+
     println!("load_file_instanced: {:?}", start.elapsed());
 
     Ok(LDrawSceneInstanced {
         main_model_name: scene.main_model_name,
         geometry_world_transforms,
+        instance_index: scene.instance_index.into(),
+        duplicate_instances: py_duplicate_instances(scene.duplicate_instances),
         geometry_cache,
+        proxy_geometry_cache,
+        memory_report: memory_report_dict(py, &scene.memory)?,
+        resolved_files: py_resolved_files(scene.resolved_files),
     })
 }
 
@@ -314,7 +652,44 @@ fn load_file_instanced_points(
         custom_mesh_path,
         &settings.into(),
     );
+    let scene = py_scene_instanced_points(py, scene);
+    println!("load_file_instanced_points: {:?}", start.elapsed());
+    scene
+}
 
+/// Load a model from `contents` like `load_file_instanced_points`.
+/// See `load_bytes` for details.
+#[pyfunction]
+fn load_bytes_instanced_points(
+    py: Python,
+    name: &str,
+    contents: PyBuffer<u8>,
+    subfiles: HashMap<String, PyBuffer<u8>>,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> PyResult<LDrawSceneInstancedPoints> {
+    let start = std::time::Instant::now();
+    let (contents, subfiles) = buffer_contents(py, contents, subfiles)?;
+    let scene = ldr_tools::load_bytes_instanced_points(
+        name,
+        contents,
+        subfiles,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+    );
+    let scene = py_scene_instanced_points(py, scene);
+    println!("load_bytes_instanced_points: {:?}", start.elapsed());
+    scene
+}
+
+fn py_scene_instanced_points(
+    py: Python,
+    scene: ldr_tools::LDrawSceneInstancedPoints,
+) -> PyResult<LDrawSceneInstancedPoints> {
     let geometry_cache = scene
         .geometry_cache
         .into_iter()
@@ -327,15 +702,305 @@ fn load_file_instanced_points(
         .map(|(k, v)| (k, PointInstances::from_instances(py, v)))
         .collect();
 
-    println!("load_file_instanced_points: {:?}", start.elapsed());
+    let proxy_geometry_cache = py_geometry_cache(py, scene.proxy_geometry_cache);
 
     Ok(LDrawSceneInstancedPoints {
         main_model_name: scene.main_model_name,
         geometry_point_instances,
+        submodel_names: scene.submodel_names,
+        instance_index: scene.instance_index.into(),
+        duplicate_instances: py_duplicate_instances(scene.duplicate_instances),
         geometry_cache,
+        proxy_geometry_cache,
+        memory_report: memory_report_dict(py, &scene.memory)?,
+        resolved_files: py_resolved_files(scene.resolved_files),
     })
 }
 
+/// Load the file and call `on_batch(geometry_cache, colors)` for each batch of geometry.
+/// The returned scene has an empty geometry cache.
+#[pyfunction]
+fn load_file_instanced_points_batched(
+    py: Python,
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+    max_batch_bytes: usize,
+    on_batch: PyObject,
+) -> PyResult<LDrawSceneInstancedPoints> {
+    let start = std::time::Instant::now();
+    let scene = ldr_tools::load_file_instanced_points_batched(
+        path,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+        max_batch_bytes,
+        |batch| {
+            // The NumPy arrays can be freed as soon as the callback releases them.
+            let geometry_cache: HashMap<_, _> = batch
+                .geometry
+                .into_iter()
+                .map(|(k, v)| (k, LDrawGeometry::from_geometry(py, v)))
+                .collect();
+            on_batch.call1(py, (geometry_cache, batch.colors))?;
+            Ok::<(), PyErr>(())
+        },
+    )?;
+
+    let geometry_point_instances = scene
+        .geometry_point_instances
+        .into_iter()
+        .map(|(k, v)| (k, PointInstances::from_instances(py, v)))
+        .collect();
+
+    println!("load_file_instanced_points_batched: {:?}", start.elapsed());
+
+    Ok(LDrawSceneInstancedPoints {
+        main_model_name: scene.main_model_name,
+        geometry_point_instances,
+        submodel_names: scene.submodel_names,
+        instance_index: scene.instance_index.into(),
+        duplicate_instances: py_duplicate_instances(scene.duplicate_instances),
+        geometry_cache: HashMap::new(),
+        proxy_geometry_cache: HashMap::new(),
+        memory_report: memory_report_dict(py, &scene.memory)?,
+        resolved_files: py_resolved_files(scene.resolved_files),
+    })
+}
+
+/// Load multiple files with a single geometry cache shared by all scenes.
+#[pyfunction]
+fn load_files_instanced_points(
+    py: Python,
+    paths: Vec<&str>,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> PyResult<LDrawScenesInstancedPoints> {
+    let start = std::time::Instant::now();
+    let scenes = ldr_tools::load_files_instanced_points(
+        &paths,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+    );
+
+    let geometry_cache = scenes
+        .geometry_cache
+        .into_iter()
+        .map(|(k, v)| (k, LDrawGeometry::from_geometry(py, v)))
+        .collect();
+
+    let models = scenes
+        .scenes
+        .into_iter()
+        .map(|scene| LDrawModelInstancedPoints {
+            main_model_name: scene.main_model_name,
+            geometry_point_instances: scene
+                .geometry_point_instances
+                .into_iter()
+                .map(|(k, v)| (k, PointInstances::from_instances(py, v)))
+                .collect(),
+            submodel_names: scene.submodel_names,
+            instance_index: scene.instance_index.into(),
+            duplicate_instances: py_duplicate_instances(scene.duplicate_instances),
+        })
+        .collect();
+
+    println!("load_files_instanced_points: {:?}", start.elapsed());
+
+    Ok(LDrawScenesInstancedPoints {
+        scenes: models,
+        geometry_cache,
+        memory_report: memory_report_dict(py, &scenes.memory)?,
+    })
+}
+
+/// Load the file and merge all instances into a single geometry for each color.
+#[pyfunction]
+fn load_file_merged(
+    py: Python,
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> PyResult<LDrawSceneMerged> {
+    let start = std::time::Instant::now();
+    let scene = ldr_tools::load_file_merged(
+        path,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+    );
+
+    let merged_geometry = scene
+        .merged_geometry
+        .into_iter()
+        .map(|(k, v)| {
+            let merged = MergedGeometry {
+                geometry: LDrawGeometry::from_geometry(py, v.geometry),
+                part_normals: pyarray_vec3(py, v.part_normals),
+            };
+            (k, merged)
+        })
+        .collect();
+
+    println!("load_file_merged: {:?}", start.elapsed());
+
+    Ok(LDrawSceneMerged {
+        main_model_name: scene.main_model_name,
+        merged_geometry,
+        duplicate_instances: py_duplicate_instances(scene.duplicate_instances),
+        memory_report: memory_report_dict(py, &scene.memory)?,
+    })
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct PartStatistics {
+    instance_count: usize,
+    color_count: usize,
+    face_count: usize,
+    triangle_count: usize,
+    vertex_count: usize,
+    edge_count: usize,
+}
+
+impl From<ldr_tools::analysis::PartStatistics> for PartStatistics {
+    fn from(value: ldr_tools::analysis::PartStatistics) -> Self {
+        Self {
+            instance_count: value.instance_count,
+            color_count: value.color_count,
+            face_count: value.counts.face_count,
+            triangle_count: value.counts.triangle_count,
+            vertex_count: value.counts.vertex_count,
+            edge_count: value.counts.edge_count,
+        }
+    }
+}
+
+#[pyclass(get_all)]
+#[derive(Debug, Clone)]
+pub struct SceneAnalysis {
+    main_model_name: String,
+    part_count: usize,
+    unique_part_colors: usize,
+    parts: HashMap<String, PartStatistics>,
+    missing_files: Vec<String>,
+    triangle_count: usize,
+    vertex_count: usize,
+    memory_estimates: HashMap<String, usize>,
+}
+
+impl From<ldr_tools::analysis::SceneAnalysis> for SceneAnalysis {
+    fn from(value: ldr_tools::analysis::SceneAnalysis) -> Self {
+        Self {
+            main_model_name: value.main_model_name,
+            part_count: value.part_count,
+            unique_part_colors: value.unique_part_colors,
+            parts: value
+                .parts
+                .into_iter()
+                .map(|(k, v)| (k, v.into()))
+                .collect(),
+            missing_files: value.missing_files,
+            triangle_count: value.triangle_count,
+            vertex_count: value.vertex_count,
+            memory_estimates: value.memory_estimates,
+        }
+    }
+}
+
+/// Find part counts, triangle estimates, missing files, and memory estimates
+/// for each instance type without creating any geometry.
+#[pyfunction]
+fn analyze_file(
+    path: &str,
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> PyResult<SceneAnalysis> {
+    Ok(ldr_tools::analysis::analyze_file(
+        path,
+        ldraw_path,
+        &additional_paths,
+        custom_mesh_path,
+        &settings.into(),
+    )
+    .into())
+}
+
+/// The folders searched for library files in priority order.
+#[pyfunction]
+fn library_paths(
+    ldraw_path: &str,
+    additional_paths: Vec<&str>,
+    custom_mesh_path: &str,
+    settings: &GeometrySettings,
+) -> Vec<String> {
+    ldr_tools::library_paths(ldraw_path, &additional_paths, custom_mesh_path, &settings.into())
+        .iter()
+        .map(|path| path.to_string_lossy().to_string())
+        .collect()
+}
+
+/// Create the instance index for a scene like one restored from a snapshot.
+/// The geometry and instances only need the arrays of [LDrawGeometry] and [PointInstances].
+#[pyfunction]
+fn point_instance_index(
+    geometry_cache: HashMap<String, &PyAny>,
+    geometry_point_instances: HashMap<(String, u32), &PyAny>,
+) -> PyResult<InstanceIndex> {
+    let mut geometry_bounds = HashMap::new();
+    for (name, geometry) in geometry_cache {
+        let vertices = vec3_array(geometry.getattr("vertices")?)?;
+        if let Some(bounds) = ldr_tools::Bounds::from_points(vertices) {
+            geometry_bounds.insert(name, bounds);
+        }
+    }
+
+    let mut point_instances = HashMap::new();
+    for (key, instances) in geometry_point_instances {
+        let angles: PyReadonlyArray1<f32> = instances.getattr("rotations_angle")?.extract()?;
+        let instances = ldr_tools::PointInstances {
+            translations: vec3_array(instances.getattr("translations")?)?,
+            rotations_axis: vec3_array(instances.getattr("rotations_axis")?)?,
+            rotations_angle: angles.as_array().to_vec(),
+            scales: vec3_array(instances.getattr("scales")?)?,
+            steps: Vec::new(),
+            submodels: Vec::new(),
+        };
+        point_instances.insert(key, instances);
+    }
+
+    Ok(ldr_tools::InstanceIndex::from_point_instances(&geometry_bounds, &point_instances).into())
+}
+
+fn vec3_array(array: &PyAny) -> PyResult<Vec<Vec3>> {
+    let array: PyReadonlyArray2<f32> = array.extract()?;
+    Ok(array
+        .as_array()
+        .rows()
+        .into_iter()
+        .map(|row| Vec3::new(row[0], row[1], row[2]))
+        .collect())
+}
+
+/// List the submodel names in an MPD file without parsing the model.
+/// The first name is the main model.
+#[pyfunction]
+fn list_submodels(path: &str) -> PyResult<Vec<String>> {
+    Ok(ldr_tools::list_submodels(path)?)
+}
+
 #[pyfunction]
 fn load_color_table(ldraw_path: &str) -> PyResult<HashMap<u32, LDrawColor>> {
     Ok(ldr_tools::load_color_table(ldraw_path)
@@ -344,6 +1009,80 @@ fn load_color_table(ldraw_path: &str) -> PyResult<HashMap<u32, LDrawColor>> {
         .collect())
 }
 
+/// Start collecting timings for Rust and Python events.
+/// Returns `False` if profiling is not available.
+#[pyfunction]
+fn start_profiling() -> bool {
+    ldr_tools::profile::start_profiling()
+}
+
+/// Stop profiling and write all events to `path` in the Chrome trace format.
+#[pyfunction]
+fn stop_profiling(path: &str) -> PyResult<()> {
+    Ok(ldr_tools::profile::stop_profiling().write_chrome_trace(path)?)
+}
+
+#[pyfunction]
+fn is_profiling() -> bool {
+    ldr_tools::profile::is_profiling()
+}
+
+#[pyfunction]
+fn profile_timestamp() -> f64 {
+    ldr_tools::profile::profile_timestamp()
+}
+
+#[pyfunction]
+fn record_profile_event(name: &str, category: &str, start_us: f64, end_us: f64) {
+    ldr_tools::profile::record_event(name, category, start_us, end_us)
+}
+
+#[pyfunction]
+fn write_synthetic_library(path: &str) -> PyResult<()> {
+    Ok(ldr_tools::synthetic::write_library(path)?)
+}
+
+#[pyfunction]
+fn write_synthetic_model(
+    path: &str,
+    part_count: usize,
+    submodel_depth: usize,
+    submodel_reuse: usize,
+) -> PyResult<()> {
+    let settings = ldr_tools::synthetic::SyntheticModelSettings {
+        part_count,
+        submodel_depth,
+        submodel_reuse,
+    };
+    Ok(ldr_tools::synthetic::write_model(path, &settings)?)
+}
+
+fn memory_report_dict(py: Python, report: &ldr_tools::memory::MemoryReport) -> PyResult<PyObject> {
+    let geometry = PyDict::new(py);
+    for (name, memory) in &report.geometry {
+        let buffers = PyDict::new(py);
+        buffers.set_item("vertices", memory.vertices)?;
+        buffers.set_item("vertex_indices", memory.vertex_indices)?;
+        buffers.set_item("face_start_indices", memory.face_start_indices)?;
+        buffers.set_item("face_sizes", memory.face_sizes)?;
+        buffers.set_item("face_colors", memory.face_colors)?;
+        buffers.set_item("is_face_stud", memory.is_face_stud)?;
+        buffers.set_item("edge_line_indices", memory.edge_line_indices)?;
+        buffers.set_item("total", memory.total())?;
+        geometry.set_item(name, buffers)?;
+    }
+
+    let dict = PyDict::new(py);
+    dict.set_item("geometry", geometry)?;
+    dict.set_item("geometry_bytes", report.geometry_bytes())?;
+    dict.set_item("transform_bytes", report.transform_bytes)?;
+    dict.set_item("instance_bytes", report.instance_bytes)?;
+    dict.set_item("instance_count", report.instance_count)?;
+    dict.set_item("geometry_cache_peak_bytes", report.geometry_cache_peak_bytes)?;
+    dict.set_item("total_bytes", report.total_bytes())?;
+    Ok(dict.into())
+}
+
 fn pyarray_vec3(py: Python, values: Vec<ldr_tools::glam::Vec3>) -> PyObject {
     // This flatten will be optimized in Release mode.
     // This avoids needing unsafe code.
@@ -365,13 +1104,38 @@ fn ldr_tools_py(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
     m.add_class::<LDrawColor>()?;
     m.add_class::<GeometrySettings>()?;
     m.add_class::<StudType>()?;
+    m.add_class::<AxisConvention>()?;
     m.add_class::<PrimitiveResolution>()?;
+    m.add_class::<PrimitivePolicy>()?;
+    m.add_class::<Region>()?;
+    m.add_class::<InstanceIndex>()?;
     m.add_class::<PointInstances>()?;
+    m.add_class::<MergedGeometry>()?;
+    m.add_class::<DuplicateInstances>()?;
+    m.add_class::<ResolvedFile>()?;
+    m.add_class::<PartStatistics>()?;
+    m.add_class::<SceneAnalysis>()?;
 
     m.add_function(wrap_pyfunction!(load_file, m)?)?;
+    m.add_function(wrap_pyfunction!(point_instance_index, m)?)?;
     m.add_function(wrap_pyfunction!(load_file_instanced, m)?)?;
     m.add_function(wrap_pyfunction!(load_file_instanced_points, m)?)?;
+    m.add_function(wrap_pyfunction!(load_bytes, m)?)?;
+    m.add_function(wrap_pyfunction!(load_bytes_instanced_points, m)?)?;
+    m.add_function(wrap_pyfunction!(load_file_instanced_points_batched, m)?)?;
+    m.add_function(wrap_pyfunction!(load_files_instanced_points, m)?)?;
+    m.add_function(wrap_pyfunction!(load_file_merged, m)?)?;
     m.add_function(wrap_pyfunction!(load_color_table, m)?)?;
+    m.add_function(wrap_pyfunction!(analyze_file, m)?)?;
+    m.add_function(wrap_pyfunction!(list_submodels, m)?)?;
+    m.add_function(wrap_pyfunction!(library_paths, m)?)?;
+    m.add_function(wrap_pyfunction!(start_profiling, m)?)?;
+    m.add_function(wrap_pyfunction!(stop_profiling, m)?)?;
+    m.add_function(wrap_pyfunction!(is_profiling, m)?)?;
+    m.add_function(wrap_pyfunction!(profile_timestamp, m)?)?;
+    m.add_function(wrap_pyfunction!(record_profile_event, m)?)?;
+    m.add_function(wrap_pyfunction!(write_synthetic_library, m)?)?;
+    m.add_function(wrap_pyfunction!(write_synthetic_model, m)?)?;
 
     Ok(())
 }
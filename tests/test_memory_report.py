@@ -0,0 +1,72 @@
+# Check the memory report for scenes shaped like those returned by ldr_tools_py.
+# The add-on imports bpy, so run the tests with Blender in headless mode.
+#
+# blender --background --factory-startup --python tests/test_memory_report.py
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from ldr_tools_blender.memory_report import numpy_bytes  # noqa: E402
+
+
+def geometry(face_count: int) -> SimpleNamespace:
+    # A quad for each face with the same arrays as ldr_tools_py.LDrawGeometry.
+    return SimpleNamespace(
+        vertices=np.zeros((face_count * 4, 3), dtype=np.float32),
+        vertex_indices=np.arange(face_count * 4, dtype=np.uint32),
+        face_start_indices=np.arange(0, face_count * 4, 4, dtype=np.uint32),
+        face_sizes=np.full(face_count, 4, dtype=np.uint32),
+        face_colors=np.full(face_count, 16, dtype=np.uint32),
+        is_face_stud=np.zeros(face_count, dtype=bool),
+        edge_line_indices=np.zeros((face_count, 2), dtype=np.uint32),
+        has_grainy_slopes=False,
+    )
+
+
+def point_instances(count: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        translations=np.zeros((count, 3), dtype=np.float32),
+        rotations_axis=np.zeros((count, 3), dtype=np.float32),
+        rotations_angle=np.zeros(count, dtype=np.float32),
+        scales=np.ones((count, 3), dtype=np.float32),
+        steps=np.zeros(count, dtype=np.uint32),
+        submodels=np.zeros(count, dtype=np.uint32),
+    )
+
+
+class NumpyBytesTest(unittest.TestCase):
+    def test_instanced_points(self):
+        scene = SimpleNamespace(
+            geometry_cache={'3001.dat': geometry(2)},
+            proxy_geometry_cache={'3001.dat': geometry(1)},
+            geometry_point_instances={('3001.dat', 4): point_instances(3)},
+        )
+
+        # Each face uses 16 bytes of indices, 48 bytes of vertices, and 21 bytes of other data.
+        # Each instance uses 48 bytes.
+        self.assertEqual({
+            'geometry_bytes': 3 * 85,
+            'instance_bytes': 3 * 48,
+            'total_bytes': 3 * 85 + 3 * 48,
+        }, numpy_bytes(scene))
+
+    def test_merged(self):
+        merged = SimpleNamespace(
+            geometry=geometry(1),
+            part_normals=np.zeros((4, 3), dtype=np.float32),
+        )
+        scene = SimpleNamespace(merged_geometry={4: merged})
+        self.assertEqual(85 + 48, numpy_bytes(scene)['geometry_bytes'])
+
+
+if __name__ == '__main__':
+    # Blender ignores any arguments after "--".
+    argv = sys.argv[sys.argv.index('--'):] if '--' in sys.argv else sys.argv[:1]
+    result = unittest.main(argv=argv, exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)